@@ -31,6 +31,10 @@ backlog = 2048
 #       range. You'll want to vary this a bit to find the best
 #       for your particular application's work load.
 #
+#       The knowledge base is read from the memory-mapped snapshot file
+#       created with `make snapshot`, which all workers share, so adding
+#       workers does not add a copy of the knowledge base per worker.
+#
 #   worker_class - The type of workers to use. The default
 #       sync class should handle most 'normal' types of work
 #       loads. You'll want to read
@@ -64,9 +68,30 @@ backlog = 2048
 #
 #       A positive integer. Generally set in the 1-5 seconds range.
 #
+#   threads - The number of worker threads for handling requests,
+#       used by the gthread worker class. A slow upload only ties up
+#       one thread, so the other threads keep serving index page loads
+#       and other uploads.
+#
+#       A positive integer generally in the 2-4 range.
+#
+#   The defaults below are derived from the number of CPU cores and
+#   use the threaded 'gthread' worker class; each of them can be
+#   overridden with the GUNICORN_WORKERS, GUNICORN_THREADS, and
+#   GUNICORN_WORKER_CLASS environment variables. Set
+#   GUNICORN_WORKER_CLASS=sync and GUNICORN_THREADS=1 to get the old
+#   single threaded behavior. Each worker also limits the number of
+#   reports generated at once with the MAX_CONCURRENT_REPORTS
+#   environment variable (see webapp/settings.py).
+#
+
+import os
+import multiprocessing
+cores = multiprocessing.cpu_count()
 
-workers = 1
-worker_class = 'sync'
+workers = int(os.environ.get('GUNICORN_WORKERS', cores + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
 worker_connections = 1000
 timeout = 30
 keepalive = 2
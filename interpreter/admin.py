@@ -9,6 +9,8 @@ from .models import NYUInterpretation
 from .models import NYUTier
 from .models import TissueType
 from .models import TumorType
+from .models import ReportJob
+from .models import GeneSynonym
 
 admin.site.register(PMKBVariant)
 admin.site.register(PMKBInterpretation)
@@ -18,3 +20,5 @@ admin.site.register(NYUInterpretation)
 admin.site.register(NYUTier)
 admin.site.register(TissueType)
 admin.site.register(TumorType)
+admin.site.register(ReportJob)
+admin.site.register(GeneSynonym)
@@ -1,5 +1,33 @@
 from django.apps import AppConfig
+from django.db import connections, router
+from django.db.models.signals import post_migrate
+from django.core.signals import request_started
+
+
+def migrate_search_index(sender, using, **kwargs):
+    """
+    Create the full-text search table, which is not a model, in the knowledge base database after it is migrated
+    """
+    from .search import create_search_index
+    if router.allow_migrate(using, sender.label):
+        create_search_index(connections[using])
+
+
+def switch_kb_build(sender, **kwargs):
+    """
+    Switch to a newly published knowledge base build before handling a request
+    """
+    from .kb_builds import check_kb_build
+    check_kb_build()
 
 
 class InterpreterConfig(AppConfig):
     name = 'interpreter'
+
+    def ready(self):
+        # connect the knowledge base change signals
+        from . import signals
+        post_migrate.connect(migrate_search_index, sender = self, dispatch_uid = 'interpreter_search_index')
+        # start on the published knowledge base build, and pick up new ones between requests
+        switch_kb_build(sender = self)
+        request_started.connect(switch_kb_build, dispatch_uid = 'interpreter_kb_build')
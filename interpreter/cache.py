@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for caching interpretation query results across requests handled by the same worker
+
+Cached results are tied to the knowledge base version, which is incremented whenever the knowledge base tables change,
+so that stale results are never returned after an import or an admin edit.
+"""
+import threading
+import hashlib
+import logging
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from .models import KnowledgeBaseVersion
+from .rules import clear_rule_matcher
+from .fusions import clear_fusion_index
+from .genes import clear_gene_synonyms
+
+logger = logging.getLogger()
+
+def get_kb_version():
+    """
+    Get the current knowledge base version from the database
+
+    Returns
+    -------
+    int
+        the current version number, 0 if the knowledge base has never been changed
+    """
+    version = KnowledgeBaseVersion.objects.filter(pk = 1).values_list('version', flat = True).first()
+    if version is None:
+        version = 0
+    return(version)
+
+def bump_kb_version():
+    """
+    Increment the knowledge base version, invalidating all cached interpretation results
+
+    Returns
+    -------
+    int
+        the new version number
+    """
+    updated = KnowledgeBaseVersion.objects.filter(pk = 1).update(version = F('version') + 1)
+    if not updated:
+        KnowledgeBaseVersion.objects.get_or_create(pk = 1, defaults = {'version': 1})
+    # drop this worker's entries right away; other workers will drop theirs when they see the new version
+    get_cache().clear()
+    clear_rule_matcher()
+    clear_fusion_index()
+    clear_gene_synonyms()
+    return(get_kb_version())
+
+class InterpretationCache(object):
+    """
+    Bounded, thread-safe, least-recently-used cache of hydrated interpretation query results,
+    optionally backed by a shared Django cache backend
+
+    Parameters
+    ----------
+    maxsize: int
+        the maximum number of entries to hold in memory; a value of 0 disables the cache
+    backend: str
+        the name of an entry in ``settings.CACHES`` to share results between workers, or None to only cache in memory
+
+    Examples
+    --------
+    Example usage::
+
+        cache = InterpretationCache(maxsize = 1024)
+        cache.validate()
+        variants = cache.get_or_query(('pmkb', 'EGFR', None, None, None), lambda: list(PMKBVariant.objects.filter(gene = 'EGFR')))
+        cache.stats()
+
+    """
+    def __init__(self, maxsize = 1024, backend = None):
+        self.maxsize = maxsize
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def enabled(self):
+        """
+        Whether the cache should be used
+        """
+        return(self.maxsize > 0)
+
+    def backend_key(self, key):
+        """
+        Converts a cache key tuple into a string that is safe to use with any Django cache backend
+        """
+        key_str = ':'.join([ str(x) for x in key ])
+        return('interpreter:' + hashlib.md5(key_str.encode('utf-8')).hexdigest())
+
+    def validate(self, version = None):
+        """
+        Checks the cache against the current knowledge base version, and clears it if the knowledge base has changed
+
+        Parameters
+        ----------
+        version: int
+            the knowledge base version to check against; queried from the database if not passed
+        """
+        if not self.enabled():
+            return
+        if version is None:
+            version = get_kb_version()
+        with self.lock:
+            if version != self.version:
+                if self.version is not None:
+                    logger.info("knowledge base version changed from {0} to {1}; clearing interpretation cache".format(self.version, version))
+                self.entries.clear()
+                self.version = version
+
+    def get(self, key):
+        """
+        Get an entry from the cache
+
+        Returns
+        -------
+        object
+            the cached value, or None if the key is not in the cache
+        """
+        if not self.enabled():
+            return(None)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return(self.entries[key])
+        if self.backend:
+            value = caches[self.backend].get(self.backend_key(key), version = self.version)
+            if value is not None:
+                with self.lock:
+                    self.hits += 1
+                self.store(key, value)
+                return(value)
+        with self.lock:
+            self.misses += 1
+        return(None)
+
+    def store(self, key, value):
+        """
+        Add an entry to the in-memory cache, evicting the least recently used entries if the cache is full
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+    def set(self, key, value):
+        """
+        Add an entry to the cache, and to the shared backend if one is configured
+        """
+        if not self.enabled():
+            return
+        self.store(key, value)
+        if self.backend:
+            caches[self.backend].set(self.backend_key(key), value, version = self.version)
+
+    def get_or_query(self, key, query):
+        """
+        Get an entry from the cache, or run ``query()`` and cache its results if the key is not in the cache
+        """
+        value = self.get(key)
+        if value is None:
+            value = query()
+            self.set(key, value)
+        return(value)
+
+    def clear(self):
+        """
+        Remove all entries from the in-memory cache
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def flush(self):
+        """
+        Remove all entries from the in-memory cache and the shared backend
+        """
+        self.clear()
+        if self.backend:
+            caches[self.backend].clear()
+
+    def stats(self):
+        """
+        Usage statistics for the cache
+
+        Returns
+        -------
+        dict
+            the cache size, hits, misses, evictions, and the knowledge base version of the cached entries
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats = {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'backend': self.backend,
+            'kb_version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+        return(stats)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    Get the interpretation cache for this worker process, creating it from the settings on first use
+
+    Returns
+    -------
+    InterpretationCache
+        the shared cache instance
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = InterpretationCache(
+                    maxsize = getattr(settings, 'INTERPRETER_CACHE_SIZE', 1024),
+                    backend = getattr(settings, 'INTERPRETER_CACHE_BACKEND', None)
+                    )
+    return(_cache)
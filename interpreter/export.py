@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for exporting interpretation results as .tsv, JSON Lines, or .xlsx files
+
+Each export row is one IR record paired with one matched PMKB interpretation, NYU tier, or NYU interpretation; records
+without any matches are exported as a single row with empty match columns. The rows are written as they are generated,
+and each writer yields the file in parts, so exports of any size can be streamed with bounded memory.
+"""
+import io
+import re
+import csv
+import json
+import zipfile
+import logging
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger()
+
+# IR columns, from the PowerPath/EPIC entry in the report, followed by the match columns
+export_columns = [
+    'Source Row', 'Genes', 'Type', 'Coding', 'Amino Acid Change', 'Variant ID', 'COSMIC/NCBI', 'Allele Frequency',
+    'Read Counts', 'Coverage', 'Fusion Breakpoint',
+    'Source', 'Entry ID', 'Tier', 'Matched Genes', 'Variant', 'Tumor Type', 'Tissue Type', 'Interpretation', 'Citations'
+    ]
+
+def export_value(value):
+    """
+    Get a value for an export column; missing values are empty, and integers are kept as numbers
+    """
+    if value is None or value != value: # NaN from pandas
+        return('')
+    if isinstance(value, bool) or not isinstance(value, int):
+        return(str(value))
+    return(value)
+
+def join_values(values):
+    """
+    Join the values of a PMKB interpretation attribute, e.g. its tiers, into a single column
+    """
+    return(', '.join([ str(value) for value in values ]))
+
+def record_export_rows(record):
+    """
+    Get the export rows for an interpreted record
+
+    Parameters
+    ----------
+    record: IRRecord
+        a record with the results of each interpretation stage
+
+    Returns
+    -------
+    list
+        lists of values for the ``export_columns``
+    """
+    source_row = record.data.get('Row', None)
+    ir_values = [
+        int(source_row) + 1 if source_row is not None else '',
+        record.data.get('Genes', None),
+        record.data.get('Type', None),
+        record.data.get('Coding', None),
+        record.data.get('Amino Acid Change', None),
+        record.data.get('Variant ID', None),
+        record.data.get('COSMIC/NCBI', None),
+        record.af_str,
+        record.data.get('Read Counts', None),
+        record.data.get('Coverage', None),
+        record.fusion
+        ]
+    matches = []
+    for view in record.interpretations.get('pmkb', []):
+        interpretation = view['interpretation']
+        matches.append(['PMKB', interpretation.id, join_values(view['tiers']), join_values(view['genes']), join_values(view['variant_names']),
+            join_values(view['tumor_types']), join_values(view['tissue_types']), interpretation.interpretation, interpretation.citations])
+    for result in record.interpretations.get('nyu_tier', []):
+        for tier in result['tiers']:
+            matches.append(['NYU Tier', tier.id, tier.tier, tier.gene, ' '.join([ x for x in [tier.coding, tier.protein] if x ]),
+                tier.tumor_type, tier.tissue_type, tier.comment, ''])
+    for interpretation in record.interpretations.get('nyu_interpretation', []):
+        matches.append(['NYU Interpretation', interpretation.id, '', interpretation.genes, interpretation.variant,
+            interpretation.tumor_type, interpretation.tissue_type, interpretation.interpretation, interpretation.citations])
+    if not matches:
+        matches.append([ '' for i in range(9) ])
+    return([ [ export_value(value) for value in ir_values + match ] for match in matches ])
+
+def iter_export_rows(tables):
+    """
+    Get the export rows for each record in a series of interpreted tables, e.g. from ``report.iter_interpreted_tables``
+
+    Yields
+    ------
+    list
+        values for the ``export_columns``
+    """
+    for table in tables:
+        for record in table.records:
+            for row in record_export_rows(record):
+                yield(row)
+        del table
+
+tsv_whitespace = { ord(c): ' ' for c in '\t\r\n' }
+
+def iter_tsv(rows, columns = export_columns, block_rows = 500):
+    """
+    Write export rows as a .tsv file with a header line
+
+    Yields
+    ------
+    str
+        consecutive parts of the file, of up to ``block_rows`` rows each
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter = '\t', lineterminator = '\n')
+    writer.writerow(columns)
+    for i, row in enumerate(rows):
+        # tabs and newlines in the interpretation text would break the columns for tools that do not handle quoting
+        writer.writerow([ value.translate(tsv_whitespace) if isinstance(value, str) else value for value in row ])
+        if (i + 1) % block_rows == 0:
+            yield(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+    yield(buffer.getvalue())
+
+def iter_jsonl(rows, columns = export_columns, block_rows = 500):
+    """
+    Write export rows as JSON Lines, one object keyed by the column names per row
+
+    Yields
+    ------
+    str
+        consecutive parts of the file, of up to ``block_rows`` rows each
+    """
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row))) + '\n')
+        if len(lines) >= block_rows:
+            yield(''.join(lines))
+            lines = []
+    yield(''.join(lines))
+
+class StreamBuffer(object):
+    """
+    Write-only file-like object that holds the bytes written to it until they are taken
+
+    It has no ``tell`` or ``seek``, so ``zipfile`` writes entries with trailing data descriptors instead of seeking back to the headers.
+    """
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return(len(data))
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return(data)
+
+xlsx_parts = [
+('[Content_Types].xml', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'),
+('_rels/.rels', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'),
+('xl/workbook.xml', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Interpretations" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'),
+('xl/_rels/workbook.xml.rels', '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>')
+]
+
+# characters that are not allowed in XML 1.0
+xml_invalid_pattern = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# max characters in an Excel cell
+xlsx_cell_limit = 32767
+
+def xlsx_row(values):
+    """
+    Get the worksheet XML for a row, with numbers as number cells and everything else as inline strings
+    """
+    cells = []
+    for value in values:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append('<c><v>{0}</v></c>'.format(value))
+        else:
+            text = xml_invalid_pattern.sub('', str(value))[:xlsx_cell_limit]
+            cells.append('<c t="inlineStr"><is><t xml:space="preserve">{0}</t></is></c>'.format(escape(text)))
+    return('<row>{0}</row>'.format(''.join(cells)))
+
+def iter_xlsx(rows, columns = export_columns, block_size = 256 * 1024):
+    """
+    Write export rows as an .xlsx workbook with a single sheet
+
+    The sheet is compressed into the workbook as it is written, so memory use does not depend on the number of rows
+
+    Yields
+    ------
+    bytes
+        consecutive parts of the file, of about ``block_size`` bytes each
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression = zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in xlsx_parts:
+            workbook.writestr(name, content)
+        with workbook.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>').encode('utf-8'))
+            sheet.write(xlsx_row(columns).encode('utf-8'))
+            for row in rows:
+                sheet.write(xlsx_row(row).encode('utf-8'))
+                if buffer.size >= block_size:
+                    yield(buffer.take())
+            sheet.write('</sheetData></worksheet>'.encode('utf-8'))
+    yield(buffer.take())
+
+# content type, file extension, and writer for each export format
+export_formats = {
+'tsv': ('text/tab-separated-values; charset=utf-8', 'tsv', iter_tsv),
+'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl', iter_jsonl),
+'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx', iter_xlsx)
+}
+
+def iter_export(rows, format):
+    """
+    Write export rows in an export format
+
+    Parameters
+    ----------
+    rows: iterable
+        lists of values for the ``export_columns``
+    format: str
+        one of the keys of ``export_formats``
+
+    Returns
+    -------
+    generator
+        consecutive parts of the file, as str or bytes
+
+    Raises
+    ------
+    ValueError
+        if the format is unknown
+    """
+    if format not in export_formats:
+        raise ValueError('Unknown export format: {0}'.format(format))
+    content_type, extension, writer = export_formats[format]
+    return(writer(rows))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for the filters that drop IR records before they are interpreted
+
+A filter chain is written as a comma separated list of filters, each optionally with a value, e.g.
+``detection,oncomine_class,min_af=5,variant_type=SNV|INDEL``; the names of the ``presets`` can be used in place of the
+filters they stand for. Each filter makes a boolean mask over the rows of the table in one vectorized pass, and the rows
+that fail any of them are dropped from the ``IRTable`` before its records are made, so they are never looked up or
+rendered. The number of rows dropped by each filter, the first one that they fail, is kept for the report summary.
+
+Filters on a column that the table does not have keep every row, e.g. 'Detection' in a .vcf file, 'Oncomine Variant
+Class' in a .vcf file without Ion Reporter FUNC annotations (see ``vcf.VCFReader``), or 'Filter' in an Ion Reporter .tsv file.
+The records of .vcf files are also dropped by the ``settings.VCF_FILTERS`` chain, e.g. 'pass_only', ahead of the report filters.
+"""
+import logging
+import pandas as pd
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+# named filter chains
+presets = OrderedDict([
+    ('oncomine', 'detection,oncomine_class,min_af'),
+    ('none', '')
+    ])
+
+def column_values(frame, column):
+    """
+    Gets the values of a column as upper case strings, with missing values as empty strings; None if there is no such column
+    """
+    if column not in frame.columns:
+        return(None)
+    return(frame[column].fillna('').astype(str).str.strip().str.upper())
+
+def value_list(value):
+    """
+    Splits a filter value on '|' into a list of upper case values
+
+    Examples
+    --------
+    Example usage::
+
+        >>> value_list('SNV|indel')
+        ['SNV', 'INDEL']
+
+    """
+    return([ part.strip().upper() for part in value.split('|') if part.strip() ])
+
+def highest_af(frequency):
+    """
+    Gets the highest allele frequency of each row from the '% Frequency' column, which holds either a single value or
+    the frequency of each allele, e.g. 'AA=0.00, AG=0.00, CG=11.27'
+
+    Returns
+    -------
+    pandas.Series
+        the highest frequency of each row, or NaN if it has none
+    """
+    if len(frequency) < 1:
+        return(pd.Series([], index = frequency.index, dtype = float))
+    values = frequency.astype(str).str.extractall(r'(?:^|=)\s*(\d+(?:\.\d+)?)\s*(?:,|$)')[0].astype(float)
+    return(values.groupby(level = 0).max().reindex(frequency.index))
+
+def detection_mask(frame, value):
+    """
+    Keeps the rows whose 'Detection' is one of the values, e.g. 'Present'
+    """
+    detection = column_values(frame, 'Detection')
+    if detection is None:
+        return(pd.Series(True, index = frame.index))
+    return(detection.isin(value_list(value)))
+
+def oncomine_class_mask(frame, value):
+    """
+    Keeps the rows with an 'Oncomine Variant Class', or with one of the values if there are any, e.g. 'Hotspot|Deleterious'
+    """
+    classes = column_values(frame, 'Oncomine Variant Class')
+    if classes is None:
+        return(pd.Series(True, index = frame.index))
+    if value:
+        return(classes.isin(value_list(value)))
+    return(classes != '')
+
+def min_af_mask(frame, value):
+    """
+    Keeps the rows whose highest allele frequency is above zero and at least the value in percent; rows without a
+    frequency, e.g. fusions, are kept
+    """
+    if '% Frequency' not in frame.columns:
+        return(pd.Series(True, index = frame.index))
+    af = highest_af(frame['% Frequency'])
+    return(af.isnull() | ((af > 0) & (af >= float(value))))
+
+def min_coverage_mask(frame, value):
+    """
+    Keeps the rows whose 'Coverage' is at least the value; rows without a coverage are kept
+    """
+    if 'Coverage' not in frame.columns:
+        return(pd.Series(True, index = frame.index))
+    coverage = pd.to_numeric(frame['Coverage'], errors = 'coerce')
+    return(coverage.isnull() | (coverage >= float(value)))
+
+def pass_only_mask(frame, value):
+    """
+    Keeps the rows whose 'Filter' is 'PASS' or '.', i.e. the lines of a .vcf file that passed the variant caller's filters
+    """
+    filter_values = column_values(frame, 'Filter')
+    if filter_values is None:
+        return(pd.Series(True, index = frame.index))
+    return(filter_values.isin(['PASS', '.']))
+
+def variant_type_mask(frame, value):
+    """
+    Keeps the rows whose 'Type' is one of the values, e.g. 'SNV|INDEL'
+    """
+    types = column_values(frame, 'Type')
+    if types is None:
+        return(pd.Series(True, index = frame.index))
+    return(types.isin(value_list(value)))
+
+# the filters, with their mask function, the default value if none is given (None if a value is required), and whether the value is a number
+filter_types = OrderedDict([
+    ('detection', (detection_mask, 'Present', False)),
+    ('oncomine_class', (oncomine_class_mask, '', False)),
+    ('min_af', (min_af_mask, '0', True)),
+    ('min_coverage', (min_coverage_mask, None, True)),
+    ('variant_type', (variant_type_mask, None, False)),
+    ('pass_only', (pass_only_mask, '', False))
+    ])
+
+def parse_filters(text):
+    """
+    Parses a filter chain
+
+    Parameters
+    ----------
+    text: str
+        the comma separated filters and presets, e.g. 'oncomine,min_coverage=100'; None or '' for no filters
+
+    Returns
+    -------
+    list
+        a ``(name, value)`` tuple for each filter, in order
+
+    Raises
+    ------
+    ValueError
+        if a filter is not known, or its value is missing or not a number
+
+    Examples
+    --------
+    Example usage::
+
+        >>> parse_filters('oncomine,min_coverage=100')
+        [('detection', 'Present'), ('oncomine_class', ''), ('min_af', '0'), ('min_coverage', '100')]
+
+    """
+    filters = []
+    for item in (text or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if item in presets:
+            filters.extend(parse_filters(presets[item]))
+            continue
+        name, sep, value = [ part.strip() for part in item.partition('=') ]
+        if name not in filter_types:
+            raise ValueError('Unknown report filter: {0}'.format(name))
+        mask, default, numeric = filter_types[name]
+        if not sep:
+            value = default
+        if value is None or (numeric and value == ''):
+            raise ValueError('Report filter {0} needs a value, e.g. {0}=10'.format(name))
+        if numeric:
+            try:
+                float(value)
+            except ValueError:
+                raise ValueError('Report filter {0} needs a number: {1}'.format(name, value))
+        filters.append((name, value))
+    return(filters)
+
+def filter_label(name, value):
+    """
+    Gets the label of a filter in the report summary
+
+    Examples
+    --------
+    Example usage::
+
+        >>> filter_label('min_af', '5')
+        'min_af=5'
+        >>> filter_label('oncomine_class', '')
+        'oncomine_class'
+
+    """
+    if value:
+        return('{0}={1}'.format(name, value))
+    return(name)
+
+def apply_filters(frame, filters):
+    """
+    Drops the rows of a table that fail any of the filters
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        the table, e.g. a chunk of an Ion Reporter .tsv file
+    filters: list
+        the filters from ``parse_filters``
+
+    Returns
+    -------
+    pandas.DataFrame
+        the rows that pass all of the filters
+    OrderedDict
+        the number of rows dropped by each filter, by the label of the filter; rows that fail more than one filter are
+        only counted for the first one
+    """
+    keep = pd.Series(True, index = frame.index)
+    counts = OrderedDict()
+    for name, value in filters:
+        mask = filter_types[name][0](frame, value).fillna(False).astype(bool)
+        label = filter_label(name, value)
+        counts[label] = counts.get(label, 0) + int((keep & ~mask).sum())
+        keep &= mask
+    logger.debug("filters kept {0} of {1} rows".format(int(keep.sum()), len(frame)))
+    return(frame[keep], counts)
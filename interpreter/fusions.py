@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for indexing the knowledge base entries that describe a specific fusion, and matching IR fusion records against them
+
+PMKB variants such as 'EML4-ALK rearrangement' and NYU interpretations such as 'CCDC6 - RET' name both partners of
+a fusion. Each one is stored as a ``FusionPair`` entry at import time; a ``FusionIndex`` keys the pairs on the ordered
+(5' gene, 3' gene) pair and on the unordered pair, so that an IR fusion record is matched to the entries for its own
+partners instead of to every entry for either gene.
+"""
+import re
+import logging
+import threading
+from collections import defaultdict
+from .models import PMKBVariant, NYUInterpretation, FusionPair
+from .ir import fusion_genes_pattern
+from .genes import load_gene_synonyms, canonical_gene
+
+logger = logging.getLogger()
+
+# e.g. 'EML4-ALK rearrangement', 'ALK-EML4 fusion'
+kb_fusion_pattern = re.compile(r'^(?P<five_prime>[A-Za-z0-9]+)-(?P<three_prime>[A-Za-z0-9]+)\s+(?:rearrangement|fusion|translocation)$')
+
+def pair_key(five_prime, three_prime):
+    """
+    Get the orientation-independent key for a pair of genes
+
+    Examples
+    --------
+    Example usage::
+
+        >>> pair_key('EML4', 'ALK')
+        'ALK EML4'
+
+    """
+    return(' '.join(sorted([five_prime.upper(), three_prime.upper()])))
+
+def parse_kb_fusion(text, synonyms = None):
+    """
+    Get the partner genes from the description of a fusion in the knowledge base
+
+    Parameters
+    ----------
+    text: str
+        a PMKB variant, e.g. 'EML4-ALK rearrangement', or the genes of an NYU interpretation, e.g. 'CCDC6 - RET'
+    synonyms: dict
+        gene synonyms from ``load_gene_synonyms``, to rename the partners to their approved symbols
+
+    Returns
+    -------
+    tuple
+        ``(five_prime, three_prime)``, or None if the text does not name two partners
+
+    Examples
+    --------
+    Example usage::
+
+        >>> parse_kb_fusion('EML4-ALK rearrangement')
+        ('EML4', 'ALK')
+        >>> parse_kb_fusion('CCDC6 - RET')
+        ('CCDC6', 'RET')
+        >>> parse_kb_fusion('ALK rearrangement')
+
+    """
+    if text is None or text != text: # NaN from pandas
+        return(None)
+    text = str(text).strip()
+    for pattern in [kb_fusion_pattern, fusion_genes_pattern]:
+        match = pattern.match(text)
+        if match:
+            partners = (match.group('five_prime').upper(), match.group('three_prime').upper())
+            if synonyms:
+                partners = tuple([ canonical_gene(gene, synonyms) for gene in partners ])
+            return(partners)
+    return(None)
+
+def make_fusion_entry(source, entry_id, text, synonyms = None):
+    """
+    Create an unsaved ``FusionPair`` entry for a knowledge base entry, or None if it does not describe a fusion
+    """
+    partners = parse_kb_fusion(text, synonyms = synonyms)
+    if partners is None:
+        return(None)
+    five_prime, three_prime = partners
+    return(FusionPair(source = source, entry_id = entry_id, five_prime = five_prime, three_prime = three_prime,
+        pair = pair_key(five_prime, three_prime)))
+
+def update_fusion_entry(source, entry_id, text):
+    """
+    Replace the ``FusionPair`` entry for a single knowledge base entry, e.g. after it is edited in the admin
+    """
+    FusionPair.objects.filter(source = source, entry_id = entry_id).delete()
+    entry = make_fusion_entry(source, entry_id, text, synonyms = load_gene_synonyms())
+    if entry is not None:
+        entry.save()
+
+def compile_fusion_pairs():
+    """
+    Rebuild the ``FusionPair`` table from the PMKB variants and NYU interpretations in the database
+
+    Returns
+    -------
+    int
+        the number of fusion pairs created
+    """
+    synonyms = load_gene_synonyms()
+    entries = []
+    for id, variant in PMKBVariant.objects.values_list('id', 'variant'):
+        entries.append(make_fusion_entry('pmkb', id, variant, synonyms = synonyms))
+    for id, genes in NYUInterpretation.objects.values_list('id', 'genes'):
+        entries.append(make_fusion_entry('nyu_interpretation', id, genes, synonyms = synonyms))
+    entries = [ entry for entry in entries if entry is not None ]
+    FusionPair.objects.all().delete()
+    FusionPair.objects.bulk_create(entries, batch_size = 500)
+    logger.info("indexed {0} knowledge base fusion pairs".format(len(entries)))
+    return(len(entries))
+
+class FusionIndex(object):
+    """
+    Index of knowledge base fusion pairs, keyed on the ordered and the unordered pair of partner genes
+
+    Parameters
+    ----------
+    pairs: iterable
+        ``(source, entry_id, five_prime, three_prime)`` tuples
+
+    Examples
+    --------
+    Example usage::
+
+        index = FusionIndex([ ('pmkb', 1, 'EML4', 'ALK'), ('pmkb', 2, 'ERG', 'TMPRSS2') ])
+        index.match('pmkb', 'EML4', 'ALK')
+        >>> frozenset({1})
+        index.match('pmkb', 'TMPRSS2', 'ERG') # only listed in the other orientation
+        >>> frozenset({2})
+
+    """
+    def __init__(self, pairs):
+        self.ordered = defaultdict(set)
+        self.unordered = defaultdict(set)
+        self.paired = defaultdict(set)
+        self.num_pairs = 0
+        for source, entry_id, five_prime, three_prime in pairs:
+            self.add(source, entry_id, five_prime, three_prime)
+
+    def add(self, source, entry_id, five_prime, three_prime):
+        """
+        Add a knowledge base fusion pair to the index
+        """
+        self.num_pairs += 1
+        self.ordered[(source, five_prime.upper(), three_prime.upper())].add(entry_id)
+        self.unordered[(source, pair_key(five_prime, three_prime))].add(entry_id)
+        self.paired[source].add(entry_id)
+
+    def match(self, source, five_prime, three_prime):
+        """
+        Get the entries from a knowledge base source for a fusion; entries listed with the same 5' and 3' genes are
+        returned if there are any, otherwise the entries for the same genes in the other orientation
+
+        Returns
+        -------
+        frozenset
+            the ids of the matching ``PMKBVariant`` or ``NYUInterpretation`` entries
+        """
+        matches = self.ordered.get((source, five_prime.upper(), three_prime.upper()), None)
+        if not matches:
+            matches = self.unordered.get((source, pair_key(five_prime, three_prime)), ())
+        return(frozenset(matches))
+
+    def paired_ids(self, source):
+        """
+        Get the entries from a knowledge base source that are tied to any fusion pair; a fusion whose pair is not in the
+        knowledge base is only matched to the other entries for its genes
+
+        Returns
+        -------
+        frozenset
+            the ids of the ``PMKBVariant`` or ``NYUInterpretation`` entries listed for a pair of partner genes
+        """
+        return(frozenset(self.paired.get(source, ())))
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+def get_fusion_index(kb_version):
+    """
+    Get the fusion index for the current knowledge base version, building it from the ``FusionPair`` table if the knowledge base has changed
+
+    Parameters
+    ----------
+    kb_version: int
+        the current knowledge base version
+
+    Returns
+    -------
+    FusionIndex
+        the index shared by all threads of this worker
+    """
+    global _index, _index_version
+    with _index_lock:
+        if _index is None or _index_version != kb_version:
+            _index = FusionIndex(FusionPair.objects.values_list('source', 'entry_id', 'five_prime', 'three_prime'))
+            _index_version = kb_version
+            logger.info("loaded {0} fusion pairs for knowledge base version {1}".format(_index.num_pairs, kb_version))
+        return(_index)
+
+def clear_fusion_index():
+    """
+    Drop this worker's fusion index, so that it is rebuilt on the next lookup
+    """
+    global _index, _index_version
+    with _index_lock:
+        _index = None
+        _index_version = None
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for converting previous and alias gene symbols to the approved symbols
+
+Gene synonyms are read from an HGNC-style .tsv file ('Approved symbol', 'Previous symbols', 'Alias symbols' columns,
+with comma separated symbols) into the ``GeneSynonym`` table. The knowledge base gene columns are converted to the
+approved symbols when they are imported, and the genes of each IR record are converted when the table is parsed,
+using a dict of the synonyms that is loaded once per worker for each knowledge base version.
+"""
+import csv
+import logging
+import threading
+from collections import OrderedDict
+from .models import GeneSynonym, PMKBVariant, NYUTier, NYUInterpretation
+
+logger = logging.getLogger()
+
+def read_gene_synonyms(path):
+    """
+    Read the previous and alias symbols for each approved gene symbol from an HGNC-style .tsv file
+
+    Symbols that are also an approved symbol, or that are listed for more than one approved symbol, are skipped,
+    since they can not be converted unambiguously.
+
+    Parameters
+    ----------
+    path: str
+        path to the .tsv file
+
+    Returns
+    -------
+    OrderedDict
+        upper case previous and alias symbols, mapped to ``(approved_symbol, synonym_type)`` tuples
+    """
+    approved = set()
+    candidates = OrderedDict()
+    with open(path) as f:
+        reader = csv.DictReader(f, delimiter = '\t')
+        for row in reader:
+            symbol = row['Approved symbol'].strip()
+            if not symbol:
+                continue
+            approved.add(symbol.upper())
+            for column, synonym_type in [('Previous symbols', 'previous'), ('Alias symbols', 'alias')]:
+                for alias in (row.get(column, None) or '').split(','):
+                    alias = alias.strip().upper()
+                    if alias:
+                        candidates.setdefault(alias, set()).add((symbol, synonym_type))
+    synonyms = OrderedDict()
+    for alias, entries in candidates.items():
+        symbols = set([ symbol for symbol, synonym_type in entries ])
+        if alias in approved:
+            logger.debug("skipping gene synonym {0}; it is also an approved symbol".format(alias))
+        elif len(symbols) > 1:
+            logger.warning("skipping gene synonym {0}; it is listed for {1}".format(alias, ', '.join(sorted(symbols))))
+        else:
+            # prefer 'previous' over 'alias' if the symbol is listed as both
+            synonyms[alias] = sorted(entries, key = lambda x: x[1] != 'previous')[0]
+    return(synonyms)
+
+def canonical_gene(gene, synonyms):
+    """
+    Get the approved symbol for a gene
+
+    Examples
+    --------
+    Example usage::
+
+        >>> canonical_gene('MLL', {'MLL': 'KMT2A'})
+        'KMT2A'
+        >>> canonical_gene('NRAS', {'MLL': 'KMT2A'})
+        'NRAS'
+
+    """
+    return(synonyms.get(str(gene).strip().upper(), str(gene).strip()))
+
+def canonical_gene_text(text, synonyms):
+    """
+    Convert each symbol in a space delimited list of genes, e.g. the genes of an NYU interpretation
+
+    Examples
+    --------
+    Example usage::
+
+        >>> canonical_gene_text('MLL - AFF1', {'MLL': 'KMT2A'})
+        'KMT2A - AFF1'
+
+    """
+    return(' '.join([ canonical_gene(gene, synonyms) if gene != '-' else gene for gene in str(text).split() ]))
+
+def canonical_variant_text(text, gene, symbol):
+    """
+    Replace the gene at the start of a PMKB variant description, e.g. 'SEPT14 copy number gain', when the gene is renamed
+    """
+    if symbol != gene and isinstance(text, str) and text.upper().startswith(gene.upper() + ' '):
+        return(symbol + text[len(gene):])
+    return(text)
+
+def load_gene_synonyms():
+    """
+    Load the gene synonyms from the database
+
+    Returns
+    -------
+    dict
+        upper case previous and alias symbols mapped to the approved symbols
+    """
+    return(dict(GeneSynonym.objects.values_list('alias', 'symbol')))
+
+def canonicalize_knowledge_base(synonyms = None):
+    """
+    Rename the genes of the knowledge base entries that use a previous or alias symbol to the approved symbol
+
+    The entries are saved one at a time, so that the keys, rules, and fusion pairs derived from their genes are updated as well
+
+    Returns
+    -------
+    int
+        the number of entries renamed
+    """
+    if synonyms is None:
+        synonyms = load_gene_synonyms()
+    num_renamed = 0
+    for variant in PMKBVariant.objects.all().only('id', 'gene', 'variant'):
+        symbol = canonical_gene(variant.gene, synonyms)
+        if symbol != variant.gene:
+            variant.variant = canonical_variant_text(variant.variant, variant.gene, symbol)
+            variant.gene = symbol
+            variant.save(update_fields = ['gene', 'variant', 'protein_key'])
+            num_renamed += 1
+    for tier in NYUTier.objects.all():
+        symbol = canonical_gene(tier.gene, synonyms)
+        if symbol != tier.gene:
+            tier.gene = symbol
+            tier.save()
+            num_renamed += 1
+    for interpretation in NYUInterpretation.objects.all():
+        genes = canonical_gene_text(interpretation.genes, synonyms)
+        if genes != interpretation.genes:
+            interpretation.genes = genes
+            interpretation.save()
+            num_renamed += 1
+    logger.info("renamed the genes of {0} knowledge base entries".format(num_renamed))
+    return(num_renamed)
+
+_synonyms = None
+_synonyms_version = None
+_synonyms_lock = threading.Lock()
+
+def get_gene_synonyms(kb_version):
+    """
+    Get the gene synonyms for the current knowledge base version, loading them from the database if the knowledge base has changed
+
+    Parameters
+    ----------
+    kb_version: int
+        the current knowledge base version
+
+    Returns
+    -------
+    dict
+        upper case previous and alias symbols mapped to the approved symbols, shared by all threads of this worker
+    """
+    global _synonyms, _synonyms_version
+    with _synonyms_lock:
+        if _synonyms is None or _synonyms_version != kb_version:
+            _synonyms = load_gene_synonyms()
+            _synonyms_version = kb_version
+            logger.info("loaded {0} gene synonyms for knowledge base version {1}".format(len(_synonyms), kb_version))
+        return(_synonyms)
+
+def clear_gene_synonyms():
+    """
+    Drop this worker's gene synonyms, so that they are reloaded on the next lookup
+    """
+    global _synonyms, _synonyms_version
+    with _synonyms_lock:
+        _synonyms = None
+        _synonyms_version = None
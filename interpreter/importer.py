@@ -23,8 +23,16 @@ parentdir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 sys.path.insert(0, parentdir)
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webapp.settings")
 django.setup()
-from interpreter.models import PMKBVariant, PMKBInterpretation, TumorType, TissueType, NYUTier, NYUInterpretation
+from interpreter.models import PMKBVariant, PMKBInterpretation, TumorType, TissueType, NYUTier, NYUInterpretation, GeneSynonym
 from interpreter.util import sanitize_tumor_tissue, sanitize_genes, debugger
+from interpreter.cache import bump_kb_version
+from interpreter.signals import suspend_kb_signals, kb_changed
+from interpreter.variants import variant_key_str
+from interpreter.rules import compile_pmkb_rules
+from interpreter.fusions import compile_fusion_pairs
+from interpreter.lookup import compile_pmkb_lookup
+from interpreter.search import compile_search_index
+from interpreter.genes import read_gene_synonyms, load_gene_synonyms, canonical_gene, canonical_gene_text, canonical_variant_text, canonicalize_knowledge_base
 sys.path.pop(0)
 import logging
 logger = logging.getLogger()
@@ -42,6 +50,7 @@ config['tumor_types_json'] = os.path.join(config['fixtures_dir'], config_json_da
 config['tissue_types_json'] = os.path.join(config['fixtures_dir'], config_json_data['tissue_types_json'])
 config['nyu_interpretations_tsv'] = os.path.join(config['fixtures_dir'], config_json_data['nyu_interpretations_tsv'])
 config['nyu_tiers_csv'] = os.path.join(config['fixtures_dir'], config_json_data['nyu_tiers_csv'])
+config['gene_synonyms_tsv'] = os.path.join(config['fixtures_dir'], config_json_data['gene_synonyms_tsv'])
 config['import_limit'] = -1
 config['import_type'] = "PMKB"
 
@@ -192,7 +201,9 @@ def import_PMKB_bulk(entries):
             tier = row['Tier'],
             interpretation = unique_interpretations[interpretation_data_str]['instance'],
             source_row =  row['Source'],
-            uid = variant_md5
+            uid = variant_md5,
+            # bulk_create does not call save(), so set the normalized key here
+            protein_key = variant_key_str(row['Gene'], row['Variant'])
             )
             bulk_variants.append(variant_instance)
             num_created_variants += 1
@@ -202,6 +213,8 @@ def import_PMKB_bulk(entries):
     # add all variants to the database
     logger.debug("Importing bulk variant entries ({0} total)".format(len(bulk_variants)))
     PMKBVariant.objects.bulk_create(bulk_variants)
+    # bulk_create does not send save signals; compile the variant rules, fusion pairs, lookup table, and search index, and invalidate cached interpretations manually
+    kb_changed(PMKBVariant, PMKBInterpretation)
 
     total_db_variants = PMKBVariant.objects.count() # 22834
     total_db_interpretations = PMKBInterpretation.objects.count()# 408
@@ -297,6 +310,12 @@ def import_PMKB(**kwargs):
 
     # entries.to_csv("all_entries.tsv", sep = "\t")
 
+    # use the approved symbol for each gene, and for the gene at the start of the variant description
+    synonyms = load_gene_synonyms()
+    symbols = entries['Gene'].map(lambda gene: canonical_gene(gene, synonyms))
+    entries['Variant'] = [ canonical_variant_text(variant, gene, symbol) for variant, gene, symbol in zip(entries['Variant'], entries['Gene'], symbols) ]
+    entries['Gene'] = symbols
+
     # remove duplicates caused by duplicate PMKB entries in Excel sheet
     num_entries_start = entries.shape[0]
     entries = entries.drop_duplicates()
@@ -370,6 +389,7 @@ def import_nyu_tiers(**kwargs):
     Imports values from the NYU tiers list to the database
     """
     nyu_tiers_csv = kwargs.pop('nyu_tiers_csv', config['nyu_tiers_csv'])
+    synonyms = load_gene_synonyms()
     num_created = 0
     num_skipped = 0
     with open(nyu_tiers_csv) as f:
@@ -378,7 +398,7 @@ def import_nyu_tiers(**kwargs):
             tumor_type_instance = TumorType.objects.get(type = sanitize_tumor_tissue(row['tumor_type']))
             tissue_type_instance = TissueType.objects.get(type = sanitize_tumor_tissue(row['tissue_type']))
             instance, created = NYUTier.objects.get_or_create(
-            gene = row['gene'],
+            gene = canonical_gene(row['gene'], synonyms),
             variant_type = row['type'],
             tumor_type = tumor_type_instance,
             tissue_type = tissue_type_instance,
@@ -400,6 +420,7 @@ def import_nyu_interpretations(**kwargs):
     """
     """
     nyu_interpretations_tsv = kwargs.pop('nyu_interpretations_tsv', config['nyu_interpretations_tsv'])
+    synonyms = load_gene_synonyms()
     num_created = 0
     num_skipped = 0
     with open(nyu_interpretations_tsv) as f:
@@ -409,7 +430,7 @@ def import_nyu_interpretations(**kwargs):
             tissue_type_instance = TissueType.objects.get(type = sanitize_tumor_tissue(row['TissueType']))
 
             instance, created = NYUInterpretation.objects.get_or_create(
-            genes = row['Gene'],
+            genes = canonical_gene_text(row['Gene'], synonyms),
             variant_type = row['VariantType'],
             tumor_type = tumor_type_instance,
             tissue_type = tissue_type_instance,
@@ -426,6 +447,20 @@ def import_nyu_interpretations(**kwargs):
     skipped = num_skipped
     ))
 
+def import_gene_synonyms(**kwargs):
+    """
+    Imports the previous and alias gene symbols from an HGNC-style .tsv file to the database, replacing any existing synonyms,
+    and renames the genes of the knowledge base entries already in the database
+    """
+    gene_synonyms_tsv = kwargs.pop('gene_synonyms_tsv', config['gene_synonyms_tsv'])
+    synonyms = read_gene_synonyms(gene_synonyms_tsv)
+    GeneSynonym.objects.all().delete()
+    GeneSynonym.objects.bulk_create([ GeneSynonym(alias = alias, symbol = symbol, synonym_type = synonym_type)
+        for alias, (symbol, synonym_type) in synonyms.items() ])
+    logger.debug("Added {0} gene synonyms to the database".format(len(synonyms)))
+    canonicalize_knowledge_base()
+    bump_kb_version()
+
 def main(**kwargs):
     """
     Main control function for the module.
@@ -435,9 +470,22 @@ def main(**kwargs):
     tissue_types_json = kwargs.pop('tissue_types_json', config['tissue_types_json'])
     nyu_tiers_csv = kwargs.pop('nyu_tiers_csv', config['nyu_tiers_csv'])
     nyu_interpretations_tsv = kwargs.pop('nyu_interpretations_tsv', config['nyu_interpretations_tsv'])
+    gene_synonyms_tsv = kwargs.pop('gene_synonyms_tsv', config['gene_synonyms_tsv'])
     import_limit = kwargs.pop('import_limit', config['import_limit'])
     import_type = kwargs.pop('import_type', config['import_type'])
 
+    # the entries are saved one at a time; rebuild the derived tables and invalidate cached interpretations once at the end
+    with suspend_kb_signals():
+        import_data(import_type = import_type, pmkb_xlsx = pmkb_xlsx, tumor_types_json = tumor_types_json,
+            tissue_types_json = tissue_types_json, nyu_tiers_csv = nyu_tiers_csv, nyu_interpretations_tsv = nyu_interpretations_tsv,
+            gene_synonyms_tsv = gene_synonyms_tsv, import_limit = import_limit)
+
+def import_data(import_type, pmkb_xlsx, tumor_types_json, tissue_types_json, nyu_tiers_csv, nyu_interpretations_tsv, gene_synonyms_tsv, import_limit):
+    """
+    Imports one type of data into the database
+    """
+    if import_type == "gene_synonyms":
+        import_gene_synonyms(gene_synonyms_tsv = gene_synonyms_tsv)
 
     if import_type == "tumor_type":
         import_tumor_types(tumor_types_json = tumor_types_json)
@@ -454,6 +502,25 @@ def main(**kwargs):
     if import_type == "nyu_interpretation":
         import_nyu_interpretations(nyu_interpretations_tsv = nyu_interpretations_tsv)
 
+    # recompile the rules for the PMKB variants already in the database
+    if import_type == "PMKB_rules":
+        compile_pmkb_rules()
+        bump_kb_version()
+
+    # rebuild the fusion pairs for the PMKB variants and NYU interpretations already in the database
+    if import_type == "fusions":
+        compile_fusion_pairs()
+        bump_kb_version()
+
+    # rebuild the denormalized PMKB lookup table from the PMKB variants already in the database
+    if import_type == "pmkb_lookup":
+        compile_pmkb_lookup()
+        bump_kb_version()
+
+    # rebuild the full-text search index from the PMKB and NYU interpretations already in the database
+    if import_type == "search_index":
+        compile_search_index()
+
 
 def parse():
     """
@@ -6,7 +6,9 @@ Module for handling the interpretation of IonReporter .tsv results against datab
 import os
 import sys
 import django
+from django.db.models import Q
 from collections import defaultdict
+from types import MappingProxyType
 import logging
 import json
 
@@ -17,11 +19,90 @@ parentdir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 sys.path.insert(0, parentdir)
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webapp.settings")
 django.setup()
-from interpreter.models import PMKBVariant, TissueType, TumorType, NYUTier, NYUInterpretation
+from interpreter.models import TissueType, TumorType, NYUTier, NYUInterpretation
 from interpreter.ir import IRTable
 from interpreter.util import debugger
+from interpreter.cache import get_cache, get_kb_version
+from interpreter.snapshot import activate_snapshot, get_snapshot
+from interpreter.variants import variant_key_str
+from interpreter.lookup import fetch_pmkb_lookup
 sys.path.pop(0)
 
+class QueryCache(object):
+    """
+    Memoizes the results of a database query function for the duration of a single report run, so that records with the same gene list share the same result objects
+
+    Parameters
+    ----------
+    name: str
+        a label for the cache to use in log messages
+
+    Examples
+    --------
+    Example usage::
+
+        cache = QueryCache(name = 'pmkb')
+        results = cache.query(query_pmkb, genes = ['EGFR'], tissue_type = 'Lung')
+        results = cache.query(query_pmkb, genes = ['EGFR'], tissue_type = 'Lung') # cache hit
+        cache.summary()
+        >>> 'pmkb: 2 lookups, 1 cache hits (50.0%)'
+
+    """
+    def __init__(self, name = None):
+        self.name = name
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, genes, **params):
+        """
+        Creates the memoization key for a query; the order of the genes does not matter, and 'Any' is treated the same as no filter
+        """
+        key = [ frozenset(genes) ]
+        for param in ['tissue_type', 'tumor_type', 'variant', 'features', 'fusion']:
+            value = params.get(param, None)
+            if value == 'Any':
+                value = None
+            key.append(value)
+        return(tuple(key))
+
+    def query(self, func, genes, **params):
+        """
+        Returns the memoized results of ``func(genes = genes, **params)``, running the query only if the key has not been seen before
+        """
+        key = self.make_key(genes, **params)
+        if key in self.results:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.results[key] = func(genes = genes, **params)
+        return(self.results[key])
+
+    def lookups(self):
+        """
+        Total number of lookups made against the cache
+        """
+        return(self.hits + self.misses)
+
+    def hit_rate(self):
+        """
+        Fraction of lookups that were answered from the cache
+        """
+        if self.lookups() == 0:
+            return(0.0)
+        return(self.hits / self.lookups())
+
+    def summary(self):
+        """
+        A short description of the cache usage, for logging
+        """
+        return("{name}: {lookups} lookups, {hits} cache hits ({rate:.1f}%)".format(
+        name = self.name,
+        lookups = self.lookups(),
+        hits = self.hits,
+        rate = self.hit_rate() * 100
+        ))
+
 def query_variant(model, **params):
     """
     NOTE: what is this for? I do not remember
@@ -31,6 +112,105 @@ def query_variant(model, **params):
     variants = model.objects.filter(**params)
     return(variants)
 
+def check_knowledge_base():
+    """
+    Checks the cross-request interpretation cache and the knowledge base snapshot against the current knowledge base version,
+    so that results from an older version of the knowledge base are never used
+
+    Returns
+    -------
+    int
+        the current knowledge base version
+    """
+    kb_version = get_kb_version()
+    get_cache().validate(version = kb_version)
+    activate_snapshot(kb_version)
+    return(kb_version)
+
+def fusion_pair(record):
+    """
+    Get the ``(five_prime, three_prime)`` partner genes of a fusion record, or None for other records; the breakpoint exons are left out so that records for the same pair share cached results
+    """
+    if record.fusion is None:
+        return(None)
+    return((record.fusion.five_prime, record.fusion.three_prime))
+
+def cache_key(source, gene, tissue_type = None, tumor_type = None, variant = None):
+    """
+    Creates the key for a single gene query in the cross-request interpretation cache; 'Any' is treated the same as no filter
+    """
+    if tissue_type == 'Any':
+        tissue_type = None
+    if tumor_type == 'Any':
+        tumor_type = None
+    return((source, gene, tissue_type, tumor_type, variant))
+
+def filter_types(query, tissue_type = None, tumor_type = None):
+    """
+    Adds the tissue and tumor type filters to a knowledge base query; 'Any' is treated the same as no filter
+    """
+    if tissue_type and tissue_type != 'Any':
+        logger.debug("adding tissue_type to query")
+        query = query.filter(tissue_type = TissueType.objects.get(type = tissue_type))
+    if tumor_type and tumor_type != 'Any':
+        logger.debug("adding tumor_type to query")
+        query = query.filter(tumor_type = TumorType.objects.get(type = tumor_type))
+    return(query)
+
+def uncached_genes(source, genes, tissue_type = None, tumor_type = None):
+    """
+    Get the genes whose entries for a source are not in the cross-request interpretation cache yet, for prefetching them;
+    none if the entries are read from the knowledge base snapshot or the cache is disabled, and at most as many as fit in the cache
+    """
+    cache = get_cache()
+    if get_snapshot() is not None or not cache.enabled():
+        return([])
+    missing = [ gene for gene in genes if cache.get(cache_key(source, gene, tissue_type = tissue_type, tumor_type = tumor_type)) is None ]
+    return(missing[:cache.maxsize])
+
+def fetch_pmkb_genes(genes, tissue_type = None, tumor_type = None, variant = None):
+    """
+    Get the PMKB variant entries for a list of genes, along with their interpretations, tumor types, and tissue types.
+
+    Results are read from the knowledge base snapshot if one is active. Otherwise each gene is looked up in the cross-request
+    interpretation cache, and the genes that are not cached are read from the ``PMKBLookup`` table with a single query.
+
+    Returns
+    -------
+    dict
+        a list of ``PMKBVariant``-like entries for each gene
+    """
+    # answer from the shared snapshot file if there is one for the current knowledge base
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return({ gene: snapshot.pmkb_variants(gene, tissue_type = tissue_type, tumor_type = tumor_type, variant = variant) for gene in genes })
+    cache = get_cache()
+    results = {}
+    missing = []
+    for gene in genes:
+        value = cache.get(cache_key('pmkb', gene, tissue_type = tissue_type, tumor_type = tumor_type, variant = variant))
+        if value is None:
+            missing.append(gene)
+        else:
+            results[gene] = value
+    if missing:
+        logger.debug("querying PMKB lookup table")
+        for gene, variants in fetch_pmkb_lookup(missing, tissue_type = tissue_type, tumor_type = tumor_type, variant = variant).items():
+            cache.set(cache_key('pmkb', gene, tissue_type = tissue_type, tumor_type = tumor_type, variant = variant), variants)
+            results[gene] = variants
+    return(results)
+
+def fetch_pmkb_variants(gene, tissue_type = None, tumor_type = None, variant = None):
+    """
+    Get the PMKB variant entries for a single gene; see ``fetch_pmkb_genes``
+
+    Returns
+    -------
+    list
+        a list of ``PMKBVariant``-like entries
+    """
+    return(fetch_pmkb_genes([gene], tissue_type = tissue_type, tumor_type = tumor_type, variant = variant)[gene])
+
 def query_pmkb(genes, **params):
     """
     Get PMKB interpretations for a list of genes.
@@ -40,7 +220,10 @@ def query_pmkb(genes, **params):
     genes: list
         a list of gene identifiers
     **params: str
-        an optional set of string keyword arguments to filter PMKB results by, for the following keys: 'tissue_type', 'tumor_type', 'variant'
+        an optional set of string keyword arguments to filter PMKB results by, for the following keys: 'tissue_type', 'tumor_type', 'variant';
+        'features' from ``record_features`` and a ``RuleMatcher`` passed as 'matcher' to only keep the variants whose rules fire for a record;
+        a ``(five_prime, three_prime)`` pair passed as 'fusion' with a ``FusionIndex`` passed as 'fusion_index' to only keep the variants for that fusion,
+        if the PMKB has any, otherwise the variants that are not for some other fusion
 
     Returns
     -------
@@ -51,34 +234,107 @@ def query_pmkb(genes, **params):
     tissue_type = params.pop('tissue_type', None)
     tumor_type = params.pop('tumor_type', None)
     variant = params.pop('variant', None)
+    features = params.pop('features', None)
+    matcher = params.pop('matcher', None)
+    fusion = params.pop('fusion', None)
+    fusion_index = params.pop('fusion_index', None)
 
-    # build database query
-    logger.debug("building database query")
-    variant_query = PMKBVariant.objects.filter(gene__in = genes)
-    if tissue_type and tissue_type != 'Any':
-        logger.debug("adding tissue_type to query")
-        variant_query = variant_query.filter(tissue_type = TissueType.objects.get(type = tissue_type))
-    if tumor_type and tumor_type != 'Any':
-        logger.debug("adding tumor_type to query")
-        variant_query = variant_query.filter(tumor_type = TumorType.objects.get(type = tumor_type))
-    if variant:
-        logger.debug("adding variant to query")
-        variant_query = variant_query.filter(variant = variant)
+    # fusions listed by both partner genes are matched by the pair, before falling back to the single gene entries
+    # that are not tied to some other pair
+    fusion_ids = None
+    other_pair_ids = frozenset()
+    if fusion is not None:
+        fusion_ids = fusion_index.match('pmkb', *fusion) or None
+        if fusion_ids is None:
+            other_pair_ids = fusion_index.paired_ids('pmkb')
 
     # store interpretations in dict; list of unique variants for each interpretation
     logger.debug("getting unique interpretations from query")
     interpretations = defaultdict(set)
-    for variant_result in variant_query:
-        interpretations[variant_result.interpretation].add(variant_result)
+    gene_variants = fetch_pmkb_genes(genes = list(genes), tissue_type = tissue_type, tumor_type = tumor_type, variant = variant)
+    for gene in genes:
+        matching_ids = None
+        if fusion_ids is not None:
+            matching_ids = fusion_ids
+        elif features is not None:
+            matching_ids = matcher.match(gene, features)
+            if not matching_ids:
+                continue
+        for variant_result in gene_variants[gene]:
+            if matching_ids is not None and variant_result.id not in matching_ids:
+                continue
+            if variant_result.id in other_pair_ids:
+                continue
+            interpretations[variant_result.interpretation].add(variant_result)
 
-    # convert to list of dicts
+    # convert to list of view-models, in the order of the PMKB source rows
     logger.debug("reformatting query results")
     results = []
-    for key, value in interpretations.items():
-        d = {'interpretation': key, 'variants': list(value)}
-        results.append(d)
+    for key in sorted(interpretations.keys(), key = lambda x: (x.source_row, x.id)):
+        results.append(make_pmkb_view(interpretation = key, variants = interpretations[key]))
     return(results)
 
+def make_pmkb_view(interpretation, variants):
+    """
+    Creates the precomputed view-model for a single PMKB interpretation, so that the report template only needs to print fields
+
+    Parameters
+    ----------
+    interpretation: PMKBInterpretation
+        the interpretation shared by all of the `variants`
+    variants: iterable
+        the ``PMKBVariant`` entries that matched the query for the interpretation
+
+    Returns
+    -------
+    MappingProxyType
+        a read-only dict with the interpretation, its variants, and the deduplicated, sorted values of each variant attribute shown in the report
+
+    Examples
+    --------
+    Example usage::
+
+        view = make_pmkb_view(interpretation = interpretation, variants = variants)
+        view['genes']
+        >>> ('EGFR', 'NRAS')
+        view['tiers']
+        >>> (1, 2)
+
+    """
+    variants = tuple(sorted(variants, key = lambda x: x.id))
+    view = {
+        'interpretation': interpretation,
+        'variants': variants,
+        'genes': tuple(sorted(set([ v.gene for v in variants ]))),
+        'tumor_types': tuple(sorted(set([ v.tumor_type.type for v in variants ]))),
+        'tissue_types': tuple(sorted(set([ v.tissue_type.type for v in variants ]))),
+        'variant_names': tuple(sorted(set([ v.variant for v in variants ]))),
+        'tiers': tuple(sorted(set([ v.tier for v in variants ]))),
+        'source_rows': tuple(sorted(set([ v.source_row for v in variants ])))
+    }
+    return(MappingProxyType(view))
+
+def interpret_source(name, ir_table, **params):
+    """
+    Adds the results of a registered source from ``sources.py`` to an Ion Reporter table
+
+    Parameters
+    ----------
+    name: str
+        the name of the source, e.g. 'pmkb'
+    ir_table: IRTable
+        an `IRTable` object created from a valid Ion Reporter export .tsv file
+    **params:
+        optional 'tissue_type', 'tumor_type', and 'variant' filters, 'match_variants', and an optional `QueryCache` passed as 'cache' to share query results across records
+
+    Returns
+    -------
+    IRTable
+        the original `ir_table` object is returned, with interpretations added for each record in the table.
+    """
+    from interpreter.sources import get_source
+    return(get_source(name).interpret(ir_table, **params))
+
 def interpret_pmkb(ir_table, **params):
     """
     Adds PMKB interpretations to an Ion Reporter table
@@ -87,25 +343,63 @@ def interpret_pmkb(ir_table, **params):
     ----------
     ir_table: IRTable
         an `IRTable` object created from a valid Ion Reporter export .tsv file
+    **params:
+        optional 'tissue_type', 'tumor_type', and 'variant' filters, and an optional `QueryCache` passed as 'cache' to share query results across records; a new cache is used for each call if none is passed.
+        If 'match_variants' is True, each record is only matched to the PMKB variants whose compiled rules fire for the record
+        (e.g. the same protein change, 'codon(s) 12, 13 any', 'exon(s) 19 deletion', 'copy number gain'), instead of every variant of its genes,
+        and fusion records are only matched to the variants for the same pair of partner genes (e.g. 'EML4-ALK rearrangement') if there are any.
 
     Returns
     -------
     IRTable
         the original `ir_table` object is returned, with interpretations added for each record in the table.
     """
-    # parse the parameters passed
-    tissue_type = params.pop('tissue_type', None)
-    tumor_type = params.pop('tumor_type', None)
-    variant = params.pop('variant', None)
-    logger.debug("querying PMKB database for records in the IRTable")
-    for record in ir_table.records:
-        pmkb_results = query_pmkb(genes = record.genes,
-            tissue_type = tissue_type,
-            tumor_type = tumor_type,
-            variant = variant)
-        record.interpretations['pmkb'] = pmkb_results
-    logger.debug("returning database query results")
-    return(ir_table)
+    return(interpret_source('pmkb', ir_table, **params))
+
+def fetch_nyu_tiers(gene, tissue_type = None, tumor_type = None, variant = None):
+    """
+    Get the NYU tier entries for a single gene, from the knowledge base snapshot or the cross-request interpretation cache
+
+    Returns
+    -------
+    list
+        a list of ``NYUTier`` entries
+    """
+    # answer from the shared snapshot file if there is one for the current knowledge base
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return(snapshot.nyu_tiers(gene, tissue_type = tissue_type, tumor_type = tumor_type, variant = variant))
+    def query():
+        # build database query
+        logger.debug("building NYU tier database query")
+        variant_query = NYUTier.objects.filter(gene = gene).select_related('tumor_type', 'tissue_type')
+        variant_query = filter_types(variant_query, tissue_type = tissue_type, tumor_type = tumor_type)
+        if variant:
+            logger.debug("adding variant to query")
+            variant_key = variant_key_str(gene, variant)
+            if variant_key:
+                variant_query = variant_query.filter(Q(protein_key = variant_key) | Q(coding_key = variant_key))
+            else:
+                variant_query = variant_query.filter(Q(protein = variant) | Q(coding = variant))
+        return(list(variant_query))
+    key = cache_key('nyu_tier', gene, tissue_type = tissue_type, tumor_type = tumor_type, variant = variant)
+    return(get_cache().get_or_query(key, query))
+
+def prefetch_nyu_tiers(genes, tissue_type = None, tumor_type = None):
+    """
+    Load the NYU tier entries for many genes into the cross-request interpretation cache with one query per 500 genes,
+    instead of one query per gene in ``fetch_nyu_tiers``
+    """
+    missing = uncached_genes('nyu_tier', genes, tissue_type = tissue_type, tumor_type = tumor_type)
+    # stay under the SQLite limit on query parameters
+    for start in range(0, len(missing), 500):
+        batch = missing[start:start + 500]
+        tiers = defaultdict(list)
+        variant_query = NYUTier.objects.filter(gene__in = batch).select_related('tumor_type', 'tissue_type')
+        for tier in filter_types(variant_query, tissue_type = tissue_type, tumor_type = tumor_type):
+            tiers[tier.gene].append(tier)
+        for gene in batch:
+            get_cache().set(cache_key('nyu_tier', gene, tissue_type = tissue_type, tumor_type = tumor_type), tiers[gene])
 
 def query_nyu_tier(genes, **params):
     """
@@ -113,29 +407,18 @@ def query_nyu_tier(genes, **params):
     tissue_type = params.pop('tissue_type', None)
     tumor_type = params.pop('tumor_type', None)
     variant = params.pop('variant', None)
-    # build database query
-    logger.debug("building NYU tier database query")
-    variant_query = NYUTier.objects.filter(gene__in = genes)
-    if tissue_type and tissue_type != 'Any':
-        logger.debug("adding tissue_type to query")
-        variant_query = variant_query.filter(tissue_type = TissueType.objects.get(type = tissue_type))
-    if tumor_type and tumor_type != 'Any':
-        logger.debug("adding tumor_type to query")
-        variant_query = variant_query.filter(tumor_type = TumorType.objects.get(type = tumor_type))
-    if variant:
-        logger.debug("adding variant to query")
-        variant_query = variant_query.filter(variant = variant)
 
     # store proteins in dict; list of unique tiers for each protein
     logger.debug("getting unique protein codings from query")
     proteins = defaultdict(set)
-    for variant_result in variant_query:
-        proteins[variant_result.protein].add(variant_result)
+    for gene in genes:
+        for variant_result in fetch_nyu_tiers(gene = gene, tissue_type = tissue_type, tumor_type = tumor_type, variant = variant):
+            proteins[variant_result.protein].add(variant_result)
     # convert to list of dicts
     logger.debug("reformatting query results")
     results = []
-    for key, value in proteins.items():
-        d = {'protein': key, 'tiers': list(value)}
+    for key in sorted(proteins.keys()):
+        d = {'protein': key, 'tiers': sorted(proteins[key], key = lambda x: x.id)}
         results.append(d)
     return(results)
 
@@ -147,67 +430,101 @@ def interpret_nyu_tier(ir_table, **params):
     ----------
     ir_table: IRTable
         an `IRTable` object created from a valid Ion Reporter export .tsv file
+    **params:
+        optional 'tissue_type', 'tumor_type', and 'variant' filters, and an optional `QueryCache` passed as 'cache' to share query results across records; a new cache is used for each call if none is passed.
+        If 'match_variants' is True, each record is only matched to the NYU tiers with the same normalized protein change, or coding change if the record has no protein change.
 
     Returns
     -------
     IRTable
         the original `ir_table` object is returned, with interpretations added for each record in the table.
     """
-    tissue_type = params.pop('tissue_type', None)
-    tumor_type = params.pop('tumor_type', None)
-    variant = params.pop('variant', None)
-    logger.info("querying NYU tier database for records in the IRTable")
-    for record in ir_table.records:
-        nyu_tier_results = query_nyu_tier(genes = record.genes,
-            tissue_type = tissue_type,
-            tumor_type = tumor_type,
-            variant = variant)
-        record.interpretations['nyu_tier'] = nyu_tier_results
-    # debugger(locals().copy())
-    return(ir_table)
+    return(interpret_source('nyu_tier', ir_table, **params))
+
+def fetch_nyu_interpretations(gene, tissue_type = None, tumor_type = None, variant = None):
+    """
+    Get the NYU interpretation entries that include a single gene, from the knowledge base snapshot or the cross-request interpretation cache
+
+    Returns
+    -------
+    list
+        a list of ``NYUInterpretation`` entries
+    """
+    # answer from the shared snapshot file if there is one for the current knowledge base
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return(snapshot.nyu_interpretations(gene, tissue_type = tissue_type, tumor_type = tumor_type, variant = variant))
+    def query():
+        # build database query
+        logger.debug("building NYU interpretation database query")
+        variant_query =  NYUInterpretation.objects.all().select_related('tumor_type', 'tissue_type')
+        variant_query = filter_types(variant_query, tissue_type = tissue_type, tumor_type = tumor_type)
+        if variant:
+            logger.debug("adding variant to query")
+            variant_query = variant_query.filter(variant = variant)
+        results = []
+        for interpretation in variant_query:
+            interpretation_genes = json.loads(interpretation.genes_json)
+            if gene in interpretation_genes:
+                results.append(interpretation)
+        return(results)
+    key = cache_key('nyu_interpretation', gene, tissue_type = tissue_type, tumor_type = tumor_type, variant = variant)
+    return(get_cache().get_or_query(key, query))
+
+def prefetch_nyu_interpretations(genes, tissue_type = None, tumor_type = None):
+    """
+    Load the NYU interpretation entries for many genes into the cross-request interpretation cache with a single pass over
+    the interpretations, instead of one pass per gene in ``fetch_nyu_interpretations``
+    """
+    missing = uncached_genes('nyu_interpretation', genes, tissue_type = tissue_type, tumor_type = tumor_type)
+    if not missing:
+        return
+    interpretations = { gene: [] for gene in missing }
+    variant_query = NYUInterpretation.objects.all().select_related('tumor_type', 'tissue_type')
+    for interpretation in filter_types(variant_query, tissue_type = tissue_type, tumor_type = tumor_type):
+        for gene in json.loads(interpretation.genes_json):
+            if gene in interpretations:
+                interpretations[gene].append(interpretation)
+    for gene in missing:
+        get_cache().set(cache_key('nyu_interpretation', gene, tissue_type = tissue_type, tumor_type = tumor_type), interpretations[gene])
 
 def query_nyu_interpretation(genes, **params):
     """
+    Get the NYU interpretations for a list of genes; a ``(five_prime, three_prime)`` pair passed as 'fusion' with a ``FusionIndex`` passed as 'fusion_index'
+    only keeps the interpretations for that fusion if there are any, otherwise the interpretations that are not for some other fusion
     """
     tissue_type = params.pop('tissue_type', None)
     tumor_type = params.pop('tumor_type', None)
     variant = params.pop('variant', None)
-    # build database query
-    logger.debug("building NYU interpretation database query")
+    fusion = params.pop('fusion', None)
+    fusion_index = params.pop('fusion_index', None)
 
-    variant_query =  NYUInterpretation.objects.all()
-    if tissue_type and tissue_type != 'Any':
-        logger.debug("adding tissue_type to query")
-        variant_query = variant_query.filter(tissue_type = TissueType.objects.get(type = tissue_type))
-    if tumor_type and tumor_type != 'Any':
-        logger.debug("adding tumor_type to query")
-        variant_query = variant_query.filter(tumor_type = TumorType.objects.get(type = tumor_type))
-    if variant:
-        logger.debug("adding variant to query")
-        variant_query = variant_query.filter(variant = variant)
+    fusion_ids = None
+    other_pair_ids = frozenset()
+    if fusion is not None:
+        fusion_ids = fusion_index.match('nyu_interpretation', *fusion) or None
+        if fusion_ids is None:
+            other_pair_ids = fusion_index.paired_ids('nyu_interpretation')
 
-    results = []
-    for interpretation in variant_query:
-        interpretation_genes = json.loads(interpretation.genes_json)
-        if any(x in interpretation_genes for x in genes):
-            results.append(interpretation)
+    # keep the unique interpretations matching any of the genes, in database order
+    interpretations = {}
+    for gene in genes:
+        for interpretation in fetch_nyu_interpretations(gene = gene, tissue_type = tissue_type, tumor_type = tumor_type, variant = variant):
+            if fusion_ids is not None and interpretation.id not in fusion_ids:
+                continue
+            if interpretation.id in other_pair_ids:
+                continue
+            interpretations[interpretation.id] = interpretation
+    results = [ interpretations[key] for key in sorted(interpretations.keys()) ]
     return(results)
 
 def interpret_nyu_interpretation(ir_table, **params):
     """
+    Adds NYU interpretations to an Ion Reporter table
+
+    If 'match_variants' is True, fusion records are only matched to the interpretations for the same pair of partner genes (e.g. 'CCDC6 - RET') if there are any.
     """
-    tissue_type = params.pop('tissue_type', None)
-    tumor_type = params.pop('tumor_type', None)
-    variant = params.pop('variant', None)
-    logger.info("querying NYU interpretation database for records in the IRTable")
-    for record in ir_table.records:
-        nyu_interpretation_results = query_nyu_interpretation(genes = record.genes,
-            tissue_type = tissue_type,
-            tumor_type = tumor_type,
-            variant = variant)
-        record.interpretations['nyu_interpretation'] = nyu_interpretation_results
-    # debugger(locals().copy())
-    return(ir_table)
+    return(interpret_source('nyu_interpretation', ir_table, **params))
 
 def demo():
     tumor_type = "Any"
@@ -3,8 +3,29 @@
 """
 Module for parsing Ion Reporter exported .tsv file
 """
+import re
 import pandas as pd
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+from .filters import apply_filters
+
+# e.g. 'EML4(13) - ALK(20)'; the exon numbers are optional
+fusion_genes_pattern = re.compile(r'^\s*(?P<five_prime>[^\s()]+)(?:\((?P<five_prime_exon>\d+)\))?\s+-\s+(?P<three_prime>[^\s()]+)(?:\((?P<three_prime_exon>\d+)\))?\s*$')
+# e.g. 'EML4-ALK.E13A20.AB462411'; the second part holds the initial and exon number of each gene
+fusion_id_pattern = re.compile(r'^(?P<five_prime>[A-Za-z0-9]+)-(?P<three_prime>[A-Za-z0-9]+)(?:\.[A-Za-z]+(?P<five_prime_exon>\d+)[A-Za-z]+(?P<three_prime_exon>\d+))?(?:\.|$)')
+
+class Fusion(namedtuple('Fusion', ['five_prime', 'three_prime', 'five_prime_exon', 'three_prime_exon'])):
+    """
+    The 5' and 3' partner genes of a fusion, and the exons at the breakpoint (None if not known)
+    """
+    __slots__ = ()
+    def __str__(self):
+        parts = []
+        for gene, exon in [(self.five_prime, self.five_prime_exon), (self.three_prime, self.three_prime_exon)]:
+            if exon is None:
+                parts.append(gene)
+            else:
+                parts.append("{0} exon {1}".format(gene, exon))
+        return(' - '.join(parts))
 
 class IRTable(object):
     """
@@ -14,12 +35,27 @@ class IRTable(object):
     ----------
     source: str
         path to .tsv file to read in.
-    params: dict
-        dictionary of extra meta data parameters; 'tumorType', 'tissueType'
+    table: pandas.dataframe
+        an already loaded part of the table, e.g. a chunk from ``IRTableReader``; the source is not read if this is passed
+    synonyms: dict
+        upper case previous and alias gene symbols mapped to approved symbols, used to rename the genes of each record
+    filters: list
+        the filters from ``filters.parse_filters``; the rows that fail any of them are dropped before the records are made
+
+    Attributes
+    ----------
+    filtered: OrderedDict
+        the number of rows dropped by each filter, by the label of the filter
     """
-    def __init__(self, source):
+    def __init__(self, source, table = None, synonyms = None, filters = None):
         self.source = source
-        self.table = self.load_table(source = self.source)
+        self.synonyms = synonyms
+        if table is None:
+            table = self.load_table(source = self.source)
+        self.filtered = OrderedDict()
+        if filters:
+            table, self.filtered = apply_filters(table, filters)
+        self.table = table
         # TODO: fix header load method, need to do a seek(0) or something to read file again from start to allow load from memory
         # self.header = self.load_header(source = self.source)
         self.records = self.get_records(data = self.table)
@@ -67,9 +103,51 @@ class IRTable(object):
         # convert dataframe to list of dictionaries
         records = data.to_dict(orient='records')
         # initialize IRRecord objects
-        ir_records = [ IRRecord(data = record) for record in records ]
+        ir_records = [ IRRecord(data = record, synonyms = self.synonyms) for record in records ]
         return(ir_records)
 
+class IRTableReader(object):
+    """
+    Reads an Ion Reporter .tsv file in chunks of records, so that only one chunk of a large file is held in memory at a time
+
+    Parameters
+    ----------
+    source: str
+        path to .tsv file to read in, or a file-like object
+    chunksize: int
+        the number of records in each chunk; can be changed between chunks
+    synonyms: dict
+        gene synonyms passed to each ``IRTable``
+    filters: list
+        filters passed to each ``IRTable``
+
+    Examples
+    --------
+    Example usage::
+
+        reader = IRTableReader("SeraSeq.tsv", chunksize = 10)
+        for table in reader:
+            print(len(table.records))
+
+    """
+    def __init__(self, source, chunksize = 500, synonyms = None, filters = None):
+        self.source = source
+        self.chunksize = chunksize
+        self.synonyms = synonyms
+        self.filters = filters
+
+    def __iter__(self):
+        reader = pd.read_csv(self.source, sep = '\t', comment = '#', iterator = True)
+        while True:
+            try:
+                df = reader.get_chunk(max(int(self.chunksize), 1))
+            except StopIteration:
+                break
+            # the index continues across chunks, so the row numbers match the whole table
+            df.index.names = ['Row']
+            df = df.reset_index()
+            yield(IRTable(source = self.source, table = df, synonyms = self.synonyms, filters = self.filters))
+
 class IRRecord(object):
     """
     An entry in the variant table output by Ion Reporter exporter
@@ -78,6 +156,8 @@ class IRRecord(object):
     ----------
     data: dict
         dictionary of values parsed from the Ion Reporter .tsv table
+    synonyms: dict
+        upper case previous and alias gene symbols mapped to approved symbols; the record's genes are renamed to the approved symbols
 
 
     Examples
@@ -89,11 +169,24 @@ class IRRecord(object):
         y.parse_genes('EGFR,EGFR-AS1')
 
     """
-    def __init__(self, data, variant = None):
+    def __init__(self, data, variant = None, synonyms = None):
         self.data = data
         self.genes = self.parse_genes(self.data['Genes'])
+        if synonyms:
+            self.genes = self.rename_genes(self.genes, synonyms)
         self.afs = self.parse_af(self.data['% Frequency'])
         self.af_str = ' '.join([str(x) for x in self.afs])
+        # the HGVS changes used for variant-level matching, or None if there are none
+        self.protein_change = self.parse_change(self.data.get('Amino Acid Change', None))
+        self.coding_change = self.parse_change(self.data.get('Coding', None))
+        # the partner genes and breakpoint of a fusion, or None for other variant types
+        self.fusion = None
+        if str(self.data.get('Type', '')).upper() == 'FUSION':
+            self.fusion = self.parse_fusion(self.data['Genes'], self.data.get('Variant ID', None))
+            if self.fusion is not None and synonyms:
+                self.fusion = self.fusion._replace(
+                    five_prime = synonyms.get(self.fusion.five_prime.upper(), self.fusion.five_prime),
+                    three_prime = synonyms.get(self.fusion.three_prime.upper(), self.fusion.three_prime))
         # initialize empty dict to hold interpretations later
         # add named interpretations sets; {'pmkb': [ interpretation1, interpretation2, ... ]}
         self.interpretations = {}
@@ -143,6 +236,103 @@ class IRRecord(object):
             genes[gene] = ''
         return(list(genes.keys()))
 
+    def rename_genes(self, genes, synonyms):
+        """
+        Replaces previous and alias gene symbols with the approved symbols, dropping any duplicates
+
+        Examples
+        --------
+        Example usage::
+
+            >>> rename_genes(['MLL', 'KMT2A', 'NRAS'], {'MLL': 'KMT2A'})
+            ['KMT2A', 'NRAS']
+
+        """
+        renamed = OrderedDict()
+        for gene in genes:
+            renamed[synonyms.get(gene.upper(), gene)] = ''
+        return(list(renamed.keys()))
+
+    def parse_change(self, change):
+        """
+        Cleans up an HGVS protein or coding change from the IR table
+
+        Parameters
+        ----------
+        change: str
+            the 'Amino Acid Change' or 'Coding' value from a row in the Ion Reporter .tsv table
+
+        Returns
+        -------
+        str
+            the change, or None for empty, missing, or unknown ('p.?') values
+
+        Examples
+        --------
+        Example usage::
+
+            >>> parse_change('p.Gln61Arg')
+            'p.Gln61Arg'
+            >>> import numpy as np
+            >>> parse_change(np.nan)
+
+        """
+        if pd.isnull(change):
+            return(None)
+        change = str(change).strip()
+        if change in ['', 'p.?', 'c.?', 'p.=']:
+            return(None)
+        return(change)
+
+    def parse_fusion(self, genes, variant_id = None):
+        """
+        Parses the partner genes and breakpoint exons of a fusion from the 'Genes' and 'Variant ID' entries in the IR table
+
+        Parameters
+        ----------
+        genes: str
+            the 'Genes' value, e.g. 'EML4(13) - ALK(20)'
+        variant_id: str
+            the 'Variant ID' value, e.g. 'EML4-ALK.E13A20.AB462411'; used for anything missing from ``genes``
+
+        Returns
+        -------
+        Fusion
+            the fusion, or None if neither value names two partner genes
+
+        Examples
+        --------
+        Example usage::
+
+            >>> parse_fusion('EML4(13) - ALK(20)')
+            Fusion(five_prime='EML4', three_prime='ALK', five_prime_exon=13, three_prime_exon=20)
+            >>> parse_fusion('ALK', 'EML4-ALK.E13A20.AB462411')
+            Fusion(five_prime='EML4', three_prime='ALK', five_prime_exon=13, three_prime_exon=20)
+
+        """
+        parsed = []
+        for pattern, text in [(fusion_genes_pattern, genes), (fusion_id_pattern, variant_id)]:
+            if pd.isnull(text):
+                continue
+            match = pattern.match(str(text).strip())
+            if match:
+                parsed.append(match.groupdict())
+        if len(parsed) < 1:
+            return(None)
+        fields = parsed[0]
+        for other in parsed[1:]:
+            # only take the exons from the Variant ID if it names the same genes
+            if (other['five_prime'], other['three_prime']) == (fields['five_prime'], fields['three_prime']):
+                for key in ['five_prime_exon', 'three_prime_exon']:
+                    if fields[key] is None:
+                        fields[key] = other[key]
+        return(Fusion(
+            five_prime = fields['five_prime'],
+            three_prime = fields['three_prime'],
+            five_prime_exon = None if fields['five_prime_exon'] is None else int(fields['five_prime_exon']),
+            three_prime_exon = None if fields['three_prime_exon'] is None else int(fields['three_prime_exon'])
+            ))
+
     def parse_af(self, af):
         """
         Attempts to split the Percent Allele Frequency ('% Frequency') entry in the IR table into separate entries and only keep non-zero entries.
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for generating reports in background worker processes
+
+Uploads are saved to ``settings.JOB_DIR`` and queued as ``ReportJob`` rows; workers started with
+``python manage.py report_worker`` claim queued jobs, store the interpretation result for each record and the
+finished HTML report next to the upload, and delete the files of jobs that are older than ``settings.JOB_RETENTION_HOURS``.
+Running jobs record a heartbeat as each stage starts; a job whose worker was killed stops updating it, and is marked as failed
+by the other workers once it is older than ``settings.JOB_STALE_MINUTES``.
+"""
+import os
+import time
+import uuid
+import logging
+import datetime
+import traceback
+from django.conf import settings
+from django.utils import timezone
+from .models import ReportJob
+from .report_store import write_report_store, ReportStore
+from .kb_builds import check_kb_build
+
+logger = logging.getLogger()
+
+def job_path(key, extension):
+    """
+    Get the path to a file for a job in the job directory
+    """
+    return(os.path.join(settings.JOB_DIR, "{0}.{1}".format(key, extension)))
+
+def submit_job(upload, tissue_type = None, tumor_type = None, ip = '', match_variants = False, sources = None, filters = ''):
+    """
+    Save an uploaded file and queue it for report generation
+
+    Parameters
+    ----------
+    upload: django.core.files.uploadedfile.UploadedFile
+        the uploaded Ion Reporter .tsv file, or annotated .vcf or .vcf.gz file
+    tissue_type: str
+        tissue type to filter interpretations by, or None for any
+    tumor_type: str
+        tumor type to filter interpretations by, or None for any
+    ip: str
+        the client IP address
+    match_variants: bool
+        use variant-level matching for the report
+    sources: list
+        the names of the interpretation sources to look up; all registered sources if None
+    filters: str
+        the filter chain that records are dropped by before they are interpreted, see ``filters.py``; '' for no filters
+
+    Returns
+    -------
+    ReportJob
+        the queued job
+    """
+    os.makedirs(settings.JOB_DIR, exist_ok = True)
+    key = uuid.uuid4().hex
+    extension = 'tsv'
+    for vcf_extension in ['vcf', 'vcf.gz']:
+        if str(upload).endswith('.' + vcf_extension):
+            extension = vcf_extension
+    input_file = job_path(key, extension)
+    with open(input_file, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    job = ReportJob.objects.create(
+        key = key,
+        filename = str(upload)[:255],
+        input_file = input_file,
+        tissue_type = tissue_type,
+        tumor_type = tumor_type,
+        match_variants = match_variants,
+        sources = ','.join(sources or []),
+        filters = filters,
+        ip = ip
+        )
+    logger.info("queued report job {0} for {1}".format(job.id, job.filename))
+    return(job)
+
+def claim_next_job(worker = ''):
+    """
+    Claim the oldest queued job for this worker
+
+    The claim is a single conditional UPDATE, so two workers can never claim the same job.
+
+    Returns
+    -------
+    ReportJob
+        the claimed job, or None if the queue is empty
+    """
+    queued = ReportJob.objects.filter(status = 'queued').order_by('created', 'id').values_list('id', flat = True)
+    for id in queued[:10]:
+        now = timezone.now()
+        claimed = ReportJob.objects.filter(id = id, status = 'queued').update(
+            status = 'running', stage = 'starting', started = now, heartbeat = now, worker = worker)
+        if claimed:
+            return(ReportJob.objects.get(id = id))
+    return(None)
+
+def run_job(job):
+    """
+    Generate the report for a claimed job, recording its progress through each stage
+
+    Returns
+    -------
+    ReportJob
+        the job with its final status
+    """
+    def progress(stage, percent):
+        ReportJob.objects.filter(id = job.id).update(stage = stage, progress = percent, heartbeat = timezone.now())
+
+    retention = datetime.timedelta(hours = settings.JOB_RETENTION_HOURS)
+    logger.info("running report job {0}".format(job.id))
+    try:
+        result_file = job_path(job.key, 'sqlite3')
+        write_report_store(input = job.input_file,
+            path = result_file,
+            tissue_type = job.tissue_type,
+            tumor_type = job.tumor_type,
+            match_variants = job.match_variants,
+            sources = job.sources.split(',') if job.sources else None,
+            filters = job.filters,
+            progress = progress)
+        # the full report is assembled from the stored records, for download
+        progress('rendering', 90)
+        report_file = job_path(job.key, 'html')
+        with ReportStore(result_file) as store, open(report_file + '.tmp', 'w', encoding = 'utf-8') as f:
+            for part in store.iter_report_html():
+                f.write(part)
+        os.replace(report_file + '.tmp', report_file)
+        now = timezone.now()
+        ReportJob.objects.filter(id = job.id).update(status = 'finished', stage = 'done', progress = 100,
+            report_file = report_file, result_file = result_file, finished = now, expires = now + retention)
+    except Exception:
+        logger.exception("report job {0} failed".format(job.id))
+        now = timezone.now()
+        ReportJob.objects.filter(id = job.id).update(status = 'failed',
+            error = traceback.format_exc(limit = 3), finished = now, expires = now + retention)
+    return(ReportJob.objects.get(id = job.id))
+
+def fail_stale_jobs(now = None):
+    """
+    Mark running jobs whose worker has stopped reporting progress as failed
+
+    A worker that is killed in the middle of a job leaves it running; failing it sets its expiry, so that its files are
+    deleted by ``purge_expired_jobs``. The job is not requeued, since the input that killed the worker would kill the next one too.
+
+    Returns
+    -------
+    int
+        the number of jobs marked as failed
+    """
+    if now is None:
+        now = timezone.now()
+    stale = now - datetime.timedelta(minutes = settings.JOB_STALE_MINUTES)
+    retention = datetime.timedelta(hours = settings.JOB_RETENTION_HOURS)
+    num_failed = ReportJob.objects.filter(status = 'running', heartbeat__lt = stale).update(status = 'failed',
+        error = 'The report worker stopped while running this job', finished = now, expires = now + retention)
+    if num_failed:
+        logger.warning("marked {0} report jobs of stopped workers as failed".format(num_failed))
+    return(num_failed)
+
+def purge_expired_jobs(now = None):
+    """
+    Delete expired jobs and their files
+
+    Returns
+    -------
+    int
+        the number of jobs deleted
+    """
+    if now is None:
+        now = timezone.now()
+    expired = ReportJob.objects.filter(expires__lt = now)
+    num_deleted = 0
+    for job in expired:
+        for path in [job.input_file, job.report_file, job.result_file]:
+            if path and os.path.exists(path):
+                os.remove(path)
+        job.delete()
+        num_deleted += 1
+    if num_deleted:
+        logger.info("deleted {0} expired report jobs".format(num_deleted))
+    return(num_deleted)
+
+def run_worker(once = False, poll_interval = None, worker = None):
+    """
+    Run queued jobs until stopped
+
+    Parameters
+    ----------
+    once: bool
+        exit once the queue is empty instead of waiting for new jobs
+    poll_interval: float
+        seconds to sleep when the queue is empty; defaults to ``settings.JOB_POLL_INTERVAL``
+    worker: str
+        name recorded on the jobs run by this worker; defaults to the host and process id
+
+    Returns
+    -------
+    int
+        the number of jobs run
+    """
+    if poll_interval is None:
+        poll_interval = settings.JOB_POLL_INTERVAL
+    if worker is None:
+        worker = "{0}:{1}".format(os.uname()[1], os.getpid())
+    num_run = 0
+    last_purge = 0
+    while True:
+        # check for stale and expired jobs about once a minute
+        if time.time() - last_purge > 60:
+            fail_stale_jobs()
+            purge_expired_jobs()
+            last_purge = time.time()
+        # switch to a newly published knowledge base build between jobs
+        check_kb_build()
+        job = claim_next_job(worker = worker)
+        if job is not None:
+            run_job(job)
+            num_run += 1
+        elif once:
+            return(num_run)
+        else:
+            time.sleep(poll_interval)
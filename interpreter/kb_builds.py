@@ -0,0 +1,487 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for versioned knowledge base builds that are swapped in while the app is serving
+
+``python manage.py build_kb`` imports the knowledge base into a new SQLite file in ``settings.KB_DIR`` instead of the
+database being served, so a long import does not hold locks on the served database and a failed import is never
+served. The new file is checked for integrity and row counts, stamped with a knowledge base version above the one being
+served, compiled into its own snapshot file (see ``snapshot.py``), and published by atomically replacing the ``current``
+pointer file. Each worker checks the pointer at most every ``settings.KB_CHECK_INTERVAL`` seconds, and switches the
+``knowledge_base`` database and the snapshot to the new build between requests, without a restart; the previous build is
+kept for ``python manage.py activate_kb --rollback``.
+
+Files in ``settings.KB_DIR``::
+
+    interpreter-20190301-120000.sqlite3     a knowledge base build
+    interpreter-20190301-120000.snapshot    the snapshot of the build
+    current                                 the name of the build being served
+    previous                                the name of the build served before it
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import sqlite3
+import logging
+import datetime
+import threading
+import subprocess
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from .models import (TumorType, TissueType, PMKBVariant, PMKBInterpretation, PMKBLookup, PMKBVariantRule, NYUTier,
+    NYUInterpretation, GeneSynonym, KnowledgeBaseVersion, UserAccessMetric, UserUploadMetric, ReportJob)
+
+logger = logging.getLogger()
+
+kb_alias = 'knowledge_base'
+
+build_pattern = re.compile(r'^interpreter-\d{8}-\d{6}(-\d+)?\.sqlite3$')
+
+# import steps of a full build, in order; the same as 'make import'
+import_types = ['gene_synonyms', 'tumor_type', 'tissue_type', 'nyu_tier', 'nyu_interpretation', 'PMKB']
+
+# tables that must have rows in every build
+required_models = [TumorType, TissueType, PMKBVariant, PMKBInterpretation, PMKBLookup]
+# tables whose row counts are compared with the served knowledge base
+checked_models = required_models + [PMKBVariantRule, NYUTier, NYUInterpretation, GeneSynonym]
+# tables that are not part of the knowledge base; emptied when the served knowledge base is copied, see ``routers.Router``
+app_state_models = [UserAccessMetric, UserUploadMetric, ReportJob]
+
+def get_import_types():
+    """
+    Get the import steps of a full build; ``import_types``, followed by the types of any other registered
+    interpretation sources, see ``sources.py``
+    """
+    from .sources import get_sources
+    types = list(import_types)
+    for source in get_sources():
+        types.extend( import_type for import_type in source.import_types if import_type not in types )
+    return(types)
+
+def build_path(name):
+    """
+    Get the path to a build in ``settings.KB_DIR``
+    """
+    return(os.path.join(settings.KB_DIR, name))
+
+def snapshot_path(name):
+    """
+    Get the path to the snapshot file of a build
+    """
+    return(os.path.splitext(build_path(name))[0] + '.snapshot')
+
+def read_pointer(pointer):
+    """
+    Get the build name stored in the 'current' or 'previous' pointer file, or None if it is not set
+    """
+    try:
+        with open(build_path(pointer)) as f:
+            name = f.read().strip()
+    except OSError:
+        return(None)
+    return(name or None)
+
+def write_pointer(pointer, name):
+    """
+    Replace the 'current' or 'previous' pointer file; the new file is written and synced first, so readers see either
+    the old name or the new one
+    """
+    path = build_path(pointer)
+    with open(path + '.tmp', 'w') as f:
+        f.write(name + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+def list_builds():
+    """
+    Get the names of the builds in ``settings.KB_DIR``, oldest first
+    """
+    if not os.path.isdir(settings.KB_DIR):
+        return([])
+    return(sorted([ name for name in os.listdir(settings.KB_DIR) if build_pattern.match(name) ]))
+
+def served_path():
+    """
+    Get the path of the knowledge base that is served: the pinned ``settings.KNOWLEDGE_BASE_DB``, the published build,
+    or ``settings.INTERPRETER_DB`` if no build has been published yet
+    """
+    if settings.KNOWLEDGE_BASE_DB:
+        return(settings.KNOWLEDGE_BASE_DB)
+    name = read_pointer('current')
+    if name is not None:
+        return(build_path(name))
+    return(settings.INTERPRETER_DB)
+
+def read_only(path):
+    """
+    Open an SQLite file read-only, so that a missing file is an error instead of an empty new database
+    """
+    return(sqlite3.connect('file:{0}?mode=ro'.format(path), uri = True))
+
+def read_kb_version(path):
+    """
+    Get the knowledge base version stored in an SQLite file, 0 if it has none
+    """
+    connection = read_only(path)
+    try:
+        row = connection.execute("SELECT version FROM {0} WHERE id = 1".format(KnowledgeBaseVersion._meta.db_table)).fetchone()
+    finally:
+        connection.close()
+    return(row[0] if row else 0)
+
+def count_rows(path):
+    """
+    Get the number of rows of each checked table in an SQLite file
+
+    Returns
+    -------
+    dict
+        the row count for the table name of each model in ``checked_models``
+    """
+    connection = read_only(path)
+    try:
+        return({ model._meta.db_table: connection.execute("SELECT count(*) FROM {0}".format(model._meta.db_table)).fetchone()[0] for model in checked_models })
+    finally:
+        connection.close()
+
+def new_build_name(now = None):
+    """
+    Get a name for a new build from the current time
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    name = 'interpreter-{0:%Y%m%d-%H%M%S}'.format(now)
+    suffix = ''
+    i = 1
+    while os.path.exists(build_path(name + suffix + '.sqlite3')):
+        i += 1
+        suffix = '-{0}'.format(i)
+    return(name + suffix + '.sqlite3')
+
+def copy_served(path):
+    """
+    Copy the served knowledge base to a new build file, e.g. to re-import only the PMKB
+
+    A read transaction is held while the file is copied, so that the copy is consistent; admin edits wait for it to finish.
+    The tables of the app state, e.g. the report jobs, are emptied in the copy, since they are only read from ``interpreter_db``.
+    """
+    source = served_path()
+    connection = sqlite3.connect(source, timeout = 20)
+    try:
+        connection.execute("BEGIN")
+        connection.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        shutil.copyfile(source, path)
+    finally:
+        connection.rollback()
+        connection.close()
+    connection = sqlite3.connect(path)
+    try:
+        for model in app_state_models:
+            connection.execute("DELETE FROM {0}".format(model._meta.db_table))
+        connection.commit()
+    finally:
+        connection.close()
+
+def run_build_step(args, path):
+    """
+    Run a management command or script from the project directory against a build file instead of the served knowledge base
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        if the step fails
+    """
+    logger.info("running build step: {0}".format(' '.join(args)))
+    env = dict(os.environ, KNOWLEDGE_BASE_DB = path)
+    subprocess.run([sys.executable] + args, env = env, cwd = settings.BASE_DIR, check = True)
+
+def create_build(types = None, copy_current = False):
+    """
+    Import the knowledge base into a new build file in ``settings.KB_DIR``
+
+    Each import step runs in its own process with the ``knowledge_base`` database pinned to the new file, the same as
+    running ``interpreter/importer.py`` by hand. The build is then stamped with the version it will be published as, and
+    compiled into its snapshot file. If any step fails the partial build is deleted.
+
+    Parameters
+    ----------
+    types: list
+        the importer types to run, in order; defaults to ``get_import_types``
+    copy_current: bool
+        start from a copy of the served knowledge base instead of an empty database
+
+    Returns
+    -------
+    str
+        the name of the new build
+    """
+    if types is None:
+        types = get_import_types()
+    os.makedirs(settings.KB_DIR, exist_ok = True)
+    name = new_build_name()
+    path = build_path(name)
+    start = time.time()
+    try:
+        if copy_current:
+            copy_served(path)
+        run_build_step(['manage.py', 'migrate', 'interpreter', '--database', kb_alias], path)
+        for import_type in types:
+            run_build_step([os.path.join('interpreter', 'importer.py'), '--type', import_type], path)
+        run_build_step(['manage.py', 'check_pmkb_lookup'], path)
+        stamp_kb_version(path, next_kb_version(path))
+        compile_build_snapshot(name)
+    except Exception:
+        logger.error("knowledge base build {0} failed; removing it".format(name))
+        remove_build(name)
+        raise
+    logger.info("built knowledge base {0}; {1:.1f}s".format(name, time.time() - start))
+    return(name)
+
+def check_build(name, min_row_fraction = None):
+    """
+    Check a build before it is published
+
+    Parameters
+    ----------
+    name: str
+        the name of the build
+    min_row_fraction: float
+        the fraction of the served knowledge base's rows that each checked table must have; defaults to
+        ``settings.KB_MIN_ROW_FRACTION``, and 0 skips the comparison
+
+    Returns
+    -------
+    list
+        descriptions of the problems found
+    """
+    if min_row_fraction is None:
+        min_row_fraction = settings.KB_MIN_ROW_FRACTION
+    path = build_path(name)
+    connection = read_only(path)
+    try:
+        integrity = [ row[0] for row in connection.execute("PRAGMA integrity_check") ]
+        foreign_keys = connection.execute("PRAGMA foreign_key_check").fetchall()
+    finally:
+        connection.close()
+    problems = []
+    if integrity != ['ok']:
+        problems.extend([ "integrity check: {0}".format(message) for message in integrity ])
+    if foreign_keys:
+        problems.append("{0} rows with missing foreign keys".format(len(foreign_keys)))
+    counts = count_rows(path)
+    for model in required_models:
+        if not counts[model._meta.db_table]:
+            problems.append("{0} has no rows".format(model._meta.db_table))
+    served = served_path()
+    if min_row_fraction and os.path.exists(served) and os.path.realpath(served) != os.path.realpath(path):
+        try:
+            served_counts = count_rows(served)
+        except sqlite3.Error:
+            served_counts = {}
+        for table, count in sorted(counts.items()):
+            served_count = served_counts.get(table, 0)
+            if count < served_count * min_row_fraction:
+                problems.append("{0} has {1} rows, the served knowledge base has {2}".format(table, count, served_count))
+    return(problems)
+
+def stamp_kb_version(path, version):
+    """
+    Set the knowledge base version stored in a build file
+    """
+    connection = sqlite3.connect(path, timeout = 20)
+    try:
+        connection.execute("INSERT OR REPLACE INTO {0} (id, version, updated) VALUES (1, ?, ?)".format(KnowledgeBaseVersion._meta.db_table),
+            (version, datetime.datetime.utcnow().isoformat(' ')))
+        connection.commit()
+    finally:
+        connection.close()
+
+def next_kb_version(path):
+    """
+    Get the knowledge base version to publish a build as: its own version if it is above the served one, otherwise the
+    one after the served version, so that the results cached for the served knowledge base are not used with the build
+    """
+    served = served_path()
+    served_version = read_kb_version(served) if os.path.exists(served) else 0
+    return(max(served_version + 1, read_kb_version(path)))
+
+def compile_build_snapshot(name):
+    """
+    Compile the snapshot file of a build, in its own process with the ``knowledge_base`` database pinned to the build
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        if the snapshot could not be compiled
+    """
+    run_build_step([os.path.join('interpreter', 'snapshot.py'), '--output', snapshot_path(name)], build_path(name))
+
+def publish_build(name):
+    """
+    Serve a build: its knowledge base version is set above the served one (see ``next_kb_version``), and the 'current'
+    pointer is replaced; the build that was served before is recorded as 'previous'
+
+    The snapshot of the build is compiled again if its version changed since it was built, e.g. when rolling back to the
+    previous build. Builds without a snapshot are served from the database.
+
+    Returns
+    -------
+    int
+        the knowledge base version of the published build
+    """
+    path = build_path(name)
+    version = next_kb_version(path)
+    if version != read_kb_version(path):
+        stamp_kb_version(path, version)
+        if os.path.exists(snapshot_path(name)):
+            try:
+                compile_build_snapshot(name)
+            except subprocess.CalledProcessError:
+                logger.error("could not compile the snapshot of knowledge base {0}; it will be served from the database".format(name))
+                os.remove(snapshot_path(name))
+    current = read_pointer('current')
+    if current is not None and current != name:
+        write_pointer('previous', current)
+    write_pointer('current', name)
+    logger.info("published knowledge base {0} as version {1}".format(name, version))
+    return(version)
+
+def remove_build(name):
+    """
+    Delete a build file, its journal, and its snapshot
+    """
+    for path in [build_path(name), build_path(name) + '-journal', snapshot_path(name)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+def prune_builds(keep = None):
+    """
+    Delete the oldest builds, keeping the ``keep`` newest ones and the 'current' and 'previous' builds
+
+    Returns
+    -------
+    list
+        the names of the deleted builds
+    """
+    if keep is None:
+        keep = settings.KB_KEEP_BUILDS
+    builds = list_builds()
+    kept = set(builds[-keep:] if keep > 0 else []) | set([read_pointer('current'), read_pointer('previous')])
+    removed = [ name for name in builds if name not in kept ]
+    for name in removed:
+        remove_build(name)
+    if removed:
+        logger.info("deleted {0} old knowledge base builds".format(len(removed)))
+    return(removed)
+
+_active_build = None
+_last_check = 0
+_active_lock = threading.Lock()
+# the build that each thread's connection to each alias was last pointed at
+_thread_build = threading.local()
+# the database files configured for each alias in the settings, before any switch to a build
+_configured_names = {}
+
+def check_kb_build(alias = kb_alias):
+    """
+    Switch the knowledge base database of this worker to the published build, if a new one has been published
+
+    The pointer file is read at most every ``settings.KB_CHECK_INTERVAL`` seconds. Each thread moves its own connection
+    to the new build the next time it calls this, between requests, so a request in progress keeps reading the build it
+    started with; see ``use_kb_build``. The snapshot of the new build is used in place of
+    ``settings.INTERPRETER_SNAPSHOT``, see ``served_snapshot_path``. Nothing is switched if ``settings.KNOWLEDGE_BASE_DB`` is set, or if no build
+    has been published.
+
+    Returns
+    -------
+    str
+        the name of the build being served, or None if the configured database is being served
+    """
+    global _active_build, _last_check
+    if settings.KNOWLEDGE_BASE_DB:
+        return(None)
+    switched = False
+    with _active_lock:
+        now = time.time()
+        if now - _last_check >= settings.KB_CHECK_INTERVAL:
+            _last_check = now
+            name = read_pointer('current')
+            if name is not None and name != _active_build:
+                if os.path.exists(build_path(name)):
+                    _configured_names.setdefault(alias, connections.databases[alias]['NAME'])
+                    connections.databases[alias]['NAME'] = build_path(name)
+                    logger.info("switched to knowledge base {0}".format(name))
+                    _active_build = name
+                    switched = True
+                else:
+                    logger.error("published knowledge base {0} is missing".format(name))
+        active_build = _active_build
+    use_kb_build(active_build, alias = alias)
+    # load the snapshot of the new build now instead of on the first lookup; at startup this is called before the apps
+    # are ready, and the snapshot is loaded on the first lookup instead
+    if switched and apps.ready:
+        from .snapshot import activate_snapshot
+        activate_snapshot(read_kb_version(build_path(active_build)))
+    return(active_build)
+
+def thread_kb_build(alias = kb_alias):
+    """
+    Get the build that this thread's knowledge base connection reads, as of its last ``check_kb_build`` or ``use_kb_build``
+
+    Returns
+    -------
+    str
+        the name of the build, or None if the configured database is being read
+    """
+    return(getattr(_thread_build, 'names', {}).get(alias, None))
+
+def use_kb_build(name, alias = kb_alias):
+    """
+    Point this thread's knowledge base connection at a build, e.g. in a lookup thread running part of a report that was
+    started on that build, whatever build the worker has switched to since
+
+    The connection gets its own copy of the database settings, so a later switch by another thread does not move it to
+    another build when it reconnects. It is only closed if it was reading a different build.
+
+    Parameters
+    ----------
+    name: str
+        the name of the build, or None for the configured database
+    """
+    if not hasattr(_thread_build, 'names'):
+        _thread_build.names = {}
+    if alias in _thread_build.names and _thread_build.names[alias] == name:
+        return
+    if name is not None:
+        path = build_path(name)
+    else:
+        path = _configured_names.get(alias, connections.databases[alias]['NAME'])
+    connection = connections[alias]
+    if connection.settings_dict['NAME'] != path:
+        connection.close()
+    connection.settings_dict = dict(connection.settings_dict, NAME = path)
+    _thread_build.names[alias] = name
+
+def served_snapshot_path():
+    """
+    Get the path of the snapshot of the served knowledge base: the snapshot of the build this worker switched to, or
+    ``settings.INTERPRETER_SNAPSHOT`` if it has not switched to a build
+    """
+    if _active_build is not None:
+        return(snapshot_path(_active_build))
+    return(getattr(settings, 'INTERPRETER_SNAPSHOT', None))
+
+def reset_kb_build():
+    """
+    Forget the build this worker switched to, so that the pointer is read on the next check
+    """
+    global _active_build, _last_check
+    with _active_lock:
+        _active_build = None
+        _last_check = 0
+        _configured_names.clear()
+    _thread_build.names = {}
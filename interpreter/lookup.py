@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for the denormalized PMKB lookup table
+
+Each ``PMKBLookup`` row holds a PMKB variant with the names of its tumor and tissue types and the id and source row of
+its interpretation, keyed on the gene and ordered by interpretation, so that the variants for all the genes of a record
+are read with a single index scan instead of joining ``PMKBVariant`` to the type and interpretation tables. The table is
+rebuilt by the importer, kept up to date by the signal handlers when entries are edited in the admin, and can be
+verified against the source tables with ``python manage.py check_pmkb_lookup``.
+"""
+import logging
+from collections import namedtuple, OrderedDict
+from django.db.models import Q
+from .models import PMKBLookup, PMKBVariant, PMKBInterpretation, TumorType, TissueType
+from .variants import variant_key_str
+
+logger = logging.getLogger()
+
+# fields compared by the consistency check
+lookup_fields = ['variant_id', 'gene', 'tissue_id', 'tissue_name', 'tumor_id', 'tumor_name', 'interpretation_id',
+    'interpretation_source_row', 'variant', 'tier', 'source_row', 'protein_key']
+
+class LookupType(namedtuple('LookupType', ['id', 'type'])):
+    """
+    Tumor or tissue type of a lookup result, mirroring the ``TumorType`` and ``TissueType`` models
+    """
+    __slots__ = ()
+    def __str__(self):
+        return(str(self.type))
+
+class LookupPMKBInterpretation(namedtuple('LookupPMKBInterpretation', ['id', 'interpretation', 'citations', 'source_row'])):
+    """
+    PMKB interpretation of a lookup result, mirroring the ``PMKBInterpretation`` model
+    """
+    __slots__ = ()
+    def __hash__(self):
+        return(hash(self.id))
+    def __eq__(self, other):
+        return(isinstance(other, LookupPMKBInterpretation) and self.id == other.id)
+
+class LookupPMKBVariant(namedtuple('LookupPMKBVariant', ['id', 'gene', 'tumor_type', 'tissue_type', 'variant', 'tier', 'interpretation', 'source_row', 'protein_key'])):
+    """
+    PMKB variant of a lookup result, mirroring the ``PMKBVariant`` model
+    """
+    __slots__ = ()
+    def __hash__(self):
+        return(hash(self.id))
+    def __eq__(self, other):
+        return(isinstance(other, LookupPMKBVariant) and self.id == other.id)
+
+def iter_lookup_entries(variant_ids = None):
+    """
+    Create unsaved ``PMKBLookup`` entries from the source tables
+
+    Parameters
+    ----------
+    variant_ids: list
+        ids of the PMKB variants to create entries for; all variants if None
+
+    Yields
+    ------
+    PMKBLookup
+        one entry per PMKB variant
+    """
+    tumor_types = dict(TumorType.objects.values_list('id', 'type'))
+    tissue_types = dict(TissueType.objects.values_list('id', 'type'))
+    interpretation_rows = dict(PMKBInterpretation.objects.values_list('id', 'source_row'))
+    variants = PMKBVariant.objects.all()
+    if variant_ids is not None:
+        variants = variants.filter(id__in = variant_ids)
+    for row in variants.values('id', 'gene', 'tissue_type_id', 'tumor_type_id', 'interpretation_id', 'variant', 'tier', 'source_row', 'protein_key'):
+        yield(PMKBLookup(
+            variant_id = row['id'],
+            gene = row['gene'],
+            tissue_id = row['tissue_type_id'],
+            tissue_name = tissue_types.get(row['tissue_type_id'], ''),
+            tumor_id = row['tumor_type_id'],
+            tumor_name = tumor_types.get(row['tumor_type_id'], ''),
+            interpretation_id = row['interpretation_id'],
+            interpretation_source_row = interpretation_rows.get(row['interpretation_id'], None),
+            variant = row['variant'],
+            tier = row['tier'],
+            source_row = row['source_row'],
+            protein_key = row['protein_key']
+            ))
+
+def compile_pmkb_lookup():
+    """
+    Rebuild the ``PMKBLookup`` table from the source tables
+
+    Returns
+    -------
+    int
+        the number of entries created
+    """
+    entries = list(iter_lookup_entries())
+    PMKBLookup.objects.all().delete()
+    PMKBLookup.objects.bulk_create(entries, batch_size = 500)
+    logger.info("compiled {0} PMKB lookup entries".format(len(entries)))
+    return(len(entries))
+
+def update_lookup_entries(variant_ids):
+    """
+    Replace the ``PMKBLookup`` entries for some PMKB variants, e.g. after they are edited in the admin; entries for deleted variants are removed
+    """
+    if not variant_ids:
+        return
+    PMKBLookup.objects.filter(variant_id__in = variant_ids).delete()
+    PMKBLookup.objects.bulk_create(list(iter_lookup_entries(variant_ids = variant_ids)))
+
+def check_pmkb_lookup(repair = False):
+    """
+    Verify the ``PMKBLookup`` table against the source tables
+
+    Parameters
+    ----------
+    repair: bool
+        replace the entries that are missing, outdated, or have no PMKB variant
+
+    Returns
+    -------
+    list
+        descriptions of the differences found
+    """
+    expected = OrderedDict([ (entry.variant_id, entry) for entry in iter_lookup_entries() ])
+    actual = { row['variant_id']: row for row in PMKBLookup.objects.values(*lookup_fields) }
+    problems = []
+    outdated = []
+    for variant_id, entry in expected.items():
+        row = actual.get(variant_id, None)
+        if row is None:
+            problems.append("PMKB variant {0} has no lookup entry".format(variant_id))
+            outdated.append(variant_id)
+            continue
+        fields = [ field for field in lookup_fields if getattr(entry, field) != row[field] ]
+        if fields:
+            problems.append("lookup entry for PMKB variant {0} does not match: {1}".format(variant_id, ', '.join(fields)))
+            outdated.append(variant_id)
+    extra = sorted(set(actual.keys()) - set(expected.keys()))
+    for variant_id in extra:
+        problems.append("lookup entry for PMKB variant {0} has no PMKB variant".format(variant_id))
+    if repair and (outdated or extra):
+        update_lookup_entries(outdated + extra)
+        logger.info("repaired {0} PMKB lookup entries".format(len(outdated) + len(extra)))
+    return(problems)
+
+def fetch_pmkb_lookup(genes, tissue_type = None, tumor_type = None, variant = None):
+    """
+    Get the PMKB variants for a set of genes from the lookup table, with one query for the variants of each 500 genes and one
+    for the text of each 500 of their interpretations
+
+    Parameters
+    ----------
+    genes: list
+        the genes to look up
+    tissue_type: str
+        tissue type name to filter by
+    tumor_type: str
+        tumor type name to filter by
+    variant: str
+        a variant to filter by; matched on the normalized protein change for each gene when there is one, e.g. 'p.Gln61Arg', otherwise on the PMKB variant text
+
+    Returns
+    -------
+    dict
+        lists of ``LookupPMKBVariant`` for each gene, grouped by interpretation in the order of the PMKB source rows
+    """
+    results = OrderedDict([ (gene, []) for gene in genes ])
+    if not genes:
+        return(results)
+    genes = list(genes)
+    rows = []
+    # stay under the SQLite limit on query parameters
+    for start in range(0, len(genes), 500):
+        batch = genes[start:start + 500]
+        batch_rows = PMKBLookup.objects.filter(gene__in = batch)
+        if tissue_type and tissue_type != 'Any':
+            batch_rows = batch_rows.filter(tissue_name = tissue_type)
+        if tumor_type and tumor_type != 'Any':
+            batch_rows = batch_rows.filter(tumor_name = tumor_type)
+        if variant:
+            variant_filter = Q()
+            for gene in batch:
+                variant_key = variant_key_str(gene, variant)
+                if variant_key:
+                    variant_filter |= Q(gene = gene, protein_key = variant_key)
+                else:
+                    variant_filter |= Q(gene = gene, variant = variant)
+            batch_rows = batch_rows.filter(variant_filter)
+        rows.extend(batch_rows.order_by('gene', 'interpretation_source_row', 'interpretation_id', 'variant_id').values_list(
+            'variant_id', 'gene', 'tissue_id', 'tissue_name', 'tumor_id', 'tumor_name', 'interpretation_id', 'variant', 'tier', 'source_row', 'protein_key'))
+    interpretation_ids = sorted(set([ row[6] for row in rows if row[6] is not None ]))
+    interpretations = {}
+    for start in range(0, len(interpretation_ids), 500):
+        for row in PMKBInterpretation.objects.filter(id__in = interpretation_ids[start:start + 500]).values_list(
+            'id', 'interpretation', 'citations', 'source_row'):
+            interpretations[row[0]] = LookupPMKBInterpretation(*row)
+    for variant_id, gene, tissue_id, tissue_name, tumor_id, tumor_name, interpretation_id, variant_name, tier, source_row, protein_key in rows:
+        results[gene].append(LookupPMKBVariant(
+            id = variant_id,
+            gene = gene,
+            tumor_type = LookupType(id = tumor_id, type = tumor_name),
+            tissue_type = LookupType(id = tissue_id, type = tissue_name),
+            variant = variant_name,
+            tier = tier,
+            interpretation = interpretations.get(interpretation_id, None),
+            source_row = source_row,
+            protein_key = protein_key
+            ))
+    return(results)
@@ -0,0 +1,38 @@
+"""
+List the knowledge base builds, or serve another one, e.g. to roll back to the previous build
+
+    python manage.py activate_kb --list
+    python manage.py activate_kb --rollback
+    python manage.py activate_kb interpreter-20190301-120000.sqlite3
+"""
+import os
+from django.core.management.base import BaseCommand, CommandError
+from interpreter.kb_builds import list_builds, read_pointer, build_path, check_build, publish_build
+
+class Command(BaseCommand):
+    help = 'List or switch the served knowledge base build'
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", nargs = '?', default = None, help="Name of the build to serve")
+        parser.add_argument("--rollback", action = 'store_true', help="Serve the build that was served before the current one")
+        parser.add_argument("--list", action = 'store_true', help="List the builds")
+
+    def handle(self, *args, **options):
+        current = read_pointer('current')
+        previous = read_pointer('previous')
+        if options['list'] or (not options['name'] and not options['rollback']):
+            for name in list_builds():
+                label = ' (current)' if name == current else ' (previous)' if name == previous else ''
+                self.stdout.write(name + label)
+            return
+        name = previous if options['rollback'] else options['name']
+        if name is None:
+            raise CommandError("There is no previous knowledge base build")
+        if not os.path.exists(build_path(name)):
+            raise CommandError("Knowledge base build not found: {0}".format(name))
+        # the row counts were compared when the build was made; only check that the file is intact
+        problems = check_build(name, min_row_fraction = 0)
+        if problems:
+            raise CommandError("Knowledge base build {0} failed its checks: {1}".format(name, '; '.join(problems)))
+        version = publish_build(name)
+        self.stdout.write("published {0} as knowledge base version {1}".format(name, version))
@@ -0,0 +1,33 @@
+"""
+Import the knowledge base into a new versioned build, check it, and publish it to the running app
+
+    python manage.py build_kb
+    python manage.py build_kb --copy-current --types PMKB
+    python manage.py build_kb --no-publish
+"""
+from django.core.management.base import BaseCommand, CommandError
+from interpreter.kb_builds import create_build, check_build, publish_build, prune_builds, remove_build
+
+class Command(BaseCommand):
+    help = 'Build a new version of the knowledge base and swap it in'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--types", nargs = '+', default = None, help="Importer types to run, in order; defaults to all of them")
+        parser.add_argument("--copy-current", action = 'store_true', help="Start from a copy of the served knowledge base instead of an empty database")
+        parser.add_argument("--no-publish", action = 'store_true', help="Check the build but do not serve it; publish it later with activate_kb")
+        parser.add_argument("--force", action = 'store_true', help="Publish even if the build has fewer rows than the served knowledge base")
+
+    def handle(self, *args, **options):
+        name = create_build(types = options['types'], copy_current = options['copy_current'])
+        problems = check_build(name, min_row_fraction = 0 if options['force'] else None)
+        for problem in problems:
+            self.stdout.write(problem)
+        if problems:
+            remove_build(name)
+            raise CommandError("{0} problems found in knowledge base build {1}; the build was removed".format(len(problems), name))
+        if options['no_publish']:
+            self.stdout.write("built {0}".format(name))
+            return
+        version = publish_build(name)
+        prune_builds()
+        self.stdout.write("published {0} as knowledge base version {1}".format(name, version))
@@ -0,0 +1,27 @@
+"""
+Verify the denormalized PMKB lookup table against the PMKB variant, interpretation, and type tables
+
+    python manage.py check_pmkb_lookup
+    python manage.py check_pmkb_lookup --repair
+"""
+from django.core.management.base import BaseCommand, CommandError
+from interpreter.lookup import check_pmkb_lookup
+from interpreter.cache import bump_kb_version
+
+class Command(BaseCommand):
+    help = 'Verify the PMKB lookup table against the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repair", action = 'store_true', help="Replace the lookup entries that do not match the source tables")
+
+    def handle(self, *args, **options):
+        problems = check_pmkb_lookup(repair = options['repair'])
+        for problem in problems:
+            self.stdout.write(problem)
+        if problems and options['repair']:
+            bump_kb_version()
+            self.stdout.write("repaired {0} problems".format(len(problems)))
+        elif problems:
+            raise CommandError("{0} problems found in the PMKB lookup table".format(len(problems)))
+        else:
+            self.stdout.write("PMKB lookup table is consistent")
@@ -0,0 +1,35 @@
+"""
+Start background workers that generate reports for uploads submitted as jobs
+
+    python manage.py report_worker --processes 2
+"""
+import multiprocessing
+from django.core.management.base import BaseCommand
+from django.db import connections
+from interpreter.jobs import run_worker
+
+def start_worker(once, poll_interval):
+    # each process opens its own database connections
+    connections.close_all()
+    run_worker(once = once, poll_interval = poll_interval)
+
+class Command(BaseCommand):
+    help = 'Run queued report jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", default = 1, type = int, help="Number of worker processes to start")
+        parser.add_argument("--once", action = 'store_true', help="Exit when the queue is empty instead of waiting for new jobs")
+        parser.add_argument("--poll-interval", default = None, type = float, help="Seconds to wait between checks of an empty queue")
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            num_run = run_worker(once = options['once'], poll_interval = options['poll_interval'])
+            self.stdout.write("ran {0} jobs".format(num_run))
+            return
+        connections.close_all()
+        processes = [ multiprocessing.Process(target = start_worker, args = (options['once'], options['poll_interval']))
+            for i in range(options['processes']) ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
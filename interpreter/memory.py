@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for measuring and limiting the memory used by report requests
+
+With ``settings.MEMORY_TRACE`` set, uploads are run under ``tracemalloc`` and the peak traced memory, the change in
+resident memory, and the source lines holding the most memory are logged when the response is finished. Tracing is
+process wide, so only one request per worker is traced at a time; the other requests run untraced while it is going on.
+The top source lines come from the largest snapshot taken after each chunk of the report is rendered, see
+``sample_memory``.
+
+Before an interactive report is generated, its peak memory is projected from the size of the upload and the number of
+records in it. Uploads projected to use more than ``settings.REPORT_MEMORY_SOFT_LIMIT`` are run as background jobs
+instead, or rejected, depending on ``settings.REPORT_MEMORY_SOFT_ACTION``.
+
+Workers whose resident memory stays high after a request are recycled by the ``post_request`` hook in
+``gunicorn_config.py``.
+"""
+import time
+import logging
+import threading
+import tracemalloc
+from functools import wraps
+from django.conf import settings
+from .util import get_rss_mb
+from .vcf import is_vcf, open_text
+
+logger = logging.getLogger()
+
+# projected report memory in MB; fixed overhead, per MB of an upload held in memory, and per record interpreted at once
+# measured with tracemalloc on copies of the SeraSeq records, e.g. 27MB for 3,400 records in chunks of 500 and 177MB in one chunk
+report_memory_base = 5
+report_memory_per_upload_mb = 2
+report_memory_per_record_kb = 52
+
+# files that are left out of the top allocating source lines
+ignored_files = (tracemalloc.__file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>', '<unknown>')
+
+# the trace of the request being traced by this worker, if any
+trace_lock = threading.Lock()
+active_trace = None
+
+class MemoryTrace(object):
+    """
+    Traces the memory allocated while a request is handled
+
+    Parameters
+    ----------
+    label: str
+        the request, for the log message
+    lines: int
+        the number of source lines listed; defaults to ``settings.MEMORY_TRACE_LINES``
+    """
+    def __init__(self, label, lines = None):
+        self.label = label
+        self.lines = lines if lines is not None else settings.MEMORY_TRACE_LINES
+        self.thread = threading.get_ident()
+        self.snapshot = None
+        self.snapshot_size = 0
+
+    def start(self):
+        self.start_time = time.time()
+        self.start_rss = get_rss_mb()
+        tracemalloc.start()
+
+    def sample(self):
+        """
+        Keep a snapshot of the allocations if more memory is traced now than at the last snapshot
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        # snapshots take time, so only take a new one after a clear increase
+        if current > self.snapshot_size * 1.1:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_size = current
+
+    def stop(self):
+        """
+        Stop tracing and log the summary
+
+        Returns
+        -------
+        str
+            the summary
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        summary = self.summary(current, peak)
+        logger.info(summary)
+        return(summary)
+
+    def summary(self, current, peak):
+        """
+        Make a text summary of the traced memory, with the source lines that held the most memory at the largest snapshot
+        """
+        lines = ["{0}: peak traced memory {1:.1f}MB, {2:.1f}MB at the end; resident memory {3:.0f}MB -> {4:.0f}MB; {5:.2f}s".format(
+            self.label, peak / (1024 * 1024), current / (1024 * 1024), self.start_rss, get_rss_mb(), time.time() - self.start_time)]
+        if self.snapshot is not None:
+            snapshot = self.snapshot.filter_traces([ tracemalloc.Filter(False, filename) for filename in ignored_files ])
+            lines.append("top {0} source lines at {1:.1f}MB traced:".format(self.lines, self.snapshot_size / (1024 * 1024)))
+            for stat in snapshot.statistics('lineno')[:self.lines]:
+                frame = stat.traceback[0]
+                lines.append("  {0}:{1}: {2:.1f}KB in {3} blocks".format(frame.filename, frame.lineno, stat.size / 1024, stat.count))
+        return('\n'.join(lines))
+
+def sample_memory():
+    """
+    Take a snapshot for the memory trace of the current request, if it is being traced; called at the points in a report
+    where the most memory is in use, e.g. after a chunk of records is rendered
+    """
+    trace = active_trace
+    if trace is not None and trace.thread == threading.get_ident():
+        trace.sample()
+
+def start_trace(label):
+    """
+    Start tracing the current request, unless another request in this worker is already being traced
+
+    Returns
+    -------
+    MemoryTrace
+        the trace, or None if it could not be started
+    """
+    global active_trace
+    if not trace_lock.acquire(blocking = False):
+        logger.debug("not tracing {0}; another request is being traced".format(label))
+        return(None)
+    trace = MemoryTrace(label)
+    trace.start()
+    active_trace = trace
+    return(trace)
+
+def stop_trace(trace):
+    """
+    Stop tracing the current request and log the summary
+    """
+    global active_trace
+    try:
+        active_trace = None
+        return(trace.stop())
+    finally:
+        trace_lock.release()
+
+def traced_content(content, trace):
+    """
+    Yields the parts of a streamed response, sampling the memory trace between them, and stops the trace once the response is finished
+    """
+    try:
+        for block in content:
+            trace.sample()
+            yield(block)
+    finally:
+        stop_trace(trace)
+
+def trace_memory(view):
+    """
+    Decorator that traces the memory used by POST requests to a view when ``settings.MEMORY_TRACE`` is set
+
+    Streamed responses are still streamed; the trace is logged once the last part has been sent.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.MEMORY_TRACE or request.method != 'POST':
+            return(view(request, *args, **kwargs))
+        trace = start_trace("{0} {1}".format(request.method, request.path))
+        if trace is None:
+            return(view(request, *args, **kwargs))
+        try:
+            response = view(request, *args, **kwargs)
+        except:
+            stop_trace(trace)
+            raise
+        if response.streaming:
+            response.streaming_content = traced_content(response.streaming_content, trace)
+        else:
+            stop_trace(trace)
+        return(response)
+    return(wrapper)
+
+def estimate_report_memory(size, num_records, in_memory = True, chunksize = None):
+    """
+    Project the peak memory of an interactive report
+
+    Records are interpreted and rendered ``chunksize`` at a time, so only uploads that are held in memory, and not
+    streamed to a temporary file, add to the peak in proportion to their size.
+
+    Parameters
+    ----------
+    size: int
+        the size of the upload in bytes
+    num_records: int
+        the number of records in the upload
+    in_memory: bool
+        whether the upload is held in memory
+    chunksize: int
+        the number of records interpreted at a time; defaults to ``settings.REPORT_CHUNK_SIZE``
+
+    Returns
+    -------
+    float
+        the projected peak memory in MB
+    """
+    if chunksize is None:
+        chunksize = settings.REPORT_CHUNK_SIZE
+    memory = report_memory_base + min(num_records, chunksize) * report_memory_per_record_kb / 1024
+    if in_memory:
+        memory += report_memory_per_upload_mb * size / (1024 * 1024)
+    return(memory)
+
+def count_upload_records(upload):
+    """
+    Count the records in an uploaded Ion Reporter .tsv file, or the data lines of an uploaded .vcf file, the same way as
+    ``report.count_ir_records``, and rewind it
+    """
+    vcf = is_vcf(upload)
+    num_lines = 0
+    with open_text(upload) as text:
+        for line in text:
+            if line.strip() and not line.startswith('#'):
+                num_lines += 1
+    upload.seek(0)
+    if vcf:
+        return(num_lines)
+    return(max(num_lines - 1, 0))
+
+def over_soft_limit(upload):
+    """
+    Check whether an upload is projected to use more memory than ``settings.REPORT_MEMORY_SOFT_LIMIT`` as an interactive report
+
+    Returns
+    -------
+    float
+        the projected memory in MB if it is over the limit, otherwise None
+    """
+    if not settings.REPORT_MEMORY_SOFT_LIMIT:
+        return(None)
+    memory = estimate_report_memory(
+        size = upload.size,
+        num_records = count_upload_records(upload),
+        in_memory = not hasattr(upload, 'temporary_file_path'))
+    if memory > settings.REPORT_MEMORY_SOFT_LIMIT:
+        return(memory)
+    return(None)
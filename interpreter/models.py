@@ -1,5 +1,6 @@
 from django.db import models
 from .util import sanitize_genes
+from .variants import variant_key_str
 import json
 
 variant_types = (
@@ -61,8 +62,17 @@ class PMKBVariant(models.Model):
     interpretation = models.ForeignKey('PMKBInterpretation', blank=True, null=True, on_delete = models.SET_NULL)
     source_row = models.IntegerField() # original row in .xlsx file
     uid = models.CharField(null=False, unique = True, max_length=255) # need a unique key for database setup... put md5sum here
+    # canonical key for specific protein changes, e.g. 'NRAS:p.Q61R'; empty for rules such as 'codon(s) 12, 13 any'
+    protein_key = models.CharField(blank=True, db_index = True, max_length=255)
     imported = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        """
+        Normalize the variant to save as protein_key
+        """
+        self.protein_key = variant_key_str(self.gene, self.variant)
+        super().save(*args, **kwargs)
     def __str__(self):
         return('[{0}] {1}...'.format(self.gene, self.variant[:15]))
 
@@ -78,6 +88,58 @@ class PMKBInterpretation(models.Model):
     def __str__(self):
         return('[{0}] {1}...'.format(self.id, self.interpretation[:15]))
 
+class PMKBLookup(models.Model):
+    """
+    Denormalized read table of the PMKB variants, maintained by ``lookup.py`` from the ``PMKBVariant``, ``PMKBInterpretation``,
+    ``TumorType``, and ``TissueType`` tables, so that the variants for a set of genes are read with a single indexed query and no joins
+    """
+    variant_id = models.IntegerField(unique = True)
+    gene = models.CharField(blank=False, max_length=255)
+    tissue_id = models.IntegerField(blank=True, null=True)
+    tissue_name = models.CharField(blank=True, max_length=255)
+    tumor_id = models.IntegerField(blank=True, null=True)
+    tumor_name = models.CharField(blank=True, max_length=255)
+    interpretation_id = models.IntegerField(blank=True, null=True)
+    interpretation_source_row = models.IntegerField(blank=True, null=True) # for grouping the variants by interpretation in PMKB order
+    variant = models.CharField(blank=False, max_length=255)
+    tier = models.IntegerField()
+    source_row = models.IntegerField()
+    protein_key = models.CharField(blank=True, max_length=255)
+    class Meta:
+        indexes = [
+            models.Index(fields = ['gene', 'interpretation_source_row', 'interpretation_id', 'variant_id']),
+            models.Index(fields = ['gene', 'protein_key'])
+            ]
+    def __str__(self):
+        return('[{0}] {1}...'.format(self.gene, self.variant[:15]))
+
+rule_types = (
+('variant', 'variant'),
+('codon', 'codon'),
+('exon', 'exon'),
+('any', 'any'),
+('copy_number', 'copy number'),
+('rearrangement', 'rearrangement'),
+('unknown', 'unknown'),
+)
+
+class PMKBVariantRule(models.Model):
+    """
+    Structured rule compiled from the description of a PMKB variant, e.g. 'KRAS codon(s) 12, 13 any'
+    """
+    variant = models.OneToOneField(PMKBVariant, on_delete = models.CASCADE, related_name = 'rule')
+    gene = models.CharField(blank=False, max_length=255)
+    rule_type = models.CharField(choices = rule_types, max_length=32)
+    consequence = models.CharField(blank=True, max_length=32) # e.g. 'any', 'missense', 'deletion', 'gain'
+    codons = models.CharField(blank=True, max_length=1024) # space delimited codon numbers
+    exons = models.CharField(blank=True, max_length=1024) # space delimited exon numbers
+    partners = models.CharField(blank=True, max_length=255) # space delimited genes for rearrangements
+    protein_key = models.CharField(blank=True, db_index = True, max_length=255) # for specific variants
+    class Meta:
+        indexes = [ models.Index(fields = ['gene', 'rule_type']) ]
+    def __str__(self):
+        return('[{0}] {1} {2}'.format(self.gene, self.rule_type, self.consequence))
+
 class NYUInterpretation(models.Model):
     """
     Custom NYU interpretation
@@ -119,5 +181,100 @@ class NYUTier(models.Model):
     protein = models.CharField(blank=False, max_length=255)
     tier = models.IntegerField()
     comment = models.TextField(blank=True)
+    # canonical keys for the protein and coding changes, e.g. 'BRAF:p.V600E' and 'BRAF:c.1799T>A'
+    protein_key = models.CharField(blank=True, db_index = True, max_length=255)
+    coding_key = models.CharField(blank=True, db_index = True, max_length=255)
+    imported = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        """
+        Normalize the protein and coding changes to save as protein_key and coding_key
+        """
+        self.protein_key = variant_key_str(self.gene, self.protein)
+        self.coding_key = variant_key_str(self.gene, self.coding)
+        super().save(*args, **kwargs)
+
+fusion_sources = (
+('pmkb', 'pmkb'),
+('nyu_interpretation', 'nyu_interpretation'),
+)
+
+class FusionPair(models.Model):
+    """
+    The 5' and 3' partner genes of a knowledge base entry that describes a fusion, e.g. 'EML4-ALK rearrangement' or 'CCDC6 - RET'
+    """
+    source = models.CharField(choices = fusion_sources, max_length=32)
+    entry_id = models.IntegerField() # id of the PMKBVariant or NYUInterpretation
+    five_prime = models.CharField(blank=False, max_length=255)
+    three_prime = models.CharField(blank=False, max_length=255)
+    pair = models.CharField(blank=False, max_length=511) # both genes in alphabetical order, space delimited, for lookups in either orientation
+    class Meta:
+        indexes = [
+        models.Index(fields = ['five_prime', 'three_prime']),
+        models.Index(fields = ['pair']),
+        models.Index(fields = ['source', 'entry_id'])
+        ]
+    def __str__(self):
+        return('[{0}] {1} - {2}'.format(self.source, self.five_prime, self.three_prime))
+
+synonym_types = (
+('previous', 'previous'),
+('alias', 'alias'),
+)
+
+class GeneSynonym(models.Model):
+    """
+    A previous or alias symbol for a gene, e.g. 'MLL' for 'KMT2A'; gene names are converted to the approved symbol before matching
+    """
+    alias = models.CharField(blank=False, unique = True, max_length=255) # upper case
+    symbol = models.CharField(blank=False, max_length=255) # the approved symbol
+    synonym_type = models.CharField(choices = synonym_types, blank=True, max_length=32)
     imported = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    def __str__(self):
+        return('{0} -> {1}'.format(self.alias, self.symbol))
+
+class KnowledgeBaseVersion(models.Model):
+    """
+    Counter that is incremented whenever the knowledge base tables change; used to invalidate cached interpretation results
+    """
+    version = models.IntegerField(default = 0)
+    updated = models.DateTimeField(auto_now=True)
+    def __str__(self):
+        return(str(self.version))
+
+job_statuses = (
+('queued', 'queued'),
+('running', 'running'),
+('finished', 'finished'),
+('failed', 'failed'),
+)
+
+class ReportJob(models.Model):
+    """
+    An uploaded Ion Reporter .tsv file queued for report generation by a background worker
+    """
+    key = models.CharField(unique = True, max_length=64) # random public id for the job, used in URLs
+    status = models.CharField(choices = job_statuses, default = 'queued', db_index = True, max_length=32)
+    stage = models.CharField(blank=True, max_length=255) # current report stage, e.g. 'PMKB'
+    progress = models.IntegerField(default = 0) # percent complete
+    filename = models.CharField(blank=True, max_length=255) # original name of the uploaded file
+    input_file = models.CharField(blank=True, max_length=1024) # path to the saved upload
+    report_file = models.CharField(blank=True, max_length=1024) # path to the finished HTML report
+    result_file = models.CharField(blank=True, max_length=1024) # path to the stored interpretation result, read one page at a time
+    tissue_type = models.CharField(blank=True, null=True, max_length=255)
+    tumor_type = models.CharField(blank=True, null=True, max_length=255)
+    match_variants = models.BooleanField(default = False)
+    sources = models.TextField(blank=True) # comma-separated names of the interpretation sources to look up; all of them if blank
+    filters = models.TextField(blank=True) # the filter chain that records are dropped by before they are interpreted, e.g. 'oncomine,min_af=5'
+    ip = models.CharField(blank=True, max_length=100)
+    worker = models.CharField(blank=True, max_length=255)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    heartbeat = models.DateTimeField(blank=True, null=True, db_index = True) # last time the worker running the job reported progress
+    finished = models.DateTimeField(blank=True, null=True)
+    expires = models.DateTimeField(blank=True, null=True, db_index = True)
+    def __str__(self):
+        return('[{0}] {1} {2}'.format(self.id, self.filename, self.status))
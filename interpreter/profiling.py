@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for profiling individual report requests on demand
+
+Staff users can add a 'profile' field to an upload, or a 'profile' parameter to a report view, to run that request
+under ``cProfile``. Streamed responses are read to the end inside the profiler, so the profile covers the whole report
+and not just the first part. Each profile is saved to ``settings.PROFILE_DIR`` with a request id, along with a summary of the
+functions with the highest cumulative time, both overall and in the interpretation, IR table, and template modules.
+Profiles older than ``settings.PROFILE_RETENTION_HOURS`` are deleted when a new one is saved.
+"""
+import io
+import os
+import re
+import time
+import uuid
+import pstats
+import logging
+import cProfile
+import datetime
+from functools import wraps
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import reverse
+
+logger = logging.getLogger()
+
+# functions shown in the focused part of the summary
+focus_pattern = r'interpret\.py|ir\.py|report\.py|report_store\.py|django/template'
+
+profile_name_pattern = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{12}$')
+
+def profile_requested(request):
+    """
+    Whether a request asks to be profiled; only staff users can profile requests
+    """
+    if 'profile' not in request.GET and 'profile' not in request.POST:
+        return(False)
+    user = getattr(request, 'user', None)
+    return(bool(user is not None and user.is_staff))
+
+def profile_path(name, extension):
+    """
+    Get the path to a saved profile or its summary
+    """
+    return(os.path.join(settings.PROFILE_DIR, '{0}.{1}'.format(name, extension)))
+
+def profile_summary(stats, lines = None):
+    """
+    Make a text summary of a profile, with the functions with the highest cumulative time overall, and in the
+    modules matched by ``focus_pattern``
+
+    Parameters
+    ----------
+    stats: pstats.Stats
+        the profile
+    lines: int
+        the number of functions listed in each part; defaults to ``settings.PROFILE_SUMMARY_LINES``
+    """
+    if lines is None:
+        lines = settings.PROFILE_SUMMARY_LINES
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats('cumulative')
+    stream.write("Top {0} functions by cumulative time\n".format(lines))
+    stats.print_stats(lines)
+    stream.write("\nTop {0} functions in the report modules and templates by cumulative time\n".format(lines))
+    stats.print_stats(focus_pattern, lines)
+    return(stream.getvalue())
+
+def save_profile(profiler, request, elapsed):
+    """
+    Save a profile and its summary to ``settings.PROFILE_DIR``, and delete the expired ones
+
+    Returns
+    -------
+    str
+        the request id the profile is saved under
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok = True)
+    name = '{0:%Y%m%d-%H%M%S}-{1}'.format(datetime.datetime.now(), uuid.uuid4().hex[:12])
+    profiler.dump_stats(profile_path(name, 'prof'))
+    header = "{0} {1}\nuser: {2}\nelapsed: {3:.3f}s\n\n".format(request.method, request.get_full_path(), request.user, elapsed)
+    with open(profile_path(name, 'txt'), 'w', encoding = 'utf-8') as f:
+        f.write(header + profile_summary(pstats.Stats(profiler)))
+    logger.info("saved profile {0} for {1} {2}; {3:.2f}s".format(name, request.method, request.path, elapsed))
+    purge_profiles()
+    return(name)
+
+def purge_profiles(now = None):
+    """
+    Delete the profiles older than ``settings.PROFILE_RETENTION_HOURS``
+
+    Returns
+    -------
+    int
+        the number of files deleted
+    """
+    if now is None:
+        now = time.time()
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return(0)
+    cutoff = now - settings.PROFILE_RETENTION_HOURS * 3600
+    num_deleted = 0
+    for filename in os.listdir(settings.PROFILE_DIR):
+        path = os.path.join(settings.PROFILE_DIR, filename)
+        if filename.endswith(('.prof', '.txt')) and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            num_deleted += 1
+    return(num_deleted)
+
+def list_profiles():
+    """
+    Get the saved profiles, newest first
+
+    Returns
+    -------
+    list
+        the request id and the first line of the summary of each profile, e.g. the request method and path
+    """
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return([])
+    profiles = []
+    for filename in sorted(os.listdir(settings.PROFILE_DIR), reverse = True):
+        name, extension = os.path.splitext(filename)
+        if extension == '.txt' and profile_name_pattern.match(name):
+            with open(os.path.join(settings.PROFILE_DIR, filename), encoding = 'utf-8') as f:
+                profiles.append({'id': name, 'request': f.readline().strip()})
+    return(profiles)
+
+def profile_view(view):
+    """
+    Decorator that runs a view under the profiler when a staff user asks for it with a 'profile' field or parameter
+
+    The response is read to the end inside the profiler; HTML responses get a link to the profile summary appended,
+    and every profiled response has the link in an ``X-Profile`` header.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not profile_requested(request):
+            return(view(request, *args, **kwargs))
+        profiler = cProfile.Profile()
+        start = time.time()
+        profiler.enable()
+        try:
+            response = view(request, *args, **kwargs)
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+                response.close()
+                profiled = HttpResponse(content, status = response.status_code)
+                for header, value in response.items():
+                    profiled[header] = value
+                response = profiled
+        finally:
+            profiler.disable()
+        name = save_profile(profiler, request, time.time() - start)
+        url = reverse('profile_detail', kwargs = {'name': name})
+        response['X-Profile'] = url
+        if response.get('Content-Type', '').startswith('text/html'):
+            response.content = response.content + '<p class="profile-link"><a href="{0}" target="_blank">Profile {1}</a></p>'.format(url, name).encode('utf-8')
+        return(response)
+    return(wrapper)
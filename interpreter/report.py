@@ -7,8 +7,14 @@ import os
 import sys
 import django
 from django.template.loader import get_template
+import gc
+import copy
 import time
 import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 logger = logging.getLogger()
 
@@ -17,88 +23,551 @@ parentdir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 sys.path.insert(0, parentdir)
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webapp.settings")
 django.setup()
-from interpreter.ir import IRTable, IRRecord
-import interpreter.interpret as interpret
+from django.conf import settings
+from django.db import connections
+from interpreter.vcf import is_vcf, count_vcf_records, read_table, table_reader
+from interpreter.filters import parse_filters
+from interpreter.kb_builds import kb_alias, thread_kb_build, use_kb_build
+from interpreter.util import get_rss_mb
+from interpreter.memory import sample_memory
+from interpreter.cache import get_kb_version
+from interpreter.genes import get_gene_synonyms
+from interpreter.sources import get_source, get_sources
 sys.path.pop(0)
 
-def make_report_html(input, template = 'report.html', **params):
+def log_stage(cache, start):
+    """
+    Logs the time taken by an interpretation stage along with the lookup cache hit rate for the stage
     """
-    Generates an HTML report based on a supplied Ion Reporter .tsv file
+    logger.info("{summary}; {elapsed:.2f}s".format(summary = cache.summary(), elapsed = time.time() - start))
+
+def make_caches(sources = None):
+    """
+    Creates the lookup caches for each interpretation source, so that records that share the same genes are only looked up once per report
 
     Parameters
     ----------
-    input: str
-        the path to an Ion Reporter .tsv file, or a file-like object that can be read
-    template: str
-        path to HTML template to use for reporting
-    **params: str
-        an optional set of string keyword arguments to filter interpretation query results by, for the following keys: 'tissue_type', 'tumor_type'
+    sources: list
+        the names of the sources; all registered sources if None
+    """
+    caches = OrderedDict([ (source.name, source.make_cache()) for source in get_sources(sources) ])
+    return(caches)
+
+# thread pool shared by the reports of this worker process, to look up the knowledge sources at the same time
+lookup_pool = None
+# one slot per thread of the pool; a stage is only submitted with a free slot, so it never waits in the pool's queue
+lookup_slots = None
+lookup_pool_lock = threading.Lock()
+
+def get_lookup_pool():
+    """
+    Get the knowledge source lookup thread pool of this worker process, with ``settings.INTERPRET_THREADS`` threads
+
+    Each thread opens its own database connections, and switches to a newly published knowledge base build before each
+    lookup. Take one of the ``lookup_slots`` before submitting a stage to the pool, see ``run_stage``.
+    """
+    global lookup_pool, lookup_slots
+    with lookup_pool_lock:
+        if lookup_pool is None:
+            lookup_slots = threading.BoundedSemaphore(settings.INTERPRET_THREADS)
+            lookup_pool = ThreadPoolExecutor(max_workers = settings.INTERPRET_THREADS, thread_name_prefix = 'interpret')
+        return(lookup_pool)
+
+def run_concurrently():
+    """
+    Whether the knowledge sources can be looked up at the same time in the lookup threads
+
+    The sources are looked up one after another in the calling thread when ``settings.INTERPRET_THREADS`` is less than 2,
+    when the knowledge base connection of the calling thread is inside a transaction, since the lookup threads would not
+    see its uncommitted changes, and when the request is being profiled, so that the profile includes the lookups.
+    """
+    if settings.INTERPRET_THREADS < 2:
+        return(False)
+    if connections[kb_alias].in_atomic_block:
+        return(False)
+    return(sys.getprofile() is None)
+
+def copy_table(table):
+    """
+    Makes a copy of a table for a single interpretation stage to add its results to; the records share everything with
+    the original records except their interpretations
+    """
+    stage_table = copy.copy(table)
+    stage_table.records = []
+    for record in table.records:
+        stage_record = copy.copy(record)
+        stage_record.interpretations = {}
+        stage_table.records.append(stage_record)
+    return(stage_table)
+
+class StageStart(object):
+    """
+    Records when a lookup thread starts running an interpretation stage, so that its deadline starts then
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.time = None
+
+    def set(self):
+        self.time = time.time()
+        self.event.set()
+
+    def wait(self, timeout = None):
+        return(self.event.wait(timeout))
+
+def run_stage(interpret_func, table, started, kb_build, **params):
+    """
+    Runs an interpretation stage in a lookup thread, against the knowledge base build that the report was started on
+
+    The stage holds one of the ``lookup_slots``, which is freed when it finishes, even if the report stopped waiting
+    for it. The database connections of the thread are closed when it finishes, so that a lookup that timed out does
+    not keep its connection open in an idle thread.
+    """
+    started.set()
+    try:
+        use_kb_build(kb_build)
+        return(interpret_func(ir_table = table, **params))
+    finally:
+        connections.close_all()
+        lookup_slots.release()
+
+def interpret_table(table, tissue_type = None, tumor_type = None, caches = None, progress = None, match_variants = False, warnings = None, sources = None, kb_build = None):
+    """
+    Adds the results of each registered interpretation source, e.g. PMKB, NYU tier, and NYU interpretation, to each record in an IRTable
+
+    The knowledge sources are looked up at the same time in the lookup threads if possible (see ``run_concurrently``),
+    each on its own copy of the table, and the results are merged into each record's ``interpretations``. A source that does
+    not finish within ``settings.INTERPRET_SOURCE_TIMEOUT`` seconds of starting, or does not get a lookup thread within
+    that time, is left out of the results for the table, and a warning is added to ``warnings``, so that the rest of the
+    report can still be generated.
+
+    Parameters
+    ----------
+    table: IRTable
+        the table to interpret
+    tissue_type: str
+        tissue type to filter the interpretations by
+    tumor_type: str
+        tumor type to filter the interpretations by
+    caches: dict
+        lookup caches from ``make_caches``; reuse the same caches for every chunk of a report
+    progress: function
+        called as ``progress(stage)`` with the label of each source as it starts
+    match_variants: bool
+        only match PMKB variants and NYU tiers with the same normalized protein or coding change as each record, instead of every entry for its genes,
+        and match fusion records to the entries for the same pair of partner genes
+    warnings: list
+        messages for the report about sources that timed out are added to this list
+    sources: list
+        the names of the sources to look up; all registered sources if None
+    kb_build: str
+        the knowledge base build the lookup threads read, resolved once per report with ``thread_kb_build`` so that every
+        chunk reads the same build; the build of the calling thread if None
 
     Returns
     -------
-    str
-        the formatted HTML string output is returned
+    IRTable
+        the interpreted table
     """
-    # calculate time used in generating report
+    if kb_build is None:
+        kb_build = thread_kb_build()
+    if caches is None:
+        caches = make_caches(sources)
+    if progress is None:
+        progress = lambda stage: None
+    stages = [ (source.label, source.name, source.interpret, {'match_variants': match_variants}) for source in get_sources(sources) ]
+    if not run_concurrently():
+        for stage, source, interpret_func, stage_params in stages:
+            progress(stage)
+            stage_start = time.time()
+            table = interpret_func(
+                ir_table = table,
+                tissue_type = tissue_type,
+                tumor_type = tumor_type,
+                cache = caches[source],
+                **stage_params
+                )
+            log_stage(cache = caches[source], start = stage_start)
+        return(table)
+
+    timeout = settings.INTERPRET_SOURCE_TIMEOUT or None
+    pool = get_lookup_pool()
     start = time.time()
-    tissue_type = params.pop('tissue_type', None)
-    tumor_type = params.pop('tumor_type', None)
-    report_template = get_template(template)
-    logger.info("generating IRTable from input file")
-    table = IRTable(input)
-    logger.info("generating PMKB interpretations")
-    table = interpret.interpret_pmkb(
-        ir_table = table,
-        tissue_type = tissue_type,
-        tumor_type = tumor_type
-        )
-    table = interpret.interpret_nyu_tier(
-        ir_table = table,
-        tissue_type = tissue_type,
-        tumor_type = tumor_type
-        )
-    table = interpret.interpret_nyu_interpretation(
-        ir_table = table,
-        tissue_type = tissue_type,
-        tumor_type = tumor_type
-        )
-    # print(table.records[3].interpretations['pmkb'][0]['variants'][0].gene)
-    # print(type(table.records[3].interpretations['pmkb'][0]['variants'][0].gene))
-    logger.debug("getting interpretation metrics")
+    submitted = []
+    for stage, source, interpret_func, stage_params in stages:
+        progress(stage)
+        # wait for a free lookup thread, e.g. while the lookups of other reports are running
+        remaining = None if timeout is None else max(start + timeout - time.time(), 0)
+        if not lookup_slots.acquire(timeout = remaining):
+            submitted.append((None, None))
+            continue
+        started = StageStart()
+        try:
+            future = pool.submit(run_stage, interpret_func, copy_table(table),
+                started = started,
+                kb_build = kb_build,
+                tissue_type = tissue_type,
+                tumor_type = tumor_type,
+                cache = caches[source],
+                **stage_params)
+        except Exception:
+            lookup_slots.release()
+            raise
+        submitted.append((future, started))
+    for (stage, source, interpret_func, stage_params), (future, started) in zip(stages, submitted):
+        try:
+            if future is None:
+                raise TimeoutError()
+            if timeout is None:
+                stage_table = future.result()
+            else:
+                # the deadline of each source starts when a lookup thread starts running it
+                if not started.wait(timeout):
+                    raise TimeoutError()
+                stage_table = future.result(timeout = max(started.time + timeout - time.time(), 0))
+        except TimeoutError:
+            logger.error("{0} lookups for {1} records did not finish within {2}s; leaving them out of the report".format(stage, len(table.records), timeout))
+            message = "{0} results are missing for some records because the lookups took longer than {1}s".format(stage, timeout)
+            if warnings is not None and message not in warnings:
+                warnings.append(message)
+            # the lookup may still be running, so it keeps the old cache to itself
+            caches[source] = get_source(source).make_cache()
+            for record in table.records:
+                record.interpretations[source] = []
+            continue
+        for record, stage_record in zip(table.records, stage_table.records):
+            record.interpretations.update(stage_record.interpretations)
+        log_stage(cache = caches[source], start = started.time)
+    return(table)
+
+def count_pmkb(table):
+    """
+    Counts the PMKB interpretations and variants matched to the records in a table
+
+    Returns
+    -------
+    tuple
+        ``(num_PMKB_interpretations, num_PMKB_variants)``
+    """
+    num_PMKB_interpretations = 0
+    num_PMKB_variants = 0
+    for record in table.records:
+        for interpretation in record.interpretations.get('pmkb', []):
+            num_PMKB_interpretations += 1
+            num_PMKB_variants += len(interpretation['variants'])
+    return(num_PMKB_interpretations, num_PMKB_variants)
+
+def collect_interpretations(records, interpretations = None):
+    """
+    Collects the unique PMKB and NYU interpretations matched to the records in a table, so that the full text of each one
+    is only rendered once in the report, and the records link to it
+
+    Parameters
+    ----------
+    records: list
+        interpreted ``IRRecord`` objects
+    interpretations: dict
+        the interpretations collected from the previous chunks of the report, to add to
+
+    Returns
+    -------
+    dict
+        ``{'pmkb': OrderedDict, 'nyu_interpretation': OrderedDict}`` mapping interpretation ids to the ``PMKBInterpretation``
+        and ``NYUInterpretation`` entries, in the order they are first matched
+    """
+    if interpretations is None:
+        interpretations = {'pmkb': OrderedDict(), 'nyu_interpretation': OrderedDict()}
+    for record in records:
+        for view in record.interpretations.get('pmkb', []):
+            interpretations['pmkb'].setdefault(view['interpretation'].id, view['interpretation'])
+        for interpretation in record.interpretations.get('nyu_interpretation', []):
+            interpretations['nyu_interpretation'].setdefault(interpretation.id, interpretation)
+    return(interpretations)
+
+def make_interpretations_context(interpretations):
+    """
+    Makes the template context for the shared section of the report with the full text of each interpretation
+    """
+    context = {
+    'pmkb_interpretations': sorted(interpretations['pmkb'].values(), key = lambda x: x.id),
+    'nyu_interpretations': sorted(interpretations['nyu_interpretation'].values(), key = lambda x: x.id)
+    }
+    return(context)
+
+def count_ir_records(path):
+    """
+    Counts the records in an Ion Reporter .tsv file, or the data lines of a .vcf file, without parsing it, for reporting progress
+
+    Returns
+    -------
+    int
+        the number of non-comment lines after the table header
+    """
+    if is_vcf(path):
+        return(count_vcf_records(path))
+    num_lines = 0
+    with open(path, encoding = 'utf-8', errors = 'replace') as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                num_lines += 1
+    return(max(num_lines - 1, 0))
+
+def make_summary_context(tissue_type, tumor_type, num_IR_entries, num_PMKB_interpretations, num_PMKB_variants, start, warnings = None, filtered = None):
+    """
+    Makes the template context for the report summary, with any warnings about missing results, e.g. from ``interpret_table``,
+    and the number of records dropped by each report filter, e.g. from ``IRTable.filtered``
+    """
     tumor_type_label = tumor_type
     if tumor_type_label == None:
         tumor_type_label = 'Any'
     tissue_type_label = tissue_type
     if tissue_type_label == None:
         tissue_type_label = 'Any'
-    num_IR_entries = len(table.records)
-    num_PMKB_interpretations = 0
-    num_PMKB_variants = 0
-    for record in table.records:
-        for interpretation in record.interpretations['pmkb']:
-            num_PMKB_interpretations += 1
-            for variant in interpretation['variants']:
-                num_PMKB_variants += 1
-
-    end = time.time()
-    elapsed = end - start
+    elapsed = time.time() - start
     elapsed_str = "{0:.2f}".format(elapsed)
-
     context = {
-    'IRtable': table,
     'tumor_type': tumor_type_label,
     'tissue_type': tissue_type_label,
     'num_IR_entries': num_IR_entries,
     'num_PMKB_interpretations': num_PMKB_interpretations,
     'num_PMKB_variants': num_PMKB_variants,
-    'elapsed': elapsed_str
+    'elapsed': elapsed_str,
+    'warnings': list(warnings or []),
+    'filtered': [ [label, count] for label, count in (filtered or {}).items() ],
+    'num_filtered': sum((filtered or {}).values())
     }
+    return(context)
+
+def make_report_html(input, template = 'report.html', **params):
+    """
+    Generates an HTML report based on a supplied Ion Reporter .tsv file, or an annotated .vcf file (see ``vcf.py``)
+
+    The whole table is held in memory; use ``iter_report_html`` for large files
+
+    Parameters
+    ----------
+    input: str
+        the path to an Ion Reporter .tsv file or a .vcf file, or a file-like object that can be read
+    template: str
+        path to HTML template to use for reporting
+    **params: str
+        an optional set of string keyword arguments to filter interpretation query results by, for the following keys: 'tissue_type', 'tumor_type';
+        'progress' can be passed a function that is called as ``progress(stage, percent)`` as each stage of the report starts;
+        'match_variants' enables variant-level matching (see ``interpret_table``);
+        'sources' is the list of names of the interpretation sources to include; all registered sources if None;
+        'vcf_filters' is the chain of filters that the records of a .vcf file are dropped by ahead of 'filters', defaults to ``settings.VCF_FILTERS``;
+        'filters' is the chain of filters that records are dropped by before they are interpreted, defaults to ``settings.REPORT_FILTERS`` (see ``filters.py``)
+
+    Returns
+    -------
+    str
+        the formatted HTML string output is returned
+    """
+    # calculate time used in generating report
+    start = time.time()
+    tissue_type = params.pop('tissue_type', None)
+    tumor_type = params.pop('tumor_type', None)
+    progress = params.pop('progress', None)
+    if progress is None:
+        progress = lambda stage, percent: None
+    match_variants = params.pop('match_variants', False)
+    sources = params.pop('sources', None)
+    vcf_filters = params.pop('vcf_filters', settings.VCF_FILTERS)
+    filters = parse_filters(params.pop('filters', settings.REPORT_FILTERS))
+    warnings = []
+    report_template = get_template(template)
+    logger.info("generating IRTable from input file")
+    progress('parsing', 0)
+    stage_start = time.time()
+    table = read_table(input, synonyms = get_gene_synonyms(get_kb_version()), vcf_filters = vcf_filters, filters = filters)
+    logger.info("IRTable: {0:.2f}s; {1} records".format(time.time() - stage_start, len(table.records)))
+    report_sources = get_sources(sources)
+    stage_percents = { source.label: int(20 + 60 * i / len(report_sources)) for i, source in enumerate(report_sources) }
+    table = interpret_table(table,
+        tissue_type = tissue_type,
+        tumor_type = tumor_type,
+        progress = lambda stage: progress(stage, stage_percents[stage]),
+        match_variants = match_variants,
+        warnings = warnings,
+        sources = sources,
+        kb_build = thread_kb_build())
+    logger.debug("getting interpretation metrics")
+    num_PMKB_interpretations, num_PMKB_variants = count_pmkb(table)
+    context = make_summary_context(
+        tissue_type = tissue_type,
+        tumor_type = tumor_type,
+        num_IR_entries = len(table.records),
+        num_PMKB_interpretations = num_PMKB_interpretations,
+        num_PMKB_variants = num_PMKB_variants,
+        start = start,
+        warnings = warnings,
+        filtered = table.filtered)
+    context['IRtable'] = table
+    context['sources'] = report_sources
+    context.update(make_interpretations_context(collect_interpretations(table.records)))
 
     logger.debug("rendering HTML from IRTable")
+    progress('rendering', 80)
     report_html = report_template.render(context)
     logger.debug("returning HTML output")
     return(report_html)
 
+def iter_interpreted_tables(input, **params):
+    """
+    Reads and interprets the records of an Ion Reporter .tsv file, or an annotated .vcf file, in chunks
+
+    The consumer should drop each table before requesting the next one, so that memory use depends on the chunk size and
+    not on the size of the input. The records of a .vcf file are dropped by the 'vcf_filters' ahead of the 'filters', and
+    counted with them in 'filtered'.
+
+    Parameters
+    ----------
+    input: str
+        the path to an Ion Reporter .tsv file or a .vcf file, or a file-like object that can be read
+    **params:
+        'tissue_type', 'tumor_type' to filter the interpretation query results by;
+        'progress', a function that is called as ``progress(stage, percent)`` as each stage of each chunk starts;
+        'match_variants', enables variant-level matching (see ``interpret_table``);
+        'chunksize', the number of records per chunk, defaults to ``settings.REPORT_CHUNK_SIZE``;
+        'memory_limit', the growth in resident memory in MB since the report started above which the chunk size is halved, down to one record per chunk, defaults to ``settings.REPORT_MEMORY_LIMIT``; 0 disables the limit
+        'warnings', a list that messages about knowledge sources that timed out are added to (see ``interpret_table``)
+        'sources', the names of the interpretation sources to look up; all registered sources if None
+        'vcf_filters', the chain of filters that the records of a .vcf file are dropped by ahead of 'filters', defaults to ``settings.VCF_FILTERS``
+        'filters', the chain of filters that records are dropped by before they are interpreted, defaults to ``settings.REPORT_FILTERS`` (see ``filters.py``)
+        'filtered', a dict that the number of records dropped by each filter is added to
+
+    Yields
+    ------
+    IRTable
+        consecutive chunks of the input, interpreted
+    """
+    tissue_type = params.pop('tissue_type', None)
+    tumor_type = params.pop('tumor_type', None)
+    progress = params.pop('progress', None)
+    if progress is None:
+        progress = lambda stage, percent: None
+    chunksize = params.pop('chunksize', settings.REPORT_CHUNK_SIZE)
+    memory_limit = params.pop('memory_limit', settings.REPORT_MEMORY_LIMIT)
+    match_variants = params.pop('match_variants', False)
+    warnings = params.pop('warnings', None)
+    sources = params.pop('sources', None)
+    vcf_filters = params.pop('vcf_filters', settings.VCF_FILTERS)
+    filters = parse_filters(params.pop('filters', settings.REPORT_FILTERS))
+    filtered = params.pop('filtered', None)
+    if filtered is None:
+        filtered = OrderedDict()
+
+    # only files on disk can be counted ahead of time to report the percent complete
+    total = None
+    if isinstance(input, str):
+        total = count_ir_records(input)
+    progress('parsing', 0)
+
+    # the memory used by this report, and not by the rest of the worker, is compared to the limit
+    start_rss = get_rss_mb()
+    # every chunk is looked up in the build the report started on, even if the worker switches to a new one meanwhile
+    kb_build = thread_kb_build()
+    caches = make_caches(sources)
+    reader = table_reader(input, chunksize = chunksize, synonyms = get_gene_synonyms(get_kb_version()), vcf_filters = vcf_filters, filters = filters)
+    num_read = 0
+    for table in reader:
+        for label, count in table.filtered.items():
+            filtered[label] = filtered.get(label, 0) + count
+        percent = int(80 * num_read / total) if total else 0
+        table = interpret_table(table,
+            tissue_type = tissue_type,
+            tumor_type = tumor_type,
+            caches = caches,
+            progress = lambda stage: progress(stage, percent),
+            match_variants = match_variants,
+            warnings = warnings,
+            sources = sources,
+            kb_build = kb_build)
+        num_read += len(table.records) + sum(table.filtered.values())
+        yield(table)
+        # drop the chunk before reading the next one
+        del table
+        # workers that keep growing are recycled by gunicorn (see ``gunicorn_config.py``), so the report is never failed here
+        if memory_limit and reader.chunksize > 1 and get_rss_mb() - start_rss > memory_limit:
+            gc.collect()
+            used = get_rss_mb() - start_rss
+            if used > memory_limit:
+                reader.chunksize = max(reader.chunksize // 2, 1)
+                logger.warning("report memory use {0:.0f}MB is over the limit of {1}MB; reducing chunk size to {2}".format(used, memory_limit, reader.chunksize))
+    if getattr(reader, 'num_filtered', None):
+        logger.info("dropped {0} of {1} .vcf records without a gene".format(reader.num_filtered, reader.num_records))
+
+def iter_report_html(input, **params):
+    """
+    Generates an HTML report based on a supplied Ion Reporter .tsv file or annotated .vcf file, reading, interpreting, and rendering the records in chunks
+
+    Each rendered chunk is written to a temporary file, so memory use depends on the chunk size and not on the size of the input.
+    All records are processed before the first part of the report is returned, so that the summary can be written at the top.
+    The unique interpretations matched to the records are kept in memory and rendered once, after the records.
+
+    Parameters
+    ----------
+    input: str
+        the path to an Ion Reporter .tsv file or a .vcf file, or a file-like object that can be read
+    **params:
+        the same as ``iter_interpreted_tables``
+
+    Yields
+    ------
+    str
+        consecutive parts of the HTML report
+    """
+    start = time.time()
+    tissue_type = params.get('tissue_type', None)
+    tumor_type = params.get('tumor_type', None)
+    progress = params.get('progress', None)
+    if progress is None:
+        progress = lambda stage, percent: None
+    warnings = params.setdefault('warnings', [])
+    filtered = params.setdefault('filtered', OrderedDict())
+    report_sources = get_sources(params.get('sources', None))
+
+    records_template = get_template('report_records.html')
+    num_IR_entries = 0
+    num_PMKB_interpretations = 0
+    num_PMKB_variants = 0
+    interpretations = collect_interpretations([])
+    with tempfile.TemporaryFile(mode = 'w+', encoding = 'utf-8') as spool:
+        for table in iter_interpreted_tables(input, **params):
+            chunk_interpretations, chunk_variants = count_pmkb(table)
+            num_IR_entries += len(table.records)
+            num_PMKB_interpretations += chunk_interpretations
+            num_PMKB_variants += chunk_variants
+            interpretations = collect_interpretations(table.records, interpretations)
+            records_html = records_template.render({'records': table.records, 'sources': report_sources})
+            # the chunk, its interpretations, and its rendered records are all in memory here
+            sample_memory()
+            spool.write(records_html)
+            del records_html
+            logger.debug("rendered {0} records".format(num_IR_entries))
+            del table
+
+        logger.info("interpreted {0} records; {1:.2f}s".format(num_IR_entries, time.time() - start))
+        progress('rendering', 80)
+        context = make_summary_context(
+            tissue_type = tissue_type,
+            tumor_type = tumor_type,
+            num_IR_entries = num_IR_entries,
+            num_PMKB_interpretations = num_PMKB_interpretations,
+            num_PMKB_variants = num_PMKB_variants,
+            start = start,
+            warnings = warnings,
+            filtered = filtered)
+        yield(get_template('report_start.html').render(context))
+        spool.seek(0)
+        while True:
+            block = spool.read(1024 * 1024)
+            if not block:
+                break
+            yield(block)
+    yield(get_template('report_interpretations.html').render(make_interpretations_context(interpretations)))
+    yield(get_template('report_end.html').render({}))
+
 def demo():
     ir_tsv = sys.argv[1] # "example-data/SeraSeq.tsv"
     report_html = make_report_html(input = ir_tsv)
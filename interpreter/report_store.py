@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for storing the interpreted records of a report, so that the report can be shown one page of records at a time
+
+The result of a report job is saved to a SQLite file with one row per IR record: a compact summary of the record with
+the number of matches from each knowledge base source, the rendered detail tables of the record, the ids of the
+interpretations it references, and its rows for ``export``. The full text of each interpretation is stored once. The report page only reads the
+summaries of the records on the requested page, and the detail of a record is read when it is expanded, so the time
+and size of the page do not depend on the number of records or interpretations.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+from collections import OrderedDict
+from django.template.loader import get_template
+from .report import iter_interpreted_tables, count_pmkb, collect_interpretations, make_summary_context
+from .sources import get_sources
+from .export import record_export_rows
+
+logger = logging.getLogger()
+
+schema = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE records (row INTEGER PRIMARY KEY, summary TEXT, detail TEXT, interpretations TEXT, export_rows TEXT);
+CREATE TABLE interpretations (source TEXT, id INTEGER, interpretation TEXT, citations TEXT, PRIMARY KEY (source, id));
+"""
+
+def summary_value(value):
+    """
+    Get a value from the IR table as a string for the record summary; missing values are empty
+    """
+    if value is None or value != value: # NaN from pandas
+        return('')
+    return(str(value))
+
+def record_summary(record, row):
+    """
+    Makes the compact summary of an interpreted record that is shown on the report page
+
+    Parameters
+    ----------
+    record: IRRecord
+        an interpreted record
+    row: int
+        the index of the record in the report
+
+    Returns
+    -------
+    dict
+        the fields of the record shown in the summary, and the number of matches from each source
+    """
+    pmkb = record.interpretations.get('pmkb', [])
+    source_row = record.data.get('Row', None)
+    summary = {
+    'row': row,
+    'source_row': int(source_row) + 1 if source_row is not None else '',
+    'genes': summary_value(record.data.get('Genes', None)),
+    'type': summary_value(record.data.get('Type', None)),
+    'coding': summary_value(record.data.get('Coding', None)),
+    'amino_acid_change': summary_value(record.data.get('Amino Acid Change', None)),
+    'frequency': record.af_str,
+    'num_pmkb': len(pmkb),
+    'num_pmkb_variants': sum([ len(interpretation['variants']) for interpretation in pmkb ]),
+    'num_nyu_tier': sum([ len(interpretation['tiers']) for interpretation in record.interpretations.get('nyu_tier', []) ]),
+    'num_nyu_interpretation': len(record.interpretations.get('nyu_interpretation', []))
+    }
+    return(summary)
+
+def write_report_store(input, path, **params):
+    """
+    Interprets an Ion Reporter .tsv file in chunks and saves the result for each record to a report store file
+
+    The file is written to a temporary path first and then moved into place, so a partial result is never read.
+
+    Parameters
+    ----------
+    input: str
+        the path to an Ion Reporter .tsv file, or a file-like object that can be read
+    path: str
+        the path to write the report store to
+    **params:
+        the same as ``report.iter_interpreted_tables``
+
+    Returns
+    -------
+    dict
+        the report summary context
+    """
+    start = time.time()
+    tissue_type = params.get('tissue_type', None)
+    tumor_type = params.get('tumor_type', None)
+    warnings = params.setdefault('warnings', [])
+    filtered = params.setdefault('filtered', OrderedDict())
+    sources = get_sources(params.get('sources', None))
+    records_template = get_template('report_records.html')
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    num_IR_entries = 0
+    num_PMKB_interpretations = 0
+    num_PMKB_variants = 0
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.executescript(schema)
+        for table in iter_interpreted_tables(input, **params):
+            chunk_interpretations, chunk_variants = count_pmkb(table)
+            num_PMKB_interpretations += chunk_interpretations
+            num_PMKB_variants += chunk_variants
+            rows = []
+            interpretations = collect_interpretations([])
+            for record in table.records:
+                references = collect_interpretations([record])
+                interpretations = collect_interpretations([record], interpretations)
+                rows.append((
+                    num_IR_entries,
+                    json.dumps(record_summary(record, num_IR_entries)),
+                    records_template.render({'records': [record], 'sources': sources}),
+                    json.dumps({ source: list(entries.keys()) for source, entries in references.items() }),
+                    json.dumps(record_export_rows(record))
+                    ))
+                num_IR_entries += 1
+            connection.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?)", rows)
+            connection.executemany("INSERT OR IGNORE INTO interpretations VALUES (?, ?, ?, ?)", [
+                (source, id, interpretation.interpretation, interpretation.citations)
+                for source, entries in interpretations.items() for id, interpretation in entries.items() ])
+            del table
+        context = make_summary_context(
+            tissue_type = tissue_type,
+            tumor_type = tumor_type,
+            num_IR_entries = num_IR_entries,
+            num_PMKB_interpretations = num_PMKB_interpretations,
+            num_PMKB_variants = num_PMKB_variants,
+            start = start,
+            warnings = warnings,
+            filtered = filtered)
+        connection.execute("INSERT INTO meta VALUES ('summary', ?)", (json.dumps(context),))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    logger.info("stored {0} interpreted records; {1:.2f}s".format(num_IR_entries, time.time() - start))
+    return(context)
+
+class ReportStore(object):
+    """
+    Read-only access to a report store file written by ``write_report_store``
+
+    Parameters
+    ----------
+    path: str
+        path to the report store file
+
+    Examples
+    --------
+    Example usage::
+
+        with ReportStore(job.result_file) as store:
+            store.page(number = 2, size = 100)
+            >>> [{'row': 100, 'genes': 'EGFR', 'num_pmkb': 3, ...}, ...]
+            store.record_html(100)
+            >>> '<table style="width:100%;", class="irtable">...'
+
+    """
+    def __init__(self, path):
+        # open read-only, so that a missing file is an error instead of an empty new database
+        self.connection = sqlite3.connect('file:{0}?mode=ro'.format(path), uri = True)
+        self.summary = json.loads(self.connection.execute("SELECT value FROM meta WHERE key = 'summary'").fetchone()[0])
+        self.num_records = self.summary['num_IR_entries']
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def page(self, number, size):
+        """
+        Get the summaries of the records on a page of the report
+
+        Parameters
+        ----------
+        number: int
+            the page number, starting from 1
+        size: int
+            the number of records per page
+
+        Returns
+        -------
+        list
+            the record summaries from ``record_summary``
+        """
+        first = (number - 1) * size
+        rows = self.connection.execute("SELECT summary FROM records WHERE row >= ? AND row < ? ORDER BY row", (first, first + size))
+        return([ json.loads(summary) for summary, in rows ])
+
+    def interpretations_html(self, references = None):
+        """
+        Render the full text of the interpretations referenced by a record
+
+        Parameters
+        ----------
+        references: dict
+            lists of interpretation ids for the 'pmkb' and 'nyu_interpretation' sources; all interpretations in the report if None
+        """
+        interpretations = {}
+        for source in ['pmkb', 'nyu_interpretation']:
+            query = "SELECT id, interpretation, citations FROM interpretations WHERE source = ?"
+            query_params = [source]
+            if references is not None:
+                ids = references.get(source, [])
+                query += " AND id IN ({0})".format(','.join([ '?' for id in ids ]))
+                query_params += list(ids)
+            rows = self.connection.execute(query + " ORDER BY id", query_params)
+            interpretations[source] = [ {'id': id, 'interpretation': interpretation, 'citations': citations} for id, interpretation, citations in rows ]
+        context = {'pmkb_interpretations': interpretations['pmkb'], 'nyu_interpretations': interpretations['nyu_interpretation']}
+        return(get_template('report_interpretations.html').render(context))
+
+    def record_html(self, row):
+        """
+        Render the detail tables of a single record, followed by the interpretations it references
+
+        Raises
+        ------
+        KeyError
+            if the report does not have the record
+        """
+        result = self.connection.execute("SELECT detail, interpretations FROM records WHERE row = ?", (row,)).fetchone()
+        if result is None:
+            raise KeyError(row)
+        detail, references = result
+        return(detail + self.interpretations_html(json.loads(references)))
+
+    def iter_export_rows(self):
+        """
+        Get the stored export rows of every record, in order
+
+        Yields
+        ------
+        list
+            values for the ``export.export_columns``
+        """
+        for export_rows, in self.connection.execute("SELECT export_rows FROM records ORDER BY row"):
+            for row in json.loads(export_rows):
+                yield(row)
+
+    def iter_report_html(self):
+        """
+        Generate the full HTML report from the stored records, the same as ``report.iter_report_html``
+
+        Yields
+        ------
+        str
+            consecutive parts of the HTML report
+        """
+        yield(get_template('report_start.html').render(self.summary))
+        for detail, in self.connection.execute("SELECT detail FROM records ORDER BY row"):
+            yield(detail)
+        yield(self.interpretations_html())
+        yield(get_template('report_end.html').render({}))
@@ -5,18 +5,29 @@ class Router(object):
     or otherwise to the default database.
     https://strongarm.io/blog/multiple-databases-in-django/
     https://docs.djangoproject.com/en/2.1/topics/db/multi-db/#multiple-databases
+
+    The knowledge base models are routed to `knowledge_base`, which is switched to a new versioned build when one is
+    published (see interpreter/kb_builds.py); the models that hold the state of the app, such as report jobs, stay in
+    `interpreter_db` so that they are not swapped along with the knowledge base.
     """
+    # interpreter app models that are not part of the knowledge base
+    app_state_models = ['useraccessmetric', 'useruploadmetric', 'reportjob']
+
+    def db_for_model(self, model):
+        if model._meta.model_name in self.app_state_models:
+            return 'interpreter_db'
+        return 'knowledge_base'
 
     def db_for_read(self, model, **hints):
-        """Send all read operations on interpreter app models to `interpreter_db`."""
+        """Send all read operations on interpreter app models to `interpreter_db` or `knowledge_base`."""
         if model._meta.app_label == 'interpreter':
-            return 'interpreter_db'
+            return self.db_for_model(model)
         return None
 
     def db_for_write(self, model, **hints):
-        """Send all write operations on interpreter app models to `interpreter_db`."""
+        """Send all write operations on interpreter app models to `interpreter_db` or `knowledge_base`."""
         if model._meta.app_label == 'interpreter':
-            return 'interpreter_db'
+            return self.db_for_model(model)
         return None
 
     def allow_relation(self, obj1, obj2, **hints):
@@ -38,9 +49,10 @@ class Router(object):
     def allow_migrate(self, db, app_label, model_name=None, **hints):
         """Ensure that the interpreter app's models get created on the right database."""
         # print("db:{db}, app_label:{app_label}, model_name:{model_name}".format(db=db, app_label=app_label, model_name=model_name))
-        # The interpreter app should be migrated only on the interpreter_db database.
+        # The interpreter app should be migrated only on the interpreter_db and knowledge_base databases;
+        # both get all of the tables, so that they can share a file until the first knowledge base build is published
         if app_label == 'interpreter':
-            return db == 'interpreter_db'
+            return db in ['interpreter_db', 'knowledge_base']
 
         # No opinion for all other scenarios
         return None
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for compiling PMKB variant descriptions into structured rules, and matching IR records against them
+
+PMKB variants are free text rules such as 'KRAS codon(s) 12, 13, 61 any', 'EGFR exon(s) 19 deletion',
+'PTEN any mutation' or 'ERBB2 copy number gain'. Each one is compiled once, at import time, into a
+``PMKBVariantRule`` entry; a ``RuleMatcher`` indexes all of the rules by gene, codon, exon, and variant key,
+so that the rules that fire for a record are found with a few dict lookups.
+"""
+import re
+import logging
+import threading
+from collections import namedtuple, defaultdict
+from .models import PMKBVariant, PMKBVariantRule
+from .variants import make_variant_key, normalize_protein_change, normalize_coding_change, VariantKey
+
+logger = logging.getLogger()
+
+# the record consequences that fire a rule with each consequence; fusions only fire rearrangement rules
+consequence_matches = {
+'any': frozenset(['missense', 'nonsense', 'synonymous', 'frameshift', 'deletion', 'insertion', 'delins', 'other']),
+'missense': frozenset(['missense']),
+'nonsense': frozenset(['nonsense']),
+'frameshift': frozenset(['frameshift']),
+'deletion': frozenset(['deletion', 'delins']),
+'insertion': frozenset(['insertion', 'delins']),
+'indel': frozenset(['deletion', 'insertion', 'delins', 'frameshift']),
+}
+
+# e.g. 'codon(s) 12, 13, 61 any', 'exon(s) 18-21 missense'
+position_rule_pattern = re.compile(r'^(?P<kind>codon|exon)\(?s?\)?\s+(?P<positions>[\d\s,\-]+?)\s+(?P<consequence>any|missense|nonsense|frameshift|deletion|insertion|indel)$')
+any_rule_pattern = re.compile(r'^any\s+(?P<consequence>mutation|missense|nonsense|frameshift|deletion|insertion|indel)$')
+copy_number_pattern = re.compile(r'^copy number\s+(?P<consequence>gain|loss)$')
+rearrangement_pattern = re.compile(r'^(?:(?P<partners>[A-Za-z0-9\-]+)\s+)?(?:rearrangement|fusion|translocation)$')
+
+class VariantRule(namedtuple('VariantRule', ['gene', 'rule_type', 'consequence', 'codons', 'exons', 'partners', 'protein_key'])):
+    """
+    A compiled PMKB variant rule; ``codons``, ``exons``, and ``partners`` are tuples
+    """
+    __slots__ = ()
+
+def parse_positions(text):
+    """
+    Parses a list of codon or exon numbers, expanding ranges
+
+    Examples
+    --------
+    Example usage::
+
+        >>> parse_positions('12, 13, 61')
+        (12, 13, 61)
+        >>> parse_positions('18-21')
+        (18, 19, 20, 21)
+
+    """
+    positions = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            positions.update(range(int(start), int(end) + 1))
+        else:
+            positions.add(int(part))
+    return(tuple(sorted(positions)))
+
+def compile_variant_rule(gene, variant):
+    """
+    Compiles a PMKB variant description into a rule
+
+    Parameters
+    ----------
+    gene: str
+        the gene of the PMKB entry
+    variant: str
+        the PMKB variant description, e.g. 'KRAS codon(s) 12, 13 any'
+
+    Returns
+    -------
+    VariantRule
+        the compiled rule; descriptions that are not understood have the rule type 'unknown', and never match
+
+    Examples
+    --------
+    Example usage::
+
+        >>> compile_variant_rule('KRAS', 'KRAS codon(s) 12, 13 any')
+        VariantRule(gene='KRAS', rule_type='codon', consequence='any', codons=(12, 13), exons=(), partners=(), protein_key='')
+        >>> compile_variant_rule('NRAS', 'NRAS Q61R').protein_key
+        'NRAS:p.Q61R'
+
+    """
+    rule = VariantRule(gene = gene, rule_type = 'unknown', consequence = '', codons = (), exons = (), partners = (), protein_key = '')
+    if variant is None or variant != variant: # NaN from pandas
+        return(rule)
+    text = str(variant).strip()
+    if gene and text.upper().startswith(gene.upper() + ' '):
+        text = text[len(gene) + 1:].strip()
+    text = re.sub(r'\s+', ' ', text).lower()
+
+    key = make_variant_key(gene, variant)
+    if key is not None:
+        start = int(key.position.split('_')[0]) if key.kind == 'p' else None
+        return(rule._replace(rule_type = 'variant', codons = (start, ) if start else (), protein_key = str(key)))
+    match = position_rule_pattern.match(text)
+    if match:
+        positions = parse_positions(match.group('positions'))
+        if match.group('kind') == 'codon':
+            return(rule._replace(rule_type = 'codon', consequence = match.group('consequence'), codons = positions))
+        return(rule._replace(rule_type = 'exon', consequence = match.group('consequence'), exons = positions))
+    match = any_rule_pattern.match(text)
+    if match:
+        consequence = match.group('consequence')
+        if consequence == 'mutation':
+            consequence = 'any'
+        return(rule._replace(rule_type = 'any', consequence = consequence))
+    match = copy_number_pattern.match(text)
+    if match:
+        return(rule._replace(rule_type = 'copy_number', consequence = match.group('consequence')))
+    match = rearrangement_pattern.match(text)
+    if match:
+        partners = ()
+        if match.group('partners'):
+            partners = tuple(sorted(set([ partner.upper() for partner in match.group('partners').split('-') if partner ])))
+        return(rule._replace(rule_type = 'rearrangement', consequence = 'fusion', partners = partners))
+    return(rule)
+
+class RecordFeatures(namedtuple('RecordFeatures', ['variant_type', 'change', 'consequence', 'codons', 'exons', 'copy_number', 'genes'])):
+    """
+    The fields of an IR record that PMKB rules are evaluated against; hashable, so that it can be used as a cache key
+    """
+    __slots__ = ()
+
+def change_consequence(ref, alt):
+    """
+    Get the consequence of a normalized protein change
+
+    Examples
+    --------
+    Example usage::
+
+        >>> change_consequence('Q', 'R')
+        'missense'
+        >>> change_consequence('E_A', 'del')
+        'deletion'
+
+    """
+    if alt == 'fs':
+        return('frameshift')
+    if alt.startswith('delins'):
+        return('delins')
+    if alt == 'del':
+        return('deletion')
+    if alt == 'dup' or alt.startswith('ins'):
+        return('insertion')
+    if alt == '*':
+        return('nonsense')
+    if alt == ref:
+        return('synonymous')
+    if len(alt) == 1:
+        return('missense')
+    return('other')
+
+def record_features(record):
+    """
+    Get the fields of an IR record that PMKB rules are evaluated against
+
+    Parameters
+    ----------
+    record: IRRecord
+        a record from an IR table
+
+    Returns
+    -------
+    RecordFeatures
+        the record's variant type, normalized protein change, consequence, codons, exons, copy number change, and genes
+    """
+    variant_type = str(record.data.get('Type', '')).upper()
+    change = None
+    consequence = 'other'
+    codons = ()
+    if record.protein_change:
+        change = normalize_protein_change(record.protein_change)
+    if change is not None:
+        position, ref, alt = change
+        consequence = change_consequence(ref, alt)
+        bounds = [ int(x) for x in position.split('_') ]
+        # a change that spans a range touches every codon in it
+        codons = tuple(range(bounds[0], bounds[-1] + 1))[:100]
+    elif record.coding_change:
+        coding = normalize_coding_change(record.coding_change)
+        # only insertions and deletions can be told apart without the protein change
+        if coding is not None and not coding[1]:
+            consequence = change_consequence(ref = None, alt = coding[2])
+    if variant_type == 'FUSION':
+        consequence = 'fusion'
+    exons = ()
+    exon = record.data.get('Exon', None)
+    if exon is not None and exon == exon and variant_type != 'FUSION':
+        try:
+            exons = (int(float(exon)), )
+        except ValueError:
+            pass
+    copy_number = None
+    if variant_type == 'CNV':
+        try:
+            value = float(record.data.get('Copy Number', 'nan'))
+            if value > 2:
+                copy_number = 'gain'
+            elif value < 2:
+                copy_number = 'loss'
+        except (TypeError, ValueError):
+            pass
+    return(RecordFeatures(
+        variant_type = variant_type,
+        change = change,
+        consequence = consequence,
+        codons = codons,
+        exons = exons,
+        copy_number = copy_number,
+        genes = tuple(sorted(set([ gene.upper() for gene in record.genes ])))
+        ))
+
+class RuleMatcher(object):
+    """
+    Index of compiled PMKB rules for finding the PMKB variants whose rules fire for an IR record
+
+    Parameters
+    ----------
+    rules: iterable
+        ``(variant_id, VariantRule)`` pairs
+
+    Examples
+    --------
+    Example usage::
+
+        matcher = RuleMatcher([ (1, compile_variant_rule('KRAS', 'KRAS codon(s) 12, 13 any')) ])
+        matcher.match('KRAS', record_features(record))
+        >>> frozenset({1})
+
+    """
+    def __init__(self, rules):
+        self.variant_rules = defaultdict(set)
+        self.codon_rules = defaultdict(list)
+        self.exon_rules = defaultdict(list)
+        self.any_rules = defaultdict(list)
+        self.copy_number_rules = defaultdict(set)
+        self.rearrangement_rules = defaultdict(list)
+        self.num_rules = 0
+        self.num_unknown = 0
+        for variant_id, rule in rules:
+            self.add(variant_id, rule)
+
+    def add(self, variant_id, rule):
+        """
+        Add a compiled rule to the index
+        """
+        self.num_rules += 1
+        if rule.rule_type == 'variant':
+            self.variant_rules[rule.protein_key].add(variant_id)
+        elif rule.rule_type == 'codon':
+            for codon in rule.codons:
+                self.codon_rules[(rule.gene, codon)].append((rule.consequence, variant_id))
+        elif rule.rule_type == 'exon':
+            for exon in rule.exons:
+                self.exon_rules[(rule.gene, exon)].append((rule.consequence, variant_id))
+        elif rule.rule_type == 'any':
+            self.any_rules[rule.gene].append((rule.consequence, variant_id))
+        elif rule.rule_type == 'copy_number':
+            self.copy_number_rules[(rule.gene, rule.consequence)].add(variant_id)
+        elif rule.rule_type == 'rearrangement':
+            self.rearrangement_rules[rule.gene].append((frozenset(rule.partners), variant_id))
+        else:
+            self.num_unknown += 1
+
+    def match(self, gene, features):
+        """
+        Get the PMKB variants of a gene whose rules fire for a record
+
+        Parameters
+        ----------
+        gene: str
+            one of the record's genes
+        features: RecordFeatures
+            the record fields from ``record_features``
+
+        Returns
+        -------
+        frozenset
+            the ids of the matching ``PMKBVariant`` entries
+        """
+        matches = set()
+        consequence = features.consequence
+        if features.variant_type == 'CNV':
+            if features.copy_number:
+                matches.update(self.copy_number_rules.get((gene, features.copy_number), ()))
+            return(frozenset(matches))
+        if consequence == 'fusion':
+            for partners, variant_id in self.rearrangement_rules.get(gene, ()):
+                if partners.issubset(features.genes):
+                    matches.add(variant_id)
+        if features.change is not None:
+            position, ref, alt = features.change
+            key = str(VariantKey(gene = gene, kind = 'p', position = position, ref = ref, alt = alt))
+            matches.update(self.variant_rules.get(key, ()))
+        for codon in features.codons:
+            for rule_consequence, variant_id in self.codon_rules.get((gene, codon), ()):
+                if consequence in consequence_matches[rule_consequence]:
+                    matches.add(variant_id)
+        for exon in features.exons:
+            for rule_consequence, variant_id in self.exon_rules.get((gene, exon), ()):
+                if consequence in consequence_matches[rule_consequence]:
+                    matches.add(variant_id)
+        for rule_consequence, variant_id in self.any_rules.get(gene, ()):
+            if consequence in consequence_matches[rule_consequence]:
+                matches.add(variant_id)
+        return(frozenset(matches))
+
+_matcher = None
+_matcher_version = None
+_matcher_lock = threading.Lock()
+
+def get_rule_matcher(kb_version):
+    """
+    Get the rule matcher for the current knowledge base version, building it from the ``PMKBVariantRule`` table if the knowledge base has changed
+
+    Parameters
+    ----------
+    kb_version: int
+        the current knowledge base version
+
+    Returns
+    -------
+    RuleMatcher
+        the matcher shared by all threads of this worker
+    """
+    global _matcher, _matcher_version
+    with _matcher_lock:
+        if _matcher is None or _matcher_version != kb_version:
+            rules = []
+            for row in PMKBVariantRule.objects.values_list('variant_id', 'gene', 'rule_type', 'consequence', 'codons', 'exons', 'partners', 'protein_key'):
+                variant_id, gene, rule_type, consequence, codons, exons, partners, protein_key = row
+                rules.append((variant_id, VariantRule(
+                    gene = gene,
+                    rule_type = rule_type,
+                    consequence = consequence,
+                    codons = tuple([ int(x) for x in codons.split() ]),
+                    exons = tuple([ int(x) for x in exons.split() ]),
+                    partners = tuple(partners.split()),
+                    protein_key = protein_key
+                    )))
+            _matcher = RuleMatcher(rules)
+            _matcher_version = kb_version
+            logger.info("loaded {0} PMKB variant rules ({1} not understood) for knowledge base version {2}".format(
+                _matcher.num_rules, _matcher.num_unknown, kb_version))
+        return(_matcher)
+
+def clear_rule_matcher():
+    """
+    Drop this worker's rule matcher, so that it is rebuilt on the next lookup
+    """
+    global _matcher, _matcher_version
+    with _matcher_lock:
+        _matcher = None
+        _matcher_version = None
+
+def make_rule_entry(variant):
+    """
+    Compile a ``PMKBVariant`` into an unsaved ``PMKBVariantRule`` entry
+    """
+    rule = compile_variant_rule(variant.gene, variant.variant)
+    return(PMKBVariantRule(
+        variant = variant,
+        gene = rule.gene,
+        rule_type = rule.rule_type,
+        consequence = rule.consequence,
+        codons = ' '.join([ str(x) for x in rule.codons ]),
+        exons = ' '.join([ str(x) for x in rule.exons ]),
+        partners = ' '.join(rule.partners),
+        protein_key = rule.protein_key
+        ))
+
+def compile_pmkb_rules():
+    """
+    Compile the rules for every PMKB variant in the database, replacing any existing rules
+
+    Returns
+    -------
+    int
+        the number of rules created
+    """
+    PMKBVariantRule.objects.all().delete()
+    entries = [ make_rule_entry(variant) for variant in PMKBVariant.objects.only('id', 'gene', 'variant') ]
+    PMKBVariantRule.objects.bulk_create(entries, batch_size = 500)
+    unknown = sum([ 1 for entry in entries if entry.rule_type == 'unknown' ])
+    logger.info("compiled {0} PMKB variant rules; {1} not understood".format(len(entries), unknown))
+    return(len(entries))
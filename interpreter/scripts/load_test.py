@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Send concurrent index page loads and .tsv uploads to an IR-interpreter server and report the throughput and latencies
+
+Run this against a running server before and after changing the gunicorn configuration, e.g.
+
+    make runserver
+    interpreter/scripts/load_test.py --url http://127.0.0.1:8000 --concurrency 8 --requests 200
+
+or let it start gunicorn with a configuration file on a free localhost port, against a temporary database with the
+knowledge base imported from the fixtures, and fail if the throughput or latency is worse than a saved baseline:
+
+    interpreter/scripts/load_test.py --gunicorn-config gunicorn_config.py --synthetic-records 2000 --baseline baseline.json --save-baseline
+    interpreter/scripts/load_test.py --gunicorn-config gunicorn_config.py --synthetic-records 2000 --baseline baseline.json
+
+The client only uses the Python standard library, so it can be run from any Python 3 installation on the same host;
+starting the server needs the app's own Python environment, with gunicorn installed.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import random
+import socket
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+import http.cookiejar
+from concurrent.futures import ThreadPoolExecutor
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+project_dir = os.path.dirname(os.path.dirname(scriptdir))
+default_tsv = os.path.join(os.path.dirname(scriptdir), "fixtures", "SeraSeq.tsv")
+
+# kinds of requests in the mix, in the order they are reported
+request_kinds = ['index', 'upload', 'synthetic']
+
+def percentile(values, percent):
+    """
+    Get the nearest-rank percentile of a list of values
+
+    Examples
+    --------
+    Example usage::
+
+        >>> percentile([1, 2, 3, 4], 50)
+        2
+        >>> percentile([1, 2, 3, 4], 99)
+        4
+
+    """
+    if len(values) < 1:
+        return(float('nan'))
+    values = sorted(values)
+    rank = max(int(round(percent / 100.0 * len(values) + 0.5)) - 1, 0)
+    return(values[min(rank, len(values) - 1)])
+
+def make_multipart(fields, files):
+    """
+    Encode form fields and files as a multipart/form-data request body
+
+    Parameters
+    ----------
+    fields: dict
+        form field names and values
+    files: dict
+        form field names and paths to files to upload
+
+    Returns
+    -------
+    tuple
+        ``(body, content_type)``
+    """
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields.items():
+        lines.append('--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\n{2}\r\n'.format(boundary, name, value).encode('utf-8'))
+    for name, path in files.items():
+        with open(path, 'rb') as f:
+            data = f.read()
+        lines.append('--{0}\r\nContent-Disposition: form-data; name="{1}"; filename="{2}"\r\nContent-Type: text/tab-separated-values\r\n\r\n'.format(
+            boundary, name, os.path.basename(path)).encode('utf-8'))
+        lines.append(data + b'\r\n')
+    lines.append('--{0}--\r\n'.format(boundary).encode('utf-8'))
+    return(b''.join(lines), 'multipart/form-data; boundary={0}'.format(boundary))
+
+class Client(object):
+    """
+    HTTP client for the app that keeps the session and CSRF cookies between requests
+    """
+    def __init__(self, url, timeout = 120):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return(cookie.value)
+        return('')
+
+    def get(self, path = '/'):
+        with self.opener.open(self.url + path, timeout = self.timeout) as response:
+            return(response.status, response.read())
+
+    def upload(self, tsv, tissue_type = 'Any', tumor_type = 'Any'):
+        body, content_type = make_multipart(
+            fields = {'tissue_type': tissue_type, 'tumor_type': tumor_type},
+            files = {'irtable': tsv})
+        request = urllib.request.Request(self.url + '/upload/', data = body, headers = {
+            'Content-Type': content_type,
+            'X-CSRFToken': self.csrf_token(),
+            'Referer': self.url + '/'
+            })
+        with self.opener.open(request, timeout = self.timeout) as response:
+            content = response.read()
+            if content.startswith(b'Error'):
+                raise RuntimeError(content.decode('utf-8', 'replace'))
+            return(response.status, content)
+
+def make_synthetic_tsv(tsv, num_records, path):
+    """
+    Make a larger Ion Reporter .tsv file by repeating the variant records of another one
+
+    Parameters
+    ----------
+    tsv: str
+        path to the .tsv file to copy the '##' header lines, column names, and records from
+    num_records: int
+        number of records to write
+    path: str
+        path to write the new file to
+
+    Returns
+    -------
+    str
+        ``path``
+    """
+    with open(tsv, encoding = 'utf-8') as f:
+        lines = [ line.rstrip('\n') for line in f if line.strip() ]
+    header = [ line for line in lines if line.startswith('##') ]
+    table = [ line for line in lines if not line.startswith('##') ]
+    columns, records = table[:1], table[1:]
+    with open(path, 'w', encoding = 'utf-8') as f:
+        for line in header + columns:
+            f.write(line + '\n')
+        for i in range(num_records):
+            f.write(records[i % len(records)] + '\n')
+    return(path)
+
+def run_request(client, kind, tsv, synthetic_tsv = None):
+    """
+    Run a single request and time it
+
+    Returns
+    -------
+    tuple
+        ``(kind, seconds, error)``
+    """
+    start = time.time()
+    error = None
+    try:
+        if kind == 'upload':
+            client.upload(tsv)
+        elif kind == 'synthetic':
+            client.upload(synthetic_tsv)
+        else:
+            client.get('/')
+    except Exception as e:
+        error = str(e)
+    return(kind, time.time() - start, error)
+
+def run_load_test(url, tsv, concurrency, num_requests, upload_fraction, seed = None, synthetic_tsv = None, synthetic_fraction = 0):
+    """
+    Send a mix of index page loads and uploads to the server from ``concurrency`` threads at once
+
+    Parameters
+    ----------
+    synthetic_tsv: str
+        a larger .tsv file, e.g. from ``make_synthetic_tsv``, to use for ``synthetic_fraction`` of the uploads
+
+    Returns
+    -------
+    dict
+        the latencies, error counts, and throughput for each kind of request
+    """
+    rng = random.Random(seed)
+    kinds = []
+    for i in range(num_requests):
+        if rng.random() >= upload_fraction:
+            kinds.append('index')
+        elif synthetic_tsv is not None and rng.random() < synthetic_fraction:
+            kinds.append('synthetic')
+        else:
+            kinds.append('upload')
+    # each thread uses its own client; load the index once to get the CSRF cookie
+    clients = [ Client(url) for i in range(concurrency) ]
+    for client in clients:
+        client.get('/')
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        futures = [ executor.submit(run_request, clients[i % concurrency], kind, tsv, synthetic_tsv) for i, kind in enumerate(kinds) ]
+        results = [ future.result() for future in futures ]
+    elapsed = time.time() - start
+
+    summary = {'elapsed': elapsed, 'requests': num_requests, 'concurrency': concurrency, 'throughput': num_requests / elapsed}
+    for kind in request_kinds:
+        latencies = [ seconds for k, seconds, error in results if k == kind and error is None ]
+        errors = [ error for k, seconds, error in results if k == kind and error is not None ]
+        summary[kind] = {
+        'count': len(latencies) + len(errors),
+        'errors': len(errors),
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else float('nan'),
+        'throughput': len(latencies) / elapsed
+        }
+        if errors:
+            summary[kind]['first_error'] = errors[0]
+    return(summary)
+
+def print_summary(summary):
+    """
+    Print the load test results as a table
+    """
+    print("{requests} requests, concurrency {concurrency}: {elapsed:.2f}s, {throughput:.2f} requests/s".format(**summary))
+    print("{0:<10}{1:>7}{2:>8}{3:>10}{4:>10}{5:>10}{6:>10}{7:>8}".format('kind', 'count', 'errors', 'p50 (s)', 'p90 (s)', 'p99 (s)', 'max (s)', 'req/s'))
+    for kind in request_kinds:
+        stats = summary[kind]
+        if stats['count'] < 1:
+            continue
+        print("{0:<10}{count:>7}{errors:>8}{p50:>10.3f}{p90:>10.3f}{p99:>10.3f}{max:>10.3f}{throughput:>8.2f}".format(kind, **stats))
+        if 'first_error' in stats:
+            print("  first {0} error: {1}".format(kind, stats['first_error'][:200]))
+
+def compare_baseline(summary, baseline, tolerance = 0.2):
+    """
+    Compare load test results to a saved baseline
+
+    A kind of request regresses if its throughput drops, or its p90 latency rises, by more than ``tolerance``, or if any
+    of its requests fail.
+
+    Parameters
+    ----------
+    summary: dict
+        results from ``run_load_test``
+    baseline: dict
+        results from an earlier run with the same settings
+    tolerance: float
+        allowed fraction of change from the baseline
+
+    Returns
+    -------
+    list
+        a description of each regression; empty if there are none
+
+    Examples
+    --------
+    Example usage::
+
+        >>> baseline = {'throughput': 10.0, 'index': {'count': 5, 'errors': 0, 'p90': 0.1, 'throughput': 5.0}}
+        >>> compare_baseline({'throughput': 9.0, 'index': {'count': 5, 'errors': 0, 'p90': 0.11, 'throughput': 4.5}}, baseline)
+        []
+        >>> compare_baseline({'throughput': 7.0, 'index': {'count': 5, 'errors': 0, 'p90': 0.2, 'throughput': 3.5}}, baseline)
+        ['throughput 7.00 requests/s is below the baseline 10.00 requests/s', 'index throughput 3.50 requests/s is below the baseline 5.00 requests/s', 'index p90 0.200s is above the baseline 0.100s']
+
+    """
+    regressions = []
+    if summary['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append("throughput {0:.2f} requests/s is below the baseline {1:.2f} requests/s".format(summary['throughput'], baseline['throughput']))
+    for kind in request_kinds:
+        if kind not in baseline or baseline[kind]['count'] < 1:
+            continue
+        stats, base = summary[kind], baseline[kind]
+        if stats['errors'] > 0:
+            regressions.append("{0} had {1} errors".format(kind, stats['errors']))
+        if stats['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append("{0} throughput {1:.2f} requests/s is below the baseline {2:.2f} requests/s".format(kind, stats['throughput'], base['throughput']))
+        if stats['p90'] > base['p90'] * (1 + tolerance):
+            regressions.append("{0} p90 {1:.3f}s is above the baseline {2:.3f}s".format(kind, stats['p90'], base['p90']))
+    return(regressions)
+
+def free_port():
+    """
+    Get a free TCP port on localhost
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return(s.getsockname()[1])
+
+def server_env(db_dir):
+    """
+    Get the environment for running the app against the databases in ``db_dir``, with its logs in ``db_dir`` as well
+    """
+    env = dict(os.environ, DB_DIR = db_dir, LOG_DIR = os.path.join(db_dir, 'logs'))
+    env.setdefault('SECRET_KEY', uuid.uuid4().hex)
+    env.pop('KNOWLEDGE_BASE_DB', None)
+    os.makedirs(env['LOG_DIR'], exist_ok = True)
+    return(env)
+
+def prepare_database(db_dir):
+    """
+    Create the app databases in ``db_dir`` and build the knowledge base from the fixtures, unless there is already a
+    knowledge base build published there
+    """
+    env = server_env(db_dir)
+    if os.path.exists(os.path.join(db_dir, 'kb', 'current')):
+        return(env)
+    manage = [sys.executable, os.path.join(project_dir, 'manage.py')]
+    for args in [['migrate'], ['migrate', 'interpreter', '--database=interpreter_db'], ['build_kb']]:
+        print("preparing the database: manage.py {0}".format(' '.join(args)))
+        subprocess.run(manage + args, cwd = project_dir, env = env, check = True, stdout = subprocess.DEVNULL)
+    return(env)
+
+def wait_for_server(url, process, log, timeout = 120):
+    """
+    Wait until the server answers on ``url``
+    """
+    start = time.time()
+    while time.time() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited with code {0}; see {1}".format(process.returncode, log))
+        try:
+            with urllib.request.urlopen(url + '/', timeout = 5) as response:
+                response.read()
+            return
+        except Exception:
+            time.sleep(0.5)
+    raise RuntimeError("gunicorn did not answer on {0} within {1}s; see {2}".format(url, timeout, log))
+
+def start_server(gunicorn_config, db_dir):
+    """
+    Start gunicorn with a configuration file on a free localhost port, against the databases in ``db_dir``
+
+    The bind address, pid file, and logs in the configuration file are replaced so that the server cannot collide with
+    a deployed one.
+
+    Returns
+    -------
+    tuple
+        ``(process, url)``
+    """
+    env = prepare_database(db_dir)
+    port = free_port()
+    log = os.path.join(env['LOG_DIR'], 'gunicorn.log')
+    # gunicorn 19 cannot be run with 'python -m', so use the script installed next to this Python if there is one
+    gunicorn = os.path.join(os.path.dirname(sys.executable), 'gunicorn')
+    command = [gunicorn if os.path.exists(gunicorn) else 'gunicorn', 'webapp.wsgi',
+        '--config', os.path.realpath(gunicorn_config),
+        '--bind', '127.0.0.1:{0}'.format(port),
+        '--pid', os.path.join(env['LOG_DIR'], 'gunicorn.pid'),
+        '--access-logfile', os.path.join(env['LOG_DIR'], 'gunicorn.access.log'),
+        '--error-logfile', log]
+    process = subprocess.Popen(command, cwd = project_dir, env = env)
+    url = 'http://127.0.0.1:{0}'.format(port)
+    try:
+        wait_for_server(url, process, log)
+    except Exception:
+        stop_server(process)
+        raise
+    print("started gunicorn with {0} on {1}".format(gunicorn_config, url))
+    return(process, url)
+
+def stop_server(process, timeout = 30):
+    """
+    Stop the gunicorn server, waiting for the workers to finish their requests
+    """
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout = timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def main(**kwargs):
+    """
+    Main control function for the script.
+
+    Returns
+    -------
+    list
+        the regressions from the baseline, if one was given
+    """
+    tmpdir = tempfile.mkdtemp(prefix = 'load_test_')
+    db_dir = os.path.realpath(kwargs['db_dir']) if kwargs['db_dir'] else os.path.join(tmpdir, 'db')
+    process = None
+    url = kwargs['url']
+    synthetic_tsv = None
+    settings = {
+        'gunicorn_config': kwargs['gunicorn_config'],
+        'concurrency': int(kwargs['concurrency']),
+        'requests': int(kwargs['num_requests']),
+        'upload_fraction': float(kwargs['upload_fraction']),
+        'synthetic_records': int(kwargs['synthetic_records']),
+        'synthetic_fraction': float(kwargs['synthetic_fraction'])
+        }
+    try:
+        if settings['synthetic_records'] > 0:
+            synthetic_tsv = make_synthetic_tsv(kwargs['tsv'], settings['synthetic_records'], os.path.join(tmpdir, 'synthetic.tsv'))
+        if kwargs['gunicorn_config']:
+            process, url = start_server(kwargs['gunicorn_config'], db_dir)
+        summary = run_load_test(
+            url = url,
+            tsv = kwargs['tsv'],
+            concurrency = settings['concurrency'],
+            num_requests = settings['requests'],
+            upload_fraction = settings['upload_fraction'],
+            seed = kwargs['seed'],
+            synthetic_tsv = synthetic_tsv,
+            synthetic_fraction = settings['synthetic_fraction'])
+    finally:
+        if process is not None:
+            stop_server(process)
+        shutil.rmtree(tmpdir, ignore_errors = True)
+    print_summary(summary)
+    summary['settings'] = settings
+
+    regressions = []
+    baseline_file = kwargs['baseline']
+    if baseline_file and kwargs['save_baseline']:
+        with open(baseline_file, 'w') as f:
+            json.dump(summary, f, indent = 4, sort_keys = True)
+        print("saved the baseline to {0}".format(baseline_file))
+    elif baseline_file and os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != settings:
+            print("warning: the baseline in {0} was run with different settings: {1}".format(baseline_file, baseline.get('settings')))
+        regressions = compare_baseline(summary, baseline, tolerance = float(kwargs['tolerance']))
+        for regression in regressions:
+            print("regression: {0}".format(regression))
+        if not regressions:
+            print("no regressions from the baseline in {0}".format(baseline_file))
+    elif baseline_file:
+        print("no baseline in {0}; save one with --save-baseline".format(baseline_file))
+    return(regressions)
+
+def parse():
+    """
+    Parses script args.
+    """
+    parser = argparse.ArgumentParser(description='Load test a running IR-interpreter server with concurrent index loads and uploads')
+    parser.add_argument("--url", default = "http://127.0.0.1:8000", dest = 'url', help="Base URL of the running app")
+    parser.add_argument("--tsv", default = default_tsv, dest = 'tsv', help="Ion Reporter .tsv file to upload")
+    parser.add_argument("--concurrency", default = 8, dest = 'concurrency', help="Number of requests to send at the same time")
+    parser.add_argument("--requests", default = 100, dest = 'num_requests', help="Total number of requests to send")
+    parser.add_argument("--upload-fraction", default = 0.5, dest = 'upload_fraction', help="Fraction of the requests that are uploads; the rest are index page loads")
+    parser.add_argument("--seed", default = None, dest = 'seed', help="Random seed for the mix of requests")
+    parser.add_argument("--synthetic-records", default = 0, dest = 'synthetic_records', help="Also upload a larger .tsv file made by repeating the records of --tsv this many times")
+    parser.add_argument("--synthetic-fraction", default = 0.5, dest = 'synthetic_fraction', help="Fraction of the uploads that use the larger .tsv file")
+    parser.add_argument("--gunicorn-config", default = None, dest = 'gunicorn_config', help="Start gunicorn with this configuration file on a free localhost port, against a temporary database built from the fixtures, instead of using --url")
+    parser.add_argument("--db-dir", default = None, dest = 'db_dir', help="Directory for the --gunicorn-config databases; they are built there the first time and reused afterwards, instead of in a temporary directory each run")
+    parser.add_argument("--baseline", default = None, dest = 'baseline', help="JSON file with the results of an earlier run; exit with an error if the throughput or p90 latency is worse")
+    parser.add_argument("--save-baseline", action = 'store_true', dest = 'save_baseline', help="Save the results to the --baseline file instead of comparing them")
+    parser.add_argument("--tolerance", default = 0.2, dest = 'tolerance', help="Fraction the throughput and p90 latency can change from the baseline before it counts as a regression")
+    args = parser.parse_args()
+    regressions = main(**vars(args))
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parse()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for full-text search over the text and citations of the PMKB and NYU interpretations
+
+The interpretations are indexed in an SQLite FTS5 virtual table in the knowledge base database, so that a search for a
+drug, trial, or mechanism, e.g. 'osimertinib' or 'MAPK', is a single index lookup ranked with bm25 instead of a
+``LIKE '%...%'`` scan of every interpretation. The table is not a Django model; it is created after ``migrate``, rebuilt
+by the importer, and kept up to date by the signal handlers when interpretations are edited in the admin.
+"""
+import math
+import logging
+from collections import OrderedDict
+from django.db import connections, router
+from django.utils.html import escape
+from .models import PMKBInterpretation, PMKBLookup, NYUInterpretation
+
+logger = logging.getLogger()
+
+search_table = 'interpretation_search'
+
+# the knowledge base models for each indexed source
+search_sources = OrderedDict([
+('pmkb', PMKBInterpretation),
+('nyu_interpretation', NYUInterpretation)
+])
+
+# bm25 weights of the source, entry id, interpretation, and citations columns; matches in the text rank above matches in the citations
+search_weights = (0.0, 0.0, 10.0, 1.0)
+
+# markers around the matched terms of a snippet, replaced with HTML once the snippet is escaped
+snippet_start = '\x02'
+snippet_end = '\x03'
+
+def search_connection():
+    """
+    Get the database connection for the knowledge base
+    """
+    return(connections[router.db_for_write(PMKBInterpretation)])
+
+def create_search_index(connection = None):
+    """
+    Create the full-text search table, if it does not exist yet
+    """
+    connection = connection or search_connection()
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5(source UNINDEXED, entry_id UNINDEXED, interpretation, citations, tokenize = 'porter unicode61 remove_diacritics 1')".format(search_table))
+
+def compile_search_index():
+    """
+    Rebuild the full-text search table from the PMKB and NYU interpretations
+
+    Returns
+    -------
+    int
+        the number of interpretations indexed
+    """
+    connection = search_connection()
+    create_search_index(connection)
+    entries = []
+    for source, model in search_sources.items():
+        entries.extend([ (source, id, interpretation, citations) for id, interpretation, citations in
+            model.objects.values_list('id', 'interpretation', 'citations') ])
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {0}".format(search_table))
+        cursor.executemany("INSERT INTO {0} (source, entry_id, interpretation, citations) VALUES (%s, %s, %s, %s)".format(search_table), entries)
+    logger.info("indexed {0} interpretations for search".format(len(entries)))
+    return(len(entries))
+
+def remove_search_entry(source, entry_id):
+    """
+    Remove an interpretation from the full-text search table
+    """
+    connection = search_connection()
+    create_search_index(connection)
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {0} WHERE source = %s AND entry_id = %s".format(search_table), [source, entry_id])
+
+def update_search_entry(source, entry_id, interpretation, citations):
+    """
+    Replace the full-text search entry for an interpretation, e.g. after it is edited in the admin
+    """
+    remove_search_entry(source, entry_id)
+    with search_connection().cursor() as cursor:
+        cursor.execute("INSERT INTO {0} (source, entry_id, interpretation, citations) VALUES (%s, %s, %s, %s)".format(search_table),
+            [source, entry_id, interpretation, citations])
+
+def make_match_query(query):
+    """
+    Convert a search from the user into an FTS5 query that matches all of its terms; each term is quoted, so punctuation
+    in e.g. 'V600E' or 'T790M/C797S' is not read as query syntax, and a term that ends with '*' matches as a prefix
+
+    Examples
+    --------
+    Example usage::
+
+        make_match_query('osimertinib MAPK*')
+        >>> '"osimertinib" "MAPK"*'
+
+    """
+    terms = []
+    for term in query.split():
+        prefix = term.endswith('*')
+        term = term.rstrip('*')
+        if not term:
+            continue
+        terms.append('"{0}"{1}'.format(term.replace('"', '""'), '*' if prefix else ''))
+    return(' '.join(terms))
+
+def snippet_html(snippet):
+    """
+    Escape a snippet from the search table, and mark the matched terms with ``<mark>``
+    """
+    return(escape(snippet).replace(snippet_start, '<mark>').replace(snippet_end, '</mark>'))
+
+def search_interpretations(query, page = 1, size = 20):
+    """
+    Search the PMKB and NYU interpretations, ranked by relevance
+
+    Parameters
+    ----------
+    query: str
+        the terms to search for; all of the terms must match
+    page: int
+        the page of results, starting from 1
+    size: int
+        the number of results per page
+
+    Returns
+    -------
+    dict
+        the total number of results and pages, and the results on the page, each with the source and id of the
+        interpretation, its genes, and HTML snippets of the matching text and citations
+    """
+    match = make_match_query(query)
+    results = {'query': query, 'page': page, 'num_results': 0, 'num_pages': 0, 'results': []}
+    if not match:
+        return(results)
+    connection = search_connection()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM {0} WHERE {0} MATCH %s".format(search_table), [match])
+        results['num_results'] = cursor.fetchone()[0]
+        results['num_pages'] = int(math.ceil(results['num_results'] / size))
+        cursor.execute("SELECT source, entry_id, snippet({0}, 2, %s, %s, '...', 24), snippet({0}, 3, %s, %s, '...', 12) "
+            "FROM {0} WHERE {0} MATCH %s ORDER BY bm25({0}, {1}) LIMIT %s OFFSET %s".format(search_table, ', '.join([ str(weight) for weight in search_weights ])),
+            [snippet_start, snippet_end, snippet_start, snippet_end, match, size, (page - 1) * size])
+        rows = cursor.fetchall()
+    # the genes of the interpretations on the page, with one query per source
+    pmkb_ids = [ entry_id for source, entry_id, text, citations in rows if source == 'pmkb' ]
+    nyu_ids = [ entry_id for source, entry_id, text, citations in rows if source == 'nyu_interpretation' ]
+    genes = {}
+    for id, gene in PMKBLookup.objects.filter(interpretation_id__in = pmkb_ids).order_by('gene').values_list('interpretation_id', 'gene').distinct():
+        genes.setdefault(('pmkb', id), []).append(gene)
+    for id, nyu_genes in NYUInterpretation.objects.filter(id__in = nyu_ids).values_list('id', 'genes'):
+        genes[('nyu_interpretation', id)] = nyu_genes.split()
+    for source, entry_id, text, citations in rows:
+        results['results'].append({
+        'source': source,
+        'id': entry_id,
+        'genes': genes.get((source, entry_id), []),
+        'interpretation': snippet_html(text),
+        'citations': snippet_html(citations)
+        })
+    return(results)
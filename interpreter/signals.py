@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Signal handlers that keep derived data in sync with the knowledge base tables
+
+The handlers update the derived tables one row at a time, which suits edits from the admin; bulk imports run inside
+``suspend_kb_signals()``, which rebuilds the derived tables and increments the knowledge base version once at the end.
+"""
+import threading
+import functools
+from contextlib import contextmanager
+from django.db.models.signals import post_save, post_delete
+from .models import PMKBVariant, PMKBVariantRule, FusionPair, PMKBLookup, PMKBInterpretation, NYUTier, NYUInterpretation, TumorType, TissueType, GeneSynonym
+from .cache import bump_kb_version
+from .rules import make_rule_entry, compile_pmkb_rules
+from .fusions import update_fusion_entry, compile_fusion_pairs
+from .lookup import update_lookup_entries, compile_pmkb_lookup
+from .search import update_search_entry, remove_search_entry, compile_search_index
+from .type_lists import clear_type_lists
+
+# models whose entries are included in cached interpretation results
+knowledge_base_models = [ PMKBVariant, PMKBInterpretation, NYUTier, NYUInterpretation, TumorType, TissueType, GeneSynonym ]
+
+# the derived tables to rebuild after the entries of a model change in bulk, in order
+derived_tables = [
+    (compile_pmkb_rules, [PMKBVariant]),
+    (compile_fusion_pairs, [PMKBVariant, NYUInterpretation]),
+    (compile_pmkb_lookup, [PMKBVariant, PMKBInterpretation, TumorType, TissueType]),
+    (compile_search_index, [PMKBInterpretation, NYUInterpretation])
+    ]
+
+# the models changed by this thread while the signal handlers are suspended, None when they are not
+_suspended = threading.local()
+
+def suspendable(handler):
+    """
+    Skips a signal handler while ``suspend_kb_signals()`` is active, recording the model of the entry instead
+    """
+    @functools.wraps(handler)
+    def wrapper(sender, **kwargs):
+        changed = getattr(_suspended, 'changed', None)
+        if changed is not None:
+            changed.add(sender)
+            return
+        return(handler(sender, **kwargs))
+    return(wrapper)
+
+def rebuild_derived_tables(models):
+    """
+    Rebuilds the derived tables of the models that changed, then increments the knowledge base version once
+    """
+    models = set(models)
+    for compile_table, sources in derived_tables:
+        if models.intersection(sources):
+            compile_table()
+    if models:
+        bump_kb_version()
+        clear_type_lists()
+
+def kb_changed(*models):
+    """
+    Records the models whose entries were changed without sending signals, e.g. by ``bulk_create()``; their derived
+    tables are rebuilt now, or at the end of ``suspend_kb_signals()`` if it is active
+    """
+    changed = getattr(_suspended, 'changed', None)
+    if changed is not None:
+        changed.update(models)
+    else:
+        rebuild_derived_tables(models)
+
+@contextmanager
+def suspend_kb_signals():
+    """
+    Suspends the per-row signal handlers, e.g. while ``importer.py`` saves thousands of entries, and rebuilds the
+    derived tables of the models that changed and increments the knowledge base version once at the end
+
+    Examples
+    --------
+    Example usage::
+
+        with suspend_kb_signals():
+            for row in rows:
+                NYUTier.objects.get_or_create(**row)
+
+    """
+    if getattr(_suspended, 'changed', None) is not None:
+        # already suspended by an outer block, which rebuilds the tables
+        yield
+        return
+    _suspended.changed = set()
+    try:
+        yield
+    finally:
+        changed = _suspended.changed
+        _suspended.changed = None
+        rebuild_derived_tables(changed)
+
+@suspendable
+def compile_variant_rule(sender, instance, **kwargs):
+    """
+    Recompile the rule for a PMKB variant whenever it is saved
+    """
+    PMKBVariantRule.objects.filter(variant = instance).delete()
+    make_rule_entry(instance).save()
+
+@suspendable
+def index_pmkb_fusion(sender, instance, **kwargs):
+    """
+    Update the fusion pair for a PMKB variant whenever it is saved
+    """
+    update_fusion_entry('pmkb', instance.id, instance.variant)
+
+@suspendable
+def index_nyu_fusion(sender, instance, **kwargs):
+    """
+    Update the fusion pair for an NYU interpretation whenever it is saved
+    """
+    update_fusion_entry('nyu_interpretation', instance.id, instance.genes)
+
+@suspendable
+def remove_fusion(sender, instance, **kwargs):
+    """
+    Remove the fusion pair for a deleted PMKB variant or NYU interpretation
+    """
+    source = 'pmkb' if sender is PMKBVariant else 'nyu_interpretation'
+    FusionPair.objects.filter(source = source, entry_id = instance.id).delete()
+
+@suspendable
+def update_pmkb_lookup(sender, instance, **kwargs):
+    """
+    Update the lookup entry for a PMKB variant whenever it is saved or deleted
+    """
+    update_lookup_entries([instance.id])
+
+@suspendable
+def update_lookup_interpretation(sender, instance, **kwargs):
+    """
+    Update the lookup entries of the variants of a PMKB interpretation whenever it is saved or deleted
+    """
+    variant_ids = list(PMKBLookup.objects.filter(interpretation_id = instance.id).values_list('variant_id', flat = True))
+    update_lookup_entries(variant_ids)
+
+@suspendable
+def update_lookup_types(sender, instance, **kwargs):
+    """
+    Update the lookup entries of the variants with a tumor or tissue type whenever it is saved or deleted
+    """
+    field = 'tumor_id' if sender is TumorType else 'tissue_id'
+    variant_ids = list(PMKBLookup.objects.filter(**{field: instance.id}).values_list('variant_id', flat = True))
+    update_lookup_entries(variant_ids)
+
+@suspendable
+def index_interpretation(sender, instance, **kwargs):
+    """
+    Update the full-text search entry for a PMKB or NYU interpretation whenever it is saved
+    """
+    source = 'pmkb' if sender is PMKBInterpretation else 'nyu_interpretation'
+    update_search_entry(source, instance.id, instance.interpretation, instance.citations)
+
+@suspendable
+def remove_interpretation(sender, instance, **kwargs):
+    """
+    Remove the full-text search entry for a deleted PMKB or NYU interpretation
+    """
+    source = 'pmkb' if sender is PMKBInterpretation else 'nyu_interpretation'
+    remove_search_entry(source, instance.id)
+
+@suspendable
+def knowledge_base_changed(sender, **kwargs):
+    """
+    Increment the knowledge base version whenever an entry is saved or deleted, e.g. from the admin
+    """
+    bump_kb_version()
+    clear_type_lists()
+
+# connected first, so the rules, fusion pairs, lookup entries, and search entries are up to date before the knowledge base version changes
+post_save.connect(compile_variant_rule, sender = PMKBVariant, dispatch_uid = 'pmkb_variant_rule_save')
+post_save.connect(index_pmkb_fusion, sender = PMKBVariant, dispatch_uid = 'pmkb_fusion_save')
+post_save.connect(index_nyu_fusion, sender = NYUInterpretation, dispatch_uid = 'nyu_interpretation_fusion_save')
+post_delete.connect(remove_fusion, sender = PMKBVariant, dispatch_uid = 'pmkb_fusion_delete')
+post_delete.connect(remove_fusion, sender = NYUInterpretation, dispatch_uid = 'nyu_interpretation_fusion_delete')
+post_save.connect(update_pmkb_lookup, sender = PMKBVariant, dispatch_uid = 'pmkb_lookup_save')
+post_delete.connect(update_pmkb_lookup, sender = PMKBVariant, dispatch_uid = 'pmkb_lookup_delete')
+post_save.connect(update_lookup_interpretation, sender = PMKBInterpretation, dispatch_uid = 'pmkb_lookup_interpretation_save')
+post_delete.connect(update_lookup_interpretation, sender = PMKBInterpretation, dispatch_uid = 'pmkb_lookup_interpretation_delete')
+for model in [PMKBInterpretation, NYUInterpretation]:
+    post_save.connect(index_interpretation, sender = model, dispatch_uid = 'search_save_{0}'.format(model.__name__))
+    post_delete.connect(remove_interpretation, sender = model, dispatch_uid = 'search_delete_{0}'.format(model.__name__))
+for model in [TumorType, TissueType]:
+    post_save.connect(update_lookup_types, sender = model, dispatch_uid = 'pmkb_lookup_save_{0}'.format(model.__name__))
+    post_delete.connect(update_lookup_types, sender = model, dispatch_uid = 'pmkb_lookup_delete_{0}'.format(model.__name__))
+
+for model in knowledge_base_models:
+    post_save.connect(knowledge_base_changed, sender = model, dispatch_uid = 'kb_version_save_{0}'.format(model.__name__))
+    post_delete.connect(knowledge_base_changed, sender = model, dispatch_uid = 'kb_version_delete_{0}'.format(model.__name__))
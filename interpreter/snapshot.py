@@ -0,0 +1,582 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compile the knowledge base into a compact, read-only snapshot file that can be shared by all app workers
+
+All strings are interned into a single UTF-8 blob with an offset array, and all entries are stored as columns of
+integer codes pointing into the string table. Workers ``mmap`` the file read-only, so that every worker on the host
+shares the same page cache copy of the knowledge base instead of holding its own ORM objects.
+
+File layout::
+
+    b'IRKB' | uint32 format version | uint32 header length | JSON header | padding | sections...
+
+Each section is an array of little-endian int32 values, or raw bytes for the string data, at the offset and length
+listed in the header.
+"""
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import argparse
+import logging
+import threading
+from collections import namedtuple, defaultdict, OrderedDict
+import django
+
+logger = logging.getLogger()
+
+# import app from top level directory
+parentdir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webapp.settings")
+django.setup()
+from django.conf import settings
+from django.db import connections
+from interpreter.models import PMKBVariant, PMKBInterpretation, NYUTier, NYUInterpretation, TumorType, TissueType
+from interpreter.cache import get_kb_version
+from interpreter.kb_builds import served_snapshot_path
+from interpreter.variants import variant_key_str
+sys.path.pop(0)
+
+MAGIC = b'IRKB'
+FORMAT_VERSION = 2
+ALIGNMENT = 8
+
+# columns stored for each table in the snapshot
+pmkb_variant_columns = ['id', 'gene', 'tumor_type', 'tissue_type', 'variant', 'tier', 'interpretation', 'source_row', 'protein_key']
+pmkb_interpretation_columns = ['id', 'interpretation', 'citations', 'source_row']
+nyu_tier_columns = ['id', 'gene', 'variant_type', 'tumor_type', 'tissue_type', 'coding', 'protein', 'tier', 'comment', 'protein_key', 'coding_key']
+nyu_interpretation_columns = ['id', 'variant', 'variant_type', 'genes', 'genes_json', 'tumor_type', 'tissue_type', 'interpretation', 'citations']
+
+class SnapshotType(namedtuple('SnapshotType', ['id', 'type'])):
+    """
+    Tumor or tissue type entry from a snapshot, mirroring the ``TumorType`` and ``TissueType`` models
+    """
+    __slots__ = ()
+    def __str__(self):
+        return(str(self.type))
+
+class SnapshotPMKBInterpretation(namedtuple('SnapshotPMKBInterpretation', pmkb_interpretation_columns)):
+    """
+    PMKB interpretation entry from a snapshot, mirroring the ``PMKBInterpretation`` model
+    """
+    __slots__ = ()
+    def __hash__(self):
+        return(hash(self.id))
+    def __eq__(self, other):
+        return(isinstance(other, SnapshotPMKBInterpretation) and self.id == other.id)
+
+class SnapshotPMKBVariant(namedtuple('SnapshotPMKBVariant', pmkb_variant_columns)):
+    """
+    PMKB variant entry from a snapshot, mirroring the ``PMKBVariant`` model
+    """
+    __slots__ = ()
+    def __hash__(self):
+        return(hash(self.id))
+    def __eq__(self, other):
+        return(isinstance(other, SnapshotPMKBVariant) and self.id == other.id)
+
+class SnapshotNYUTier(namedtuple('SnapshotNYUTier', nyu_tier_columns)):
+    """
+    NYU tier entry from a snapshot, mirroring the ``NYUTier`` model
+    """
+    __slots__ = ()
+    def __hash__(self):
+        return(hash(self.id))
+    def __eq__(self, other):
+        return(isinstance(other, SnapshotNYUTier) and self.id == other.id)
+
+class SnapshotNYUInterpretation(namedtuple('SnapshotNYUInterpretation', nyu_interpretation_columns)):
+    """
+    NYU interpretation entry from a snapshot, mirroring the ``NYUInterpretation`` model
+    """
+    __slots__ = ()
+    def __hash__(self):
+        return(hash(self.id))
+    def __eq__(self, other):
+        return(isinstance(other, SnapshotNYUInterpretation) and self.id == other.id)
+
+class StringTable(object):
+    """
+    Interns strings for the snapshot compiler; each unique string is stored once and referred to by its integer id
+    """
+    def __init__(self):
+        self.ids = OrderedDict()
+
+    def intern(self, value):
+        """
+        Get the id for a string, adding it to the table if needed
+        """
+        if value is None:
+            value = ''
+        value = str(value)
+        if value not in self.ids:
+            self.ids[value] = len(self.ids)
+        return(self.ids[value])
+
+    def encode(self):
+        """
+        Encode the table as an array of offsets and a blob of UTF-8 string data
+
+        Returns
+        -------
+        tuple
+            ``(offsets, data)``; string ``i`` is ``data[offsets[i]:offsets[i + 1]]``
+        """
+        offsets = array.array('i', [0])
+        chunks = []
+        total = 0
+        for value in self.ids.keys():
+            encoded = value.encode('utf-8')
+            chunks.append(encoded)
+            total += len(encoded)
+            offsets.append(total)
+        return(offsets, b''.join(chunks))
+
+def sort_by_gene(rows, gene_column):
+    """
+    Sort table rows by gene and id, and build the gene index mapping each gene to its range of rows
+
+    Returns
+    -------
+    tuple
+        ``(rows, index)``, where ``index`` is a dict of ``{gene: [start, end]}``
+    """
+    rows = sorted(rows, key = lambda x: (x[gene_column], x['id']))
+    index = OrderedDict()
+    for i, row in enumerate(rows):
+        gene = row[gene_column]
+        if gene not in index:
+            index[gene] = [i, i]
+        index[gene][1] = i + 1
+    return(rows, index)
+
+def compile_snapshot(output):
+    """
+    Compile the knowledge base database tables into a snapshot file.
+
+    The file is written to a temporary path first and then moved into place, so workers never see a partial file.
+
+    Parameters
+    ----------
+    output: str
+        path to write the snapshot file to
+
+    Returns
+    -------
+    dict
+        the header of the snapshot file
+    """
+    strings = StringTable()
+    sections = OrderedDict()
+
+    def add_columns(prefix, rows, columns, string_columns):
+        for column in columns:
+            if column in string_columns:
+                values = [ strings.intern(row[column]) for row in rows ]
+            else:
+                values = [ int(row[column]) if row[column] is not None else -1 for row in rows ]
+            sections['{0}_{1}'.format(prefix, column)] = array.array('i', values)
+
+    # tumor and tissue types are referred to by the string id of their name
+    tumor_types = { x['id']: x['type'] for x in TumorType.objects.values('id', 'type') }
+    tissue_types = { x['id']: x['type'] for x in TissueType.objects.values('id', 'type') }
+
+    # PMKB interpretations; variants refer to them by row number in the snapshot
+    interpretations = list(PMKBInterpretation.objects.order_by('id').values(*pmkb_interpretation_columns))
+    interpretation_rows = { row['id']: i for i, row in enumerate(interpretations) }
+    add_columns('pmkb_interpretation', interpretations, pmkb_interpretation_columns, ['interpretation', 'citations'])
+
+    # PMKB variants
+    variants = []
+    for row in PMKBVariant.objects.values('id', 'gene', 'tumor_type_id', 'tissue_type_id', 'variant', 'tier', 'interpretation_id', 'source_row', 'protein_key'):
+        variants.append({
+        'id': row['id'],
+        'gene': row['gene'],
+        'tumor_type': tumor_types[row['tumor_type_id']],
+        'tissue_type': tissue_types[row['tissue_type_id']],
+        'variant': row['variant'],
+        'tier': row['tier'],
+        'interpretation': interpretation_rows.get(row['interpretation_id'], -1),
+        'source_row': row['source_row'],
+        'protein_key': row['protein_key']
+        })
+    variants, pmkb_index = sort_by_gene(variants, 'gene')
+    add_columns('pmkb_variant', variants, pmkb_variant_columns, ['gene', 'tumor_type', 'tissue_type', 'variant', 'protein_key'])
+
+    # NYU tiers
+    tiers = []
+    for row in NYUTier.objects.values('id', 'gene', 'variant_type', 'tumor_type_id', 'tissue_type_id', 'coding', 'protein', 'tier', 'comment', 'protein_key', 'coding_key'):
+        row['tumor_type'] = tumor_types[row.pop('tumor_type_id')]
+        row['tissue_type'] = tissue_types[row.pop('tissue_type_id')]
+        tiers.append(row)
+    tiers, tier_index = sort_by_gene(tiers, 'gene')
+    add_columns('nyu_tier', tiers, nyu_tier_columns, ['gene', 'variant_type', 'tumor_type', 'tissue_type', 'coding', 'protein', 'comment', 'protein_key', 'coding_key'])
+
+    # NYU interpretations; indexed by each gene in their gene list
+    nyu_interpretations = []
+    nyu_index = defaultdict(list)
+    for row in NYUInterpretation.objects.order_by('id').values('id', 'variant', 'variant_type', 'genes', 'genes_json', 'tumor_type_id', 'tissue_type_id', 'interpretation', 'citations'):
+        row['tumor_type'] = tumor_types[row.pop('tumor_type_id')]
+        row['tissue_type'] = tissue_types[row.pop('tissue_type_id')]
+        for gene in json.loads(row['genes_json']):
+            nyu_index[gene].append(len(nyu_interpretations))
+        nyu_interpretations.append(row)
+    add_columns('nyu_interpretation', nyu_interpretations, nyu_interpretation_columns,
+        ['variant', 'variant_type', 'genes', 'genes_json', 'tumor_type', 'tissue_type', 'interpretation', 'citations'])
+
+    # intern the type names so they can be used as filters
+    tumor_type_ids = { name: strings.intern(name) for name in tumor_types.values() }
+    tissue_type_ids = { name: strings.intern(name) for name in tissue_types.values() }
+
+    offsets, string_data = strings.encode()
+    sections['string_offsets'] = offsets
+    sections['string_data'] = string_data
+
+    header = {
+    'kb_version': get_kb_version(),
+    'database': str(connections['knowledge_base'].settings_dict['NAME']),
+    'counts': {
+        'strings': len(strings.ids),
+        'pmkb_variants': len(variants),
+        'pmkb_interpretations': len(interpretations),
+        'nyu_tiers': len(tiers),
+        'nyu_interpretations': len(nyu_interpretations)
+        },
+    'tumor_types': tumor_type_ids,
+    'tissue_types': tissue_type_ids,
+    'pmkb_index': pmkb_index,
+    'nyu_tier_index': tier_index,
+    'nyu_interpretation_index': nyu_index,
+    'sections': OrderedDict()
+    }
+
+    # lay out the sections after the header; the header size depends on the section offsets, so iterate until it is stable
+    section_bytes = OrderedDict()
+    for name, values in sections.items():
+        if isinstance(values, array.array):
+            if sys.byteorder != 'little':
+                values.byteswap()
+            section_bytes[name] = values.tobytes()
+        else:
+            section_bytes[name] = values
+    data_start = 0
+    while True:
+        position = data_start
+        for name, data in section_bytes.items():
+            header['sections'][name] = [position, len(data)]
+            position += len(data) + (-len(data) % ALIGNMENT)
+        header_bytes = json.dumps(header).encode('utf-8')
+        prefix_size = len(MAGIC) + 8 + len(header_bytes)
+        new_data_start = prefix_size + (-prefix_size % ALIGNMENT)
+        if new_data_start == data_start:
+            break
+        data_start = new_data_start
+
+    tmp_output = output + '.tmp'
+    with open(tmp_output, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<II', FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b'\0' * (data_start - prefix_size))
+        for name, data in section_bytes.items():
+            f.write(data)
+            f.write(b'\0' * (-len(data) % ALIGNMENT))
+    os.replace(tmp_output, output)
+    logger.info("wrote knowledge base snapshot {0} ({1} bytes, {2} PMKB variants)".format(output, os.path.getsize(output), len(variants)))
+    return(header)
+
+class KnowledgeBaseSnapshot(object):
+    """
+    Read-only view of a compiled knowledge base snapshot file
+
+    Lookups return lightweight immutable entries with the same attributes as the database models, so they can be
+    used in place of query results in the interpretations and the report templates.
+
+    Parameters
+    ----------
+    path: str
+        path to the snapshot file
+
+    Examples
+    --------
+    Example usage::
+
+        snapshot = KnowledgeBaseSnapshot('db/interpreter.snapshot')
+        snapshot.pmkb_variants('NRAS', tissue_type = 'Lung')
+        snapshot.close()
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.stat = os.fstat(self.file.fileno())
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("not a knowledge base snapshot file: {0}".format(path))
+        format_version, header_size = struct.unpack('<II', self.mmap[len(MAGIC):len(MAGIC) + 8])
+        if format_version != FORMAT_VERSION:
+            self.close()
+            raise ValueError("unsupported snapshot format version {0}: {1}".format(format_version, path))
+        header_start = len(MAGIC) + 8
+        self.header = json.loads(self.mmap[header_start:header_start + header_size].decode('utf-8'))
+        self.kb_version = self.header['kb_version']
+        self.database = self.header['database']
+        # zero-copy views of each section
+        self.buffer = memoryview(self.mmap)
+        self.sections = {}
+        for name, (offset, length) in self.header['sections'].items():
+            view = self.buffer[offset:offset + length]
+            if name != 'string_data':
+                view = view.cast('i')
+            self.sections[name] = view
+        self.string_offsets = self.sections['string_offsets']
+        self.string_data = self.sections['string_data']
+
+    def close(self):
+        """
+        Release the memory map and the file
+        """
+        for view in getattr(self, 'sections', {}).values():
+            view.release()
+        self.sections = {}
+        self.string_offsets = None
+        self.string_data = None
+        if getattr(self, 'buffer', None) is not None:
+            self.buffer.release()
+            self.buffer = None
+        self.mmap.close()
+        self.file.close()
+
+    def string(self, string_id):
+        """
+        Decode a string from the string table
+        """
+        start = self.string_offsets[string_id]
+        end = self.string_offsets[string_id + 1]
+        return(bytes(self.string_data[start:end]).decode('utf-8'))
+
+    def type_id(self, kind, name):
+        """
+        Get the string id for a tumor or tissue type name, for filtering
+
+        Returns
+        -------
+        int
+            the string id, None if no filtering should be done, or -1 if the type is not in the snapshot
+        """
+        if not name or name == 'Any':
+            return(None)
+        return(self.header[kind].get(name, -1))
+
+    def column(self, table, column, row):
+        """
+        Get the raw integer value of a column for a row in a table
+        """
+        return(self.sections['{0}_{1}'.format(table, column)][row])
+
+    def rows(self, table, index, gene, tissue_type = None, tumor_type = None):
+        """
+        Get the row numbers for a gene in a table, filtered by tissue and tumor type
+        """
+        rows = self.header[index].get(gene, [])
+        if index != 'nyu_interpretation_index':
+            rows = range(*rows) if rows else []
+        tissue_id = self.type_id('tissue_types', tissue_type)
+        tumor_id = self.type_id('tumor_types', tumor_type)
+        results = []
+        for row in rows:
+            if tissue_id is not None and self.column(table, 'tissue_type', row) != tissue_id:
+                continue
+            if tumor_id is not None and self.column(table, 'tumor_type', row) != tumor_id:
+                continue
+            results.append(row)
+        return(results)
+
+    def make_type(self, string_id):
+        return(SnapshotType(id = string_id, type = self.string(string_id)))
+
+    def pmkb_interpretation(self, row):
+        """
+        Get the PMKB interpretation entry at a row of the snapshot
+        """
+        if row < 0:
+            return(None)
+        return(SnapshotPMKBInterpretation(
+            id = self.column('pmkb_interpretation', 'id', row),
+            interpretation = self.string(self.column('pmkb_interpretation', 'interpretation', row)),
+            citations = self.string(self.column('pmkb_interpretation', 'citations', row)),
+            source_row = self.column('pmkb_interpretation', 'source_row', row)
+            ))
+
+    def pmkb_variants(self, gene, tissue_type = None, tumor_type = None, variant = None):
+        """
+        Get the PMKB variant entries for a gene
+
+        Returns
+        -------
+        list
+            a list of ``SnapshotPMKBVariant``
+        """
+        results = []
+        interpretations = {}
+        key = variant_key_str(gene, variant) if variant else ''
+        for row in self.rows('pmkb_variant', 'pmkb_index', gene, tissue_type = tissue_type, tumor_type = tumor_type):
+            variant_name = self.string(self.column('pmkb_variant', 'variant', row))
+            protein_key = self.string(self.column('pmkb_variant', 'protein_key', row))
+            if key and protein_key != key:
+                continue
+            if variant and not key and variant_name != variant:
+                continue
+            interpretation_row = self.column('pmkb_variant', 'interpretation', row)
+            if interpretation_row not in interpretations:
+                interpretations[interpretation_row] = self.pmkb_interpretation(interpretation_row)
+            results.append(SnapshotPMKBVariant(
+                id = self.column('pmkb_variant', 'id', row),
+                gene = gene,
+                tumor_type = self.make_type(self.column('pmkb_variant', 'tumor_type', row)),
+                tissue_type = self.make_type(self.column('pmkb_variant', 'tissue_type', row)),
+                variant = variant_name,
+                tier = self.column('pmkb_variant', 'tier', row),
+                interpretation = interpretations[interpretation_row],
+                source_row = self.column('pmkb_variant', 'source_row', row),
+                protein_key = protein_key
+                ))
+        return(results)
+
+    def nyu_tiers(self, gene, tissue_type = None, tumor_type = None, variant = None):
+        """
+        Get the NYU tier entries for a gene
+
+        Returns
+        -------
+        list
+            a list of ``SnapshotNYUTier``
+        """
+        results = []
+        key = variant_key_str(gene, variant) if variant else ''
+        for row in self.rows('nyu_tier', 'nyu_tier_index', gene, tissue_type = tissue_type, tumor_type = tumor_type):
+            entry = SnapshotNYUTier(
+                id = self.column('nyu_tier', 'id', row),
+                gene = gene,
+                variant_type = self.string(self.column('nyu_tier', 'variant_type', row)),
+                tumor_type = self.make_type(self.column('nyu_tier', 'tumor_type', row)),
+                tissue_type = self.make_type(self.column('nyu_tier', 'tissue_type', row)),
+                coding = self.string(self.column('nyu_tier', 'coding', row)),
+                protein = self.string(self.column('nyu_tier', 'protein', row)),
+                tier = self.column('nyu_tier', 'tier', row),
+                comment = self.string(self.column('nyu_tier', 'comment', row)),
+                protein_key = self.string(self.column('nyu_tier', 'protein_key', row)),
+                coding_key = self.string(self.column('nyu_tier', 'coding_key', row))
+                )
+            if key and key not in (entry.protein_key, entry.coding_key):
+                continue
+            if variant and not key and variant not in (entry.protein, entry.coding):
+                continue
+            results.append(entry)
+        return(results)
+
+    def nyu_interpretations(self, gene, tissue_type = None, tumor_type = None, variant = None):
+        """
+        Get the NYU interpretation entries that include a gene
+
+        Returns
+        -------
+        list
+            a list of ``SnapshotNYUInterpretation``
+        """
+        results = []
+        for row in self.rows('nyu_interpretation', 'nyu_interpretation_index', gene, tissue_type = tissue_type, tumor_type = tumor_type):
+            variant_name = self.string(self.column('nyu_interpretation', 'variant', row))
+            if variant and variant_name != variant:
+                continue
+            results.append(SnapshotNYUInterpretation(
+                id = self.column('nyu_interpretation', 'id', row),
+                variant = variant_name,
+                variant_type = self.string(self.column('nyu_interpretation', 'variant_type', row)),
+                genes = self.string(self.column('nyu_interpretation', 'genes', row)),
+                genes_json = self.string(self.column('nyu_interpretation', 'genes_json', row)),
+                tumor_type = self.make_type(self.column('nyu_interpretation', 'tumor_type', row)),
+                tissue_type = self.make_type(self.column('nyu_interpretation', 'tissue_type', row)),
+                interpretation = self.string(self.column('nyu_interpretation', 'interpretation', row)),
+                citations = self.string(self.column('nyu_interpretation', 'citations', row))
+                ))
+        return(results)
+
+_snapshot = None
+_active = False
+_snapshot_lock = threading.Lock()
+def activate_snapshot(kb_version, path = None):
+    """
+    Load the snapshot file configured in the settings, and mark it as active if it was built from the current knowledge base.
+
+    The snapshot is reloaded if the file has been replaced since it was last loaded.
+    Snapshots built from an older knowledge base version or a different database are ignored, so that stale data is never served.
+
+    Parameters
+    ----------
+    kb_version: int
+        the current knowledge base version
+    path: str
+        path to the snapshot file, defaults to the snapshot of the build being served, or ``settings.INTERPRETER_SNAPSHOT``
+
+    Returns
+    -------
+    KnowledgeBaseSnapshot
+        the active snapshot, or None if no usable snapshot is available
+    """
+    global _snapshot, _active
+    if path is None:
+        path = served_snapshot_path()
+    with _snapshot_lock:
+        if not path or not os.path.exists(path):
+            _active = False
+            return(None)
+        stat = os.stat(path)
+        if _snapshot is None or _snapshot.path != path or (_snapshot.stat.st_ino, _snapshot.stat.st_mtime) != (stat.st_ino, stat.st_mtime):
+            # the old mapping is left for the garbage collector, in case entries from it are still being used
+            logger.info("loading knowledge base snapshot {0}".format(path))
+            _snapshot = KnowledgeBaseSnapshot(path)
+        database = str(connections['knowledge_base'].settings_dict['NAME'])
+        _active = _snapshot.kb_version == kb_version and _snapshot.database == database
+        if not _active:
+            logger.warning("knowledge base snapshot {0} is out of date (version {1}, current version {2}); using the database".format(path, _snapshot.kb_version, kb_version))
+            return(None)
+        return(_snapshot)
+
+def get_snapshot():
+    """
+    Get the active knowledge base snapshot, if any
+
+    Returns
+    -------
+    KnowledgeBaseSnapshot
+        the snapshot loaded by ``activate_snapshot``, or None if it is not usable
+    """
+    if _active:
+        return(_snapshot)
+    return(None)
+
+def main(**kwargs):
+    """
+    Main control function for the module.
+    """
+    output = kwargs.pop('output', getattr(settings, 'INTERPRETER_SNAPSHOT', None))
+    header = compile_snapshot(output = output)
+    print(json.dumps(header['counts']))
+
+def parse():
+    """
+    Parses script args.
+    """
+    parser = argparse.ArgumentParser(description='Compile the knowledge base into a snapshot file shared by the app workers')
+    parser.add_argument("--output", default = getattr(settings, 'INTERPRETER_SNAPSHOT', None), dest = 'output', help="Path to the snapshot file to write")
+    args = parser.parse_args()
+    main(**vars(args))
+
+if __name__ == '__main__':
+    parse()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module with the registry of the knowledge sources that IR records are interpreted against
+
+Each source is an ``InterpretationSource`` with a batched ``lookup`` over the gene lists of many records, and hooks for
+the importer types that load it (``import_types``), the indexes it is matched with (``build_index``), fetching the
+entries for many genes at once (``prefetch``), and its per-report cache (``make_cache``). The report looks up and renders
+every registered source, in the order they were registered, unless only some of them are requested.
+
+A new source subclasses ``InterpretationSource``, implements ``query``, and is added with ``register_source``; its
+results are added to each record's ``interpretations`` under its ``name``, and rendered with its ``template``.
+"""
+import os
+import sys
+import django
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+# import app from top level directory
+parentdir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webapp.settings")
+django.setup()
+import interpreter.interpret as interpret
+from interpreter.rules import record_features, get_rule_matcher
+from interpreter.fusions import get_fusion_index
+sys.path.pop(0)
+
+class InterpretationSource(ABC):
+    """
+    A knowledge source that IR records are interpreted against
+
+    Attributes
+    ----------
+    name: str
+        the key for the source's results in each record's ``interpretations``
+    label: str
+        the name of the source in the report and the logs
+    template: str
+        the template that renders a record's results for the source, passed as 'results'
+    import_types: tuple
+        the ``importer.py`` types that load the source into the knowledge base, in order
+    """
+    name = None
+    label = None
+    template = 'sources/generic.html'
+    import_types = ()
+
+    @abstractmethod
+    def query(self, genes, **params):
+        """
+        Get the results for a single list of genes; ``params`` has the 'tissue_type', 'tumor_type', and 'variant'
+        filters, the params from ``build_index``, and the record's params from ``record_params``
+        """
+
+    def record_params(self, record, match_variants = False, variant = None):
+        """
+        Get the params for looking up a single record, e.g. its protein change; records with the same genes and params
+        share their results
+        """
+        return({'variant': variant})
+
+    def build_index(self, kb_version, match_variants = False):
+        """
+        Get the indexes the source is matched with for the current knowledge base version, passed to every ``query``
+        """
+        return({})
+
+    def prefetch(self, genes, tissue_type = None, tumor_type = None):
+        """
+        Load the entries for many genes at once into the cross-request interpretation cache, before they are queried one
+        gene list at a time
+        """
+        pass
+
+    def uses_prefetch(self, record_params):
+        """
+        Whether the results for a record with the ``record_params`` are read from the entries loaded by ``prefetch``;
+        the genes of the other records are not prefetched
+        """
+        return(True)
+
+    def make_cache(self):
+        """
+        Make the cache that the results of the source are memoized in for a single report
+        """
+        return(interpret.QueryCache(name = self.label))
+
+    def lookup(self, gene_sets, tissue_type = None, tumor_type = None, params = None, cache = None, match_variants = False):
+        """
+        Get the results for many lists of genes at once
+
+        The genes of the lists that are not in ``cache`` yet are prefetched together (see ``uses_prefetch``), and then each
+        distinct list of genes and params is queried once.
+
+        Parameters
+        ----------
+        gene_sets: list
+            a list of genes for each record
+        tissue_type: str
+            tissue type to filter the results by
+        tumor_type: str
+            tumor type to filter the results by
+        params: list
+            the ``record_params`` for each list of genes; None for no params
+        cache: QueryCache
+            the cache to share the results in, e.g. across the chunks of a report; a new one is used if none is passed
+        match_variants: bool
+            passed to ``build_index``
+
+        Returns
+        -------
+        list
+            the results for each list of genes
+        """
+        if cache is None:
+            cache = self.make_cache()
+        if params is None:
+            params = [ {} for gene_set in gene_sets ]
+        # drop any cross-request cached results and snapshots from an older version of the knowledge base
+        kb_version = interpret.check_knowledge_base()
+        index = self.build_index(kb_version, match_variants = match_variants)
+        missing = set()
+        for genes, record_params in zip(gene_sets, params):
+            if cache.make_key(genes, tissue_type = tissue_type, tumor_type = tumor_type, **record_params) not in cache.results and self.uses_prefetch(record_params):
+                missing.update(genes)
+        if missing:
+            self.prefetch(sorted(missing), tissue_type = tissue_type, tumor_type = tumor_type)
+        results = []
+        for genes, record_params in zip(gene_sets, params):
+            query_params = dict(index, **record_params)
+            results.append(cache.query(self.query, genes = genes, tissue_type = tissue_type, tumor_type = tumor_type, **query_params))
+        return(results)
+
+    def interpret(self, ir_table, tissue_type = None, tumor_type = None, variant = None, match_variants = False, cache = None):
+        """
+        Adds the results of the source to each record in an IRTable, under ``name`` in the record's ``interpretations``
+
+        Returns
+        -------
+        IRTable
+            the original `ir_table` object, with the results added
+        """
+        logger.debug("looking up {0} results for {1} records".format(self.label, len(ir_table.records)))
+        results = self.lookup(
+            gene_sets = [ record.genes for record in ir_table.records ],
+            tissue_type = tissue_type,
+            tumor_type = tumor_type,
+            params = [ self.record_params(record, match_variants = match_variants, variant = variant) for record in ir_table.records ],
+            cache = cache,
+            match_variants = match_variants)
+        for record, result in zip(ir_table.records, results):
+            record.interpretations[self.name] = result
+        return(ir_table)
+
+class PMKBSource(InterpretationSource):
+    """
+    PMKB interpretations; with 'match_variants', each record is only matched to the variants whose compiled rules fire
+    for the record, and fusion records to the variants for the same pair of partner genes if there are any
+    """
+    name = 'pmkb'
+    label = 'PMKB'
+    template = 'sources/pmkb.html'
+    import_types = ('PMKB',)
+
+    def query(self, genes, **params):
+        return(interpret.query_pmkb(genes, **params))
+
+    def record_params(self, record, match_variants = False, variant = None):
+        if not match_variants:
+            return({'variant': variant})
+        return({'variant': variant, 'features': record_features(record), 'fusion': interpret.fusion_pair(record)})
+
+    def build_index(self, kb_version, match_variants = False):
+        if not match_variants:
+            return({})
+        return({'matcher': get_rule_matcher(kb_version), 'fusion_index': get_fusion_index(kb_version)})
+
+    def prefetch(self, genes, tissue_type = None, tumor_type = None):
+        interpret.fetch_pmkb_genes(genes, tissue_type = tissue_type, tumor_type = tumor_type)
+
+class NYUTierSource(InterpretationSource):
+    """
+    NYU tiers; with 'match_variants', each record is only matched to the tiers with the same normalized protein change,
+    or coding change if the record has no protein change
+    """
+    name = 'nyu_tier'
+    label = 'NYU tier'
+    template = 'sources/nyu_tier.html'
+    import_types = ('nyu_tier',)
+
+    def query(self, genes, **params):
+        return(interpret.query_nyu_tier(genes, **params))
+
+    def record_params(self, record, match_variants = False, variant = None):
+        if match_variants and (record.protein_change or record.coding_change):
+            variant = record.protein_change or record.coding_change
+        return({'variant': variant})
+
+    def prefetch(self, genes, tissue_type = None, tumor_type = None):
+        interpret.prefetch_nyu_tiers(genes, tissue_type = tissue_type, tumor_type = tumor_type)
+
+    def uses_prefetch(self, record_params):
+        # the tiers for a variant are queried by its normalized key, not read from the tiers prefetched for the whole gene
+        return(record_params.get('variant') is None)
+
+class NYUInterpretationSource(InterpretationSource):
+    """
+    NYU interpretations, which are not tied to specific variants; with 'match_variants', fusion records are only matched
+    to the interpretations for the same pair of partner genes if there are any
+    """
+    name = 'nyu_interpretation'
+    label = 'NYU interpretation'
+    template = 'sources/nyu_interpretation.html'
+    import_types = ('nyu_interpretation',)
+
+    def query(self, genes, **params):
+        return(interpret.query_nyu_interpretation(genes, **params))
+
+    def record_params(self, record, match_variants = False, variant = None):
+        if not match_variants:
+            return({'variant': variant})
+        return({'variant': variant, 'fusion': interpret.fusion_pair(record)})
+
+    def build_index(self, kb_version, match_variants = False):
+        if not match_variants:
+            return({})
+        return({'fusion_index': get_fusion_index(kb_version)})
+
+    def prefetch(self, genes, tissue_type = None, tumor_type = None):
+        interpret.prefetch_nyu_interpretations(genes, tissue_type = tissue_type, tumor_type = tumor_type)
+
+# the registered sources, in the order they are looked up and rendered
+registry = OrderedDict()
+
+def register_source(source):
+    """
+    Add a source to the registry, replacing any source with the same name
+
+    Returns
+    -------
+    InterpretationSource
+        the source
+    """
+    registry[source.name] = source
+    return(source)
+
+def unregister_source(name):
+    """
+    Remove a source from the registry
+    """
+    registry.pop(name, None)
+
+def get_source(name):
+    """
+    Get a registered source by name
+    """
+    return(registry[name])
+
+def get_sources(names = None):
+    """
+    Get the registered sources, in order
+
+    Parameters
+    ----------
+    names: list
+        only get the sources with these names; all sources if None
+
+    Returns
+    -------
+    list
+        the ``InterpretationSource`` objects
+    """
+    if names is None:
+        return(list(registry.values()))
+    unknown = [ name for name in names if name not in registry ]
+    if unknown:
+        raise ValueError("Unknown interpretation source: {0}".format(', '.join(unknown)))
+    return([ source for source in registry.values() if source.name in names ])
+
+register_source(PMKBSource())
+register_source(NYUTierSource())
+register_source(NYUInterpretationSource())
@@ -0,0 +1,77 @@
+from django.test import TestCase
+from .models import PMKBVariant, PMKBInterpretation, TissueType, TumorType
+from .cache import InterpretationCache, get_cache, get_kb_version, bump_kb_version
+from .interpret import fetch_pmkb_variants, query_pmkb
+
+class TestInterpretationCache(TestCase):
+    multi_db = True
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used entry is evicted when the cache is full
+        """
+        cache = InterpretationCache(maxsize = 2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertTrue( cache.get('a') == 1 )
+        self.assertTrue( cache.get('b') is None )
+        self.assertTrue( cache.get('c') == 3 )
+        self.assertTrue( cache.stats()['evictions'] == 1 )
+        self.assertTrue( cache.stats()['size'] == 2 )
+
+    def test_disabled(self):
+        """
+        Test that a cache with size 0 never stores anything
+        """
+        cache = InterpretationCache(maxsize = 0)
+        cache.set('a', 1)
+        self.assertTrue( cache.get('a') is None )
+        self.assertTrue( cache.get_or_query('a', lambda: 2) == 2 )
+
+    def test_validate_clears_on_new_version(self):
+        """
+        Test that the cache is cleared when the knowledge base version changes
+        """
+        cache = InterpretationCache(maxsize = 10)
+        cache.validate(version = 1)
+        cache.set('a', 1)
+        cache.validate(version = 1)
+        self.assertTrue( cache.get('a') == 1 )
+        cache.validate(version = 2)
+        self.assertTrue( cache.get('a') is None )
+
+class TestKnowledgeBaseVersion(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        self.tumor = TumorType.objects.create(type = "Any")
+        self.tissue = TissueType.objects.create(type = "Any")
+        self.interpretation = PMKBInterpretation.objects.create(interpretation = "Bar", citations = "Foo", source_row = 1)
+        PMKBVariant.objects.create(gene = 'NRAS', tumor_type = self.tumor, tissue_type = self.tissue, variant = '',
+            tier = 1, interpretation = self.interpretation, source_row = 1, uid = 'NRAS1')
+
+    def test_save_increments_version(self):
+        """
+        Test that saving a knowledge base entry increments the knowledge base version
+        """
+        version = get_kb_version()
+        self.interpretation.save()
+        self.assertTrue( get_kb_version() == version + 1 )
+        self.assertTrue( bump_kb_version() == version + 2 )
+
+    def test_cached_results_invalidated(self):
+        """
+        Test that a new variant saved after a query is returned by the next query for the same gene
+        """
+        get_cache().validate()
+        self.assertTrue( len(fetch_pmkb_variants(gene = 'NRAS')) == 1 )
+        self.assertTrue( len(fetch_pmkb_variants(gene = 'NRAS')) == 1 )
+        PMKBVariant.objects.create(gene = 'NRAS', tumor_type = self.tumor, tissue_type = self.tissue, variant = 'NRAS Q61R',
+            tier = 1, interpretation = self.interpretation, source_row = 1, uid = 'NRAS2')
+        get_cache().validate()
+        self.assertTrue( len(fetch_pmkb_variants(gene = 'NRAS')) == 2 )
+        results = query_pmkb(genes = ['NRAS'])
+        self.assertTrue( results[0]['variant_names'] == ('', 'NRAS Q61R') )
@@ -0,0 +1,82 @@
+import os
+import io
+import json
+import zipfile
+from xml.etree import ElementTree
+from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .models import PMKBInterpretation, PMKBVariant, TissueType, TumorType
+from .report import iter_interpreted_tables
+from .export import export_columns, iter_export_rows, iter_tsv, iter_jsonl, iter_xlsx, iter_export
+"""
+Tests for exporting interpretation results as .tsv, JSON Lines, and .xlsx files
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
+
+class TestWriters(TestCase):
+    def setUp(self):
+        self.columns = ['Genes', 'Tier', 'Interpretation']
+        self.rows = [ ['EGFR', i, 'line one\n\tline two & <three>'] for i in range(5) ]
+
+    def test_tsv(self):
+        parts = list(iter_tsv(self.rows, columns = self.columns, block_rows = 2))
+        self.assertTrue( len(parts) == 3 )
+        lines = ''.join(parts).splitlines()
+        self.assertTrue( lines[0] == 'Genes\tTier\tInterpretation' )
+        self.assertTrue( lines[1] == 'EGFR\t0\tline one  line two & <three>' )
+        self.assertTrue( len(lines) == 6 )
+
+    def test_jsonl(self):
+        lines = ''.join(iter_jsonl(self.rows, columns = self.columns)).splitlines()
+        self.assertTrue( json.loads(lines[4]) == {'Genes': 'EGFR', 'Tier': 4, 'Interpretation': 'line one\n\tline two & <three>'} )
+
+    def test_xlsx(self):
+        """
+        Test that the workbook is a valid zip file with the rows in its sheet
+        """
+        parts = list(iter_xlsx(iter(self.rows), columns = self.columns, block_size = 100))
+        self.assertTrue( len(parts) > 1 )
+        with zipfile.ZipFile(io.BytesIO(b''.join(parts))) as workbook:
+            self.assertTrue( workbook.testzip() is None )
+            sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+        namespace = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+        rows = sheet.findall('{0}sheetData/{0}row'.format(namespace))
+        self.assertTrue( len(rows) == 6 )
+        self.assertTrue( ''.join(rows[1].itertext()) == 'EGFR0line one\n\tline two & <three>' )
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            iter_export(self.rows, 'csv')
+
+class TestExportRows(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        Any_tumor = TumorType.objects.create(type = "Any")
+        Any_tissue = TissueType.objects.create(type = "Any")
+        self.interpretation = PMKBInterpretation.objects.create(interpretation = "PIK3CA interpretation text", citations = "PIK3CA citation", source_row = 1)
+        for i, (variant, tier) in enumerate([('PIK3CA E545K', 1), ('PIK3CA H1047R', 2)]):
+            PMKBVariant.objects.create(gene = 'PIK3CA', tumor_type = Any_tumor, tissue_type = Any_tissue, variant = variant,
+                tier = tier, interpretation = self.interpretation, source_row = 1, uid = str(i))
+
+    def test_rows(self):
+        rows = list(iter_export_rows(iter_interpreted_tables(IR_tsv, chunksize = 8)))
+        # one row for each record, since only the PIK3CA records have a match
+        self.assertTrue( len(rows) == 35 )
+        self.assertTrue( all([ len(row) == len(export_columns) for row in rows ]) )
+        row = dict(zip(export_columns, rows[8]))
+        self.assertTrue( (row['Source Row'], row['Genes'], row['Source'], row['Entry ID']) == (9, 'PIK3CA', 'PMKB', self.interpretation.id) )
+        self.assertTrue( (row['Tier'], row['Variant'], row['Citations']) == ('1, 2', 'PIK3CA E545K, PIK3CA H1047R', 'PIK3CA citation') )
+        self.assertTrue( dict(zip(export_columns, rows[0]))['Source'] == '' )
+
+    def test_upload_export(self):
+        with open(IR_tsv, 'rb') as f:
+            upload = SimpleUploadedFile('SeraSeq.tsv', f.read())
+        response = self.client.post('/upload/', {'irtable': upload, 'tissue_type': 'Any', 'tumor_type': 'Any', 'export_format': 'tsv'})
+        self.assertTrue( response.streaming )
+        self.assertTrue( response['Content-Disposition'] == 'attachment; filename="SeraSeq.tsv"' )
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertTrue( lines[0].split('\t') == export_columns )
+        self.assertTrue( len(lines) == 36 )
@@ -0,0 +1,130 @@
+import os
+import io
+import shutil
+import tempfile
+import pandas as pd
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .ir import IRTable, IRTableReader
+from .models import ReportJob
+from .jobs import run_job
+from .report_store import ReportStore
+from .report import make_report_html, iter_report_html
+from .filters import parse_filters, apply_filters, highest_af
+from .vcf import read_table
+"""
+Tests for the report filters
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
+annotated_vcf = os.path.join(fixtures_dir, "annotated.vcf")
+
+# an Ion Reporter .vcf file, with one line without an Oncomine class
+func_vcf = '\n'.join([
+    '##fileformat=VCFv4.1',
+    '##INFO=<ID=FUNC,Number=.,Type=String,Description="Functional Annotations">',
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE',
+    "chr7\t55249071\t.\tC\tT\t.\tPASS\tFUNC=[{'origAlt':'T','gene':'EGFR','coding':'c.2369C>T','protein':'p.Thr790Met'}]\tGT:AF:DP\t0/1:0.2:500",
+    "chr12\t25398284\t.\tC\tT\t.\tPASS\tFUNC=[{'origAlt':'T','gene':'KRAS','coding':'c.35G>A','protein':'p.Gly12Asp','oncomineVariantClass':'Hotspot'}]\tGT:AF:DP\t0/1:0.05:800",
+    ''])
+
+class TestFilters(TestCase):
+    def setUp(self):
+        self.frame = pd.DataFrame([
+            {'Type': 'SNV', 'Detection': 'Present', 'Oncomine Variant Class': 'Hotspot', '% Frequency': 'AA=0.00, CG=11.27', 'Coverage': 1996},
+            {'Type': 'SNV', 'Detection': 'Absent', 'Oncomine Variant Class': 'Hotspot', '% Frequency': '0.00', 'Coverage': 500},
+            {'Type': 'INDEL', 'Detection': 'No Call', 'Oncomine Variant Class': None, '% Frequency': 3.5, 'Coverage': 80},
+            {'Type': 'FUSION', 'Detection': 'Present', 'Oncomine Variant Class': 'Fusion', '% Frequency': None, 'Coverage': None}
+            ])
+
+    def test_parse(self):
+        self.assertTrue( parse_filters('') == [] )
+        self.assertTrue( parse_filters(None) == [] )
+        self.assertTrue( parse_filters('none') == [] )
+        self.assertTrue( parse_filters(' min_af = 5 , variant_type=SNV|INDEL') == [('min_af', '5'), ('variant_type', 'SNV|INDEL')] )
+        self.assertTrue( parse_filters('oncomine')[0] == ('detection', 'Present') )
+        for text in ['foo', 'min_coverage', 'min_af=', 'min_af=high', 'variant_type']:
+            with self.assertRaises(ValueError):
+                parse_filters(text)
+
+    def test_highest_af(self):
+        self.assertTrue( highest_af(self.frame['% Frequency']).fillna(-1).tolist() == [11.27, 0.0, 3.5, -1] )
+
+    def test_apply(self):
+        frame, counts = apply_filters(self.frame, parse_filters('detection'))
+        self.assertTrue( frame['Type'].tolist() == ['SNV', 'FUSION'] )
+        self.assertTrue( counts == {'detection=Present': 2} )
+        # zero frequency alleles are dropped; rows without a frequency or coverage are kept
+        self.assertTrue( apply_filters(self.frame, parse_filters('min_af'))[0]['Type'].tolist() == ['SNV', 'INDEL', 'FUSION'] )
+        self.assertTrue( apply_filters(self.frame, parse_filters('min_coverage=100'))[0]['Type'].tolist() == ['SNV', 'SNV', 'FUSION'] )
+        self.assertTrue( apply_filters(self.frame, parse_filters('oncomine_class'))[0]['Type'].tolist() == ['SNV', 'SNV', 'FUSION'] )
+        self.assertTrue( apply_filters(self.frame, parse_filters('oncomine_class=hotspot'))[0]['Type'].tolist() == ['SNV', 'SNV'] )
+        self.assertTrue( apply_filters(self.frame, parse_filters('variant_type=snv|fusion'))[0]['Type'].tolist() == ['SNV', 'SNV', 'FUSION'] )
+        # rows are only counted for the first filter they fail
+        frame, counts = apply_filters(self.frame, parse_filters('oncomine'))
+        self.assertTrue( frame['Type'].tolist() == ['SNV', 'FUSION'] )
+        self.assertTrue( list(counts.items()) == [('detection=Present', 2), ('oncomine_class', 0), ('min_af=0', 0)] )
+        # filters on missing columns keep every row
+        frame, counts = apply_filters(self.frame[['Type']], parse_filters('oncomine'))
+        self.assertTrue( len(frame) == 4 )
+        frame, counts = apply_filters(self.frame.iloc[0:0], parse_filters('oncomine,min_coverage=10,variant_type=SNV'))
+        self.assertTrue( len(frame) == 0 )
+
+    def test_table(self):
+        table = IRTable(IR_tsv, filters = parse_filters('variant_type=SNV,min_af=10'))
+        self.assertTrue( len(table.records) == 14 )
+        self.assertTrue( list(table.filtered.items()) == [('variant_type=SNV', 18), ('min_af=10', 3)] )
+        # the source rows are kept
+        self.assertTrue( table.records[0].data['Row'] == 0 )
+        chunks = list(IRTableReader(IR_tsv, chunksize = 10, filters = parse_filters('variant_type=SNV,min_af=10')))
+        self.assertTrue( sum([ len(chunk.records) for chunk in chunks ]) == 14 )
+        self.assertTrue( sum([ chunk.filtered['min_af=10'] for chunk in chunks ]) == 3 )
+
+class TestFilteredReport(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+        self.settings = override_settings(JOB_DIR = self.job_dir)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.job_dir)
+
+    def test_report(self):
+        summary = 'IR Entries: 14<br>\n            Filtered Out: 21 (variant_type=SNV: 18, min_af=10: 3)<br>'
+        html = make_report_html(input = IR_tsv, filters = 'variant_type=SNV,min_af=10')
+        self.assertTrue( summary in html )
+        self.assertTrue( html.count('class="irtable"') == 14 )
+        self.assertTrue( summary in ''.join(iter_report_html(input = IR_tsv, chunksize = 10, filters = 'variant_type=SNV,min_af=10')) )
+        with override_settings(REPORT_FILTERS = 'variant_type=FUSION'):
+            html = ''.join(iter_report_html(input = IR_tsv))
+        self.assertTrue( 'IR Entries: 15<br>' in html )
+        self.assertTrue( 'Filtered Out' not in make_report_html(input = IR_tsv) )
+        # the filters are applied to .vcf records after the .vcf filters
+        html = make_report_html(input = annotated_vcf, filters = 'min_af=10')
+        self.assertTrue( 'IR Entries: 4<br>' in html )
+        # .vcf files without Ion Reporter FUNC annotations have no Oncomine classes to filter on
+        html = make_report_html(input = annotated_vcf, filters = 'oncomine')
+        self.assertTrue( 'IR Entries: 5<br>' in html )
+        self.assertTrue( 'IR Entries: 5<br>' in ''.join(iter_report_html(input = annotated_vcf, chunksize = 2, filters = 'oncomine')) )
+        # records of a file with FUNC annotations are dropped if they have no Oncomine class
+        table = read_table(io.BytesIO(func_vcf.encode('utf-8')), filters = parse_filters('oncomine'))
+        self.assertTrue( [ record.genes for record in table.records ] == [['KRAS']] )
+        self.assertTrue( table.filtered['oncomine_class'] == 1 )
+
+    def test_upload(self):
+        with open(IR_tsv, 'rb') as f:
+            response = self.client.post('/upload/', {'irtable': f, 'filters': 'variant_type=SNV,min_af=10'})
+        self.assertTrue( 'IR Entries: 14<br>' in b''.join(response.streaming_content).decode('utf-8') )
+        with open(IR_tsv, 'rb') as f:
+            response = self.client.post('/upload/', {'irtable': f, 'filters': 'min_af=high'})
+        self.assertTrue( response.content == b'Error: Report filter min_af needs a number: high' )
+        with open(IR_tsv, 'rb') as f:
+            response = self.client.post('/upload/', {'irtable': SimpleUploadedFile('SeraSeq.tsv', f.read()), 'filters': 'min_af=10', 'background': '1'})
+        job = run_job(ReportJob.objects.get())
+        self.assertTrue( job.filters == 'min_af=10' )
+        with ReportStore(job.result_file) as store:
+            self.assertTrue( store.num_records == 30 )
+            self.assertTrue( store.summary['filtered'] == [['min_af=10', 5]] )
@@ -0,0 +1,96 @@
+import os
+from django.test import TestCase
+from .models import PMKBVariant, PMKBInterpretation, NYUInterpretation, FusionPair, TissueType, TumorType
+from .ir import IRTable, IRRecord, Fusion
+from .interpret import interpret_pmkb, interpret_nyu_interpretation
+from .fusions import parse_kb_fusion, FusionIndex, compile_fusion_pairs
+"""
+Tests for parsing fusions and matching IR fusion records to knowledge base entries by their partner genes
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
+
+def make_record(genes, variant_id = float('nan'), type = 'FUSION'):
+    return(IRRecord(data = {'Genes': genes, 'Type': type, 'Variant ID': variant_id, '% Frequency': float('nan')}))
+
+class TestParseFusion(TestCase):
+    def test_genes(self):
+        self.assertTrue( make_record('EML4(13) - ALK(20)').fusion == Fusion('EML4', 'ALK', 13, 20) )
+
+    def test_variant_id(self):
+        self.assertTrue( make_record('ALK', 'EML4-ALK.E13A20.AB462411').fusion == Fusion('EML4', 'ALK', 13, 20) )
+        self.assertTrue( make_record('EML4 - ALK', 'EML4-ALK.E13A20').fusion == Fusion('EML4', 'ALK', 13, 20) )
+        self.assertTrue( make_record('LMNA - NTRK1', 'LMNA-NTRK1').fusion == Fusion('LMNA', 'NTRK1', None, None) )
+
+    def test_not_fusion(self):
+        self.assertTrue( make_record('NRAS', type = 'SNV').fusion is None )
+        self.assertTrue( make_record('ALK').fusion is None )
+
+    def test_str(self):
+        self.assertTrue( str(Fusion('EML4', 'ALK', 13, 20)) == 'EML4 exon 13 - ALK exon 20' )
+
+    def test_kb_fusion(self):
+        self.assertTrue( parse_kb_fusion('EML4-ALK rearrangement') == ('EML4', 'ALK') )
+        self.assertTrue( parse_kb_fusion('CCDC6 - RET') == ('CCDC6', 'RET') )
+        self.assertTrue( parse_kb_fusion('ALK rearrangement') is None )
+        self.assertTrue( parse_kb_fusion('CDK4') is None )
+
+class TestFusionIndex(TestCase):
+    def test_match(self):
+        index = FusionIndex([ ('pmkb', 1, 'EML4', 'ALK'), ('pmkb', 2, 'ERG', 'TMPRSS2'), ('pmkb', 3, 'ALK', 'EML4'), ('nyu_interpretation', 1, 'CCDC6', 'RET') ])
+        self.assertTrue( index.match('pmkb', 'EML4', 'ALK') == frozenset([1]) )
+        self.assertTrue( index.match('pmkb', 'TMPRSS2', 'ERG') == frozenset([2]) )
+        self.assertTrue( index.match('pmkb', 'KIF5B', 'ALK') == frozenset() )
+        self.assertTrue( index.match('nyu_interpretation', 'CCDC6', 'RET') == frozenset([1]) )
+        self.assertTrue( index.match('pmkb', 'CCDC6', 'RET') == frozenset() )
+        self.assertTrue( index.paired_ids('pmkb') == frozenset([1, 2, 3]) )
+        self.assertTrue( index.paired_ids('nyu_tier') == frozenset() )
+
+class TestFusionMatching(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        Any_tumor = TumorType.objects.create(type = "Any")
+        Any_tissue = TissueType.objects.create(type = "Any")
+        for i, (gene, variant) in enumerate([('EML4', 'EML4-ALK rearrangement'), ('ALK', 'ALK F1174L'), ('ALK', 'ALK any mutation'),
+            ('ERG', 'ERG-TMPRSS2 rearrangement'), ('ERG', 'ERG any mutation'), ('RET', 'RET any mutation')]):
+            interpretation = PMKBInterpretation.objects.create(interpretation = variant, citations = "Foo", source_row = i)
+            PMKBVariant.objects.create(gene = gene, tumor_type = Any_tumor, tissue_type = Any_tissue, variant = variant,
+                tier = 1, interpretation = interpretation, source_row = i, uid = str(i))
+        for genes, variant_type in [('FGFR3 - TACC3', 'fusion'), ('FGFR3', 'other'), ('CDK4', 'other')]:
+            NYUInterpretation.objects.create(genes = genes, variant_type = variant_type, tumor_type = Any_tumor, tissue_type = Any_tissue,
+                interpretation = genes)
+
+    def test_pairs_saved(self):
+        pairs = sorted(FusionPair.objects.values_list('source', 'five_prime', 'three_prime'))
+        self.assertTrue( pairs == [('nyu_interpretation', 'FGFR3', 'TACC3'), ('pmkb', 'EML4', 'ALK'), ('pmkb', 'ERG', 'TMPRSS2')] )
+        self.assertTrue( compile_fusion_pairs() == 3 )
+        NYUInterpretation.objects.get(genes = 'FGFR3 - TACC3').delete()
+        self.assertTrue( FusionPair.objects.count() == 2 )
+
+    def test_interpret_pmkb(self):
+        """
+        Test that fusion records are matched by their partner genes first
+
+        SeraSeq.tsv records 4 and 34 are EML4(13) - ALK(20) and TMPRSS2(1) - ERG(2); record 26 is KIF5B(24) - RET(11), which is not in the fusion index,
+        and does not fire the 'RET any mutation' rule
+        """
+        ir_table = interpret_pmkb(ir_table = IRTable(source = IR_tsv), match_variants = True)
+        names = lambda record: [ interpretation['variant_names'] for interpretation in record.interpretations['pmkb'] ]
+        self.assertTrue( names(ir_table.records[4]) == [ ('EML4-ALK rearrangement',) ] )
+        self.assertTrue( names(ir_table.records[34]) == [ ('ERG-TMPRSS2 rearrangement',) ] )
+        self.assertTrue( names(ir_table.records[26]) == [] )
+
+    def test_interpret_nyu_interpretation(self):
+        """
+        Test that a fusion whose pair is not in the knowledge base is not matched to the interpretations for other FGFR3 fusions
+
+        SeraSeq.tsv records 11 and 12 are FGFR3(17) - TACC3(10) and FGFR3(17) - BAIAP2L1(2)
+        """
+        ir_table = interpret_nyu_interpretation(ir_table = IRTable(source = IR_tsv), match_variants = True)
+        genes = lambda record: [ interpretation.genes for interpretation in record.interpretations['nyu_interpretation'] ]
+        self.assertTrue( genes(ir_table.records[11]) == [ 'FGFR3 - TACC3' ] )
+        self.assertTrue( genes(ir_table.records[12]) == [ 'FGFR3' ] )
+        ir_table = interpret_nyu_interpretation(ir_table = IRTable(source = IR_tsv))
+        self.assertTrue( genes(ir_table.records[11]) == [ 'FGFR3 - TACC3', 'FGFR3' ] )
@@ -0,0 +1,67 @@
+import os
+from django.test import TestCase
+from .models import PMKBVariant, PMKBInterpretation, NYUTier, NYUInterpretation, GeneSynonym, FusionPair, TissueType, TumorType
+from .ir import IRRecord
+from .genes import read_gene_synonyms, load_gene_synonyms, canonical_gene, canonical_gene_text, canonicalize_knowledge_base
+"""
+Tests for converting previous and alias gene symbols to the approved symbols
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+synonyms_tsv = os.path.join(fixtures_dir, "gene_synonyms.tsv")
+
+def make_record(genes, type = 'SNV', synonyms = None):
+    return(IRRecord(data = {'Genes': genes, 'Type': type, '% Frequency': float('nan')}, synonyms = synonyms))
+
+class TestReadSynonyms(TestCase):
+    def test_fixture(self):
+        synonyms = read_gene_synonyms(synonyms_tsv)
+        self.assertTrue( synonyms['MLL'] == ('KMT2A', 'previous') )
+        self.assertTrue( synonyms['HER2'] == ('ERBB2', 'alias') )
+        self.assertTrue( synonyms['SEPT14'] == ('SEPTIN14', 'previous') )
+        # approved symbols are never converted
+        self.assertTrue( 'KMT2A' not in synonyms )
+
+    def test_canonical_gene(self):
+        synonyms = {'MLL': 'KMT2A', 'HER2': 'ERBB2'}
+        self.assertTrue( canonical_gene('Her2', synonyms) == 'ERBB2' )
+        self.assertTrue( canonical_gene('NRAS', synonyms) == 'NRAS' )
+        self.assertTrue( canonical_gene_text('MLL - AFF1', synonyms) == 'KMT2A - AFF1' )
+
+class TestRecordGenes(TestCase):
+    def test_rename(self):
+        synonyms = {'MLL': 'KMT2A', 'WHSC1': 'NSD2'}
+        self.assertTrue( make_record('MLL', synonyms = synonyms).genes == ['KMT2A'] )
+        self.assertTrue( make_record('MLL,KMT2A', synonyms = synonyms).genes == ['KMT2A'] )
+        self.assertTrue( make_record('MLL', synonyms = None).genes == ['MLL'] )
+
+    def test_rename_fusion(self):
+        record = make_record('WHSC1(2) - MLL(9)', type = 'FUSION', synonyms = {'MLL': 'KMT2A', 'WHSC1': 'NSD2'})
+        self.assertTrue( record.genes == ['NSD2', 'KMT2A'] )
+        self.assertTrue( (record.fusion.five_prime, record.fusion.three_prime) == ('NSD2', 'KMT2A') )
+
+class TestCanonicalizeKnowledgeBase(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        Any_tumor = TumorType.objects.create(type = "Any")
+        Any_tissue = TissueType.objects.create(type = "Any")
+        interpretation = PMKBInterpretation.objects.create(interpretation = "Foo", citations = "Foo", source_row = 1)
+        PMKBVariant.objects.create(gene = 'SEPT14', tumor_type = Any_tumor, tissue_type = Any_tissue, variant = 'SEPT14 copy number gain',
+            tier = 1, interpretation = interpretation, source_row = 1, uid = '1')
+        NYUTier.objects.create(gene = 'HER2', variant_type = 'snp', tumor_type = Any_tumor, tissue_type = Any_tissue,
+            coding = 'c.2264T>C', protein = 'p.Leu755Ser', tier = 1)
+        NYUInterpretation.objects.create(genes = 'MLL - AFF1', variant_type = 'fusion', tumor_type = Any_tumor, tissue_type = Any_tissue,
+            interpretation = 'Foo')
+        GeneSynonym.objects.bulk_create([ GeneSynonym(alias = alias, symbol = symbol, synonym_type = synonym_type)
+            for alias, (symbol, synonym_type) in read_gene_synonyms(synonyms_tsv).items() ])
+
+    def test_canonicalize(self):
+        self.assertTrue( load_gene_synonyms()['MLL'] == 'KMT2A' )
+        self.assertTrue( canonicalize_knowledge_base() == 3 )
+        variant = PMKBVariant.objects.get(uid = '1')
+        self.assertTrue( (variant.gene, variant.variant, variant.rule.rule_type) == ('SEPTIN14', 'SEPTIN14 copy number gain', 'copy_number') )
+        self.assertTrue( NYUTier.objects.get().protein_key == 'ERBB2:p.L755S' )
+        self.assertTrue( NYUInterpretation.objects.get().genes_json == '["KMT2A", "AFF1"]' )
+        self.assertTrue( FusionPair.objects.get().five_prime == 'KMT2A' )
+        self.assertTrue( canonicalize_knowledge_base() == 0 )
@@ -3,7 +3,7 @@ import hashlib
 from django.test import TestCase
 from .models import PMKBVariant, PMKBInterpretation, TissueType, TumorType
 from .ir import IRTable
-from .interpret import interpret_pmkb
+from .interpret import interpret_pmkb, QueryCache
 """
 Tests for the interpret module, to make sure that the correct interpretations are being returned under various conditions
 """
@@ -12,6 +12,9 @@ IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
 NRAS_IDH1_tsv = os.path.join(fixtures_dir, "NRAS_IDH1.tsv")
 
 class TestInterpret(TestCase):
+    # roll back the knowledge_base entries after the tests as well, so they do not leak into other test cases
+    multi_db = True
+
     @classmethod # causes setup to only run once per instance of this class, instead of before every test
     def setUpTestData(self):
         # make demo fake db entries
@@ -254,3 +257,52 @@ class TestInterpret(TestCase):
         self.assertTrue(ir_table.records[1].genes == ['IDH1'])
         self.assertTrue(ir_table.records[1].interpretations['pmkb'] == [] )
         self.assertTrue(len(ir_table.records[1].interpretations['pmkb']) == 0 )
+
+    def test_pmkb_view_model_NRAS_IDH1_1(self):
+        """
+        Test that the PMKB results carry deduplicated and sorted fields for the report template
+
+        NRAS should return the 'Bar' interpretation with all three tumor and tissue types
+        """
+        tissue_type = None
+        tumor_type = None
+        params = {'tissue_type': tissue_type, 'tumor_type': tumor_type}
+        ir_table = IRTable(source = NRAS_IDH1_tsv)
+        ir_table = interpret_pmkb(ir_table = ir_table, **params)
+        view = ir_table.records[0].interpretations['pmkb'][0]
+        self.assertTrue( view['genes'] == ('NRAS',) )
+        self.assertTrue( view['tumor_types'] == ('Adenocarcinoma', 'Any', 'Carcinoma') )
+        self.assertTrue( view['tissue_types'] == ('Any', 'Lung', 'Skin') )
+        self.assertTrue( view['variant_names'] == ('',) )
+        self.assertTrue( view['tiers'] == (1,) )
+        self.assertTrue( view['source_rows'] == (1,) )
+        # the view-model should be read-only
+        with self.assertRaises(TypeError):
+            view['genes'] = ('EGFR',)
+
+    def test_pmkb_cache_shared_results(self):
+        """
+        Test that records with the same genes share the same memoized PMKB results
+
+        SeraSeq.tsv contains multiple records for PIK3CA, EGFR, and FGFR3 - TACC3
+        """
+        cache = QueryCache(name = 'pmkb')
+        ir_table = IRTable(source = IR_tsv)
+        ir_table = interpret_pmkb(ir_table = ir_table, tissue_type = None, tumor_type = None, cache = cache)
+        # records 8 and 9 are both PIK3CA
+        self.assertTrue( ir_table.records[8].genes == ir_table.records[9].genes == ['PIK3CA'] )
+        self.assertTrue( ir_table.records[8].interpretations['pmkb'] is ir_table.records[9].interpretations['pmkb'] )
+        # records 11 and 13 are both FGFR3 - TACC3 fusions
+        self.assertTrue( ir_table.records[11].interpretations['pmkb'] is ir_table.records[13].interpretations['pmkb'] )
+        self.assertTrue( cache.lookups() == len(ir_table.records) )
+        self.assertTrue( cache.misses == len(set([ frozenset(record.genes) for record in ir_table.records ])) )
+        self.assertTrue( cache.hits > 0 )
+
+    def test_pmkb_cache_key_Any(self):
+        """
+        Test that 'Any' and None filters, and the order of the genes, map to the same cache key
+        """
+        cache = QueryCache()
+        self.assertTrue( cache.make_key(['EGFR', 'NRAS'], tissue_type = 'Any', tumor_type = None) ==
+            cache.make_key(['NRAS', 'EGFR'], tissue_type = None, tumor_type = 'Any') )
+        self.assertFalse( cache.make_key(['EGFR'], tissue_type = 'Lung') == cache.make_key(['EGFR'], tissue_type = 'Skin') )
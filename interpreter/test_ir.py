@@ -1,7 +1,7 @@
 import os
 from django.test import TestCase
 from .models import PMKBVariant
-from .ir import IRTable
+from .ir import IRTable, IRTableReader
 import numpy as np
 
 fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
@@ -58,3 +58,14 @@ class TestIR(TestCase):
         afs = self.demo_table.records[0].parse_af(af = 38.44)
         expected_afs = ['38.44']
         self.assertTrue(afs == expected_afs, 'Did not return expected afs: {0}, instead got: {1}'.format(expected_afs, afs))
+
+    def test_reader_chunks(self):
+        """
+        Make sure reading in chunks returns the same records and row numbers as reading the whole table
+        """
+        tables = [ table for table in IRTableReader(source = IR_tsv, chunksize = 10) ]
+        self.assertTrue( [ len(table.records) for table in tables ] == [10, 10, 10, 5] )
+        rows = [ record.data['Row'] for table in tables for record in table.records ]
+        expected_rows = [ record.data['Row'] for record in self.demo_table.records ]
+        self.assertTrue( rows == expected_rows )
+        self.assertTrue( tables[3].records[4].genes == ['TMPRSS2', 'ERG'] )
@@ -0,0 +1,126 @@
+import os
+import json
+import shutil
+import datetime
+import tempfile
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .models import ReportJob
+from .jobs import submit_job, claim_next_job, run_job, run_worker, fail_stale_jobs, purge_expired_jobs
+
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
+
+class TestJobs(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+        self.settings = override_settings(JOB_DIR = self.job_dir)
+        self.settings.enable()
+        with open(IR_tsv, 'rb') as f:
+            self.upload = SimpleUploadedFile('SeraSeq.tsv', f.read())
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.job_dir)
+
+    def test_submit_and_run(self):
+        """
+        Test that a submitted job is claimed once, and runs to a finished report
+        """
+        job = submit_job(upload = self.upload)
+        self.assertTrue( job.status == 'queued' )
+        self.assertTrue( os.path.exists(job.input_file) )
+        claimed = claim_next_job(worker = 'test')
+        self.assertTrue( claimed.id == job.id )
+        self.assertTrue( claim_next_job(worker = 'test') is None )
+        job = run_job(claimed)
+        self.assertTrue( job.status == 'finished' )
+        self.assertTrue( job.progress == 100 )
+        self.assertTrue( job.expires > job.finished )
+        with open(job.report_file) as f:
+            self.assertTrue( f.read().strip().startswith('<!DOCTYPE html>') )
+
+    def test_failed_job(self):
+        """
+        Test that a job whose input can not be read is marked as failed
+        """
+        job = submit_job(upload = self.upload)
+        os.remove(job.input_file)
+        self.assertTrue( run_worker(once = True) == 1 )
+        job = ReportJob.objects.get(id = job.id)
+        self.assertTrue( job.status == 'failed' )
+        self.assertTrue( len(job.error) > 0 )
+
+    def test_purge_expired(self):
+        """
+        Test that expired jobs and their files are deleted
+        """
+        submit_job(upload = self.upload)
+        job = run_job(claim_next_job())
+        self.assertTrue( purge_expired_jobs() == 0 )
+        self.assertTrue( purge_expired_jobs(now = job.expires + datetime.timedelta(seconds = 1)) == 1 )
+        self.assertFalse( os.path.exists(job.input_file) )
+        self.assertFalse( os.path.exists(job.report_file) )
+        self.assertTrue( ReportJob.objects.count() == 0 )
+
+    def test_dead_worker(self):
+        """
+        Test that a job left running by a worker that was killed is marked as failed, and then deleted when it expires
+        """
+        submit_job(upload = self.upload)
+        job = claim_next_job(worker = 'dead')
+        self.assertTrue( fail_stale_jobs() == 0 )
+        stale = job.heartbeat + datetime.timedelta(minutes = 31)
+        self.assertTrue( fail_stale_jobs(now = stale) == 1 )
+        job = ReportJob.objects.get(id = job.id)
+        self.assertTrue( job.status == 'failed' )
+        self.assertTrue( job.expires > stale )
+        self.assertTrue( purge_expired_jobs(now = job.expires + datetime.timedelta(seconds = 1)) == 1 )
+        self.assertFalse( os.path.exists(job.input_file) )
+
+    def test_job_views(self):
+        """
+        Test submitting a job and fetching its status and report over HTTP
+        """
+        response = self.client.post('/jobs/submit/', {'irtable': self.upload, 'tissue_type': 'Any', 'tumor_type': 'Any'})
+        self.assertTrue( response.status_code == 202 )
+        status = response.json()
+        self.assertTrue( status['status'] == 'queued' )
+        self.assertTrue( self.client.get('/jobs/{0}/report/'.format(status['id'])).status_code == 404 )
+        run_worker(once = True)
+        status = self.client.get(status['status_url']).json()
+        self.assertTrue( status['status'] == 'finished' )
+        response = self.client.get(status['report_url'])
+        self.assertTrue( response.content.strip().startswith(b'<!DOCTYPE html>') )
+
+    @override_settings(REPORT_PAGE_SIZE = 10)
+    def test_paginated_report(self):
+        """
+        Test that the job report shows one page of record summaries, and loads the detail of each record separately
+        """
+        job = run_job(submit_job(upload = self.upload))
+        response = self.client.get('/jobs/{0}/report/'.format(job.key), {'page': 4})
+        self.assertTrue( b'Records 31-35 of 35' in response.content )
+        self.assertTrue( response.content.count(b'class="record-toggle"') == 5 )
+        self.assertFalse( b'class="pmkbtable"' in response.content )
+        self.assertTrue( self.client.get('/jobs/{0}/report/'.format(job.key), {'page': 5}).status_code == 404 )
+        response = self.client.get('/jobs/{0}/records/34/'.format(job.key))
+        self.assertTrue( response.content.count(b'class="irtable"') == 1 )
+        self.assertTrue( self.client.get('/jobs/{0}/records/35/'.format(job.key)).status_code == 404 )
+        response = self.client.get('/jobs/{0}/report/full/'.format(job.key))
+        self.assertTrue( response.streaming )
+        self.assertTrue( b''.join(response.streaming_content).count(b'class="irtable"') == 35 )
+
+    def test_job_export(self):
+        """
+        Test that the stored result of a job is exported with one row per record and match
+        """
+        job = run_job(submit_job(upload = self.upload))
+        response = self.client.get('/jobs/{0}/export/jsonl/'.format(job.key))
+        self.assertTrue( response['Content-Disposition'] == 'attachment; filename="SeraSeq.jsonl"' )
+        rows = [ json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines() ]
+        self.assertTrue( len(rows) == 35 )
+        self.assertTrue( rows[0]['Genes'] == 'NRAS' )
+        self.assertTrue( self.client.get('/jobs/{0}/export/csv/'.format(job.key)).status_code == 404 )
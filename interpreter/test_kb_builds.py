@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from django.conf import settings
+from django.db import connections
+from .kb_builds import (checked_models, required_models, read_pointer, write_pointer, list_builds, build_path, served_path,
+    read_kb_version, check_build, publish_build, prune_builds, check_kb_build, reset_kb_build, use_kb_build, snapshot_path, served_snapshot_path, remove_build)
+from .models import KnowledgeBaseVersion
+"""
+Tests for the versioned knowledge base builds and the switch to a newly published build
+"""
+
+def make_kb_file(path, rows = 3, version = None):
+    """
+    Make a small SQLite file with the tables that are checked in a build
+    """
+    connection = sqlite3.connect(path)
+    for model in checked_models:
+        connection.execute("CREATE TABLE {0} (id INTEGER PRIMARY KEY)".format(model._meta.db_table))
+        connection.executemany("INSERT INTO {0} (id) VALUES (?)".format(model._meta.db_table), [ (i,) for i in range(rows) ])
+    connection.execute("CREATE TABLE {0} (id INTEGER PRIMARY KEY, version INTEGER, updated TEXT)".format(KnowledgeBaseVersion._meta.db_table))
+    if version is not None:
+        connection.execute("INSERT INTO {0} VALUES (1, ?, '')".format(KnowledgeBaseVersion._meta.db_table), (version,))
+    connection.commit()
+    connection.close()
+
+class TestKnowledgeBaseBuilds(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.kb_dir = os.path.join(self.tmpdir.name, 'kb')
+        os.makedirs(self.kb_dir)
+        self.served = os.path.join(self.tmpdir.name, 'interpreter.sqlite3')
+        make_kb_file(self.served, rows = 10, version = 5)
+        self.settings = override_settings(KB_DIR = self.kb_dir, INTERPRETER_DB = self.served, KNOWLEDGE_BASE_DB = None,
+            KB_CHECK_INTERVAL = 0, KB_MIN_ROW_FRACTION = 0.9, KB_KEEP_BUILDS = 1)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.tmpdir.cleanup()
+
+    def test_pointers(self):
+        self.assertTrue( read_pointer('current') is None )
+        self.assertTrue( served_path() == self.served )
+        write_pointer('current', 'interpreter-20190301-120000.sqlite3')
+        self.assertTrue( read_pointer('current') == 'interpreter-20190301-120000.sqlite3' )
+        self.assertTrue( served_path() == build_path('interpreter-20190301-120000.sqlite3') )
+        self.assertFalse( os.path.exists(build_path('current.tmp')) )
+        with override_settings(KNOWLEDGE_BASE_DB = '/pinned.sqlite3'):
+            self.assertTrue( served_path() == '/pinned.sqlite3' )
+
+    def test_check_build(self):
+        make_kb_file(build_path('interpreter-20190301-120000.sqlite3'), rows = 10)
+        self.assertTrue( check_build('interpreter-20190301-120000.sqlite3') == [] )
+        # fewer rows than the served knowledge base
+        make_kb_file(build_path('interpreter-20190302-120000.sqlite3'), rows = 5)
+        problems = check_build('interpreter-20190302-120000.sqlite3')
+        self.assertTrue( len(problems) == len(checked_models) )
+        self.assertTrue( check_build('interpreter-20190302-120000.sqlite3', min_row_fraction = 0) == [] )
+        # empty tables
+        make_kb_file(build_path('interpreter-20190303-120000.sqlite3'), rows = 0)
+        problems = check_build('interpreter-20190303-120000.sqlite3', min_row_fraction = 0)
+        self.assertTrue( len(problems) == len(required_models) )
+
+    def test_publish_and_prune(self):
+        for name in ['interpreter-20190301-120000.sqlite3', 'interpreter-20190302-120000.sqlite3', 'interpreter-20190303-120000.sqlite3']:
+            make_kb_file(build_path(name), version = 1)
+        # the version of a published build is above the one it replaces, so cached results are not reused
+        self.assertTrue( publish_build('interpreter-20190301-120000.sqlite3') == 6 )
+        self.assertTrue( publish_build('interpreter-20190302-120000.sqlite3') == 7 )
+        self.assertTrue( read_kb_version(build_path('interpreter-20190302-120000.sqlite3')) == 7 )
+        self.assertTrue( (read_pointer('current'), read_pointer('previous')) == ('interpreter-20190302-120000.sqlite3', 'interpreter-20190301-120000.sqlite3') )
+        # the newest build, the current one, and the previous one are kept
+        make_kb_file(build_path('interpreter-20190304-120000.sqlite3'))
+        self.assertTrue( prune_builds() == ['interpreter-20190303-120000.sqlite3'] )
+        self.assertTrue( list_builds() == ['interpreter-20190301-120000.sqlite3', 'interpreter-20190302-120000.sqlite3', 'interpreter-20190304-120000.sqlite3'] )
+
+    def test_snapshot(self):
+        """
+        Test that a build's snapshot is compiled again when it is published with a new version, and is served with the build
+        """
+        name = 'interpreter-20190301-120000.sqlite3'
+        make_kb_file(build_path(name), version = 6)
+        with open(snapshot_path(name), 'wb') as f:
+            f.write(b'IRKB')
+        # the build was stamped with the next version when it was made, so its snapshot is still current
+        with mock.patch('interpreter.kb_builds.run_build_step') as run_build_step:
+            self.assertTrue( publish_build(name) == 6 )
+            self.assertFalse( run_build_step.called )
+            # publishing it again needs a new version
+            self.assertTrue( publish_build(name) == 7 )
+            self.assertTrue( run_build_step.call_args[0] == ([os.path.join('interpreter', 'snapshot.py'), '--output', snapshot_path(name)], build_path(name)) )
+        remove_build(name)
+        self.assertFalse( os.path.exists(snapshot_path(name)) )
+
+    def test_served_snapshot(self):
+        """
+        Test that the snapshot of the build a worker switches to is used instead of the configured one
+        """
+        name = 'interpreter-20190301-120000.sqlite3'
+        make_kb_file(build_path(name), version = 1)
+        alias = 'kb_builds_test'
+        connections.databases[alias] = dict(connections.databases['knowledge_base'], NAME = self.served)
+        try:
+            reset_kb_build()
+            self.assertTrue( served_snapshot_path() == settings.INTERPRETER_SNAPSHOT )
+            publish_build(name)
+            self.assertTrue( check_kb_build(alias = alias) == name )
+            self.assertTrue( served_snapshot_path() == snapshot_path(name) )
+        finally:
+            connections[alias].close()
+            reset_kb_build()
+            del connections[alias]
+            del connections.databases[alias]
+        self.assertTrue( served_snapshot_path() == settings.INTERPRETER_SNAPSHOT )
+
+    def test_switch(self):
+        """
+        Test that a worker's database is switched to a newly published build, and that each thread reopens its connection
+        """
+        alias = 'kb_builds_test'
+        connections.databases[alias] = dict(connections.databases['knowledge_base'], NAME = self.served)
+        try:
+            reset_kb_build()
+            self.assertTrue( check_kb_build(alias = alias) is None )
+            make_kb_file(build_path('interpreter-20190301-120000.sqlite3'), rows = 2, version = 1)
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM {0}".format(checked_models[0]._meta.db_table))
+                self.assertTrue( cursor.fetchone()[0] == 10 )
+            publish_build('interpreter-20190301-120000.sqlite3')
+            self.assertTrue( check_kb_build(alias = alias) == 'interpreter-20190301-120000.sqlite3' )
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM {0}".format(checked_models[0]._meta.db_table))
+                self.assertTrue( cursor.fetchone()[0] == 2 )
+        finally:
+            connections[alias].close()
+            reset_kb_build()
+            del connections.databases[alias]
+
+    def test_use_build(self):
+        """
+        Test that a thread pointed at the build a report started on keeps reading it after the worker switches to a new build
+        """
+        alias = 'kb_builds_test'
+        name = 'interpreter-20190301-120000.sqlite3'
+        connections.databases[alias] = dict(connections.databases['knowledge_base'], NAME = self.served)
+
+        def count_rows(build, counts):
+            use_kb_build(build, alias = alias)
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM {0}".format(checked_models[0]._meta.db_table))
+                counts.append(cursor.fetchone()[0])
+            connections[alias].close()
+
+        def count_in_thread(build):
+            counts = []
+            thread = threading.Thread(target = count_rows, args = (build, counts))
+            thread.start()
+            thread.join()
+            return(counts[0])
+
+        try:
+            reset_kb_build()
+            self.assertTrue( check_kb_build(alias = alias) is None )
+            make_kb_file(build_path(name), rows = 2, version = 1)
+            publish_build(name)
+            self.assertTrue( check_kb_build(alias = alias) == name )
+            self.assertTrue( count_in_thread(None) == 10 )
+            self.assertTrue( count_in_thread(name) == 2 )
+        finally:
+            connections[alias].close()
+            reset_kb_build()
+            del connections.databases[alias]
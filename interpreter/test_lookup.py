@@ -0,0 +1,97 @@
+from io import StringIO
+from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from .models import PMKBVariant, PMKBInterpretation, PMKBLookup, TissueType, TumorType
+from .lookup import compile_pmkb_lookup, check_pmkb_lookup, fetch_pmkb_lookup
+from .cache import get_kb_version
+from .signals import suspend_kb_signals
+"""
+Tests for the denormalized PMKB lookup table
+"""
+
+class TestPMKBLookup(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        self.Any_tumor = TumorType.objects.create(type = "Any")
+        self.Lung = TissueType.objects.create(type = "Lung")
+        self.Skin = TissueType.objects.create(type = "Skin")
+        self.interpretation1 = PMKBInterpretation.objects.create(interpretation = "Foo", citations = "Foo", source_row = 2)
+        self.interpretation2 = PMKBInterpretation.objects.create(interpretation = "Bar", citations = "Bar", source_row = 1)
+        for i, (gene, variant, tissue, interpretation) in enumerate([
+            ('NRAS', 'NRAS Q61R', self.Lung, self.interpretation1),
+            ('NRAS', 'NRAS G12D', self.Skin, self.interpretation2),
+            ('KRAS', 'KRAS any mutation', self.Lung, self.interpretation2)
+            ]):
+            PMKBVariant.objects.create(gene = gene, tumor_type = self.Any_tumor, tissue_type = tissue, variant = variant,
+                tier = 1, interpretation = interpretation, source_row = i, uid = str(i))
+
+    def test_fetch(self):
+        results = fetch_pmkb_lookup(['NRAS', 'KRAS', 'EGFR'])
+        # grouped by interpretation, in the order of the PMKB source rows
+        self.assertTrue( [ variant.variant for variant in results['NRAS'] ] == ['NRAS G12D', 'NRAS Q61R'] )
+        self.assertTrue( results['EGFR'] == [] )
+        variant = results['KRAS'][0]
+        self.assertTrue( (variant.tissue_type.type, variant.tumor_type.type, variant.interpretation.interpretation) == ('Lung', 'Any', 'Bar') )
+        self.assertTrue( [ variant.variant for variant in fetch_pmkb_lookup(['NRAS'], tissue_type = 'Lung')['NRAS'] ] == ['NRAS Q61R'] )
+        self.assertTrue( [ variant.variant for variant in fetch_pmkb_lookup(['NRAS', 'KRAS'], variant = 'p.Gln61Arg')['NRAS'] ] == ['NRAS Q61R'] )
+
+    def test_fetch_queries(self):
+        """
+        Test that the variants for all genes are read with one query, and their interpretations with one more
+        """
+        with self.assertNumQueries(2, using = 'knowledge_base'):
+            fetch_pmkb_lookup(['NRAS', 'KRAS'])
+
+    def test_fetch_batches(self):
+        """
+        Test that the genes are queried 500 at a time, to stay under the SQLite limit on query parameters
+        """
+        genes = [ 'GENE{0}'.format(i) for i in range(1200) ] + ['NRAS', 'KRAS']
+        with self.assertNumQueries(4, using = 'knowledge_base'):
+            results = fetch_pmkb_lookup(genes)
+        self.assertTrue( [ variant.variant for variant in results['NRAS'] ] == ['NRAS G12D', 'NRAS Q61R'] )
+        self.assertTrue( len(results['KRAS']) == 1 )
+
+    def test_signals(self):
+        """
+        Test that the lookup table follows edits to the source tables
+        """
+        self.Lung.type = 'Lungs'
+        self.Lung.save()
+        self.assertTrue( PMKBLookup.objects.get(variant = 'KRAS any mutation').tissue_name == 'Lungs' )
+        self.interpretation2.source_row = 3
+        self.interpretation2.save()
+        self.assertTrue( [ variant.variant for variant in fetch_pmkb_lookup(['NRAS'])['NRAS'] ] == ['NRAS Q61R', 'NRAS G12D'] )
+        PMKBVariant.objects.get(uid = '0').delete()
+        self.assertTrue( PMKBLookup.objects.filter(gene = 'NRAS').count() == 1 )
+        self.assertTrue( check_pmkb_lookup() == [] )
+
+    def test_suspended_signals(self):
+        """
+        Test that the lookup table is rebuilt and the knowledge base version incremented once after a suspended import
+        """
+        version = get_kb_version()
+        with suspend_kb_signals():
+            for i in range(5):
+                PMKBVariant.objects.create(gene = 'EGFR', tumor_type = self.Any_tumor, tissue_type = self.Lung, variant = 'EGFR L858R',
+                    tier = 1, interpretation = self.interpretation1, source_row = 10 + i, uid = str(10 + i))
+            self.assertTrue( PMKBLookup.objects.filter(gene = 'EGFR').count() == 0 )
+            self.assertTrue( get_kb_version() == version )
+        self.assertTrue( PMKBLookup.objects.filter(gene = 'EGFR').count() == 5 )
+        self.assertTrue( get_kb_version() == version + 1 )
+        self.assertTrue( check_pmkb_lookup() == [] )
+
+    def test_check(self):
+        PMKBLookup.objects.filter(variant = 'NRAS Q61R').update(tier = 2)
+        PMKBLookup.objects.filter(variant = 'KRAS any mutation').delete()
+        problems = check_pmkb_lookup()
+        self.assertTrue( len(problems) == 2 )
+        self.assertTrue( 'does not match: tier' in problems[0] )
+        with self.assertRaises(CommandError):
+            call_command('check_pmkb_lookup', stdout = StringIO())
+        call_command('check_pmkb_lookup', repair = True, stdout = StringIO())
+        self.assertTrue( check_pmkb_lookup() == [] )
+        self.assertTrue( compile_pmkb_lookup() == 3 )
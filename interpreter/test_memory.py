@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .models import ReportJob
+from .memory import estimate_report_memory, count_upload_records, over_soft_limit
+"""
+Tests for the per-request memory tracing and the projected report memory limit
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
+
+class TestMemory(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+        self.settings = override_settings(JOB_DIR = self.job_dir)
+        self.settings.enable()
+        with open(IR_tsv, 'rb') as f:
+            self.upload = SimpleUploadedFile('SeraSeq.tsv', f.read())
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.job_dir)
+
+    def test_estimate(self):
+        self.assertTrue( count_upload_records(self.upload) == 35 )
+        # the upload is rewound for the report
+        self.assertTrue( self.upload.read(2) == b'##' )
+        # only one chunk of records is in memory at a time
+        self.assertTrue( estimate_report_memory(0, 100000, chunksize = 500) == estimate_report_memory(0, 500, chunksize = 500) )
+        self.assertTrue( estimate_report_memory(0, 10, chunksize = 500) < estimate_report_memory(0, 500, chunksize = 500) )
+        self.assertTrue( estimate_report_memory(10 * 1024 * 1024, 10, in_memory = False) < estimate_report_memory(10 * 1024 * 1024, 10) )
+        with override_settings(REPORT_MEMORY_SOFT_LIMIT = 0):
+            self.assertTrue( over_soft_limit(self.upload) is None )
+        with override_settings(REPORT_MEMORY_SOFT_LIMIT = 1):
+            self.assertTrue( over_soft_limit(self.upload) > 1 )
+
+    def test_soft_limit(self):
+        """
+        Test that uploads over the soft limit are run as background jobs, or rejected
+        """
+        with override_settings(REPORT_MEMORY_SOFT_LIMIT = 1, REPORT_MEMORY_SOFT_ACTION = 'background'):
+            response = self.client.post('/upload/', {'irtable': self.upload, 'tissue_type': 'Any', 'tumor_type': 'Any'})
+        job = ReportJob.objects.get()
+        self.assertTrue( response.status_code == 302 )
+        self.assertTrue( response['Location'].endswith(job.key + '/') )
+        self.upload.seek(0)
+        with override_settings(REPORT_MEMORY_SOFT_LIMIT = 1, REPORT_MEMORY_SOFT_ACTION = 'reject'):
+            response = self.client.post('/upload/', {'irtable': self.upload, 'tissue_type': 'Any', 'tumor_type': 'Any'})
+        self.assertTrue( response.status_code == 413 )
+        self.assertTrue( ReportJob.objects.count() == 1 )
+
+    def test_trace(self):
+        with override_settings(MEMORY_TRACE = True, MEMORY_TRACE_LINES = 5), self.assertLogs(level = 'INFO') as logs:
+            response = self.client.post('/upload/', {'irtable': self.upload, 'tissue_type': 'Any', 'tumor_type': 'Any'})
+            # the report is still streamed, and the trace is logged once it is finished
+            self.assertTrue( response.streaming )
+            self.assertFalse( any('peak traced memory' in line for line in logs.output) )
+            content = b''.join(response.streaming_content)
+        self.assertTrue( b'</html>' in content )
+        summary = [ line for line in logs.output if 'peak traced memory' in line ]
+        self.assertTrue( len(summary) == 1 )
+        self.assertTrue( summary[0].startswith('INFO:root:POST /upload/: peak traced memory') )
+        self.assertTrue( 'top 5 source lines' in summary[0] )
@@ -0,0 +1,70 @@
+import os
+import time
+import shutil
+import tempfile
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .profiling import list_profiles, purge_profiles
+"""
+Tests for the staff-only request profiling
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
+
+class TestProfiling(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.settings = override_settings(PROFILE_DIR = self.profile_dir)
+        self.settings.enable()
+        with open(IR_tsv, 'rb') as f:
+            self.upload = SimpleUploadedFile('SeraSeq.tsv', f.read())
+        self.staff = User.objects.create_user('staff', password = 'password', is_staff = True)
+        self.user = User.objects.create_user('user', password = 'password')
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.profile_dir)
+
+    def test_profile_upload(self):
+        self.client.force_login(self.staff)
+        response = self.client.post('/upload/', {'irtable': self.upload, 'tissue_type': 'Any', 'tumor_type': 'Any', 'profile': '1'})
+        self.assertTrue( response.status_code == 200 )
+        profiles = list_profiles()
+        self.assertTrue( len(profiles) == 1 )
+        self.assertTrue( profiles[0]['request'] == 'POST /upload/' )
+        url = response['X-Profile']
+        # the whole streamed report is included, with a link to the profile at the end
+        self.assertTrue( b'</html>' in response.content )
+        self.assertTrue( response.content.endswith('<a href="{0}" target="_blank">Profile {1}</a></p>'.format(url, profiles[0]['id']).encode('utf-8')) )
+        summary = b''.join(self.client.get(url).streaming_content).decode('utf-8')
+        self.assertTrue( 'Top 40 functions in the report modules and templates by cumulative time' in summary )
+        self.assertTrue( 'interpret.py' in summary )
+        self.assertTrue( self.client.get(url, {'download': '1'})['Content-Disposition'].endswith('.prof"') )
+        self.assertTrue( self.client.get('/profiles/').json()['profiles'][0]['url'] == url )
+        self.assertTrue( self.client.get('/profiles/20190301-120000-000000000000/').status_code == 404 )
+
+    def test_staff_only(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/upload/', {'irtable': self.upload, 'tissue_type': 'Any', 'tumor_type': 'Any', 'profile': '1'})
+        self.assertTrue( response.streaming )
+        self.assertFalse( response.has_header('X-Profile') )
+        # free the report slot, as the server does once the response is sent
+        response.close()
+        self.assertTrue( list_profiles() == [] )
+        # the profile views redirect to the admin login
+        self.assertTrue( self.client.get('/profiles/').status_code == 302 )
+
+    def test_purge(self):
+        for name, age in [('20190301-120000-000000000000', 100), ('20190302-120000-000000000000', 1)]:
+            for extension in ['prof', 'txt']:
+                path = os.path.join(self.profile_dir, '{0}.{1}'.format(name, extension))
+                with open(path, 'w') as f:
+                    f.write('GET /\n')
+                mtime = time.time() - age * 3600
+                os.utime(path, (mtime, mtime))
+        with override_settings(PROFILE_RETENTION_HOURS = 72):
+            self.assertTrue( purge_profiles() == 2 )
+        self.assertTrue( [ profile['id'] for profile in list_profiles() ] == ['20190302-120000-000000000000'] )
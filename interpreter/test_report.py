@@ -1,6 +1,16 @@
 import os
-from django.test import TestCase
-from .report import make_report_html
+import re
+import time
+import threading
+import itertools
+from unittest import mock
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import connections
+from .models import PMKBInterpretation, PMKBVariant, NYUInterpretation, TissueType, TumorType
+from . import report
+from .report import make_report_html, iter_report_html, count_ir_records, get_lookup_pool
+from .sources import get_source
+from .views import report_slots
 
 
 fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
@@ -17,3 +27,174 @@ class TestIR(TestCase):
         self.assertTrue(self.html.strip().startswith('<!DOCTYPE html>'))
     def test_report_content_end(self):
         self.assertTrue(self.html.strip().endswith('</html>'))
+
+class TestChunkedReport(TestCase):
+    def test_count_ir_records(self):
+        self.assertTrue( count_ir_records(IR_tsv) == 35 )
+
+    def test_chunked_report(self):
+        """
+        Test that a report generated in chunks contains every record and the summary
+        """
+        stages = []
+        html = ''.join(iter_report_html(input = IR_tsv, chunksize = 8, progress = lambda stage, percent: stages.append((stage, percent))))
+        self.assertTrue( html.strip().startswith('<!DOCTYPE html>') )
+        self.assertTrue( html.strip().endswith('</html>') )
+        self.assertTrue( 'IR Entries: 35<br>' in html )
+        self.assertTrue( html.count('class="irtable"') == 35 )
+        self.assertTrue( stages[0] == ('parsing', 0) )
+        self.assertTrue( stages[-1] == ('rendering', 80) )
+        self.assertTrue( [ percent for stage, percent in stages ] == sorted([ percent for stage, percent in stages ]) )
+
+    def test_memory_limit(self):
+        """
+        Test that the chunk size is halved while the report's memory use grows over the limit, and that the report is still generated
+        """
+        rss = itertools.count(100, 50)
+        with mock.patch('interpreter.report.get_rss_mb', lambda: next(rss)), self.assertLogs(level = 'WARNING') as logs:
+            html = ''.join(iter_report_html(input = IR_tsv, chunksize = 8, memory_limit = 10))
+        self.assertTrue( html.count('class="irtable"') == 35 )
+        reduced = [ line for line in logs.output if 'reducing chunk size' in line ]
+        self.assertTrue( [ line.rsplit(' ', 1)[1] for line in reduced ] == ['4', '2', '1'] )
+
+class TestReportSlots(TestCase):
+    multi_db = True
+
+    def test_unread_response(self):
+        """
+        Test that the report slot of a streamed report is freed when the response is closed before it is read
+        """
+        responses = []
+        for i in range(2):
+            with open(IR_tsv, 'rb') as f:
+                responses.append(self.client.post('/upload/', {'irtable': f}))
+        self.assertFalse( report_slots.acquire(blocking = False) )
+        for response in responses:
+            response.close()
+            response.close()
+        self.assertTrue( report_slots.acquire(blocking = False) )
+        self.assertTrue( report_slots.acquire(blocking = False) )
+        report_slots.release()
+        report_slots.release()
+
+class SharedInterpretationsMixin(object):
+    """
+    Knowledge base entries shared by two of the records, and the checks that they are rendered once
+    """
+    @classmethod
+    def create_interpretations(self):
+        Any_tumor = TumorType.objects.create(type = "Any")
+        Any_tissue = TissueType.objects.create(type = "Any")
+        self.pmkb = PMKBInterpretation.objects.create(interpretation = "PIK3CA PMKB interpretation text", citations = "PMKB citation", source_row = 1)
+        for i, variant in enumerate(['PIK3CA E545K', 'PIK3CA H1047R']):
+            PMKBVariant.objects.create(gene = 'PIK3CA', tumor_type = Any_tumor, tissue_type = Any_tissue, variant = variant,
+                tier = 1, interpretation = self.pmkb, source_row = 1, uid = str(i))
+        self.nyu = NYUInterpretation.objects.create(genes = 'PIK3CA', variant_type = 'snp', tumor_type = Any_tumor, tissue_type = Any_tissue,
+            interpretation = "PIK3CA NYU interpretation text", citations = "NYU citation")
+
+    def check_report(self, html):
+        # records 8 and 9 are both PIK3CA variants
+        self.assertTrue( html.count('href="#pmkb-{0}"'.format(self.pmkb.id)) == 2 )
+        self.assertTrue( html.count('id="pmkb-{0}"'.format(self.pmkb.id)) == 1 )
+        self.assertTrue( html.count('PMKB citation') == 1 )
+        self.assertTrue( html.count('href="#nyu-{0}"'.format(self.nyu.id)) == 2 )
+        self.assertTrue( html.count('id="nyu-{0}"'.format(self.nyu.id)) == 1 )
+        self.assertTrue( html.count('NYU citation') == 1 )
+
+class TestSharedInterpretations(SharedInterpretationsMixin, TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        self.create_interpretations()
+
+    def test_report(self):
+        self.check_report(make_report_html(input = IR_tsv))
+
+    def test_chunked_report(self):
+        """
+        Test that interpretations matched in different chunks are only rendered once
+        """
+        self.check_report(''.join(iter_report_html(input = IR_tsv, chunksize = 9)))
+
+class TestConcurrentLookups(SharedInterpretationsMixin, TransactionTestCase):
+    """
+    The knowledge sources are only looked up in the lookup threads when the test data is committed, so that the other
+    connections can see it
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.create_interpretations()
+
+    def test_same_report(self):
+        with override_settings(INTERPRET_THREADS = 3):
+            concurrent = ''.join(iter_report_html(input = IR_tsv, chunksize = 9))
+        with override_settings(INTERPRET_THREADS = 1):
+            sequential = ''.join(iter_report_html(input = IR_tsv, chunksize = 9))
+        self.check_report(concurrent)
+        self.assertTrue( re.sub(r'Execution time: .*s', '', concurrent) == re.sub(r'Execution time: .*s', '', sequential) )
+
+    def test_timeout(self):
+        """
+        Test that a report is still generated, with a warning, when one source does not return in time
+        """
+        threads = []
+        def slow_nyu_tier(ir_table, **params):
+            threads.append(threading.current_thread().name)
+            time.sleep(0.5)
+            return(ir_table)
+        source = get_source('nyu_tier')
+        source.interpret = slow_nyu_tier
+        try:
+            with override_settings(INTERPRET_THREADS = 3, INTERPRET_SOURCE_TIMEOUT = 0.1):
+                html = ''.join(iter_report_html(input = IR_tsv, chunksize = 20))
+        finally:
+            del source.interpret
+        self.assertTrue( len(threads) == 2 )
+        self.assertTrue( all([ name.startswith('interpret') for name in threads ]) )
+        self.assertTrue( html.count('<b>Warning:</b> NYU tier results are missing for some records') == 1 )
+        # the other sources are still in the report
+        self.check_report(html)
+
+    def test_deadline(self):
+        """
+        Test that the deadline of a source starts when a lookup thread starts running it, and not while it waits for one
+        """
+        get_lookup_pool()
+        held = 0
+        while report.lookup_slots.acquire(blocking = False):
+            held += 1
+        def release():
+            for i in range(held):
+                report.lookup_slots.release()
+        def slow_nyu_tier(ir_table, **params):
+            time.sleep(0.4)
+            return(ir_table)
+        source = get_source('nyu_tier')
+        source.interpret = slow_nyu_tier
+        timer = threading.Timer(0.4, release)
+        timer.start()
+        try:
+            with override_settings(INTERPRET_THREADS = 3, INTERPRET_SOURCE_TIMEOUT = 0.6):
+                html = ''.join(iter_report_html(input = IR_tsv))
+        finally:
+            timer.join()
+            del source.interpret
+        self.assertTrue( 'Warning' not in html )
+        self.check_report(html)
+
+    def test_closed_connections(self):
+        """
+        Test that the lookup threads close their database connections when each lookup finishes
+        """
+        threads = []
+        close_all = connections.close_all
+        def record_close_all():
+            threads.append(threading.current_thread().name)
+            close_all()
+        with override_settings(INTERPRET_THREADS = 3), mock.patch.object(connections, 'close_all', record_close_all):
+            self.check_report(''.join(iter_report_html(input = IR_tsv, chunksize = 9)))
+        # three sources for each of the four chunks
+        self.assertTrue( len(threads) == 12 )
+        self.assertTrue( all([ name.startswith('interpret') for name in threads ]) )
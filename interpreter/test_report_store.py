@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+from .models import PMKBInterpretation, PMKBVariant, TissueType, TumorType
+from .report import iter_report_html
+from .report_store import write_report_store, ReportStore
+"""
+Tests for storing the interpreted records of a report and reading them back one page or one record at a time
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
+
+class TestReportStore(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        Any_tumor = TumorType.objects.create(type = "Any")
+        Any_tissue = TissueType.objects.create(type = "Any")
+        self.interpretation = PMKBInterpretation.objects.create(interpretation = "PIK3CA interpretation text", citations = "PIK3CA citation", source_row = 1)
+        for i, variant in enumerate(['PIK3CA E545K', 'PIK3CA H1047R']):
+            PMKBVariant.objects.create(gene = 'PIK3CA', tumor_type = Any_tumor, tissue_type = Any_tissue, variant = variant,
+                tier = 1, interpretation = self.interpretation, source_row = 1, uid = str(i))
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'report.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_store(self):
+        context = write_report_store(IR_tsv, self.path, chunksize = 8)
+        self.assertTrue( context['num_IR_entries'] == 35 )
+        with ReportStore(self.path) as store:
+            self.assertTrue( store.num_records == 35 )
+            self.assertTrue( [ record['row'] for record in store.page(number = 2, size = 10) ] == list(range(10, 20)) )
+            self.assertTrue( len(store.page(number = 4, size = 10)) == 5 )
+            # records 8 and 9 are both PIK3CA variants
+            record = store.page(number = 1, size = 10)[8]
+            self.assertTrue( (record['genes'], record['num_pmkb'], record['num_pmkb_variants']) == ('PIK3CA', 1, 2) )
+            html = store.record_html(9)
+            self.assertTrue( 'id="pmkb-{0}"'.format(self.interpretation.id) in html )
+            self.assertTrue( 'PIK3CA citation' in html )
+            self.assertFalse( 'PIK3CA citation' in store.record_html(0) )
+            with self.assertRaises(KeyError):
+                store.record_html(35)
+
+    def test_full_report(self):
+        """
+        Test that the full report assembled from the store is the same as the report generated directly
+        """
+        write_report_store(IR_tsv, self.path)
+        with ReportStore(self.path) as store:
+            html = ''.join(store.iter_report_html())
+        direct = ''.join(iter_report_html(input = IR_tsv))
+        # only the execution time and the whitespace between records differ
+        html, direct = [ ' '.join(x.split('Execution time')[1].split('<br>', 1)[1].split()) for x in [html, direct] ]
+        self.assertTrue( html == direct )
+
+    def test_missing_store(self):
+        with self.assertRaises(Exception):
+            ReportStore(os.path.join(self.dir, 'missing.sqlite3'))
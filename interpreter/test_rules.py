@@ -0,0 +1,119 @@
+import os
+from django.test import TestCase
+from .models import PMKBVariant, PMKBVariantRule, PMKBInterpretation, TissueType, TumorType
+from .ir import IRTable, IRRecord
+from .interpret import interpret_pmkb
+from .rules import compile_variant_rule, record_features, RuleMatcher, compile_pmkb_rules
+"""
+Tests for compiling PMKB variant descriptions into rules, and matching IR records against them
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
+
+def make_record(genes, type, protein = float('nan'), coding = float('nan'), exon = float('nan'), copy_number = float('nan')):
+    return(IRRecord(data = {'Genes': genes, 'Type': type, 'Amino Acid Change': protein, 'Coding': coding,
+        'Exon': exon, 'Copy Number': copy_number, '% Frequency': float('nan')}))
+
+class TestCompileRules(TestCase):
+    def test_codon_rule(self):
+        rule = compile_variant_rule('KRAS', 'KRAS codon(s) 12, 13, 61 any')
+        self.assertTrue( (rule.rule_type, rule.codons, rule.consequence) == ('codon', (12, 13, 61), 'any') )
+
+    def test_exon_range_rule(self):
+        rule = compile_variant_rule('EGFR', 'EGFR exon(s) 18-21 missense')
+        self.assertTrue( (rule.rule_type, rule.exons, rule.consequence) == ('exon', (18, 19, 20, 21), 'missense') )
+
+    def test_any_rule(self):
+        self.assertTrue( compile_variant_rule('PTEN', 'PTEN any mutation').consequence == 'any' )
+        self.assertTrue( compile_variant_rule('APC', 'APC any nonsense').consequence == 'nonsense' )
+
+    def test_copy_number_rule(self):
+        rule = compile_variant_rule('ERBB2', 'ERBB2 copy number gain')
+        self.assertTrue( (rule.rule_type, rule.consequence) == ('copy_number', 'gain') )
+
+    def test_rearrangement_rule(self):
+        rule = compile_variant_rule('ERG', 'ERG-TMPRSS2 rearrangement')
+        self.assertTrue( (rule.rule_type, rule.partners) == ('rearrangement', ('ERG', 'TMPRSS2')) )
+
+    def test_variant_rule(self):
+        rule = compile_variant_rule('BRAF', 'BRAF V600E')
+        self.assertTrue( (rule.rule_type, rule.codons, rule.protein_key) == ('variant', (600, ), 'BRAF:p.V600E') )
+
+    def test_unknown_rule(self):
+        self.assertTrue( compile_variant_rule('KIT', 'KIT something else').rule_type == 'unknown' )
+        self.assertTrue( compile_variant_rule('KIT', float('nan')).rule_type == 'unknown' )
+
+class TestRuleMatcher(TestCase):
+    def setUp(self):
+        rules = [
+        (1, 'KRAS', 'KRAS codon(s) 12, 13 any'),
+        (2, 'KRAS', 'KRAS codon(s) 12 frameshift'),
+        (3, 'EGFR', 'EGFR exon(s) 19 deletion'),
+        (4, 'EGFR', 'EGFR L858R'),
+        (5, 'ERBB2', 'ERBB2 copy number gain'),
+        (6, 'ERG', 'ERG-TMPRSS2 rearrangement'),
+        (7, 'APC', 'APC any nonsense'),
+        (8, 'EGFR', 'EGFR any mutation'),
+        ]
+        self.matcher = RuleMatcher([ (id, compile_variant_rule(gene, variant)) for id, gene, variant in rules ])
+
+    def test_codon(self):
+        features = record_features(make_record('KRAS', 'SNV', protein = 'p.Gly12Asp', exon = 2))
+        self.assertTrue( self.matcher.match('KRAS', features) == frozenset([1]) )
+
+    def test_exon_deletion(self):
+        features = record_features(make_record('EGFR', 'INDEL', protein = 'p.Glu746_Ala750del', exon = 19))
+        self.assertTrue( self.matcher.match('EGFR', features) == frozenset([3, 8]) )
+
+    def test_specific_variant(self):
+        features = record_features(make_record('EGFR', 'SNV', protein = 'p.Leu858Arg', exon = 21))
+        self.assertTrue( self.matcher.match('EGFR', features) == frozenset([4, 8]) )
+
+    def test_copy_number(self):
+        self.assertTrue( self.matcher.match('ERBB2', record_features(make_record('ERBB2', 'CNV', copy_number = 8.5))) == frozenset([5]) )
+        self.assertTrue( self.matcher.match('ERBB2', record_features(make_record('ERBB2', 'CNV', copy_number = 1.0))) == frozenset() )
+
+    def test_rearrangement(self):
+        features = record_features(make_record('TMPRSS2(1) - ERG(2)', 'FUSION', exon = 1))
+        self.assertTrue( self.matcher.match('ERG', features) == frozenset([6]) )
+        features = record_features(make_record('EWSR1(7) - ERG(6)', 'FUSION', exon = 7))
+        self.assertTrue( self.matcher.match('ERG', features) == frozenset() )
+
+    def test_fusion_any_mutation(self):
+        features = record_features(make_record('EGFR(24) - SEPTIN14(10)', 'FUSION', exon = 24))
+        self.assertTrue( self.matcher.match('EGFR', features) == frozenset() )
+
+    def test_consequence(self):
+        self.assertTrue( self.matcher.match('APC', record_features(make_record('APC', 'SNV', protein = 'p.Arg1450Ter'))) == frozenset([7]) )
+        self.assertTrue( self.matcher.match('APC', record_features(make_record('APC', 'SNV', protein = 'p.Arg1450Gln'))) == frozenset() )
+
+class TestRuleMatching(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        Any_tumor = TumorType.objects.create(type = "Any")
+        Any_tissue = TissueType.objects.create(type = "Any")
+        for i, (gene, variant) in enumerate([('PIK3CA', 'PIK3CA codon(s) 542, 545 any'), ('PIK3CA', 'PIK3CA exon(s) 21 missense'),
+            ('PIK3CA', 'PIK3CA copy number gain'), ('EGFR', 'EGFR exon(s) 19 deletion')]):
+            interpretation = PMKBInterpretation.objects.create(interpretation = variant, citations = "Foo", source_row = i)
+            PMKBVariant.objects.create(gene = gene, tumor_type = Any_tumor, tissue_type = Any_tissue, variant = variant,
+                tier = 1, interpretation = interpretation, source_row = i, uid = str(i))
+
+    def test_rules_saved(self):
+        self.assertTrue( PMKBVariantRule.objects.count() == 4 )
+        self.assertTrue( PMKBVariant.objects.get(variant = 'EGFR exon(s) 19 deletion').rule.exons == '19' )
+        self.assertTrue( compile_pmkb_rules() == 4 )
+
+    def test_interpret_rules(self):
+        """
+        Test that only the rules that fire are reported for each record
+
+        SeraSeq.tsv records 8 and 9 are PIK3CA p.Glu545Lys (exon 10) and p.His1047Arg (exon 21), and record 18 is EGFR p.Glu746_Ala750del (exon 19)
+        """
+        ir_table = interpret_pmkb(ir_table = IRTable(source = IR_tsv), match_variants = True)
+        names = lambda record: [ interpretation['variant_names'] for interpretation in record.interpretations['pmkb'] ]
+        self.assertTrue( names(ir_table.records[8]) == [ ('PIK3CA codon(s) 542, 545 any',) ] )
+        self.assertTrue( names(ir_table.records[9]) == [ ('PIK3CA exon(s) 21 missense',) ] )
+        self.assertTrue( names(ir_table.records[18]) == [ ('EGFR exon(s) 19 deletion',) ] )
+        self.assertTrue( names(ir_table.records[19]) == [] )
@@ -0,0 +1,79 @@
+from django.test import TestCase
+from .models import PMKBVariant, PMKBInterpretation, NYUInterpretation, TissueType, TumorType
+from .search import make_match_query, compile_search_index, search_interpretations
+"""
+Tests for the full-text search over the PMKB and NYU interpretations
+"""
+
+class TestMatchQuery(TestCase):
+    def test_match_query(self):
+        self.assertTrue( make_match_query('osimertinib') == '"osimertinib"' )
+        self.assertTrue( make_match_query(' MAPK*  T790M/C797S ') == '"MAPK"* "T790M/C797S"' )
+        self.assertTrue( make_match_query('say "what" *') == '"say" """what"""' )
+        self.assertTrue( make_match_query('') == '' )
+
+class TestSearch(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        self.Any_tumor = TumorType.objects.create(type = "Any")
+        self.Any_tissue = TissueType.objects.create(type = "Any")
+        self.egfr = PMKBInterpretation.objects.create(
+            interpretation = "EGFR T790M confers resistance to first generation inhibitors; osimertinib is approved for these tumors.",
+            citations = "Mok TS, et al. Osimertinib or Platinum-Pemetrexed in EGFR T790M-Positive Lung Cancer. N Engl J Med 2017",
+            source_row = 1)
+        self.braf = PMKBInterpretation.objects.create(
+            interpretation = "BRAF V600E activates the MAPK pathway. <Vemurafenib> & dabrafenib are approved.",
+            citations = "Chapman PB, et al. Improved survival with vemurafenib in melanoma with BRAF V600E mutation.",
+            source_row = 2)
+        PMKBVariant.objects.create(gene = 'EGFR', tumor_type = self.Any_tumor, tissue_type = self.Any_tissue, variant = 'EGFR T790M',
+            tier = 1, interpretation = self.egfr, source_row = 1, uid = '1')
+        self.nyu = NYUInterpretation.objects.create(genes = 'KRAS NRAS', variant_type = 'SNV', tumor_type = self.Any_tumor, tissue_type = self.Any_tissue,
+            variant = 'any', interpretation = "Activating mutations in the MAPK pathway predict lack of response to cetuximab.", citations = "")
+
+    def test_search(self):
+        results = search_interpretations('osimertinib')
+        self.assertTrue( results['num_results'] == 1 )
+        result = results['results'][0]
+        self.assertTrue( (result['source'], result['id'], result['genes']) == ('pmkb', self.egfr.id, ['EGFR']) )
+        self.assertTrue( '<mark>osimertinib</mark>' in result['interpretation'] )
+        self.assertTrue( '<mark>Osimertinib</mark>' in result['citations'] )
+
+    def test_ranking_and_snippets(self):
+        results = search_interpretations('mapk')
+        self.assertTrue( sorted([ (result['source'], result['genes']) for result in results['results'] ]) == [('nyu_interpretation', ['KRAS', 'NRAS']), ('pmkb', [])] )
+        # the interpretation text is escaped around the marked terms
+        braf = [ result for result in results['results'] if result['id'] == self.braf.id ][0]
+        self.assertTrue( '&lt;Vemurafenib&gt; &amp; dabrafenib' in braf['interpretation'] )
+        # matches in the text rank above matches in the citations only
+        results = search_interpretations('vemurafenib')
+        self.assertTrue( results['results'][0]['id'] == self.braf.id )
+        self.assertTrue( search_interpretations('resist*')['num_results'] == 1 )
+        self.assertTrue( search_interpretations('osimertinib cetuximab')['num_results'] == 0 )
+        self.assertTrue( search_interpretations('')['results'] == [] )
+
+    def test_pagination(self):
+        results = search_interpretations('mapk', page = 1, size = 1)
+        self.assertTrue( (results['num_results'], results['num_pages'], len(results['results'])) == (2, 2, 1) )
+        second = search_interpretations('mapk', page = 2, size = 1)
+        self.assertTrue( second['results'][0]['id'] != results['results'][0]['id'] or second['results'][0]['source'] != results['results'][0]['source'] )
+        self.assertTrue( search_interpretations('mapk', page = 3, size = 1)['results'] == [] )
+
+    def test_signals(self):
+        """
+        Test that the search table follows edits and deletes of interpretations, and that it can be rebuilt
+        """
+        self.nyu.interpretation = "Resistance to panitumumab."
+        self.nyu.save()
+        self.assertTrue( search_interpretations('mapk')['num_results'] == 1 )
+        self.assertTrue( search_interpretations('panitumumab')['results'][0]['source'] == 'nyu_interpretation' )
+        self.braf.delete()
+        self.assertTrue( search_interpretations('mapk')['num_results'] == 0 )
+        self.assertTrue( compile_search_index() == 2 )
+        self.assertTrue( search_interpretations('panitumumab')['num_results'] == 1 )
+
+    def test_view(self):
+        response = self.client.get('/search/', {'q': 'osimertinib'})
+        self.assertTrue( response.json()['results'][0]['id'] == self.egfr.id )
+        self.assertTrue( self.client.get('/search/', {'q': 'osimertinib', 'page': 'x'}).status_code == 400 )
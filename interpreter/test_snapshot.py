@@ -0,0 +1,77 @@
+import os
+import tempfile
+from django.test import TestCase
+from .models import PMKBVariant, PMKBInterpretation, TissueType, TumorType, NYUTier, NYUInterpretation
+from .cache import get_kb_version
+from .snapshot import compile_snapshot, KnowledgeBaseSnapshot, activate_snapshot, get_snapshot
+from .interpret import query_pmkb, fetch_pmkb_variants, fetch_nyu_tiers, fetch_nyu_interpretations
+
+class TestSnapshot(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        Any_tumor = TumorType.objects.create(type = "Any")
+        Adenocarcinoma = TumorType.objects.create(type = "Adenocarcinoma")
+        Any_tissue = TissueType.objects.create(type = "Any")
+        Lung = TissueType.objects.create(type = "Lung")
+        interpretation1 = PMKBInterpretation.objects.create(interpretation = "Bar", citations = "Foo", source_row = 1)
+        interpretation2 = PMKBInterpretation.objects.create(interpretation = "Baz – é", citations = "Foo", source_row = 2)
+        PMKBVariant.objects.create(gene = 'NRAS', tumor_type = Any_tumor, tissue_type = Any_tissue, variant = 'NRAS Q61R',
+            tier = 1, interpretation = interpretation1, source_row = 1, uid = '1')
+        PMKBVariant.objects.create(gene = 'NRAS', tumor_type = Adenocarcinoma, tissue_type = Lung, variant = 'NRAS Q61K',
+            tier = 2, interpretation = interpretation2, source_row = 2, uid = '2')
+        PMKBVariant.objects.create(gene = 'EGFR', tumor_type = Adenocarcinoma, tissue_type = Lung, variant = 'EGFR L858R',
+            tier = 1, interpretation = interpretation2, source_row = 2, uid = '3')
+        NYUTier.objects.create(gene = 'NRAS', variant_type = 'snp', tumor_type = Any_tumor, tissue_type = Any_tissue,
+            coding = 'c.182A>G', protein = 'p.Gln61Arg', tier = 1, comment = '')
+        NYUInterpretation.objects.create(genes = 'CCDC6 - RET', variant_type = 'fusion', tumor_type = Any_tumor, tissue_type = Any_tissue,
+            interpretation = 'RET fusion', citations = '')
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'interpreter.snapshot')
+        compile_snapshot(output = self.path)
+
+    def tearDown(self):
+        activate_snapshot(kb_version = None, path = os.path.join(self.tmpdir.name, 'missing'))
+        self.tmpdir.cleanup()
+
+    def test_snapshot_lookups(self):
+        """
+        Test that lookups from the snapshot return the same entries as the database
+        """
+        snapshot = KnowledgeBaseSnapshot(self.path)
+        variants = snapshot.pmkb_variants('NRAS')
+        self.assertTrue( [ v.variant for v in variants ] == ['NRAS Q61R', 'NRAS Q61K'] )
+        self.assertTrue( variants[1].tumor_type.type == 'Adenocarcinoma' )
+        self.assertTrue( variants[1].interpretation.interpretation == "Baz – é" )
+        self.assertTrue( [ v.variant for v in snapshot.pmkb_variants('NRAS', tissue_type = 'Lung') ] == ['NRAS Q61K'] )
+        self.assertTrue( snapshot.pmkb_variants('NRAS', tumor_type = 'Carcinoma') == [] )
+        self.assertTrue( snapshot.pmkb_variants('IDH1') == [] )
+        self.assertTrue( [ t.protein for t in snapshot.nyu_tiers('NRAS') ] == ['p.Gln61Arg'] )
+        self.assertTrue( [ i.interpretation for i in snapshot.nyu_interpretations('RET') ] == ['RET fusion'] )
+        self.assertTrue( snapshot.nyu_interpretations('-') == [] )
+        snapshot.close()
+
+    def test_interpret_uses_active_snapshot(self):
+        """
+        Test that the interpret lookups are answered from the snapshot when it matches the current knowledge base version
+        """
+        self.assertTrue( activate_snapshot(kb_version = get_kb_version(), path = self.path) is not None )
+        self.assertTrue( get_snapshot() is not None )
+        db_results = [ (v.id, v.variant) for v in PMKBVariant.objects.filter(gene = 'NRAS') ]
+        snapshot_results = [ (v.id, v.variant) for v in fetch_pmkb_variants(gene = 'NRAS') ]
+        self.assertTrue( sorted(db_results) == sorted(snapshot_results) )
+        self.assertTrue( len(fetch_nyu_tiers(gene = 'NRAS')) == 1 )
+        self.assertTrue( len(fetch_nyu_interpretations(gene = 'CCDC6')) == 1 )
+        results = query_pmkb(genes = ['NRAS', 'EGFR'])
+        self.assertTrue( [ r['interpretation'].interpretation for r in results ] == ['Bar', "Baz – é"] )
+        self.assertTrue( results[1]['genes'] == ('EGFR', 'NRAS') )
+
+    def test_stale_snapshot_ignored(self):
+        """
+        Test that a snapshot built from an older knowledge base version is not used
+        """
+        self.assertTrue( activate_snapshot(kb_version = get_kb_version() + 1, path = self.path) is None )
+        self.assertTrue( get_snapshot() is None )
@@ -0,0 +1,114 @@
+import os
+from unittest import mock
+from django.test import TestCase
+from .models import NYUTier, TissueType, TumorType
+from .report import make_report_html, iter_report_html
+from .cache import get_cache
+from .kb_builds import import_types, get_import_types
+from .interpret import query_nyu_tier
+from .sources import InterpretationSource, get_source, get_sources, register_source, unregister_source
+"""
+Tests for the registry of interpretation sources
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
+
+class GeneCountSource(InterpretationSource):
+    """
+    A source that only counts the genes of each record, to test the registry without a knowledge base table
+    """
+    name = 'gene_count'
+    label = 'Gene count'
+    import_types = ('gene_count',)
+
+    def query(self, genes, **params):
+        return([ "{0} genes".format(len(genes)) ])
+
+class TestSources(TestCase):
+    multi_db = True
+
+    def test_registry(self):
+        self.assertTrue( [ source.name for source in get_sources() ] == ['pmkb', 'nyu_tier', 'nyu_interpretation'] )
+        # always in the registered order
+        self.assertTrue( [ source.name for source in get_sources(['nyu_interpretation', 'pmkb']) ] == ['pmkb', 'nyu_interpretation'] )
+        self.assertTrue( get_source('nyu_tier').label == 'NYU tier' )
+        with self.assertRaises(ValueError):
+            get_sources(['pmkb', 'civic'])
+        self.assertTrue( get_import_types() == import_types )
+        # a source has to implement its query
+        with self.assertRaises(TypeError):
+            type('NoQuerySource', (InterpretationSource,), {'name': 'no_query'})()
+
+    def test_disabled_source(self):
+        html = make_report_html(input = IR_tsv, sources = ['pmkb'])
+        self.assertTrue( html.count('<th>Tier</th>') == 35 )
+        self.assertTrue( 'NYU Tier' not in html )
+        self.assertTrue( '<th>VariantType</th>' not in html )
+        chunked = ''.join(iter_report_html(input = IR_tsv, chunksize = 10, sources = ['nyu_tier']))
+        self.assertTrue( chunked.count('<th>NYU Tier</th>') == 35 )
+        self.assertTrue( '<th>Tier</th>' not in chunked )
+
+    def test_registered_source(self):
+        """
+        Test that a new source is looked up, rendered with the generic template, and imported in full builds
+        """
+        register_source(GeneCountSource())
+        try:
+            html = ''.join(iter_report_html(input = IR_tsv, chunksize = 10))
+            self.assertTrue( get_import_types() == import_types + ['gene_count'] )
+        finally:
+            unregister_source('gene_count')
+        self.assertTrue( html.count('<th>Gene count</th>') == 35 )
+        self.assertTrue( '<td>1 genes</td>' in html )
+        self.assertTrue( html.count('<th>Tier</th>') == 35 )
+        self.assertTrue( [ source.name for source in get_sources() ] == ['pmkb', 'nyu_tier', 'nyu_interpretation'] )
+
+    def test_upload_sources(self):
+        with open(IR_tsv, 'rb') as f:
+            response = self.client.post('/upload/', {'irtable': f, 'tissue_type': 'Any', 'tumor_type': 'Any', 'sources': ['nyu_tier']})
+        html = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue( html.count('<th>NYU Tier</th>') == 35 )
+        self.assertTrue( '<th>Tier</th>' not in html )
+        with open(IR_tsv, 'rb') as f:
+            response = self.client.post('/upload/', {'irtable': f, 'sources': ['civic']})
+        self.assertTrue( response.content == b'Error: Unknown interpretation source: civic' )
+        self.assertTrue( b'name="sources" value="nyu_interpretation" checked' in self.client.get('/').content )
+
+class TestPrefetch(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        Any_tumor = TumorType.objects.create(type = "Any")
+        Any_tissue = TissueType.objects.create(type = "Any")
+        NYUTier.objects.bulk_create([ NYUTier(gene = 'GENE{0}'.format(i), variant_type = 'snp', tumor_type = Any_tumor, tissue_type = Any_tissue,
+            coding = 'c.1A>G', protein = 'p.M1V', tier = 1) for i in range(600) ])
+
+    def test_prefetch(self):
+        """
+        Test that the NYU tiers for many genes are read with one query per 500 genes, and then looked up from the cache
+        """
+        get_cache().validate()
+        genes = [ 'GENE{0}'.format(i) for i in range(600) ]
+        with self.assertNumQueries(2, using = 'knowledge_base'):
+            get_source('nyu_tier').prefetch(genes)
+        # only the knowledge base version is checked
+        with self.assertNumQueries(1, using = 'knowledge_base'):
+            results = get_source('nyu_tier').lookup([ [gene] for gene in genes ])
+        self.assertTrue( len(results) == 600 )
+        self.assertTrue( results[599] == query_nyu_tier(['GENE599']) )
+        self.assertTrue( results[0][0]['tiers'][0].protein == 'p.M1V' )
+
+    def test_prefetch_variants(self):
+        """
+        Test that only the genes of records looked up without a variant, e.g. fusions with 'match_variants', are prefetched
+        """
+        get_cache().validate()
+        source = get_source('nyu_tier')
+        with mock.patch.object(source, 'prefetch') as prefetch:
+            results = source.lookup([['GENE1'], ['GENE2']], params = [{'variant': 'p.M1V'}, {'variant': None}])
+        self.assertTrue( prefetch.call_args[0] == (['GENE2'],) )
+        self.assertTrue( results[1][0]['tiers'][0].gene == 'GENE2' )
+        with mock.patch.object(source, 'prefetch') as prefetch:
+            source.lookup([['GENE3']], params = [{'variant': 'p.M1V'}])
+        self.assertFalse( prefetch.called )
@@ -0,0 +1,57 @@
+from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .models import TissueType, TumorType
+from .type_lists import TypeIndex, get_type_lists, clear_type_lists
+"""
+Tests for the cached tissue and tumor type lists, the index page, and the type autocomplete endpoint
+"""
+
+class TestTypeIndex(TestCase):
+    def test_search(self):
+        index = TypeIndex(['Lung', 'Non-Small Cell Lung Carcinoma', 'Skin', 'Small Intestine'])
+        self.assertTrue( index.search('lu') == ['Lung', 'Non-Small Cell Lung Carcinoma'] )
+        self.assertTrue( index.search('SMALL') == ['Non-Small Cell Lung Carcinoma', 'Small Intestine'] )
+        self.assertTrue( index.search('small c') == ['Non-Small Cell Lung Carcinoma'] )
+        self.assertTrue( index.search('ung') == [] )
+        self.assertTrue( index.search('', limit = 2) == ['Lung', 'Non-Small Cell Lung Carcinoma'] )
+
+class TestTypeViews(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        for type in ['Any', 'Lung', 'Skin']:
+            TissueType.objects.create(type = type)
+        for type in ['Any', 'Adenocarcinoma', 'Melanoma']:
+            TumorType.objects.create(type = type)
+
+    def setUp(self):
+        # the lists are held between tests, and the knowledge base version is rolled back after each one
+        clear_type_lists()
+
+    def test_index_warm_cache(self):
+        """
+        Test that the index page and the autocomplete endpoint do not query the database once the type lists are loaded
+        """
+        self.assertTrue( self.client.get('/').status_code == 200 )
+        self.client.get('/types/tissue/', {'q': 'lu'})
+        with self.assertNumQueries(0), self.assertNumQueries(0, using = 'knowledge_base'):
+            response = self.client.get('/')
+            self.client.get('/types/tissue/', {'q': 'lu'})
+        self.assertTrue( response.status_code == 200 )
+        self.assertFalse( b'<option value="Lung">' in response.content )
+
+    def test_autocomplete(self):
+        self.assertTrue( self.client.get('/types/tissue/', {'q': 'lu'}).json()['results'] == ['Lung'] )
+        self.assertTrue( self.client.get('/types/tumor/').json()['results'] == ['Adenocarcinoma', 'Any', 'Melanoma'] )
+        self.assertTrue( self.client.get('/types/foo/').status_code == 404 )
+
+    def test_reload_on_change(self):
+        self.assertTrue( ('tissue', 'Brain') not in get_type_lists() )
+        TissueType.objects.create(type = 'Brain')
+        self.assertTrue( ('tissue', 'Brain') in get_type_lists() )
+
+    def test_unknown_type(self):
+        upload = SimpleUploadedFile('SeraSeq.tsv', b'')
+        response = self.client.post('/upload/', {'irtable': upload, 'tissue_type': 'Lungs', 'tumor_type': 'Any'})
+        self.assertTrue( response.content == b'Error: Unknown tissue type: Lungs' )
@@ -0,0 +1,91 @@
+import os
+from django.test import TestCase
+from .models import PMKBVariant, PMKBInterpretation, NYUTier, TissueType, TumorType
+from .ir import IRTable
+from .interpret import interpret_pmkb, interpret_nyu_tier
+from .variants import make_variant_key, variant_key_str
+"""
+Tests for normalizing variants, and for matching IR records to knowledge base entries by variant
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+NRAS_IDH1_tsv = os.path.join(fixtures_dir, "NRAS_IDH1.tsv")
+
+class TestVariantKeys(TestCase):
+    def test_protein_three_letter(self):
+        self.assertTrue( variant_key_str('NRAS', 'p.Gln61Arg') == 'NRAS:p.Q61R' )
+
+    def test_protein_pmkb(self):
+        self.assertTrue( variant_key_str('NRAS', 'NRAS Q61R') == 'NRAS:p.Q61R' )
+
+    def test_protein_deletion(self):
+        self.assertTrue( variant_key_str('EGFR', 'p.Glu746_Ala750del') == variant_key_str('EGFR', 'EGFR E746_A750del') == 'EGFR:p.E746_A750del' )
+
+    def test_protein_insertion(self):
+        self.assertTrue( variant_key_str('ERBB2', 'p.Glu770_Ala771insAlaTyrValMet') == 'ERBB2:p.E770_A771insAYVM' )
+
+    def test_protein_frameshift(self):
+        self.assertTrue( variant_key_str('APC', 'p.Glu1309AspfsTer4') == variant_key_str('APC', 'APC E1309fs') == 'APC:p.E1309fs' )
+
+    def test_protein_nonsense(self):
+        self.assertTrue( variant_key_str('CDKN2A', 'p.Trp110Ter') == variant_key_str('CDKN2A', 'CDKN2A W110*') )
+
+    def test_coding(self):
+        self.assertTrue( variant_key_str('NRAS', 'c.182a>g') == 'NRAS:c.182A>G' )
+        self.assertTrue( variant_key_str('EGFR', 'c.2236_2250delGAATTAAGAGAAGCA') == variant_key_str('EGFR', 'c.2236_2250del15') )
+
+    def test_key_fields(self):
+        key = make_variant_key('NRAS', 'p.Gln61Arg')
+        self.assertTrue( (key.gene, key.position, key.ref, key.alt) == ('NRAS', '61', 'Q', 'R') )
+
+    def test_not_specific(self):
+        """
+        Rules and unknown changes do not have a variant key
+        """
+        for text in ['KRAS codon(s) 12, 13 any', 'KRAS any mutation', 'KIT exon(s) 11 deletion', 'p.?', '', float('nan')]:
+            self.assertTrue( make_variant_key('KRAS', text) is None, text )
+
+class TestVariantMatching(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpTestData(self):
+        Any_tumor = TumorType.objects.create(type = "Any")
+        Any_tissue = TissueType.objects.create(type = "Any")
+        for i, variant in enumerate(['NRAS Q61R', 'NRAS Q61K', 'NRAS any mutation', 'IDH1 R132C']):
+            interpretation = PMKBInterpretation.objects.create(interpretation = variant, citations = "Foo", source_row = i)
+            PMKBVariant.objects.create(
+                gene = variant.split()[0],
+                tumor_type = Any_tumor,
+                tissue_type = Any_tissue,
+                variant = variant,
+                tier = 1,
+                interpretation = interpretation,
+                source_row = i,
+                uid = str(i)
+            )
+        for protein, coding in [('p.Gln61Arg', 'c.182A>G'), ('p.Gln61Lys', 'c.181C>A')]:
+            NYUTier.objects.create(gene = 'NRAS', variant_type = 'snp', tumor_type = Any_tumor, tissue_type = Any_tissue,
+                coding = coding, protein = protein, tier = 1)
+
+    def test_keys_saved(self):
+        self.assertTrue( PMKBVariant.objects.get(variant = 'NRAS Q61R').protein_key == 'NRAS:p.Q61R' )
+        self.assertTrue( PMKBVariant.objects.get(variant = 'NRAS any mutation').protein_key == '' )
+        self.assertTrue( NYUTier.objects.get(protein = 'p.Gln61Arg').coding_key == 'NRAS:c.182A>G' )
+
+    def test_pmkb_gene_level(self):
+        """
+        Without variant matching, every interpretation for the gene is returned
+        """
+        ir_table = interpret_pmkb(ir_table = IRTable(source = NRAS_IDH1_tsv))
+        self.assertTrue( len(ir_table.records[0].interpretations['pmkb']) == 3 )
+
+    def test_pmkb_match_variants(self):
+        ir_table = interpret_pmkb(ir_table = IRTable(source = NRAS_IDH1_tsv), match_variants = True)
+        nras = ir_table.records[0].interpretations['pmkb']
+        self.assertTrue( [ interpretation['variant_names'] for interpretation in nras ] == [ ('NRAS Q61R',), ('NRAS any mutation',) ] )
+        idh1 = ir_table.records[1].interpretations['pmkb']
+        self.assertTrue( [ interpretation['variant_names'] for interpretation in idh1 ] == [ ('IDH1 R132C',) ] )
+
+    def test_nyu_tier_match_variants(self):
+        ir_table = interpret_nyu_tier(ir_table = IRTable(source = NRAS_IDH1_tsv), match_variants = True)
+        self.assertTrue( [ result['protein'] for result in ir_table.records[0].interpretations['nyu_tier'] ] == ['p.Gln61Arg'] )
@@ -0,0 +1,103 @@
+import os
+import io
+import gzip
+import shutil
+import tempfile
+from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .vcf import VCFReader, is_vcf, count_vcf_records, read_table
+from .filters import parse_filters
+from .report import make_report_html, iter_report_html, count_ir_records
+"""
+Tests for reading annotated .vcf files
+"""
+fixtures_dir = os.path.join(os.path.dirname(__file__), "fixtures")
+IR_tsv = os.path.join(fixtures_dir, "SeraSeq.tsv")
+annotated_vcf = os.path.join(fixtures_dir, "annotated.vcf")
+
+# a VEP annotated line and an Ion Reporter line, with the counts in the first sample
+other_vcf = '\n'.join([
+    '##fileformat=VCFv4.1',
+    '##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations from Ensembl VEP. Format: Allele|Consequence|IMPACT|SYMBOL|Gene|Feature_type|Feature|BIOTYPE|EXON|INTRON|HGVSc|HGVSp">',
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE',
+    'chr7\t140453136\t.\tA\tT\t.\t.\tCSQ=T|missense_variant|MODERATE|BRAF|ENSG00000157764|Transcript|ENST00000288602|protein_coding|15/18||ENST00000288602.6:c.1799T>A|ENSP00000288602.6:p.Val600Glu\tGT:AF:DP\t0/1:0.35:400',
+    "chr12\t25398284\t.\tC\tT\t.\tPASS\tTYPE=snp;FUNC=[{'origAlt':'T','gene':'KRAS','coding':'c.35G>A','protein':'p.Gly12Asp','transcript':'NM_033360.3','function':'missense','location':'exonic','exon':'2','oncomineGeneClass':'Gain-of-Function','oncomineVariantClass':'Hotspot'}]\tGT:AO:DP\t0/1:40:800",
+    ''])
+
+class TestVCFReader(TestCase):
+    def test_read(self):
+        reader = VCFReader(annotated_vcf, filters = parse_filters('pass_only'))
+        table = reader.read_table()
+        # the filtered line and the line without a gene are dropped; the line with two alleles is two records
+        self.assertTrue( [ record.genes for record in table.records ] == [['NRAS'], ['ALK'], ['ALK'], ['PIK3CA'], ['EGFR']] )
+        self.assertTrue( (reader.num_records, reader.num_filtered) == (7, 1) )
+        self.assertTrue( table.filtered == {'pass_only': 1} )
+        self.assertTrue( [ record.data['Row'] for record in table.records ] == [0, 2, 2, 4, 5] )
+        nras = table.records[0]
+        self.assertTrue( (nras.protein_change, nras.coding_change, nras.af_str) == ('p.Gln61Arg', 'c.182A>G', '11.27') )
+        self.assertTrue( (nras.data['Type'], nras.data['Coverage'], nras.data['Read Counts'], nras.data['Exon']) == ('SNV', 1996, 225, '3') )
+        self.assertTrue( [ record.coding_change for record in table.records[1:3] ] == ['c.3522C>A', 'c.3522C>G'] )
+        self.assertTrue( [ record.af_str for record in table.records[1:3] ] == ['30.0', '2.0'] )
+        # the frequency is computed from the read counts when there is no AF
+        self.assertTrue( table.records[3].af_str == '20.0' )
+        self.assertTrue( table.records[4].data['Type'] == 'INDEL' )
+
+    def test_filters(self):
+        self.assertTrue( len(VCFReader(annotated_vcf).read_table().records) == 6 )
+        self.assertTrue( [ record.af_str for record in read_table(annotated_vcf, vcf_filters = 'pass_only,min_af=5').records ] == ['11.27', '30.0', '20.0', '25.0'] )
+        self.assertTrue( len(read_table(annotated_vcf, vcf_filters = 'min_coverage=1000').records) == 4 )
+
+    def test_gzip(self):
+        """
+        Test that compressed files and uploads are read in chunks
+        """
+        with open(annotated_vcf, 'rb') as f:
+            compressed = gzip.compress(f.read())
+        upload = io.BytesIO(compressed)
+        self.assertTrue( is_vcf(upload) )
+        self.assertTrue( upload.tell() == 0 )
+        self.assertTrue( [ len(table.records) for table in VCFReader(upload, chunksize = 2) ] == [2, 2, 2] )
+        self.assertFalse( upload.closed )
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'annotated.vcf.gz')
+            with open(path, 'wb') as f:
+                f.write(compressed)
+            self.assertTrue( count_vcf_records(path) == 6 )
+            self.assertTrue( count_ir_records(path) == 6 )
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertFalse( is_vcf(IR_tsv) )
+
+    def test_annotations(self):
+        """
+        Test the VEP and Ion Reporter annotations
+        """
+        table = read_table(io.BytesIO(other_vcf.encode('utf-8')))
+        braf, kras = table.records
+        self.assertTrue( (braf.genes, braf.coding_change, braf.protein_change, braf.af_str, braf.data['Exon']) == (['BRAF'], 'c.1799T>A', 'p.Val600Glu', '35.0', '15') )
+        self.assertTrue( (kras.genes, kras.protein_change, kras.af_str, kras.data['Type']) == (['KRAS'], 'p.Gly12Asp', '5.0', 'SNV') )
+        self.assertTrue( kras.data['Oncomine Variant Class'] == 'Hotspot' )
+
+class TestVCFReport(TestCase):
+    multi_db = True
+
+    def test_report(self):
+        html = make_report_html(input = annotated_vcf)
+        self.assertTrue( 'IR Entries: 5<br>' in html )
+        self.assertTrue( html.count('class="irtable"') == 5 )
+        # the records dropped by the .vcf filters are listed with the report filters
+        self.assertTrue( 'Filtered Out: 1 (pass_only: 1)' in html )
+        chunked = ''.join(iter_report_html(input = annotated_vcf, chunksize = 2, vcf_filters = ''))
+        self.assertTrue( 'IR Entries: 6<br>' in chunked )
+        self.assertTrue( 'p.Gly12Asp' in chunked )
+
+    def test_upload(self):
+        with open(annotated_vcf, 'rb') as f:
+            upload = SimpleUploadedFile('annotated.vcf.gz', gzip.compress(f.read()))
+        response = self.client.post('/upload/', {'irtable': upload, 'tissue_type': 'Any', 'tumor_type': 'Any'})
+        html = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue( 'IR Entries: 5<br>' in html )
+        upload = SimpleUploadedFile('annotated.bcf', b'')
+        response = self.client.post('/upload/', {'irtable': upload})
+        self.assertTrue( response.content == b'Error: Invalid file type, filename must end with ".tsv", ".vcf", or ".vcf.gz"' )
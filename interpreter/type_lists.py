@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for the lists of tissue and tumor types shown on the upload form
+
+The lists are loaded once per worker for each knowledge base version, along with a prefix index used to autocomplete
+the type names. The knowledge base version is checked at most every ``settings.TYPE_LIST_CHECK_INTERVAL`` seconds,
+so that the index page and the autocomplete endpoint do not need any database queries while the lists are loaded.
+"""
+import time
+import bisect
+import logging
+import threading
+from django.conf import settings
+from .models import TumorType, TissueType
+from .cache import get_kb_version
+
+logger = logging.getLogger()
+
+class TypeIndex(object):
+    """
+    Prefix index of type names, matching the start of any word in a name, case insensitive
+
+    Parameters
+    ----------
+    types: list
+        the type names
+
+    Examples
+    --------
+    Example usage::
+
+        index = TypeIndex(['Lung', 'Non-Small Cell Lung Carcinoma', 'Skin'])
+        index.search('lu')
+        >>> ['Lung', 'Non-Small Cell Lung Carcinoma']
+        index.search('small c')
+        >>> ['Non-Small Cell Lung Carcinoma']
+
+    """
+    def __init__(self, types):
+        self.types = sorted(set(types))
+        keys = []
+        for type in self.types:
+            name = type.lower()
+            for start in range(len(name)):
+                # index the name from the start of each word
+                if start == 0 or (not name[start - 1].isalnum() and name[start].isalnum()):
+                    keys.append((name[start:], type))
+        keys.sort()
+        self.keys = [ key for key, type in keys ]
+        self.values = [ type for key, type in keys ]
+
+    def search(self, prefix, limit = None):
+        """
+        Get the types with a word that starts with the prefix, in alphabetical order
+
+        Parameters
+        ----------
+        prefix: str
+            the start of a word in the type name; all types are returned for an empty prefix
+        limit: int
+            the maximum number of types to return
+
+        Returns
+        -------
+        list
+            the matching type names
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            matches = self.types
+        else:
+            matches = set()
+            i = bisect.bisect_left(self.keys, prefix)
+            while i < len(self.keys) and self.keys[i].startswith(prefix):
+                matches.add(self.values[i])
+                i += 1
+            matches = sorted(matches)
+        if limit is not None:
+            matches = matches[:limit]
+        return(list(matches))
+
+class TypeLists(object):
+    """
+    The tissue and tumor types in the knowledge base for a single knowledge base version, and their prefix indexes
+    """
+    def __init__(self, version):
+        self.version = version
+        self.loaded = time.time()
+        self.checked = self.loaded
+        self.types = {
+        'tissue': sorted(TissueType.objects.values_list('type', flat = True).distinct()),
+        'tumor': sorted(TumorType.objects.values_list('type', flat = True).distinct())
+        }
+        self.indexes = { type: TypeIndex(types) for type, types in self.types.items() }
+
+    def search(self, type, prefix, limit = None):
+        """
+        Get the tissue or tumor types with a word that starts with the prefix
+        """
+        return(self.indexes[type].search(prefix, limit = limit))
+
+    def __contains__(self, item):
+        """
+        Check if a ``(type, name)`` pair is in the lists, e.g. ``('tissue', 'Lung') in type_lists``
+        """
+        type, name = item
+        return(name in self.indexes[type].types)
+
+_type_lists = None
+_type_lists_lock = threading.Lock()
+
+def get_type_lists():
+    """
+    Get the tissue and tumor type lists for the current knowledge base version
+
+    The lists are reloaded if the knowledge base version has changed; the version is only checked if the lists were
+    last checked more than ``settings.TYPE_LIST_CHECK_INTERVAL`` seconds ago.
+
+    Returns
+    -------
+    TypeLists
+        the lists shared by all threads of this worker
+    """
+    global _type_lists
+    with _type_lists_lock:
+        now = time.time()
+        if _type_lists is None or now - _type_lists.checked > settings.TYPE_LIST_CHECK_INTERVAL:
+            version = get_kb_version()
+            if _type_lists is None or _type_lists.version != version:
+                _type_lists = TypeLists(version)
+                logger.info("loaded {0} tissue types and {1} tumor types for knowledge base version {2}".format(
+                    len(_type_lists.types['tissue']), len(_type_lists.types['tumor']), version))
+            _type_lists.checked = now
+        return(_type_lists)
+
+def clear_type_lists():
+    """
+    Drop this worker's type lists, so that they are reloaded on the next lookup
+    """
+    global _type_lists
+    with _type_lists_lock:
+        _type_lists = None
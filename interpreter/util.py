@@ -3,6 +3,8 @@
 """
 Utility functions to use in the app
 """
+import os
+import resource
 def capitalize(x):
     """
     Capitalize the first letter of every word in a string,
@@ -92,3 +94,25 @@ def debugger(vars):
     vars.update(locals())
     shell = code.InteractiveConsole(vars)
     shell.interact()
+
+def get_rss_mb():
+    """
+    Get the resident memory size of the current process in MB
+
+    Uses ``/proc/self/statm`` where available, otherwise the peak resident size reported by ``getrusage``
+
+    Returns
+    -------
+    float
+        resident memory in MB
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024))
+    except (OSError, ValueError, IndexError):
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kB on Linux
+        if os.uname()[0] == 'Darwin':
+            return(maxrss / (1024 * 1024))
+        return(maxrss / 1024)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for normalizing protein and coding sequence changes to canonical variant keys
+
+Ion Reporter writes changes in three-letter HGVS notation (``p.Gln61Arg``, ``c.182A>G``) while the knowledge bases use
+free text such as ``NRAS Q61R``; both are converted to the same key, e.g. ``NRAS:p.Q61R``, so that variants can be
+matched with an indexed equality lookup.
+"""
+import re
+from collections import namedtuple
+
+# three-letter amino acid codes, and the stop codon
+amino_acids = {
+'Ala': 'A', 'Arg': 'R', 'Asn': 'N', 'Asp': 'D', 'Cys': 'C',
+'Gln': 'Q', 'Glu': 'E', 'Gly': 'G', 'His': 'H', 'Ile': 'I',
+'Leu': 'L', 'Lys': 'K', 'Met': 'M', 'Phe': 'F', 'Pro': 'P',
+'Ser': 'S', 'Thr': 'T', 'Trp': 'W', 'Tyr': 'Y', 'Val': 'V',
+'Sec': 'U', 'Pyl': 'O', 'Xaa': 'X', 'Ter': '*'
+}
+amino_acids_pattern = re.compile('|'.join(amino_acids.keys()))
+
+# e.g. 'Q61R', 'E746_A750del', 'D770_N771insG', 'E1309fs', 'W288*'
+protein_pattern = re.compile(r'^(?P<ref>[A-Z*])(?P<start>\d+)(?:_(?P<end_ref>[A-Z*])(?P<end>\d+))?(?P<change>.*)$')
+# e.g. '182A>G', '2236_2250delGAATTAAGAGAAGCA', '2310_2311insGGT', '-5C>T', '1234+1G>A'
+coding_position = r'[-*]?\d+(?:[-+]\d+)?'
+coding_pattern = re.compile(r'^(?P<position>{0}(?:_{0})?)(?P<change>.*)$'.format(coding_position))
+
+class VariantKey(namedtuple('VariantKey', ['gene', 'kind', 'position', 'ref', 'alt'])):
+    """
+    Canonical form of a single variant
+
+    ``kind`` is 'p' for protein changes and 'c' for coding sequence changes. For a change that spans a range,
+    ``position`` and ``ref`` hold the start and end separated by '_', e.g. ``position = '746_750'`` and ``ref = 'E_A'``.
+    The string form is the key stored in the database.
+
+    Examples
+    --------
+    Example usage::
+
+        >>> str(VariantKey(gene = 'NRAS', kind = 'p', position = '61', ref = 'Q', alt = 'R'))
+        'NRAS:p.Q61R'
+        >>> str(VariantKey(gene = 'EGFR', kind = 'p', position = '746_750', ref = 'E_A', alt = 'del'))
+        'EGFR:p.E746_A750del'
+
+    """
+    __slots__ = ()
+    def __str__(self):
+        if self.kind == 'p' and '_' in self.position:
+            start, end = self.position.split('_')
+            ref, end_ref = self.ref.split('_')
+            change = "{0}{1}_{2}{3}{4}".format(ref, start, end_ref, end, self.alt)
+        elif self.kind == 'p':
+            change = "{0}{1}{2}".format(self.ref, self.position, self.alt)
+        elif self.alt[0] in 'ACGTN':
+            change = "{0}{1}>{2}".format(self.position, self.ref, self.alt)
+        else:
+            change = "{0}{1}".format(self.position, self.alt)
+        return("{0}:{1}.{2}".format(self.gene, self.kind, change))
+
+def clean_change(text, gene = None):
+    """
+    Strips the gene name, whitespace, and parentheses from a variant description
+
+    Examples
+    --------
+    Example usage::
+
+        >>> clean_change('NRAS Q61R', gene = 'NRAS')
+        'Q61R'
+        >>> clean_change(' p.(Gln61Arg) ')
+        'p.Gln61Arg'
+
+    """
+    text = str(text).strip()
+    if gene and text.upper().startswith(gene.upper() + ' '):
+        text = text[len(gene) + 1:].strip()
+    text = text.replace('(', '').replace(')', '')
+    return(text)
+
+def normalize_protein_change(text):
+    """
+    Converts a protein change to its one-letter canonical form
+
+    Parameters
+    ----------
+    text: str
+        a protein change in one or three-letter notation, with or without the 'p.' prefix
+
+    Returns
+    -------
+    tuple
+        ``(position, ref, alt)``, or None if the text is not a single specific protein change
+
+    Examples
+    --------
+    Example usage::
+
+        >>> normalize_protein_change('p.Gln61Arg')
+        ('61', 'Q', 'R')
+        >>> normalize_protein_change('p.Glu746_Ala750del')
+        ('746_750', 'E_A', 'del')
+        >>> normalize_protein_change('p.Asp770_Asn771insGly')
+        ('770_771', 'D_N', 'insG')
+        >>> normalize_protein_change('p.Arg1450LeufsTer4')
+        ('1450', 'R', 'fs')
+        >>> normalize_protein_change('codon(s) 12, 13 any')
+
+    """
+    text = clean_change(text)
+    if text.startswith('p.'):
+        text = text[2:]
+    text = amino_acids_pattern.sub(lambda match: amino_acids[match.group(0)], text)
+    match = protein_pattern.match(text)
+    if not match:
+        return(None)
+    change = match.group('change')
+    if re.match(r'^[A-Z*=]$', change):
+        alt = change
+        if alt == '=':
+            alt = match.group('ref')
+    elif re.match(r'^[A-Z]?fs', change):
+        # the new amino acid and the position of the new stop codon are not used to match frameshifts
+        alt = 'fs'
+    elif re.match(r'^(del|dup)[A-Z]*$', change):
+        alt = change[:3]
+    elif re.match(r'^(delins|ins)[A-Z*]+$', change):
+        alt = change
+    else:
+        return(None)
+    if match.group('end'):
+        position = "{0}_{1}".format(match.group('start'), match.group('end'))
+        ref = "{0}_{1}".format(match.group('ref'), match.group('end_ref'))
+    else:
+        position = match.group('start')
+        ref = match.group('ref')
+    return(position, ref, alt)
+
+def normalize_coding_change(text):
+    """
+    Converts a coding sequence change to its canonical form
+
+    Deleted and duplicated bases are dropped, since they are optional in HGVS notation.
+
+    Returns
+    -------
+    tuple
+        ``(position, ref, alt)``, or None if the text is not a single specific coding change
+
+    Examples
+    --------
+    Example usage::
+
+        >>> normalize_coding_change('c.182A>G')
+        ('182', 'A', 'G')
+        >>> normalize_coding_change('c.2236_2250delGAATTAAGAGAAGCA')
+        ('2236_2250', '', 'del')
+
+    """
+    text = clean_change(text)
+    if not text.startswith('c.'):
+        return(None)
+    match = coding_pattern.match(text[2:])
+    if not match:
+        return(None)
+    position = match.group('position')
+    change = match.group('change').upper()
+    substitution = re.match(r'^([ACGTN]+)>([ACGTN]+)$', change)
+    if substitution:
+        return(position, substitution.group(1), substitution.group(2))
+    if re.match(r'^(DEL|DUP)[ACGTN\d]*$', change):
+        return(position, '', change[:3].lower())
+    insertion = re.match(r'^(DELINS|INS)([ACGTN]+)$', change)
+    if insertion:
+        return(position, '', insertion.group(1).lower() + insertion.group(2))
+    return(None)
+
+def make_variant_key(gene, text):
+    """
+    Get the canonical key for a variant of a gene
+
+    Parameters
+    ----------
+    gene: str
+        the gene name
+    text: str
+        a protein change (``p.Gln61Arg``, ``Q61R``, ``NRAS Q61R``) or coding change (``c.182A>G``)
+
+    Returns
+    -------
+    VariantKey
+        the canonical key, or None if the text does not describe a single specific variant
+
+    Examples
+    --------
+    Example usage::
+
+        >>> str(make_variant_key('NRAS', 'p.Gln61Arg')) == str(make_variant_key('NRAS', 'NRAS Q61R'))
+        True
+        >>> str(make_variant_key('NRAS', 'c.182a>g'))
+        'NRAS:c.182A>G'
+        >>> make_variant_key('KRAS', 'KRAS codon(s) 12, 13 any')
+
+    """
+    if not gene or text is None or text != text: # NaN from pandas
+        return(None)
+    text = clean_change(text, gene = gene)
+    if text.startswith('c.'):
+        kind = 'c'
+        change = normalize_coding_change(text)
+    else:
+        kind = 'p'
+        change = normalize_protein_change(text)
+    if change is None:
+        return(None)
+    position, ref, alt = change
+    return(VariantKey(gene = gene, kind = kind, position = position, ref = ref, alt = alt))
+
+def variant_key_str(gene, text):
+    """
+    Get the string form of the canonical key for a variant, as stored in the database; an empty string if the variant can not be normalized
+    """
+    key = make_variant_key(gene, text)
+    if key is None:
+        return('')
+    return(str(key))
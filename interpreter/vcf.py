@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for reading annotated .vcf files into the same records as the Ion Reporter .tsv export
+
+The file is read one line at a time, optionally gzip compressed, and each alternate allele becomes a record with the
+same columns as a row of the .tsv export: the gene, HGVS coding and protein changes, and the effect are taken from the
+first SnpEff ``ANN`` or VEP ``CSQ`` annotation for the allele, or from the Ion Reporter ``FUNC`` annotation, and the
+allele frequency, coverage, and read counts from the INFO field or the first sample. Records without a gene are dropped
+while the file is read, so they are never held in memory or interpreted; the other records are dropped by the filter
+chain of each ``IRTable``, which starts with the ``settings.VCF_FILTERS`` for .vcf files, e.g. 'pass_only' (see ``filters.py``).
+"""
+import io
+import re
+import gzip
+from urllib.parse import unquote
+from contextlib import contextmanager
+import pandas as pd
+from .ir import IRTable, IRTableReader
+from .filters import parse_filters
+
+gzip_magic = b'\x1f\x8b'
+vcf_magic = '##fileformat=VCF'
+
+# columns of the records, named the same as the Ion Reporter .tsv export
+columns = ['Row', 'Locus', 'Ref', 'Observed Allele', 'Type', 'Genes', 'Location', 'Oncomine Variant Class', 'Oncomine Gene Class',
+    'Variant ID', 'Filter', '% Frequency', 'Amino Acid Change', 'Read Counts', 'Coverage', 'Exon', 'Transcript', 'Coding', 'Variant Effect']
+
+# the fields of a SnpEff ANN annotation, when the header does not list them
+default_ann_fields = ['Allele', 'Annotation', 'Annotation_Impact', 'Gene_Name', 'Gene_ID', 'Feature_Type', 'Feature_ID',
+    'Transcript_BioType', 'Rank', 'HGVS.c', 'HGVS.p', 'cDNA.pos / cDNA.length', 'CDS.pos / CDS.length', 'AA.pos / AA.length', 'Distance', 'ERRORS / WARNINGS / INFO']
+
+# record columns filled from the ANN and CSQ annotation fields; the first field that is present is used
+annotation_columns = [
+    ('Genes', ['Gene_Name', 'SYMBOL']),
+    ('Coding', ['HGVS.c', 'HGVSc']),
+    ('Amino Acid Change', ['HGVS.p', 'HGVSp']),
+    ('Variant Effect', ['Annotation', 'Consequence']),
+    ('Transcript', ['Feature_ID', 'Feature']),
+    ('Exon', ['Rank', 'EXON'])
+    ]
+
+# record columns filled from the Ion Reporter FUNC annotation
+func_columns = [
+    ('Genes', 'gene'),
+    ('Coding', 'coding'),
+    ('Amino Acid Change', 'protein'),
+    ('Variant Effect', 'function'),
+    ('Transcript', 'transcript'),
+    ('Exon', 'exon'),
+    ('Location', 'location'),
+    ('Oncomine Gene Class', 'oncomineGeneClass'),
+    ('Oncomine Variant Class', 'oncomineVariantClass')
+    ]
+
+# record columns that are only filled from the FUNC annotation; left out of the tables of files without it, so that the
+# report filters on them keep every record instead of dropping them all (see ``filters.py``)
+func_only_columns = ['Oncomine Variant Class', 'Oncomine Gene Class']
+
+# e.g. ##INFO=<ID=ANN,Number=.,Type=String,Description="Functional annotations: 'Allele | Annotation | ...' ">
+info_header_pattern = re.compile(r'^##INFO=<ID=(?P<id>[^,>]+),.*Description="(?P<description>[^"]*)"')
+# e.g. FUNC=[{'gene':'NRAS','protein':'p.Gln61Arg',...}]
+func_entry_pattern = re.compile(r'\{([^}]*)\}')
+func_field_pattern = re.compile(r"'([^']*)':'([^']*)'")
+
+# Ion Reporter and VCF variant types, as the .tsv export names them
+variant_types = {'SNP': 'SNV', 'SNV': 'SNV', 'MNP': 'MNV', 'MNV': 'MNV', 'INS': 'INDEL', 'DEL': 'INDEL', 'INDEL': 'INDEL', 'COMPLEX': 'INDEL'}
+
+@contextmanager
+def open_text(source):
+    """
+    Opens a path or a file-like object as text, decompressing it if it is gzip compressed
+
+    File-like objects are read from the start, and are left open.
+    """
+    f = open(source, 'rb') if isinstance(source, str) else source
+    try:
+        f.seek(0)
+        magic = f.read(2)
+        f.seek(0)
+        if isinstance(magic, str):
+            yield(f)
+            return
+        stream = gzip.GzipFile(fileobj = f, mode = 'rb') if magic == gzip_magic else f
+        text = io.TextIOWrapper(stream, encoding = 'utf-8', errors = 'replace')
+        try:
+            yield(text)
+        finally:
+            # leave the file-like object open for the caller
+            text.detach()
+    finally:
+        if isinstance(source, str):
+            f.close()
+
+def is_vcf(source):
+    """
+    Checks whether a path or a file-like object is a .vcf file, from its first line; file-like objects are rewound
+
+    Examples
+    --------
+    Example usage::
+
+        >>> is_vcf(io.BytesIO(b'##fileformat=VCFv4.2\\n'))
+        True
+        >>> is_vcf(io.BytesIO(b'Locus\\tGenes\\n'))
+        False
+
+    """
+    with open_text(source) as text:
+        first = text.readline()
+    if not isinstance(source, str):
+        source.seek(0)
+    return(first.startswith(vcf_magic))
+
+def count_vcf_records(source):
+    """
+    Counts the data lines in a .vcf file without parsing them, for reporting progress; lines with more than one
+    alternate allele are counted once
+    """
+    num_lines = 0
+    with open_text(source) as text:
+        for line in text:
+            if line.strip() and not line.startswith('#'):
+                num_lines += 1
+    return(num_lines)
+
+def parse_info(text):
+    """
+    Parses the INFO field of a .vcf record; flags are set to True
+
+    Examples
+    --------
+    Example usage::
+
+        >>> parse_info('DP=100;AF=0.25,0.1;SOMATIC')
+        {'DP': '100', 'AF': '0.25,0.1', 'SOMATIC': True}
+
+    """
+    info = {}
+    if text in ['', '.']:
+        return(info)
+    for part in text.split(';'):
+        key, sep, value = part.partition('=')
+        info[key] = value if sep else True
+    return(info)
+
+def parse_annotation_fields(description):
+    """
+    Gets the names of the fields of an ANN or CSQ annotation from the description in its INFO header line
+
+    Examples
+    --------
+    Example usage::
+
+        >>> parse_annotation_fields("Functional annotations: 'Allele | Annotation | Gene_Name' ")
+        ['Allele', 'Annotation', 'Gene_Name']
+        >>> parse_annotation_fields('Consequence annotations from Ensembl VEP. Format: Allele|Consequence|SYMBOL')
+        ['Allele', 'Consequence', 'SYMBOL']
+
+    """
+    if 'Format:' in description:
+        description = description.split('Format:', 1)[1]
+    elif ':' in description:
+        description = description.split(':', 1)[1]
+    return([ field.strip() for field in description.strip().strip("'").split('|') ])
+
+def parse_annotations(text, fields):
+    """
+    Parses the annotations in an ANN or CSQ INFO value into a list of dicts, one per annotation, in order
+    """
+    annotations = []
+    for entry in text.split(','):
+        values = [ unquote(value) for value in entry.split('|') ]
+        annotations.append(dict(zip(fields, values)))
+    return(annotations)
+
+def parse_func(text):
+    """
+    Parses the Ion Reporter FUNC annotation into a list of dicts
+
+    Examples
+    --------
+    Example usage::
+
+        >>> parse_func("[{'gene':'NRAS','protein':'p.Gln61Arg'}]")
+        [{'gene': 'NRAS', 'protein': 'p.Gln61Arg'}]
+
+    """
+    return([ dict(func_field_pattern.findall(entry)) for entry in func_entry_pattern.findall(text) ])
+
+def allele_value(value, index):
+    """
+    Gets the value for an alternate allele from a comma separated per-allele value; the only value if there is one
+
+    Examples
+    --------
+    Example usage::
+
+        >>> allele_value('0.25,0.1', 1)
+        '0.1'
+        >>> allele_value('100', 1)
+        '100'
+
+    """
+    if value is None or value is True:
+        return(None)
+    values = str(value).split(',')
+    if len(values) == 1:
+        return(values[0])
+    if index < len(values):
+        return(values[index])
+    return(None)
+
+def to_float(value):
+    """
+    Converts a value to a float, or None if it is missing or not a number
+    """
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return(None)
+    if number != number:
+        return(None)
+    return(number)
+
+def clean_hgvs(change):
+    """
+    Drops the transcript or protein ID from a VEP HGVS change, e.g. 'ENSP00000358548.4:p.Gln61Arg'
+
+    Examples
+    --------
+    Example usage::
+
+        >>> clean_hgvs('ENSP00000358548.4:p.Gln61Arg')
+        'p.Gln61Arg'
+        >>> clean_hgvs('c.182A>G')
+        'c.182A>G'
+
+    """
+    if change and ':' in change:
+        return(change.rsplit(':', 1)[1])
+    return(change)
+
+def variant_type(ref, alt, info, index):
+    """
+    Gets the variant type of an alternate allele, named the same as the Ion Reporter .tsv export
+
+    Examples
+    --------
+    Example usage::
+
+        >>> variant_type('A', 'G', {}, 0)
+        'SNV'
+        >>> variant_type('AT', 'A', {}, 0)
+        'INDEL'
+        >>> variant_type('A', '<CNV>', {}, 0)
+        'CNV'
+
+    """
+    value = allele_value(info.get('TYPE', None), index)
+    if value is not None and value.upper() in variant_types:
+        return(variant_types[value.upper()])
+    if alt.startswith('<'):
+        return(str(info.get('SVTYPE', alt.strip('<>'))).upper())
+    if len(ref) == len(alt):
+        return('SNV' if len(ref) == 1 else 'MNV')
+    return('INDEL')
+
+class VCFReader(object):
+    """
+    Reads an annotated .vcf file in chunks of records, in the same way as ``ir.IRTableReader``
+
+    Each alternate allele of each line is a record. Only the records that have a gene are kept; the rest of the
+    filtering is done by the ``filters`` of each ``IRTable``, which count the records they drop.
+
+    Parameters
+    ----------
+    source: str
+        path to the .vcf or .vcf.gz file to read in, or a binary file-like object
+    chunksize: int
+        the number of records in each chunk; can be changed between chunks
+    synonyms: dict
+        gene synonyms passed to each ``IRTable``
+    filters: list
+        filters from ``filters.parse_filters`` passed to each ``IRTable``, e.g. ``[('pass_only', '')]``
+
+    Attributes
+    ----------
+    num_records: int
+        the number of records read so far
+    num_filtered: int
+        the number of records read so far that were dropped for not having a gene
+    has_func: bool
+        whether the file has Ion Reporter FUNC annotations, from its header or the lines read so far; the tables only
+        have the ``func_only_columns`` if it does
+
+    Examples
+    --------
+    Example usage::
+
+        reader = VCFReader("sample.vcf.gz", chunksize = 10, filters = parse_filters('pass_only,min_af=5'))
+        for table in reader:
+            print(len(table.records))
+
+    """
+    def __init__(self, source, chunksize = 500, synonyms = None, filters = None):
+        self.source = source
+        self.chunksize = chunksize
+        self.synonyms = synonyms
+        self.filters = filters
+        self.num_records = 0
+        self.num_filtered = 0
+        self.has_func = False
+
+    def __iter__(self):
+        chunk = []
+        for data in self.iter_data():
+            chunk.append(data)
+            if len(chunk) >= max(int(self.chunksize), 1):
+                yield(self.make_table(chunk))
+                chunk = []
+        if chunk:
+            yield(self.make_table(chunk))
+
+    def make_table(self, records):
+        """
+        Makes an ``IRTable`` from the data of a chunk of records
+        """
+        table_columns = columns if self.has_func else [ column for column in columns if column not in func_only_columns ]
+        return(IRTable(source = self.source, table = pd.DataFrame(records, columns = table_columns), synonyms = self.synonyms, filters = self.filters))
+
+    def read_table(self):
+        """
+        Reads all of the records into one ``IRTable``
+        """
+        return(self.make_table(list(self.iter_data())))
+
+    def iter_data(self):
+        """
+        Yields the data of each record that has a gene, as a dict with the ``columns`` as keys
+        """
+        annotation_fields = {'ANN': default_ann_fields}
+        row = 0
+        with open_text(self.source) as text:
+            for line in text:
+                line = line.rstrip('\r\n')
+                if not line:
+                    continue
+                if line.startswith('##'):
+                    match = info_header_pattern.match(line)
+                    if match and match.group('id') in ['ANN', 'CSQ']:
+                        annotation_fields[match.group('id')] = parse_annotation_fields(match.group('description'))
+                    if match and match.group('id') == 'FUNC':
+                        self.has_func = True
+                    continue
+                if line.startswith('#'):
+                    continue
+                for data in self.parse_line(line, row, annotation_fields):
+                    self.num_records += 1
+                    if self.keep(data):
+                        yield(data)
+                    else:
+                        self.num_filtered += 1
+                row += 1
+
+    def keep(self, data):
+        """
+        Checks whether a record has a gene to be interpreted
+        """
+        return(not pd.isnull(data['Genes']) and bool(data['Genes']))
+
+    def parse_line(self, line, row, annotation_fields):
+        """
+        Parses a data line of the .vcf file into the data of a record for each alternate allele
+
+        Parameters
+        ----------
+        line: str
+            the tab separated line
+        row: int
+            the number of the data line in the file, starting at 0; the same for each allele
+        annotation_fields: dict
+            the names of the fields of the 'ANN' and 'CSQ' annotations
+
+        Returns
+        -------
+        list
+            a dict for each alternate allele
+        """
+        fields = line.split('\t')
+        chrom, pos, id, ref, alts, qual, filter = fields[:7]
+        info = parse_info(fields[7] if len(fields) > 7 else '')
+        sample = {}
+        if len(fields) > 9:
+            sample = dict(zip(fields[8].split(':'), fields[9].split(':')))
+        annotations = []
+        for key in ['ANN', 'CSQ']:
+            if key in info and info[key] is not True:
+                annotations.extend(parse_annotations(info[key], annotation_fields.get(key, default_ann_fields)))
+        func = parse_func(info['FUNC']) if isinstance(info.get('FUNC', None), str) else []
+        if func:
+            self.has_func = True
+
+        records = []
+        for index, alt in enumerate(alts.split(',')):
+            if alt in ['.', '*']:
+                continue
+            data = { column: float('nan') for column in columns }
+            data.update({
+                'Row': row,
+                'Locus': '{0}:{1}'.format(chrom, pos),
+                'Ref': ref,
+                'Observed Allele': alt,
+                'Type': variant_type(ref, alt, info, index),
+                'Variant ID': id if id != '.' else float('nan'),
+                'Filter': filter
+                })
+            self.add_counts(data, info, sample, index)
+            # SnpEff and VEP list the annotations for every allele, most severe first; VEP drops the common leading base of indels
+            alleles = [alt]
+            if len(ref) != len(alt) and ref[:1] == alt[:1]:
+                alleles.append(alt[1:] or '-')
+            allele_annotations = [ annotation for annotation in annotations if annotation.get('Allele', alt) in alleles ]
+            if allele_annotations:
+                annotation = allele_annotations[0]
+                for column, keys in annotation_columns:
+                    for key in keys:
+                        if annotation.get(key, ''):
+                            data[column] = annotation[key]
+                            break
+            # Ion Reporter lists one FUNC entry per transcript and allele
+            allele_func = [ entry for entry in func if entry.get('origAlt', alt) == alt or entry.get('normalizedAlt', None) == alt ]
+            if allele_func:
+                for column, key in func_columns:
+                    if allele_func[0].get(key, ''):
+                        data[column] = allele_func[0][key]
+            for column in ['Coding', 'Amino Acid Change']:
+                if isinstance(data[column], str):
+                    data[column] = clean_hgvs(data[column])
+            if isinstance(data['Exon'], str):
+                data['Exon'] = data['Exon'].split('/')[0]
+            records.append(data)
+        return(records)
+
+    def add_counts(self, data, info, sample, index):
+        """
+        Adds the allele frequency in percent, the coverage, and the alternate read count of an allele to its record, from
+        the INFO field or the first sample
+        """
+        coverage = to_float(info.get('DP', None))
+        if coverage is None:
+            coverage = to_float(sample.get('DP', None))
+        alt_reads = to_float(allele_value(sample.get('AO', None), index))
+        ad = [ to_float(value) for value in sample.get('AD', '').split(',') ]
+        if alt_reads is None and len(ad) > index + 1:
+            alt_reads = ad[index + 1]
+        af = None
+        for value in [info.get('AF', None), sample.get('AF', None), sample.get('VAF', None)]:
+            af = to_float(allele_value(value, index))
+            if af is not None:
+                break
+        if af is None and alt_reads is not None:
+            depth = coverage if coverage else sum([ value for value in ad if value is not None ])
+            if depth:
+                af = alt_reads / depth
+        if af is not None:
+            data['% Frequency'] = round(af * 100, 2)
+        if coverage is not None:
+            data['Coverage'] = int(coverage)
+        if alt_reads is not None:
+            data['Read Counts'] = int(alt_reads)
+
+def read_table(source, synonyms = None, vcf_filters = None, filters = None):
+    """
+    Reads a whole Ion Reporter .tsv file, or an annotated .vcf file, into an ``IRTable``
+
+    Parameters
+    ----------
+    source: str
+        path to the file, or a file-like object
+    synonyms: dict
+        gene synonyms passed to the ``IRTable``
+    vcf_filters: str
+        the filter chain that the records of a .vcf file are dropped by ahead of ``filters``, e.g. 'pass_only'
+    filters: list
+        the filters passed to the ``IRTable``, see ``filters.py``
+    """
+    if is_vcf(source):
+        return(VCFReader(source, synonyms = synonyms, filters = parse_filters(vcf_filters) + (filters or [])).read_table())
+    return(IRTable(source, synonyms = synonyms, filters = filters))
+
+def table_reader(source, chunksize = 500, synonyms = None, vcf_filters = None, filters = None):
+    """
+    Gets a reader for the chunks of records of an Ion Reporter .tsv file, or an annotated .vcf file; the records of a
+    .vcf file are dropped by the 'vcf_filters' chain ahead of the 'filters', as in ``read_table``
+
+    Returns
+    -------
+    IRTableReader
+        or a ``VCFReader`` for .vcf files
+    """
+    if is_vcf(source):
+        return(VCFReader(source, chunksize = chunksize, synonyms = synonyms, filters = parse_filters(vcf_filters) + (filters or [])))
+    return(IRTableReader(source, chunksize = chunksize, synonyms = synonyms, filters = filters))
@@ -1,9 +1,27 @@
-from django.http import HttpResponse
-from django.shortcuts import render
-from .models import PMKBVariant, UserAccessMetric, UserUploadMetric, TumorType, TissueType
-from .report import make_report_html
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse, Http404
+from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
+from .models import PMKBVariant, UserAccessMetric, UserUploadMetric, ReportJob
+from .report import iter_report_html, iter_interpreted_tables
+from .export import export_formats, iter_export, iter_export_rows
+from .jobs import submit_job
+from .report_store import ReportStore
+from .cache import get_cache, bump_kb_version
+from .type_lists import get_type_lists
+from .search import search_interpretations
+from .profiling import profile_view, list_profiles, profile_path, profile_name_pattern
+from .memory import trace_memory, over_soft_limit
+from .sources import get_sources
+from .filters import parse_filters, presets, filter_types
+import os
+import math
+import sqlite3
 import subprocess
 import logging
+import threading
+from django.conf import settings
 from ipware import get_client_ip
 
 # logger = logging.getLogger(__name__)
@@ -17,82 +35,236 @@ except:
     log.warning("could not get commit hash from git repo")
     pass
 
-MAX_UPLOAD_SIZE = 2 * 1024 * 1024 # 2MB
+MAX_UPLOAD_SIZE = settings.MAX_UPLOAD_SIZE
+# file types that reports can be generated from; .vcf files are read by ``vcf.VCFReader``
+upload_extensions = ('.tsv', '.vcf', '.vcf.gz')
+
+# limit the number of reports generated at once by the threads of this worker process
+report_slots = threading.BoundedSemaphore(settings.MAX_CONCURRENT_REPORTS)
+
+class release_after(object):
+    """
+    The parts of a streamed report, which free the report slot once they are all sent or the response is closed
+
+    The server closes the response once it is sent, or when the client goes away before it is; a generator that is
+    closed before it starts does not run its ``finally`` block, so the slot is also released in ``close()``.
+    """
+    def __init__(self, *parts):
+        self.parts = parts
+        self.released = False
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            for part in self.parts:
+                for block in part:
+                    yield(block)
+        finally:
+            self.release()
+
+    def release(self):
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        report_slots.release()
+
+    def close(self):
+        try:
+            # stop generating the report, e.g. its pending lookups
+            for part in self.parts:
+                if hasattr(part, 'close'):
+                    part.close()
+        finally:
+            self.release()
+
+# (ip, view) pairs already saved as a UserAccessMetric by this worker
+recorded_access = set()
+recorded_access_lock = threading.Lock()
+
+def record_access(ip, view):
+    """
+    Saves a UserAccessMetric for the first visit from an IP address to a view; later visits do not query the database
+    """
+    with recorded_access_lock:
+        if (ip, view) in recorded_access:
+            return
+        if len(recorded_access) > 10000:
+            recorded_access.clear()
+    try:
+        # TODO: Fix this; unique constraint in db
+        instance, created = UserAccessMetric.objects.get_or_create(ip = ip, view = view)
+        with recorded_access_lock:
+            recorded_access.add((ip, view))
+    except:
+        logger.error("Could not record UserAccessMetric")
 
 def all_types(type, include_any = True):
     """
-    Return a list of all types from the database
+    Return a list of all types in the knowledge base
     """
-    all_types = []
-    if type == "tumor":
-        all_types = sorted(TumorType.objects.values_list('type', flat = True).distinct())
-    if type == "tissue":
-        all_types = sorted(TissueType.objects.values_list('type', flat=True).distinct())
-    if not include_any:
+    all_types = list(get_type_lists().types[type])
+    if not include_any and 'Any' in all_types:
         all_types.remove('Any')
     return(all_types)
 
+def get_type_param(request, type):
+    """
+    Get a tissue or tumor type from the upload form; None for 'Any'
+
+    Raises
+    ------
+    ValueError
+        if the type is not in the knowledge base
+    """
+    value = request.POST.get('{0}_type'.format(type), 'Any').strip()
+    if value in ['', 'Any']:
+        return(None)
+    if (type, value) not in get_type_lists():
+        raise ValueError('Unknown {0} type: {1}'.format(type, value))
+    return(value)
+
+def get_sources_param(request):
+    """
+    Get the names of the interpretation sources checked in the upload form; None for all of them
+
+    Raises
+    ------
+    ValueError
+        if a source is not registered
+    """
+    names = [ name.strip() for name in request.POST.getlist('sources') if name.strip() ]
+    if not names:
+        return(None)
+    get_sources(names)
+    return(names)
+
+def get_filters_param(request):
+    """
+    Get the report filter chain from the upload form; ``settings.REPORT_FILTERS`` if it is not set
+
+    Raises
+    ------
+    ValueError
+        if the chain can not be parsed, see ``filters.parse_filters``
+    """
+    filters = request.POST.get('filters', None)
+    if filters is None:
+        filters = settings.REPORT_FILTERS
+    filters = filters.strip()
+    parse_filters(filters)
+    return(filters)
+
 def index(request):
     """
     Returns the home page index
+
+    The tissue and tumor types are not listed in the page; the upload form looks them up from ``type_list`` as the user types
     """
     logger.info("index requested")
     ip, is_routable = get_client_ip(request)
     # save user access logging
-    try:
-        # TODO: Fix this; unique constraint in db
-        instance, created = UserAccessMetric.objects.get_or_create(ip = ip, view = 'index')
-    except:
-        logger.error("Could not record UserAccessMetric")
-
-    # get all the available tumor and tissue types to populate the uploads form
-    logger.debug("retrieving the available tumor and tissue types")
-    # 'Any' is hard-coded as first entry in the HTML form
-    all_tissue_types = all_types(type = "tissue", include_any = False)
-    all_tumor_types = all_types(type = "tumor", include_any = False)
-
-    # sanity check for initialized reference databses
-    if len(all_tissue_types) < 1:
-        logger.warn("all_tissue_types length is less than one; has the database been imported?")
-    if len(all_tumor_types) < 1:
-        logger.warn("all_tumor_types length is less than one; has the database been imported?")
+    record_access(ip, 'index')
     template = "interpreter/index.html"
-    context = {'version': version, 'tumor_types': all_tumor_types, 'tissue_types': all_tissue_types}
+    context = {'version': version, 'sources': get_sources(), 'filters': settings.REPORT_FILTERS, 'filter_names': list(presets.keys()) + list(filter_types.keys())}
     return render(request, template, context)
 
+def type_list(request, type):
+    """
+    Returns the tissue or tumor types as JSON; with a 'q' parameter, only the types with a word that starts with 'q', up to ``settings.AUTOCOMPLETE_LIMIT`` of them
+    """
+    if type not in ['tissue', 'tumor']:
+        raise Http404("Unknown type list")
+    type_lists = get_type_lists()
+    query = request.GET.get('q', None)
+    if query is None:
+        results = type_lists.types[type]
+    else:
+        results = type_lists.search(type, query, limit = settings.AUTOCOMPLETE_LIMIT)
+    # sanity check for initialized reference databses
+    if len(type_lists.types[type]) < 1:
+        logger.warn("no {0} types found; has the database been imported?".format(type))
+    return JsonResponse({'type': type, 'query': query, 'results': results})
+
+def search(request):
+    """
+    Returns the PMKB and NYU interpretations that match the 'q' parameter as JSON, ranked by relevance, with HTML snippets of the matching text
+
+    The page number is passed as the 'page' parameter, with ``settings.SEARCH_PAGE_SIZE`` results per page
+    """
+    query = request.GET.get('q', '')
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid page'}, status = 400)
+    if page < 1:
+        return JsonResponse({'error': 'Invalid page'}, status = 400)
+    return JsonResponse(search_interpretations(query, page = page, size = settings.SEARCH_PAGE_SIZE))
+
+def export_response(parts, format, filename):
+    """
+    Streams an export file as a download
+    """
+    content_type, extension, writer = export_formats[format]
+    response = StreamingHttpResponse(parts, content_type = content_type)
+    response['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(filename, extension)
+    return(response)
+
+@profile_view
+@trace_memory
 def upload(request):
     """
-    Responds to a POST request from an uploaded Ion Reporter .tsv file
+    Responds to a POST request from an uploaded Ion Reporter .tsv file, or an annotated .vcf or .vcf.gz file
+
+    Only the interpretation sources checked in the 'sources' fields are looked up, or all of them if none are checked.
+    The records that fail the filters in the 'filters' field, e.g. 'oncomine,min_coverage=100', are dropped before they
+    are interpreted, see ``filters.py``.
+    If the 'background' field is set, the file is queued as a report job and the response redirects to the job status page.
+    If the 'export_format' field is set to one of the ``export.export_formats``, the interpretation results are streamed
+    as an export file instead of an HTML report. Staff users can set the 'profile' field to profile the request, see ``profiling.py``.
+    Uploads projected to use more memory than ``settings.REPORT_MEMORY_SOFT_LIMIT`` are queued as report jobs or rejected,
+    see ``memory.py``.
     """
     if request.method == 'POST' and 'irtable' in request.FILES:
         logger.info("POST requested")
         ip, is_routable = get_client_ip(request)
 
-        try:
-            instance, created = UserAccessMetric.objects.get_or_create(ip = ip, view = 'upload')
-        except:
-            logger.error("Could not record UserAccessMetric")
+        record_access(ip, 'upload')
 
         # check for a tumor or tissue type passed
         # use 'Any' as the default value, pass as None-type to exclude filtering
-        tissue_type = request.POST.get('tissue_type', 'Any')
-        if tissue_type == 'Any':
-            tissue_type = None
-        tumor_type = request.POST.get('tumor_type', 'Any')
-        if tumor_type == 'Any':
-            tumor_type = None
+        try:
+            tissue_type = get_type_param(request, 'tissue')
+            tumor_type = get_type_param(request, 'tumor')
+            sources = get_sources_param(request)
+            filters = get_filters_param(request)
+        except ValueError as e:
+            logger.error(str(e))
+            return HttpResponse('Error: {0}'.format(e))
         logger.debug("tissue_type: {tissue_type}, tumor_type: {tumor_type}".format(tumor_type = tumor_type, tissue_type = tissue_type))
 
+        # only show the knowledge base entries for the same protein or coding change as each record
+        match_variants = bool(request.POST.get('match_variants', ''))
+
+        export_format = request.POST.get('export_format', '') or None
+        if export_format is not None and export_format not in export_formats:
+            logger.error("unknown export format: {0}".format(export_format))
+            return HttpResponse('Error: Unknown export format: {0}'.format(export_format))
+
+        # background jobs do not tie up a web worker, so they can be larger
+        background = bool(request.POST.get('background', ''))
+        max_size = settings.JOB_MAX_UPLOAD_SIZE if background else MAX_UPLOAD_SIZE
+
         # check for file too large
         logger.debug("checking file size")
-        if request.FILES['irtable'].size > MAX_UPLOAD_SIZE:
+        if request.FILES['irtable'].size > max_size:
             logger.error("file size too large; {0:.2f}MB".format(request.FILES['irtable'].size / (1024 * 1024)))
-            return HttpResponse('Error: File is too large, size limit is: {0}MB'.format(MAX_UPLOAD_SIZE / (1024 * 1024)) )
+            return HttpResponse('Error: File is too large, size limit is: {0}MB'.format(max_size / (1024 * 1024)) )
         # check file type
         logger.debug("checking file type")
-        if not str(request.FILES['irtable']).endswith('.tsv'):
+        if not str(request.FILES['irtable']).endswith(upload_extensions):
             logger.error("Invalid file type")
-            return HttpResponse('Error: Invalid file type, filename must end with ".tsv"')
+            return HttpResponse('Error: Invalid file type, filename must end with ".tsv", ".vcf", or ".vcf.gz"')
 
         try:
             # TODO: Fix this; unique constraint in db
@@ -100,15 +272,265 @@ def upload(request):
         except:
             logger.error("Could not record UserUploadMetric")        
 
+        # large reports are generated by the report worker instead of this web worker
+        if not background:
+            memory = over_soft_limit(request.FILES['irtable'])
+            if memory is not None:
+                logger.warning("report projected to use {0:.0f}MB, over the limit of {1}MB".format(memory, settings.REPORT_MEMORY_SOFT_LIMIT))
+                if settings.REPORT_MEMORY_SOFT_ACTION == 'reject':
+                    return HttpResponse('Error: File is too large to generate a report for, please submit it as a background job', status = 413)
+                background = True
+
+        if background:
+            job = submit_job(upload = request.FILES['irtable'],
+                tissue_type = tissue_type,
+                tumor_type = tumor_type,
+                match_variants = match_variants,
+                sources = sources,
+                filters = filters,
+                ip = ip)
+            return redirect('job_page', key = job.key)
+
+        # wait for a free report slot
+        if not report_slots.acquire(timeout = settings.REPORT_SLOT_TIMEOUT):
+            logger.error("no report slot available after {0}s".format(settings.REPORT_SLOT_TIMEOUT))
+            return HttpResponse('Error: The server is busy generating other reports, please try again', status = 503)
+
         # try to generate the HTML report
+        # large uploads are already on disk, so read them from there instead of through the upload object
+        upload = request.FILES['irtable']
+        input = upload.temporary_file_path() if hasattr(upload, 'temporary_file_path') else upload
         try:
-            logger.debug("generating report HTML")
-            report = make_report_html(input = request.FILES['irtable'],
-                tissue_type = tissue_type,
-                tumor_type = tumor_type)
-            return HttpResponse(report)
+            if export_format is not None:
+                logger.debug("generating {0} export".format(export_format))
+                tables = iter_interpreted_tables(input,
+                    tissue_type = tissue_type,
+                    tumor_type = tumor_type,
+                    match_variants = match_variants,
+                    sources = sources,
+                    filters = filters)
+                report = iter_export(iter_export_rows(tables), export_format)
+            else:
+                logger.debug("generating report HTML")
+                report = iter_report_html(input = input,
+                    tissue_type = tissue_type,
+                    tumor_type = tumor_type,
+                    match_variants = match_variants,
+                    sources = sources,
+                    filters = filters)
+            # the first chunk of records, or all records for a report, is interpreted before the first part is returned, so errors can still be reported here
+            first = next(report)
         except:
             logger.error("an error occured while generating report HTML")
+            report_slots.release()
             return HttpResponse('Error: An error occured while generating report HTML')
+        if export_format is not None:
+            filename = os.path.splitext(os.path.basename(str(upload)))[0]
+            return export_response(release_after([first], report), export_format, filename)
+        return StreamingHttpResponse(release_after([first], report))
     else:
         return HttpResponse('Error: Invalid file selected')
+
+@staff_member_required
+def cache_stats(request):
+    """
+    Returns the interpretation cache statistics for the worker handling the request
+    """
+    cache = get_cache()
+    cache.validate()
+    return JsonResponse(cache.stats())
+
+@staff_member_required
+@require_POST
+def cache_flush(request):
+    """
+    Flushes the interpretation cache; the knowledge base version is incremented so that all other workers drop their cached entries as well
+    """
+    logger.info("interpretation cache flush requested")
+    get_cache().flush()
+    kb_version = bump_kb_version()
+    return JsonResponse({'flushed': True, 'kb_version': kb_version})
+
+@staff_member_required
+def profile_list(request):
+    """
+    Returns the saved request profiles as JSON, newest first
+    """
+    profiles = list_profiles()
+    for profile in profiles:
+        profile['url'] = reverse('profile_detail', kwargs = {'name': profile['id']})
+    return JsonResponse({'profiles': profiles})
+
+@staff_member_required
+def profile_detail(request, name):
+    """
+    Returns the summary of a saved request profile as text; with a 'download' parameter, the profile itself for tools such as ``snakeviz``
+    """
+    if not profile_name_pattern.match(name):
+        raise Http404("Profile not found")
+    try:
+        if 'download' in request.GET:
+            response = FileResponse(open(profile_path(name, 'prof'), 'rb'), content_type = 'application/octet-stream')
+            response['Content-Disposition'] = 'attachment; filename="{0}.prof"'.format(name)
+            return response
+        return FileResponse(open(profile_path(name, 'txt'), 'rb'), content_type = 'text/plain; charset=utf-8')
+    except OSError:
+        raise Http404("Profile not found")
+
+def job_status_dict(job):
+    """
+    The public details of a report job
+    """
+    status = {
+    'id': job.key,
+    'filename': job.filename,
+    'status': job.status,
+    'stage': job.stage,
+    'progress': job.progress,
+    'created': job.created,
+    'finished': job.finished,
+    'expires': job.expires,
+    'status_url': reverse('job_status', kwargs = {'key': job.key}),
+    'report_url': None,
+    'full_report_url': None
+    }
+    if job.status == 'finished':
+        status['report_url'] = reverse('job_report', kwargs = {'key': job.key})
+        status['full_report_url'] = reverse('job_report_full', kwargs = {'key': job.key})
+    if job.status == 'failed':
+        status['error'] = 'An error occured while generating report HTML'
+    return(status)
+
+@require_POST
+def job_submit(request):
+    """
+    Queues an uploaded Ion Reporter .tsv file, or an annotated .vcf or .vcf.gz file, for report generation, and returns the job id and status URL as JSON
+    """
+    if 'irtable' not in request.FILES:
+        return JsonResponse({'error': 'Invalid file selected'}, status = 400)
+    ip, is_routable = get_client_ip(request)
+    upload = request.FILES['irtable']
+    if upload.size > settings.JOB_MAX_UPLOAD_SIZE:
+        return JsonResponse({'error': 'File is too large, size limit is: {0}MB'.format(settings.JOB_MAX_UPLOAD_SIZE / (1024 * 1024))}, status = 400)
+    if not str(upload).endswith(upload_extensions):
+        return JsonResponse({'error': 'Invalid file type, filename must end with ".tsv", ".vcf", or ".vcf.gz"'}, status = 400)
+    try:
+        tissue_type = get_type_param(request, 'tissue')
+        tumor_type = get_type_param(request, 'tumor')
+        sources = get_sources_param(request)
+        filters = get_filters_param(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status = 400)
+    match_variants = bool(request.POST.get('match_variants', ''))
+    job = submit_job(upload = upload, tissue_type = tissue_type, tumor_type = tumor_type, ip = ip, match_variants = match_variants,
+        sources = sources, filters = filters)
+    return JsonResponse(job_status_dict(job), status = 202)
+
+def job_status(request, key):
+    """
+    Returns the status and progress of a report job as JSON
+    """
+    job = get_object_or_404(ReportJob, key = key)
+    return JsonResponse(job_status_dict(job))
+
+def job_page(request, key):
+    """
+    Returns a page that shows the progress of a report job and reloads until the report is ready
+    """
+    job = get_object_or_404(ReportJob, key = key)
+    if job.status == 'finished':
+        return redirect('job_report', key = job.key)
+    template = "interpreter/job.html"
+    context = {'job': job, 'poll_interval': max(int(settings.JOB_POLL_INTERVAL), 1)}
+    return render(request, template, context)
+
+def open_report_store(job):
+    """
+    Open the stored interpretation result of a finished report job
+
+    Raises
+    ------
+    Http404
+        if the result has expired
+    """
+    try:
+        return(ReportStore(job.result_file))
+    except sqlite3.Error:
+        logger.error("result file for job {0} is missing".format(job.id))
+        raise Http404("Report has expired")
+
+@profile_view
+def job_report(request, key):
+    """
+    Returns a page of the report for a report job, with one summary row per record; the detail of each record is loaded from ``job_record`` when it is expanded
+
+    The page number is passed as the 'page' parameter, with ``settings.REPORT_PAGE_SIZE`` records per page
+    """
+    job = get_object_or_404(ReportJob, key = key, status = 'finished')
+    if not job.result_file:
+        return redirect('job_report_full', key = job.key)
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        raise Http404("Invalid page")
+    with open_report_store(job) as store:
+        num_pages = max(int(math.ceil(store.num_records / settings.REPORT_PAGE_SIZE)), 1)
+        if page < 1 or page > num_pages:
+            raise Http404("Invalid page")
+        context = dict(store.summary)
+        context.update({
+        'job': job,
+        'records': store.page(number = page, size = settings.REPORT_PAGE_SIZE),
+        'page': page,
+        'num_pages': num_pages,
+        'first_record': min((page - 1) * settings.REPORT_PAGE_SIZE + 1, store.num_records),
+        'last_record': min(page * settings.REPORT_PAGE_SIZE, store.num_records)
+        })
+    return render(request, 'report_summary.html', context)
+
+@profile_view
+def job_record(request, key, row):
+    """
+    Returns the detail tables of a single record of a report job, and the interpretations that it references, as an HTML fragment
+    """
+    job = get_object_or_404(ReportJob, key = key, status = 'finished')
+    with open_report_store(job) as store:
+        try:
+            html = store.record_html(row)
+        except KeyError:
+            raise Http404("Record not found")
+    return HttpResponse(html)
+
+@profile_view
+def job_export(request, key, format):
+    """
+    Streams the interpretation results of a report job as an export file, from the job's stored result
+    """
+    job = get_object_or_404(ReportJob, key = key, status = 'finished')
+    if format not in export_formats or not job.result_file:
+        raise Http404("Unknown export format")
+    store = open_report_store(job)
+    def parts():
+        # the store is read as the response is sent, and closed when it is finished
+        try:
+            for part in iter_export(store.iter_export_rows(), format):
+                yield(part)
+        finally:
+            store.close()
+    filename = os.path.splitext(os.path.basename(job.filename))[0] or job.key
+    return export_response(parts(), format, filename)
+
+@profile_view
+def job_report_full(request, key):
+    """
+    Returns the full HTML report for a report job, with the detail of every record
+
+    The report file is streamed in blocks, so that large reports are not read into memory
+    """
+    job = get_object_or_404(ReportJob, key = key, status = 'finished')
+    try:
+        report = open(job.report_file, 'rb')
+    except OSError:
+        logger.error("report file for job {0} is missing".format(job.id))
+        raise Http404("Report has expired")
+    return FileResponse(report, content_type = 'text/html; charset=utf-8')
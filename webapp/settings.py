@@ -20,6 +20,10 @@ DB_DIR = os.path.realpath(os.environ.get(
     ))
 DJANGO_DB = os.path.join(DB_DIR, os.environ.get('DJANGO_DB', 'db.sqlite3'))
 INTERPRETER_DB = os.path.join(DB_DIR, os.environ.get('INTERPRETER_DB', 'interpreter.sqlite3'))
+# versioned knowledge base builds from 'manage.py build_kb'; the file named in KB_DIR/current is served
+KB_DIR = os.path.join(DB_DIR, os.environ.get('KB_DIR', 'kb'))
+# knowledge base to use until a build is published; setting KNOWLEDGE_BASE_DB pins it, and the published build is not used
+KNOWLEDGE_BASE_DB = os.environ.get('KNOWLEDGE_BASE_DB', None)
 LOG_DIR = os.path.realpath(os.environ.get('LOG_DIR', 'logs'))
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.1/howto/deployment/checklist/
@@ -183,19 +187,112 @@ WSGI_APPLICATION = 'webapp.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
+# each thread gets its own connection; wait for other threads' writes to finish instead of failing with 'database is locked'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': DJANGO_DB, # os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {'timeout': 20},
     },
     'interpreter_db': {
     'ENGINE': 'django.db.backends.sqlite3',
     'NAME': INTERPRETER_DB,
+    'OPTIONS': {'timeout': 20},
+    },
+    # the knowledge base tables; switched to the published build in KB_DIR between requests, see interpreter/kb_builds.py
+    'knowledge_base': {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': KNOWLEDGE_BASE_DB or INTERPRETER_DB,
+    'OPTIONS': {'timeout': 20},
     },
 }
 
 DATABASE_ROUTERS = ['interpreter.routers.Router']
 
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# 'interpreter' is a file based cache that can be shared by all workers on the host
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'interpreter': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(DB_DIR, 'cache'),
+    },
+}
+
+# max number of gene query results to hold in each worker's in-memory interpretation cache; 0 disables caching
+INTERPRETER_CACHE_SIZE = int(os.environ.get('INTERPRETER_CACHE_SIZE', 1024))
+# name of an entry in CACHES to share interpretation results between workers, e.g. 'interpreter'; None for in-memory only
+INTERPRETER_CACHE_BACKEND = os.environ.get('INTERPRETER_CACHE_BACKEND', None)
+# compiled knowledge base snapshot shared by all workers; used when it exists and matches the current knowledge base
+INTERPRETER_SNAPSHOT = os.path.join(DB_DIR, os.environ.get('INTERPRETER_SNAPSHOT', 'interpreter.snapshot'))
+
+# seconds between checks of KB_DIR/current for a newly published knowledge base build
+KB_CHECK_INTERVAL = float(os.environ.get('KB_CHECK_INTERVAL', 2))
+# number of knowledge base builds to keep in KB_DIR, including the one being served and the previous one for rollback
+KB_KEEP_BUILDS = int(os.environ.get('KB_KEEP_BUILDS', 3))
+# a build is not published if a knowledge base table has fewer rows than this fraction of the served knowledge base, unless forced
+KB_MIN_ROW_FRACTION = float(os.environ.get('KB_MIN_ROW_FRACTION', 0.9))
+
+# seconds between checks of the knowledge base version for the tissue and tumor type lists held by each worker
+TYPE_LIST_CHECK_INTERVAL = float(os.environ.get('TYPE_LIST_CHECK_INTERVAL', 30))
+# max number of tissue or tumor types returned by the autocomplete endpoint
+AUTOCOMPLETE_LIMIT = int(os.environ.get('AUTOCOMPLETE_LIMIT', 20))
+# number of results per page of the interpretation search endpoint
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+
+# profiles of requests run with the staff-only 'profile' option; deleted after PROFILE_RETENTION_HOURS
+PROFILE_DIR = os.path.join(LOG_DIR, os.environ.get('PROFILE_DIR', 'profiles'))
+PROFILE_RETENTION_HOURS = float(os.environ.get('PROFILE_RETENTION_HOURS', 72))
+# number of functions listed in each part of a profile summary
+PROFILE_SUMMARY_LINES = int(os.environ.get('PROFILE_SUMMARY_LINES', 40))
+
+# max number of reports each worker process generates at the same time, so that threaded workers keep threads free for other requests
+MAX_CONCURRENT_REPORTS = int(os.environ.get('MAX_CONCURRENT_REPORTS', 2))
+# seconds an upload waits for a free report slot before returning a 'server busy' error
+REPORT_SLOT_TIMEOUT = float(os.environ.get('REPORT_SLOT_TIMEOUT', 20))
+
+# background report jobs; uploads and finished reports are saved here until they expire
+JOB_DIR = os.path.join(DB_DIR, os.environ.get('JOB_DIR', 'jobs'))
+# hours to keep a finished or failed job's files before the worker deletes them
+JOB_RETENTION_HOURS = float(os.environ.get('JOB_RETENTION_HOURS', 24))
+# seconds a worker sleeps between checks for new jobs when the queue is empty
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+# minutes a running job can go without reporting progress before it is taken to belong to a dead worker and marked as failed
+JOB_STALE_MINUTES = float(os.environ.get('JOB_STALE_MINUTES', 30))
+# max size of an upload submitted as a background job; larger than the interactive limit since it does not tie up a web worker
+JOB_MAX_UPLOAD_SIZE = int(os.environ.get('JOB_MAX_UPLOAD_SIZE', 500 * 1024 * 1024))
+
+# max size of an uploaded .tsv file; uploads larger than FILE_UPLOAD_MAX_MEMORY_SIZE are streamed to a temporary file instead of held in memory
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 200 * 1024 * 1024))
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440 # 2.5MB
+# threads per worker process for looking up the PMKB, NYU tier, and NYU interpretation results of a report at the same
+# time, shared by all of its reports; 1 looks them up one after another in the request thread
+INTERPRET_THREADS = int(os.environ.get('INTERPRET_THREADS', 6))
+# seconds each knowledge source has to return the results for a chunk of records before the report is generated without
+# them, with a warning; 0 waits for as long as it takes
+INTERPRET_SOURCE_TIMEOUT = float(os.environ.get('INTERPRET_SOURCE_TIMEOUT', 60))
+# filter chain that the records of .vcf uploads are dropped by ahead of the report filters, e.g. 'pass_only,min_coverage=100'; see
+# interpreter/filters.py; 'pass_only' only keeps the lines with FILTER 'PASS' or '.', and records without a gene are always dropped
+VCF_FILTERS = os.environ.get('VCF_FILTERS', 'pass_only')
+# filters that records are dropped by before they are interpreted, for requests that do not set their own, e.g. 'oncomine,min_coverage=100'; see interpreter/filters.py
+REPORT_FILTERS = os.environ.get('REPORT_FILTERS', '')
+# number of records read, interpreted, and rendered at a time when generating a report
+REPORT_CHUNK_SIZE = int(os.environ.get('REPORT_CHUNK_SIZE', 500))
+# growth in resident memory in MB during a report above which its chunk size is halved, down to one record per chunk; 0 disables the limit
+REPORT_MEMORY_LIMIT = int(os.environ.get('REPORT_MEMORY_LIMIT', 1024))
+# number of records on each page of a background job's report
+REPORT_PAGE_SIZE = int(os.environ.get('REPORT_PAGE_SIZE', 100))
+# projected peak memory in MB of an interactive report, from its size and number of records, above which the upload is
+# run as a background job ('background') or rejected ('reject') according to REPORT_MEMORY_SOFT_ACTION; 0 disables the limit
+REPORT_MEMORY_SOFT_LIMIT = int(os.environ.get('REPORT_MEMORY_SOFT_LIMIT', 0))
+REPORT_MEMORY_SOFT_ACTION = os.environ.get('REPORT_MEMORY_SOFT_ACTION', 'background')
+# log the peak traced memory and the top allocating source lines of each upload; slows the uploads down while set
+MEMORY_TRACE = os.environ.get('MEMORY_TRACE', '0') == '1'
+# number of source lines listed in each memory trace
+MEMORY_TRACE_LINES = int(os.environ.get('MEMORY_TRACE_LINES', 10))
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
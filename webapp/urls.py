@@ -20,5 +20,18 @@ from interpreter import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.index, name='index'),
-    path('upload/', views.upload, name='upload')
+    path('upload/', views.upload, name='upload'),
+    path('types/<str:type>/', views.type_list, name='type_list'),
+    path('search/', views.search, name='search'),
+    path('cache/', views.cache_stats, name='cache_stats'),
+    path('cache/flush/', views.cache_flush, name='cache_flush'),
+    path('profiles/', views.profile_list, name='profile_list'),
+    path('profiles/<str:name>/', views.profile_detail, name='profile_detail'),
+    path('jobs/submit/', views.job_submit, name='job_submit'),
+    path('jobs/<str:key>/', views.job_page, name='job_page'),
+    path('jobs/<str:key>/status/', views.job_status, name='job_status'),
+    path('jobs/<str:key>/report/', views.job_report, name='job_report'),
+    path('jobs/<str:key>/report/full/', views.job_report_full, name='job_report_full'),
+    path('jobs/<str:key>/export/<str:format>/', views.job_export, name='job_export'),
+    path('jobs/<str:key>/records/<int:row>/', views.job_record, name='job_record')
 ]